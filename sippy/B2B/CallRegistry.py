@@ -0,0 +1,98 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+class B2BCallRegistry(object):
+    # Calls in memory indexed by CallController.id and by the Call-ID of
+    # the incoming leg, plus per-state sets that are kept current by the
+    # controller itself (see CallController.state), so that lookups,
+    # removals and per-state counts do not depend on the number of calls.
+    # Iteration goes over a snapshot in the order calls were added.
+    calls = None
+    by_call_id = None
+    by_state = None
+
+    def __init__(self):
+        self.calls = {}
+        self.by_call_id = {}
+        self.by_state = {}
+
+    def add(self, cc, call_id = None):
+        if call_id is None:
+            call_id = str(cc.cId)
+        if cc.id in self.calls:
+            raise ValueError('call %d is already registered' % cc.id)
+        self.calls[cc.id] = (cc, call_id)
+        self.by_call_id.setdefault(call_id, {})[cc.id] = cc
+        self.by_state.setdefault(cc.state, {})[cc.id] = cc
+        cc.registry = self
+
+    # Compatibility with the list this has replaced
+    append = add
+
+    def remove(self, cc):
+        try:
+            cc, call_id = self.calls.pop(cc.id)
+        except KeyError:
+            raise ValueError('call %d is not registered' % cc.id) from None
+        ccs = self.by_call_id[call_id]
+        del ccs[cc.id]
+        if len(ccs) == 0:
+            del self.by_call_id[call_id]
+        del self.by_state[cc.state][cc.id]
+        cc.registry = None
+
+    def stateChanged(self, cc, ostate, nstate):
+        del self.by_state[ostate][cc.id]
+        self.by_state.setdefault(nstate, {})[cc.id] = cc
+
+    def get(self, id):
+        entry = self.calls.get(id, None)
+        return entry[0] if entry is not None else None
+
+    def getByCallId(self, call_id):
+        return tuple(self.by_call_id.get(call_id, {}).values())
+
+    def inState(self, *states):
+        res = []
+        for state in states:
+            res.extend(self.by_state.get(state, {}).values())
+        return tuple(res)
+
+    def count(self, *states):
+        return sum([len(self.by_state.get(x, ())) for x in states])
+
+    def counts(self):
+        return dict([(state, len(ccs)) for state, ccs in self.by_state.items()])
+
+    def __len__(self):
+        return len(self.calls)
+
+    def __iter__(self):
+        return iter(tuple(cc for cc, call_id in self.calls.values()))
+
+    def __contains__(self, cc):
+        entry = self.calls.get(cc.id, None)
+        return entry is not None and entry[0] is cc
@@ -33,6 +33,8 @@ try:
 except ImportError:
     from urllib.parse import unquote
 from socket import getaddrinfo, SOCK_STREAM, AF_INET, AF_INET6
+from collections import OrderedDict
+from time import monotonic
 
 SRC_WSS = '[[WSS]]'
 SRC_PROXY = '[[PROXY]]'
@@ -100,25 +102,9 @@ class B2BRoute(object):
 
     def __init__(self, sroute = None, cself = None):
         if cself != None:
-            self.rnum = cself.rnum
-            self.addrinfo = cself.addrinfo
-            self._cld = cself.cld
-            self.cld_set = cself.cld_set
-            self.hostport = cself.hostport
-            self.hostonly = cself.hostonly
-            self.credit_time = cself.credit_time
-            self.crt_set = cself.crt_set
-            self.expires = cself.expires
-            self.no_progress_expires = cself.no_progress_expires
-            self.no_reply_expires = cself.no_reply_expires
-            self.forward_on_fail = cself.forward_on_fail
-            self.user = cself.user
-            self.passw = cself.passw
-            self.pass_auth = cself.pass_auth
-            self._cli = cself.cli
-            self.cli_set = cself.cli_set
-            self.params = dict(cself.params)
-            self.ainfo = cself.ainfo
+            # Shallow copy, the params dict is shared with the original
+            # until customize() needs to change it
+            self.__dict__.update(cself.__dict__)
             if cself.extra_headers is not None:
                 self.extra_headers = tuple([x.getCopy() for x in cself.extra_headers])
             return
@@ -217,6 +203,7 @@ class B2BRoute(object):
             self.crt_set = default_credit_time
         if 'gt' in self.params:
             timeout, skip = self.params['gt'].split(',', 1)
+            self.params = dict(self.params)
             self.params['group_timeout'] = (int(timeout), rnum + int(skip))
         if self.extra_headers is not None:
             self.extra_headers = self.extra_headers + tuple(pass_headers)
@@ -263,3 +250,65 @@ class B2BRoute(object):
     def cld(self, value):
         self._cld = value
         self.cld_set = True
+
+class B2BRouteCache(object):
+    # Parsed routes keyed by the route string, so that the same "Routing:"
+    # entry coming from RADIUS with every call is parsed (and its host
+    # resolved) once. Cached routes are only used as templates, each call
+    # gets a shallow copy of one to customize.
+    #
+    # The number of entries is capped, the least recently used ones are
+    # evicted first, and each entry lives for ttl seconds, so that the
+    # hostnames in routes get re-resolved every now and then.
+    max_entries = 1024
+    ttl = 300.0
+    entries = None
+    hits = 0
+    misses = 0
+    evictions = 0
+    expirations = 0
+
+    def __init__(self, max_entries = None, ttl = None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if ttl is not None:
+            self.ttl = ttl
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, sroute, now = None):
+        if now is None:
+            now = monotonic()
+        entries = self.entries
+        entry = entries.get(sroute, None)
+        if entry is not None:
+            if entry[0] > now:
+                entries.move_to_end(sroute)
+                self.hits += 1
+                return entry[1].getCopy()
+            del entries[sroute]
+            self.expirations += 1
+        self.misses += 1
+        route = B2BRoute(sroute)
+        entries[sroute] = (now + self.ttl, route)
+        while len(entries) > self.max_entries:
+            entries.popitem(last = False)
+            self.evictions += 1
+        return route.getCopy()
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0.0
+        return {'entries':len(self.entries), 'hits':self.hits, \
+          'misses':self.misses, 'hit_rate':hit_rate, \
+          'evictions':self.evictions, 'expirations':self.expirations}
+
+    def __str__(self):
+        return 'entries=%(entries)d hits=%(hits)d misses=%(misses)d ' \
+          'hit_rate=%(hit_rate).3f evictions=%(evictions)d ' \
+          'expirations=%(expirations)d' % self.stats()
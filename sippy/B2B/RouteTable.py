@@ -0,0 +1,214 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from ipaddress import ip_address, ip_network
+
+from sippy.B2B.Route import B2BRoute
+
+# Local routing table, the alternative to getting "Routing:" entries from
+# the RADIUS server with each call. The file has one rule per line:
+#
+# <cld-prefix> [cli=<cli-prefix>] [src=<network>] <route> [<route> ...]
+#
+# where <route> is in the same format as the static_route / "Routing:"
+# entry and "*" as the <cld-prefix> matches any CLD. Lines starting
+# with "#" are comments. The longest CLD prefix wins, among the rules with
+# the same CLD prefix the ones with the cli= / src= qualifiers that match
+# take precedence over the one without them.
+#
+# The table is compiled into a dict keyed by the prefix itself plus the
+# list of distinct prefix lengths, so that a lookup takes one dict probe
+# per length instead of a walk over one node per digit. Route objects are
+# built once at load time and shared by all rules with the same route
+# string.
+
+class B2BRouteRule(object):
+    cli = None
+    src = None
+    routes = None
+
+    def __init__(self, cli, src, routes):
+        self.cli = cli
+        self.src = src
+        self.routes = routes
+
+    def matches(self, cli, srcaddr):
+        if self.cli is not None and (cli is None or not cli.startswith(self.cli)):
+            return False
+        if self.src is not None and (srcaddr is None or srcaddr not in self.src):
+            return False
+        return True
+
+    def specificity(self):
+        return (len(self.cli) if self.cli is not None else -1, \
+          self.src.prefixlen if self.src is not None else -1)
+
+class B2BRouteTableIndex(object):
+    # Immutable once built, reload replaces the whole index at once
+    plain = None
+    qualified = None
+    lengths = None
+    nrules = 0
+    nroutes = 0
+
+    def __init__(self):
+        self.plain = {}
+        self.qualified = {}
+
+    def parse(self, f, fname = '<table>'):
+        rcache, lcache = {}, {}
+        for lnum, line in enumerate(f, 1):
+            args = line.split()
+            if len(args) == 0 or args[0].startswith('#'):
+                continue
+            try:
+                self.addRule(args, rcache, lcache)
+            except Exception as ex:
+                raise ValueError('%s:%d: %s' % (fname, lnum, ex))
+        self.compile()
+        self.nroutes = len(rcache)
+        return self
+
+    def addRule(self, args, rcache, lcache):
+        prefix = args.pop(0)
+        if prefix == '*':
+            prefix = ''
+        cli = src = None
+        while len(args) > 0 and args[0].startswith(('cli=', 'src=')):
+            a, v = args.pop(0).split('=', 1)
+            if a == 'cli':
+                cli = v
+            else:
+                src = ip_network(v, strict = False)
+        if len(args) == 0:
+            raise ValueError('no routes specified')
+        lkey = ' '.join(args)
+        routes = lcache.get(lkey, None)
+        if routes is None:
+            routes = tuple([self.getRoute(x, rcache) for x in args])
+            lcache[lkey] = routes
+        if cli is None and src is None:
+            if prefix in self.plain:
+                raise ValueError('duplicate rule for prefix "%s"' % prefix)
+            self.plain[prefix] = routes
+        else:
+            self.qualified.setdefault(prefix, []).append(B2BRouteRule(cli, src, routes))
+        self.nrules += 1
+
+    def getRoute(self, sroute, rcache):
+        route = rcache.get(sroute, None)
+        if route is None:
+            route = B2BRoute(sroute)
+            rcache[sroute] = route
+        return route
+
+    def compile(self):
+        for rules in self.qualified.values():
+            rules.sort(key = lambda x: x.specificity(), reverse = True)
+        lengths = set([len(x) for x in self.plain.keys()])
+        lengths.update([len(x) for x in self.qualified.keys()])
+        self.lengths = tuple(sorted(lengths, reverse = True))
+
+    def match(self, cld, cli = None, src = None):
+        plain, qualified = self.plain, self.qualified
+        ncld = len(cld)
+        srcaddr = None
+        for l in self.lengths:
+            if l > ncld:
+                continue
+            prefix = cld[:l]
+            if prefix in qualified:
+                if src is not None and srcaddr is None:
+                    try:
+                        srcaddr = ip_address(src.strip('[]'))
+                    except ValueError:
+                        src = None
+                for rule in qualified[prefix]:
+                    if rule.matches(cli, srcaddr):
+                        return rule.routes
+            routes = plain.get(prefix, None)
+            if routes is not None:
+                return routes
+        return None
+
+class B2BRouteTable(object):
+    fname = None
+    index = None
+    nlookups = 0
+    nmisses = 0
+    nreloads = 0
+    nreload_errors = 0
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.index = self.load()
+
+    def load(self):
+        with open(self.fname, 'r') as f:
+            return B2BRouteTableIndex().parse(f, self.fname)
+
+    def reload(self):
+        # Builds the new index aside and swaps it in, the old one stays
+        # in place if the file cannot be loaded
+        try:
+            index = self.load()
+        except:
+            self.reloadFailed()
+            raise
+        return self.swap(index)
+
+    def swap(self, index):
+        self.index = index
+        self.nreloads += 1
+        return index.nrules
+
+    def reloadFailed(self):
+        self.nreload_errors += 1
+
+    def match(self, cld, cli = None, src = None):
+        self.nlookups += 1
+        routes = self.index.match(cld if cld is not None else '', cli, src)
+        if routes is None:
+            self.nmisses += 1
+        return routes
+
+    def lookup(self, cld, cli = None, src = None):
+        routes = self.match(cld, cli, src)
+        if routes is None:
+            return None
+        return [x.getCopy() for x in routes]
+
+    def stats(self):
+        return {'fname':self.fname, 'rules':self.index.nrules, \
+          'prefix_lengths':len(self.index.lengths), 'routes':self.index.nroutes, \
+          'lookups':self.nlookups, 'misses':self.nmisses, 'reloads':self.nreloads, \
+          'reload_errors':self.nreload_errors}
+
+    def __str__(self):
+        return 'B2BRouteTable(%s): %d rules, %d routes, %d lookups, %d misses, ' \
+          '%d reloads, %d reload errors' % (self.fname, self.index.nrules, \
+          self.index.nroutes, self.nlookups, self.nmisses, self.nreloads, \
+          self.nreload_errors)
@@ -0,0 +1,248 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import deque
+from json import dumps
+from os import open as os_open, write, close, O_WRONLY, O_APPEND, O_CREAT
+from queue import Queue
+from threading import Thread
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Core.Exceptions import dump_exception
+from sippy.Time.MonoTime import MonoTime
+from sippy.Time.Timeout import Timeout
+
+# Timeline of the call setup: the incoming INVITE ("invite"), the call being
+# accepted by the CallMap ("accepted"), the authorisation result ("aaa"),
+# each outbound attempt ("originate"), the RTPproxy reply to the offer
+# ("rtpp") and the first 100 ("100"), 18x ("18x") and 2xx ("200") received
+# from the callee. Each stage is also observed into the histogram as the
+# time since the previous mark, the first occurrence of the stage counts.
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, \
+  1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class B2BSetupTrace(object):
+    max_marks = 32
+    id = None
+    call_id = None
+    cli = None
+    cld = None
+    marks = None
+    result = None
+
+    def __init__(self, id, call_id, rtime):
+        self.id = id
+        self.call_id = call_id
+        self.marks = [('invite', rtime)]
+
+    def mark(self, stage, rtime = None):
+        if self.result is not None or len(self.marks) >= self.max_marks:
+            return
+        if rtime is None:
+            rtime = MonoTime()
+        self.marks.append((stage, rtime))
+
+    def spans(self):
+        # [(stage, seconds since the previous mark, seconds since INVITE), ...]
+        t0 = prev = self.marks[0][1]
+        res = []
+        for stage, rtime in self.marks:
+            res.append((stage, rtime - prev, rtime - t0))
+            prev = rtime
+        return res
+
+    def asdict(self):
+        return {'id': self.id, 'call_id': self.call_id, 'cli': self.cli, \
+          'cld': self.cld, 'start': round(self.marks[0][1].realt, 6), \
+          'result': self.result, 'marks': [(stage, round(total, 6)) \
+          for stage, delta, total in self.spans()]}
+
+    def __str__(self):
+        result = self.result if self.result is not None else 'in progress'
+        res = 'Call %d %s (%s -> %s): %s\n' % (self.id, self.call_id, self.cli, \
+          self.cld, result)
+        for stage, delta, total in self.spans():
+            res += '  %-10s +%.6f %.6f\n' % (stage, delta, total)
+        return res
+
+class B2BSetupTraceWriter(Thread):
+    # Appends the finished timelines to the file off the main thread, so
+    # that a slow disk does not hold up the call processing. The outcome
+    # of each write is reported back to the main thread.
+    daemon = True
+    fname = None
+    wi = None
+    result_cb = None
+
+    def __init__(self, fname, result_cb):
+        Thread.__init__(self)
+        self.fname = fname
+        self.result_cb = result_cb
+        self.wi = Queue()
+        self.start()
+
+    def write(self, data, n):
+        self.wi.put((data, n))
+
+    def shutdown(self):
+        self.wi.put(None)
+        self.join()
+
+    def run(self):
+        while True:
+            wi = self.wi.get()
+            if wi == None:
+                break
+            data, n = wi
+            try:
+                # Single append per flush, so that the workers sharing the
+                # file do not interleave within a line
+                fd = os_open(self.fname, O_WRONLY | O_APPEND | O_CREAT, 0o644)
+                try:
+                    write(fd, data)
+                finally:
+                    close(fd)
+            except Exception:
+                dump_exception('B2BSetupTracer: cannot write %s' % self.fname)
+                n = None
+            ED2.callFromThread(self.result_cb, n)
+        self.result_cb = None
+
+class B2BSetupTracer(object):
+    keep = 1000
+    fname = None
+    flush_ival = 1.0
+    recent = None
+    pending = None
+    flush_timer = None
+    writer = None
+    m_stages = None
+    totals = None
+    started = 0
+    finished = 0
+    written = 0
+    write_errors = 0
+
+    def __init__(self, keep = None, fname = None, metrics = None):
+        if keep is not None:
+            self.keep = keep
+        self.recent = deque(maxlen = self.keep)
+        self.totals = {}
+        if metrics is not None:
+            self.m_stages = metrics.histogram('sippy_call_setup_stage_seconds', \
+              'Time from the previous call setup milestone to the stage', \
+              labelnames = ('stage',), buckets = STAGE_BUCKETS)
+        if fname is not None:
+            self.fname = fname
+            self.pending = []
+            self.writer = B2BSetupTraceWriter(fname, self.flushed)
+            self.flush_timer = Timeout(self.flush, self.flush_ival, -1)
+
+    @staticmethod
+    def fromConfig(global_config, metrics = None):
+        if 'setup_trace_file' not in global_config and \
+          not ('setup_trace' in global_config and global_config['setup_trace']):
+            return None
+        keep = global_config['setup_trace_keep'] if 'setup_trace_keep' in global_config else None
+        fname = global_config['setup_trace_file'] if 'setup_trace_file' in global_config else None
+        return B2BSetupTracer(keep, fname, metrics)
+
+    def start(self, id, call_id, rtime):
+        self.started += 1
+        return B2BSetupTrace(id, call_id, rtime)
+
+    def finish(self, trace, result):
+        if trace.result is not None:
+            return
+        trace.result = result
+        self.finished += 1
+        seen = set()
+        for stage, delta, total in trace.spans()[1:]:
+            if stage in seen:
+                continue
+            seen.add(stage)
+            if self.m_stages is not None:
+                self.m_stages.labels(stage).observe(delta)
+            st = self.totals.get(stage, None)
+            if st is None:
+                self.totals[stage] = [1, delta, delta]
+                continue
+            st[0] += 1
+            st[1] += delta
+            if delta > st[2]:
+                st[2] = delta
+        self.recent.append(trace)
+        if self.pending is not None:
+            self.pending.append(dumps(trace.asdict()) + '\n')
+
+    def find(self, key):
+        # Finished traces by the call id (number) or the Call-ID
+        if key.isdigit():
+            id = int(key)
+            return [x for x in self.recent if x.id == id]
+        return [x for x in self.recent if x.call_id == key]
+
+    def dump(self, fname):
+        data = ''.join([dumps(x.asdict()) + '\n' for x in self.recent])
+        with open(fname, 'w') as f:
+            f.write(data)
+        return len(self.recent)
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+        self.writer.write(''.join(self.pending).encode(), len(self.pending))
+        self.pending = []
+
+    def flushed(self, n):
+        if n is None:
+            self.write_errors += 1
+        else:
+            self.written += n
+
+    def shutdown(self):
+        if self.flush_timer is not None:
+            self.flush_timer.cancel()
+            self.flush_timer = None
+            self.flush()
+            self.writer.shutdown()
+
+    def stats(self):
+        return {'started':self.started, 'finished':self.finished, \
+          'kept':len(self.recent), 'written':self.written, \
+          'write_errors':self.write_errors}
+
+    def __str__(self):
+        res = 'Setup traces: %d started, %d finished, %d kept' % (self.started, \
+          self.finished, len(self.recent))
+        if self.fname is not None:
+            res += ', %d written to %s' % (self.written, self.fname)
+        res += '\n'
+        for stage, (count, total, vmax) in self.totals.items():
+            res += '  %-10s count %d, avg %.6f, max %.6f\n' % (stage, count, \
+              total / count, vmax)
+        return res
@@ -22,16 +22,45 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+from functools import partial
+from threading import Thread
+
 from ..CLIManager import CLIConnectionManager, CLIManager
 from ..Time.MonoTime import MonoTime
+from ..Core.EventDispatcher import ED2
+from ..Core.Profiler import EDProfiler
 from .States import CCStateConnected, CCStateARComplete
 
+class _TableReloader(Thread):
+    # Loads the new version of the table in the background, so that a
+    # large one does not stall the event loop, the main thread then
+    # swaps it in
+    daemon = True
+
+    def __init__(self, table, done_f):
+        Thread.__init__(self)
+        self.table = table
+        self.done_f = done_f
+        self.start()
+
+    def run(self):
+        try:
+            res = self.table.load()
+        except Exception as ex:
+            ED2.callFromThread(self.done_f, None, ex)
+        else:
+            ED2.callFromThread(self.done_f, res, None)
+        self.table = None
+        self.done_f = None
+
 class B2BSimpleAPI(CLIConnectionManager):
     global_config = None
+    reloading = None
 
     def __init__(self, global_config):
         cmdfile = global_config['b2bua_socket']
         self.global_config = global_config
+        self.reloading = {}
         if cmdfile.startswith('tcp:'):
             parts = cmdfile[4:].split(':', 1)
             if len(parts) == 1:
@@ -54,7 +83,7 @@ class B2BSimpleAPI(CLIConnectionManager):
         if cmd == 'l':
             res = 'In-memory calls:\n'
             total = 0
-            for (cid, sname), uaast, uaost in ccm.listActiveCalls():
+            for cid, sname, uaast, uaost in ccm.listActiveCalls():
                 res += f'{cid}: {sname} ('
                 if uaast is not None:
                     _s, _t, _h, _p, _cld, _cli = uaast
@@ -70,15 +99,6 @@ class B2BSimpleAPI(CLIConnectionManager):
             res += 'Total: %d\n' % total
             clim.send(res)
             return False
-        if cmd == 'lt':
-            res = 'In-memory server transactions:\n'
-            for tid, t in self.global_config['_sip_tm'].tserver.iteritems():
-                res += '%s %s %s\n' % (tid, t.method, t.state)
-            res += 'In-memory client transactions:\n'
-            for tid, t in self.global_config['_sip_tm'].tclient.iteritems():
-                res += '%s %s %s\n' % (tid, t.method, t.state)
-            clim.send(res)
-            return False
         if cmd in ('lt', 'llt'):
             if cmd == 'llt':
                 mindur = 60.0
@@ -86,19 +106,58 @@ class B2BSimpleAPI(CLIConnectionManager):
                 mindur = 0.0
             ctime = MonoTime()
             res = 'In-memory server transactions:\n'
-            for tid, t in self.global_config['_sip_tm'].tserver.iteritems():
+            for tid, t in self.global_config['_sip_tm'].tserver.items():
                 duration = ctime - t.rtime
                 if duration < mindur:
                     continue
-                res += '%s %s %s %s\n' % (tid, t.method, t.state, duration)
+                res += '%s %s %s %s\n' % (tid, t.method, t.state.__name__, duration)
             res += 'In-memory client transactions:\n'
-            for tid, t in self.global_config['_sip_tm'].tclient.iteritems():
+            for tid, t in self.global_config['_sip_tm'].tclient.items():
                 duration = ctime - t.rtime
                 if duration < mindur:
                     continue
-                res += '%s %s %s %s\n' % (tid, t.method, t.state, duration)
+                res += '%s %s %s %s\n' % (tid, t.method, t.state.__name__, duration)
             clim.send(res)
             return False
+        if cmd == 'm':
+            if '_metrics' not in self.global_config:
+                clim.send('ERROR: metrics are not available\n')
+                return False
+            clim.send(self.global_config['_metrics'].render())
+            return False
+        if cmd == 'p':
+            # Event loop profiler: p [on|off|reset]
+            arg = args[0].lower() if len(args) > 0 else None
+            metrics = self.global_config['_metrics'] if '_metrics' in self.global_config else None
+            if arg == 'on':
+                EDProfiler.enable(metrics)
+            elif arg == 'off':
+                EDProfiler.disable(metrics)
+            elif ED2.profiler is None:
+                clim.send('ERROR: profiler is not enabled\n')
+                return False
+            elif arg == 'reset':
+                ED2.profiler.reset()
+            elif arg is None:
+                clim.send(ED2.profiler.report())
+                return False
+            else:
+                clim.send('ERROR: syntax error: p [on|off|reset]\n')
+                return False
+            clim.send('OK\n')
+            return False
+        if cmd == 'rt':
+            # Local routing table: rt [reload]
+            self.tableCommand(clim, cmd, args, '_route_table', 'routing table')
+            return False
+        if cmd == 'da':
+            # Local digest authentication store: da [reload]
+            self.tableCommand(clim, cmd, args, '_digest_auth', 'digest store')
+            return False
+        if cmd == 'st':
+            # Call setup timelines: st [<id>|<call-id>|dump <path>]
+            self.traceCommand(clim, args)
+            return False
         if cmd == 'd':
             if len(args) != 1:
                 clim.send('ERROR: syntax error: d <call-id>\n')
@@ -107,7 +166,7 @@ class B2BSimpleAPI(CLIConnectionManager):
                 self.discAll()
                 clim.send('OK\n')
                 return False
-            dlist = [x for x in ccm.ccmap if str(x.cId) == args[0]]
+            dlist = ccm.ccmap.getByCallId(args[0])
             if len(dlist) == 0:
                 clim.send('ERROR: no call with id of %s has been found\n' % args[0])
                 return False
@@ -121,26 +180,85 @@ class B2BSimpleAPI(CLIConnectionManager):
                 return False
             idx = int(args[0])
             media_index = int(args[1]) if len(args) == 2 else 0
-            dlist = [x for x in ccm.ccmap if x.id == idx]
-            if len(dlist) == 0:
+            cc = ccm.ccmap.get(idx)
+            if cc is None:
                 clim.send('ERROR: no call with id of %d has been found\n' % idx)
                 return False
-            for cc in dlist:
-                if not cc.proxied:
-                    continue
-                if cc.state == CCStateConnected:
-                    cc.disconnect(MonoTime().getOffsetCopy(-60), origin = 'media_timeout',
-                      media_index = media_index)
-                    continue
-                if cc.state == CCStateARComplete:
-                    if cc.rtp_proxy_session is not None:
-                        cc.rtp_proxy_session.media_timeout_index = media_index
-                    cc.uaO.disconnect(MonoTime().getOffsetCopy(-60), origin = 'media_timeout')
-                    continue
+            if not cc.proxied:
+                pass
+            elif cc.state == CCStateConnected:
+                cc.disconnect(MonoTime().getOffsetCopy(-60), origin = 'media_timeout',
+                  media_index = media_index)
+            elif cc.state == CCStateARComplete:
+                if cc.rtp_proxy_session is not None:
+                    cc.rtp_proxy_session.media_timeout_index = media_index
+                cc.uaO.disconnect(MonoTime().getOffsetCopy(-60), origin = 'media_timeout')
             clim.send('OK\n')
             return False
         clim.send('ERROR: unknown command\n')
         return False
 
+    def tableCommand(self, clim, cmd, args, key, name):
+        if key not in self.global_config:
+            clim.send('ERROR: %s is not configured\n' % name)
+            return
+        table = self.global_config[key]
+        if len(args) == 0:
+            clim.send('%s\n' % str(table))
+            return
+        if args[0].lower() != 'reload':
+            clim.send('ERROR: syntax error: %s [reload]\n' % cmd)
+            return
+        if key in self.reloading:
+            clim.send('ERROR: %s reload is already in progress\n' % name)
+            return
+        # The outcome goes to the log, the command returns right away
+        self.reloading[key] = _TableReloader(table, partial(self.tableReloaded, \
+          table, key, name))
+        clim.send('OK: reloading\n')
+
+    def tableReloaded(self, table, key, name, res, ex):
+        del self.reloading[key]
+        slogger = self.global_config['_sip_logger']
+        if ex is not None:
+            table.reloadFailed()
+            slogger.write('%s reload failed, keeping the old one: %s' % (name, str(ex)))
+            return
+        nentries = table.swap(res)
+        slogger.write('%s reloaded: %d entries' % (name, nentries))
+
+    def traceCommand(self, clim, args):
+        if '_setup_tracer' not in self.global_config:
+            clim.send('ERROR: setup tracing is not enabled\n')
+            return
+        tracer = self.global_config['_setup_tracer']
+        if len(args) == 0:
+            clim.send(str(tracer))
+            return
+        if args[0].lower() == 'dump':
+            if len(args) != 2:
+                clim.send('ERROR: syntax error: st dump <path>\n')
+                return
+            try:
+                ntraces = tracer.dump(args[1])
+            except Exception as ex:
+                clim.send('ERROR: %s\n' % str(ex))
+                return
+            clim.send('OK: %d traces\n' % ntraces)
+            return
+        ccm = self.global_config['_cmap']
+        if args[0].isdigit():
+            cc = ccm.ccmap.get(int(args[0]))
+            ccs = (cc,) if cc is not None else ()
+        else:
+            ccs = ccm.ccmap.getByCallId(args[0])
+        # Calls still being set up first, then the finished ones
+        traces = [cc.strace for cc in ccs if cc.strace is not None]
+        traces.extend(tracer.find(args[0]))
+        if len(traces) == 0:
+            clim.send('ERROR: no setup trace for %s has been found\n' % args[0])
+            return
+        clim.send(''.join([str(x) for x in traces]))
+
     def set_rtp_io_socket(self, rtpp_nsock, rtpp_nsock_spec):
         CLIManager(rtpp_nsock, self.recvCommand)
@@ -0,0 +1,422 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os, sys, socket
+from errno import EAGAIN, ECHILD, EINTR
+from pickle import dumps, loads
+from re import compile as re_compile, I as re_I, M as re_M
+from signal import SIGHUP, SIGPROF, SIGTERM, SIGUSR1, SIGUSR2
+from threading import Thread
+from zlib import crc32
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Core.Exceptions import dump_exception
+from sippy.CLIManager import CLIConnectionManager
+from sippy.Network_server import Remote_address
+from sippy.Signal import Signal
+from sippy.SipTransactionManager import SipTransactionManager, local4remote
+from sippy.Time.MonoTime import MonoTime
+from sippy.Time.Timeout import Timeout
+from sippy.Udp_server import Udp_server, Udp_server_opts
+
+_CALL_ID_RE = re_compile(rb'^(?:call-id|i)[ \t]*:[ \t]*(\S+)', re_I | re_M)
+_B2B_SFX_RE = re_compile(r'(?:-b2b_\d+)+$')
+_WORKER_TAG_RE = re_compile(r'\.w(\d+)$')
+_MAX_FWD_SIZE = 128 * 1024
+
+def call_id_owner(call_id, nworkers):
+    # Both legs of a call have to map to the same worker: the egress
+    # Call-ID is the ingress one with "-b2b_N" appended, or, when the
+    # Call-ID is hidden, a hash tagged with the ".wN" of the worker
+    # that generated it.
+    base = _B2B_SFX_RE.sub('', call_id)
+    m = _WORKER_TAG_RE.search(base)
+    if m is not None:
+        wid = int(m.group(1))
+        if wid < nworkers:
+            return wid
+    return crc32(base.encode('utf-8', 'backslashreplace')) % nworkers
+
+def raw_call_id(data):
+    # Pull Call-ID out of the raw datagram without parsing the message
+    hdrs = data.split(b'\r\n\r\n', 1)[0]
+    m = _CALL_ID_RE.search(hdrs)
+    if m is None:
+        return None
+    return m.group(1).decode('utf-8', 'backslashreplace')
+
+def worker_cmdfile(cmdfile, wid):
+    if cmdfile.startswith('tcp:'):
+        parts = cmdfile[4:].split(':', 1)
+        port = 12345 if len(parts) == 1 else int(parts[1])
+        return 'tcp:%s:%d' % (parts[0], port + 1 + wid)
+    return '%s.%d' % (cmdfile, wid)
+
+class _ForwardReceiver(Thread):
+    daemon = True
+    worker = None
+
+    def __init__(self, worker):
+        Thread.__init__(self)
+        self.worker = worker
+        self.start()
+
+    def run(self):
+        rsock = self.worker.rsock
+        while True:
+            try:
+                msg = rsock.recv(_MAX_FWD_SIZE)
+            except OSError as why:
+                if why.errno == EINTR:
+                    continue
+                break
+            if len(msg) == 0:
+                break
+            try:
+                args = loads(msg)
+            except Exception:
+                dump_exception('B2BWorker: cannot decode forwarded message')
+                continue
+            ED2.callFromThread(self.worker.deliver, *args)
+        self.worker = None
+
+class B2BWorkerTransactionManager(SipTransactionManager):
+    worker = None
+
+    def handleIncoming(self, data_in, ra:Remote_address, server, rtime):
+        if self.worker is not None and self.worker.forward(data_in, ra, server, rtime):
+            return
+        super().handleIncoming(data_in, ra, server, rtime)
+
+class B2BWorker(object):
+    wid = None
+    nworkers = None
+    rsock = None
+    wsocks = None
+    stm = None
+    rthr = None
+    # local, forwarded out, forwarded in, dropped
+    stats = None
+
+    def __init__(self, wid, rsock, wsocks):
+        self.wid = wid
+        self.nworkers = len(wsocks)
+        self.rsock = rsock
+        self.wsocks = wsocks
+        self.stats = [0, 0, 0, 0]
+
+    def attach(self, stm):
+        self.stm = stm
+        stm.worker = self
+        self.rthr = _ForwardReceiver(self)
+
+    def forward(self, data, ra, server, rtime):
+        if not isinstance(data, bytes):
+            return False
+        call_id = raw_call_id(data)
+        if call_id is None:
+            self.stats[0] += 1
+            return False
+        owner = call_id_owner(call_id, self.nworkers)
+        if owner == self.wid:
+            self.stats[0] += 1
+            return False
+        for laddress, userv in self.stm.l4r.cache_l2s.items():
+            if userv is server:
+                break
+        else:
+            laddress = None
+        msg = dumps((laddress, ra.address, ra.transport, rtime.monot, rtime.realt, data))
+        try:
+            self.wsocks[owner].send(msg, socket.MSG_DONTWAIT)
+        except OSError as why:
+            if why.errno != EAGAIN:
+                dump_exception('B2BWorker[%d]: cannot forward message to worker %d' % (self.wid, owner))
+            # Owner is overloaded, let the retransmission take care of it
+            self.stats[3] += 1
+            return True
+        self.stats[1] += 1
+        return True
+
+    def deliver(self, laddress, address, transport, monot, realt, data):
+        if self.stm is None:
+            return
+        self.stats[2] += 1
+        server = self.stm.l4r.cache_l2s.get(laddress, None)
+        if server is None:
+            server = self.stm.l4r.getServer(address)
+        rtime = MonoTime(monot = monot, realt = realt)
+        SipTransactionManager.handleIncoming(self.stm, data, Remote_address(address, transport), \
+          server, rtime)
+
+    def shutdown(self):
+        try:
+            self.rsock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        if self.rthr is not None:
+            self.rthr.join()
+            self.rthr = None
+        self.rsock.close()
+        for wsock in self.wsocks:
+            wsock.close()
+        self.stm = None
+
+class _FanOut(Thread):
+    daemon = True
+    api = None
+    clim = None
+    cmd = None
+
+    def __init__(self, api, clim, cmd):
+        Thread.__init__(self)
+        self.api = api
+        self.clim = clim
+        self.cmd = cmd
+        self.start()
+
+    def run(self):
+        replies = []
+        for cmdfile in self.api.worker_cmdfiles:
+            replies.append(self.api.query(cmdfile, self.cmd))
+        ED2.callFromThread(self.api.reply, self.clim, self.cmd, replies)
+        self.api = None
+        self.clim = None
+
+class B2BSupervisorAPI(CLIConnectionManager):
+    worker_cmdfiles = None
+    pending = None
+    query_timeout = 5.0
+
+    def __init__(self, global_config, worker_cmdfiles):
+        self.worker_cmdfiles = worker_cmdfiles
+        self.pending = {}
+        family, address = self.cmdaddr(global_config['b2bua_socket'])
+        super().__init__(self.recvCommand, address, tcp = (family == socket.AF_INET))
+
+    @staticmethod
+    def cmdaddr(cmdfile):
+        if cmdfile.startswith('tcp:'):
+            parts = cmdfile[4:].split(':', 1)
+            if len(parts) == 1:
+                return (socket.AF_INET, (parts[0], 12345))
+            return (socket.AF_INET, (parts[0], int(parts[1])))
+        if cmdfile.startswith('unix:'):
+            cmdfile = cmdfile[5:]
+        return (socket.AF_UNIX, cmdfile)
+
+    def recvCommand(self, clim, cmd):
+        # Commands from the same connection are relayed one at a time,
+        # so that replies come back in order
+        cmds = self.pending.setdefault(clim, [])
+        cmds.append(cmd)
+        if len(cmds) == 1:
+            self.nextCommand(clim)
+        return False
+
+    def nextCommand(self, clim):
+        cmds = self.pending[clim]
+        if len(cmds) == 0:
+            del self.pending[clim]
+            return
+        if cmds[0].split()[0].lower() == 'q':
+            del self.pending[clim]
+            clim.close()
+            return
+        _FanOut(self, clim, cmds[0])
+
+    def query(self, cmdfile, cmd):
+        family, address = self.cmdaddr(cmdfile)
+        s = socket.socket(family, socket.SOCK_STREAM)
+        s.settimeout(self.query_timeout)
+        try:
+            s.connect(address)
+            # "q" makes the worker close connection once the reply is out
+            s.sendall(('%s\nq\n' % cmd).encode('ascii'))
+            rval = b''
+            while True:
+                data = s.recv(8192)
+                if len(data) == 0:
+                    break
+                rval += data
+        except (OSError, socket.timeout):
+            return None
+        finally:
+            s.close()
+        return rval.decode('ascii', 'backslashreplace')
+
+    def reply(self, clim, cmd, replies):
+        clim.send(self.aggregate(cmd, replies))
+        self.pending[clim].pop(0)
+        self.nextCommand(clim)
+
+    def aggregate(self, cmd, replies):
+        if cmd.split()[0].lower() == 'l':
+            res = 'In-memory calls:\n'
+            total = 0
+            for r in replies:
+                if r is None:
+                    continue
+                for line in r.splitlines()[1:]:
+                    if line.startswith('Total: '):
+                        total += int(line[7:])
+                    else:
+                        res += line + '\n'
+            res += 'Total: %d\n' % total
+            return res
+        good = [r for r in replies if r is not None]
+        if len(good) > 0 and all(r.count('\n') == 1 for r in good):
+            # Single line status replies, succeed if any of the workers did
+            if 'OK\n' in good:
+                return 'OK\n'
+            return good[0]
+        res = ''
+        for wid, r in enumerate(replies):
+            res += 'Worker %d:\n' % wid
+            res += r if r is not None else 'ERROR: no response\n'
+        return res
+
+class B2BWorkerSet(object):
+    global_config = None
+    nworkers = None
+    pids = None
+    stopping = False
+    restart = False
+    reopen_f = None
+    clis = None
+    rtimer = None
+
+    def __init__(self, global_config, nworkers, reopen_f = None):
+        self.global_config = global_config
+        self.nworkers = nworkers
+        self.reopen_f = reopen_f
+        self.pids = {}
+
+    def spawn(self):
+        # Make sure nothing else is listening on the port before the
+        # workers bind it with SO_REUSEPORT
+        laddresses, fixed = local4remote.getLAddresses(self.global_config)
+        for laddress in laddresses:
+            sopts = Udp_server_opts(laddress, None)
+            sopts.flags = 0
+            Udp_server(self.global_config, sopts).shutdown()
+        socks = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for i in range(self.nworkers)]
+        for wid in range(self.nworkers):
+            pid = os.fork()
+            if pid == 0:
+                rsock = socks[wid][0]
+                for i, (r, w) in enumerate(socks):
+                    if i != wid:
+                        r.close()
+                self.initWorker(wid, rsock, [w for r, w in socks])
+                return True
+            self.pids[pid] = wid
+        for r, w in socks:
+            r.close()
+            w.close()
+        return False
+
+    def initWorker(self, wid, rsock, wsocks):
+        global_config = self.global_config
+        global_config['_b2bua_worker'] = B2BWorker(wid, rsock, wsocks)
+        global_config['_sip_port_shared'] = True
+        global_config['_sip_tm_class'] = B2BWorkerTransactionManager
+        global_config['_cid_affinity_tag'] = '.w%d' % wid
+        global_config['_my_pid'] = os.getpid()
+        global_config['b2bua_socket'] = worker_cmdfile(global_config['b2bua_socket'], wid)
+        for key in ('acct_spool', 'capture_file'):
+            if key in global_config:
+                global_config[key] = '%s.%d' % (global_config[key], wid)
+        if 'metrics_http' in global_config:
+            address, sep, port = global_config['metrics_http'].rpartition(':')
+            global_config['metrics_http'] = '%s%s%d' % (address, sep, int(port) + wid)
+        self.pids = None
+
+    def run(self):
+        cmdfile = self.global_config['b2bua_socket']
+        wcmdfiles = [worker_cmdfile(cmdfile, wid) for wid in range(self.nworkers)]
+        self.clis = B2BSupervisorAPI(self.global_config, wcmdfiles)
+        for signum in (SIGHUP, SIGUSR2, SIGPROF, SIGTERM):
+            Signal(signum, self.relay, signum)
+        if not self.global_config['foreground'] or 'route_table' in self.global_config or \
+          'digest_store' in self.global_config:
+            Signal(SIGUSR1, self.relay, SIGUSR1)
+        self.rtimer = Timeout(self.reap, 1.0, -1)
+        try:
+            ED2.loop()
+        finally:
+            self.clis.shutdown()
+        if self.restart:
+            os.chdir(self.global_config['_orig_cwd'])
+            argv = [sys.executable,]
+            argv.extend(self.global_config['_orig_argv'])
+            os.execv(sys.executable, argv)
+
+    def relay(self, signum):
+        print('[%d]: signal %d received, relaying to %d workers' % (os.getpid(), signum, len(self.pids)))
+        if signum == SIGUSR1 and self.reopen_f is not None and \
+          not self.global_config['foreground']:
+            self.reopen_f(signum, self.global_config['logfile'])
+        elif signum == SIGTERM:
+            self.stopping = True
+        elif signum == SIGPROF:
+            # Workers exit once they are idle, the whole set is re-executed
+            # after the last one is gone
+            self.stopping = True
+            self.restart = True
+        for pid in self.pids.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+        sys.stdout.flush()
+
+    def reap(self):
+        while len(self.pids) > 0:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as why:
+                if why.errno == EINTR:
+                    continue
+                if why.errno != ECHILD:
+                    raise
+                self.pids = {}
+                break
+            if pid == 0:
+                break
+            wid = self.pids.pop(pid, None)
+            if wid is None:
+                continue
+            print('[%d]: worker %d (pid %d) exited with status %d' % (os.getpid(), wid, pid, status))
+            if not self.stopping:
+                # Call-ID affinity depends on the set being complete,
+                # bring the rest down and let the process manager restart us
+                print('[%d]: unexpected worker exit, stopping the remaining workers' % os.getpid())
+                self.relay(SIGTERM)
+            sys.stdout.flush()
+        if len(self.pids) == 0:
+            self.rtimer.cancel()
+            ED2.breakLoop()
@@ -27,15 +27,17 @@
 from __future__ import print_function
 
 from functools import partial
+from collections import deque
 from datetime import datetime
-from heapq import heappush, heappop, heapify
 from threading import Lock, local as t_local
 from random import random
-import sys, traceback, signal
+import sys, os, traceback, signal
 from _thread import get_ident
 from sippy.Time.MonoTime import MonoTime
 from sippy.Core.Exceptions import dump_exception, StdException
+from sippy.Core.TimerQueue import TimerHeap, TimerWheel
 from queue import Queue
+from time import monotonic
 
 from elperiodic.ElPeriodic import ElPeriodic
 
@@ -43,6 +45,9 @@ class EventListener(object):
     etime = None
     cb_with_ts = False
     randomize_runs = None
+    tqueued = False
+    wslot = None
+    wl0 = False
 
     def __lt__(self, other):
         return self.etime < other.etime
@@ -50,7 +55,7 @@ class EventListener(object):
     def cancel(self):
         if self.ed != None:
             # Do not crash if cleanup() has already been called
-            self.ed.twasted += 1
+            self.ed.timers.remove(self)
         self.cleanup()
 
     def cleanup(self):
@@ -84,7 +89,7 @@ class EventListener(object):
             self.etime = self.ival
             self.ival = None
             self.nticks = 1
-        heappush(self.ed.tlisteners, self)
+        self.ed.timers.add(self)
         return
 
 class Singleton(object):
@@ -110,13 +115,45 @@ class Singleton(object):
     def __sinit__(self, *args, **kwds):
         pass
 
+class CFTQueueStats(object):
+    # Counters of the cross-thread call queue, only updated by the main
+    # thread when it drains the queue.
+    dispatched = 0
+    wakeups = 0
+    last_batch = 0
+    max_batch = 0
+    lat_total = 0.0
+    lat_max = 0.0
+    queue = None
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def snapshot(self):
+        if self.wakeups > 0:
+            avg_batch = self.dispatched / self.wakeups
+        else:
+            avg_batch = 0.0
+        if self.dispatched > 0:
+            avg_lat = self.lat_total / self.dispatched
+        else:
+            avg_lat = 0.0
+        return {'dispatched':self.dispatched, 'wakeups':self.wakeups, \
+          'depth':len(self.queue), 'last_batch':self.last_batch, \
+          'max_batch':self.max_batch, 'avg_batch':avg_batch, \
+          'avg_latency':avg_lat, 'max_latency':self.lat_max}
+
+    def __str__(self):
+        return 'dispatched=%(dispatched)d wakeups=%(wakeups)d depth=%(depth)d ' \
+          'batch=%(last_batch)d/%(avg_batch).1f/%(max_batch)d ' \
+          'latency=%(avg_latency).6f/%(max_latency).6f' % self.snapshot()
+
 class EventDispatcher2(Singleton):
-    tlisteners = None
+    timers = None
     slisteners = None
     endloop = False
     el_rval = None
     signals_pending = None
-    twasted = 0
     tcbs_lock = None
     last_ts = None
     my_ident = None
@@ -126,8 +163,12 @@ class EventDispatcher2(Singleton):
     bands = None
     _exception = None
     tloc_data = None
+    cft_queue = None
+    cft_wakeup = None
+    cft_stats = None
+    profiler = None
 
-    def __init__(self, freq = 100.0):
+    def __init__(self, freq = 100.0, timers = 'heap'):
         EventDispatcher2.state_lock.acquire()
         if EventDispatcher2.ed_inum != 0:
             EventDispatcher2.state_lock.release()
@@ -135,10 +176,18 @@ class EventDispatcher2(Singleton):
         EventDispatcher2.ed_inum = 1
         EventDispatcher2.state_lock.release()
         self.tcbs_lock = Lock()
-        self.tlisteners = []
+        self.cft_queue = deque()
+        self.cft_wakeup = Lock()
+        self.cft_stats = CFTQueueStats(self.cft_queue)
         self.slisteners = []
         self.signals_pending = []
         self.last_ts = MonoTime()
+        if timers == 'heap':
+            self.timers = TimerHeap()
+        elif timers == 'wheel':
+            self.timers = TimerWheel(1.0 / freq, self.last_ts.monot)
+        else:
+            raise ValueError('EventDispatcher2: unknown timers backend: %s' % timers)
         self.my_ident = get_ident()
         self.elp = ElPeriodic(freq)
         self.elp.CFT_enable(signal.SIGURG)
@@ -165,42 +214,50 @@ class EventDispatcher2(Singleton):
         return el
 
     def dispatchTimers(self):
-        while len(self.tlisteners) != 0:
-            el = self.tlisteners[0]
-            if el.cb_func != None and el.etime > self.last_ts:
-                # We've finished
+        prof = self.profiler
+        while True:
+            due = self.timers.pop_due(self.last_ts.monot)
+            if len(due) == 0:
                 return
-            el = heappop(self.tlisteners)
-            if el.cb_func == None:
-                # Skip any already removed timers
-                self.twasted -= 1
-                continue
-            if el.nticks == -1 or el.nticks > 1:
-                # Re-schedule periodic timer
-                if el.nticks > 1:
-                    el.nticks -= 1
-                if el.randomize_runs != None:
-                    ival = el.randomize_runs(el.ival)
-                else:
-                    ival = el.ival
-                el.etime.offset(ival)
-                heappush(self.tlisteners, el)
-                cleanup = False
-            else:
-                cleanup = True
-            try:
-                if not el.cb_with_ts:
-                    el.cb_func(*el.cb_params)
+            for i, el in enumerate(due):
+                if el.cb_func == None:
+                    # Cancelled by one of the callbacks before it
+                    continue
+                if prof is not None:
+                    cb_func, t0 = el.cb_func, prof.clock()
+                    prof.timer_late(t0 - el.etime.monot)
+                if el.nticks == -1 or el.nticks > 1:
+                    # Re-schedule periodic timer
+                    if el.nticks > 1:
+                        el.nticks -= 1
+                    if el.randomize_runs != None:
+                        ival = el.randomize_runs(el.ival)
+                    else:
+                        ival = el.ival
+                    el.etime.offset(ival)
+                    self.timers.add(el)
+                    cleanup = False
                 else:
-                    el.cb_func(self.last_ts, *el.cb_params)
-            except Exception as ex:
-                if isinstance(ex, SystemExit):
-                    raise
-                dump_exception('EventDispatcher2: unhandled exception when processing timeout event')
-            if self.endloop:
-                return
-            if cleanup:
-                el.cleanup()
+                    cleanup = True
+                try:
+                    if not el.cb_with_ts:
+                        el.cb_func(*el.cb_params)
+                    else:
+                        el.cb_func(self.last_ts, *el.cb_params)
+                except Exception as ex:
+                    if isinstance(ex, SystemExit):
+                        raise
+                    dump_exception('EventDispatcher2: unhandled exception when processing timeout event')
+                if prof is not None:
+                    prof.record('timer', cb_func, t0)
+                if self.endloop:
+                    # Put back whatever is left to be fired on the next run
+                    for el in due[i + 1:]:
+                        if el.cb_func != None:
+                            self.timers.add(el)
+                    return
+                if cleanup:
+                    el.cleanup()
 
     def regSignal(self, signum, signal_cb, *cb_params, **cb_kw_args):
         sl = EventListener()
@@ -220,21 +277,29 @@ class EventDispatcher2(Singleton):
         sl.cleanup()
 
     def dispatchSignals(self):
+        prof = self.profiler
         while len(self.signals_pending) > 0:
             signum = self.signals_pending.pop(0)
             for sl in [x for x in self.slisteners if x.signum == signum]:
                 if sl not in self.slisteners:
                     continue
+                if prof is not None:
+                    cb_func, t0 = sl.cb_func, prof.clock()
                 try:
                     sl.cb_func(*sl.cb_params, **sl.cb_kw_args)
                 except Exception as ex:
                     if isinstance(ex, SystemExit):
                         raise
                     dump_exception('EventDispatcher2: unhandled exception when processing signal event')
+                if prof is not None:
+                    prof.record('signal', cb_func, t0)
                 if self.endloop:
                     return
 
     def dispatchThreadCallback(self, thread_cb, cb_params):
+        prof = self.profiler
+        if prof is not None:
+            t0 = prof.clock()
         try:
             thread_cb(*cb_params)
         except BaseException as ex:
@@ -242,25 +307,68 @@ class EventDispatcher2(Singleton):
                 self._exception = ex
                 return
             dump_exception('EventDispatcher2: unhandled exception when processing from-thread-call')
+        if prof is not None:
+            prof.record('thread', thread_cb, t0)
 
     def dispatchThreadCallbackSync(self, res_cb_q, thread_cb, cb_params):
+        prof = self.profiler
+        if prof is not None:
+            t0 = prof.clock()
         try:
             res = thread_cb(*cb_params)
         except BaseException as ex:
             rval = (None, ex)
         else:
             rval = (res, None)
+        if prof is not None:
+            prof.record('thread', thread_cb, t0)
         res_cb_q.put(rval)
 
+    def dispatchThreadCallbacks(self):
+        # Runs in the main thread. Re-arm the wakeup first, so that anything
+        # queued after that point either gets picked up by the loop below
+        # or triggers another wakeup, never both missed. Only drain what
+        # is already there to not starve timers when producers are busy.
+        self.cft_wakeup.release()
+        stats = self.cft_stats
+        queue = self.cft_queue
+        nitems = len(queue)
+        for i in range(nitems):
+            dispatch_f, args, etime = queue.popleft()
+            lat = monotonic() - etime
+            stats.lat_total += lat
+            if lat > stats.lat_max:
+                stats.lat_max = lat
+            dispatch_f(*args)
+        stats.wakeups += 1
+        stats.dispatched += nitems
+        stats.last_batch = nitems
+        if nitems > stats.max_batch:
+            stats.max_batch = nitems
+
+    def _queueThreadCallback(self, dispatch_f, *args):
+        # deque.append() and non-blocking Lock.acquire() are both atomic
+        # and never block, so this is safe to call from any thread as well
+        # as from the signal handler in the main thread.
+        self.cft_queue.append((dispatch_f, args, monotonic()))
+        if not self.cft_wakeup.acquire(False):
+            # Wakeup is already pending, the item will be picked up by it
+            return
+        try:
+            self.elp.call_from_thread(self.dispatchThreadCallbacks)
+        except:
+            self.cft_wakeup.release()
+            raise
+
     def callFromThread(self, thread_cb, *cb_params):
-        self.elp.call_from_thread(self.dispatchThreadCallback, thread_cb, cb_params)
+        self._queueThreadCallback(self.dispatchThreadCallback, thread_cb, cb_params)
         #print('EventDispatcher2.callFromThread completed', str(self), thread_cb, cb_params)
 
     def callFromThreadSync(self, thread_cb, *cb_params):
         if not hasattr(self.tloc_data, 'res_cb_q'):
             self.tloc_data.res_cb_q = Queue()
         res_cb_q = self.tloc_data.res_cb_q
-        self.elp.call_from_thread(self.dispatchThreadCallbackSync, res_cb_q, thread_cb, cb_params)
+        self._queueThreadCallback(self.dispatchThreadCallbackSync, res_cb_q, thread_cb, cb_params)
         res, ex = res_cb_q.get()
         if ex is not None:
             raise ex
@@ -287,14 +395,14 @@ class EventDispatcher2(Singleton):
             self.dispatchTimers()
             if self.endloop:
                 break
-            if self.twasted * 2 > len(self.tlisteners):
-                # Clean-up removed timers when their share becomes more than 50%
-                self.tlisteners = [x for x in self.tlisteners if x.cb_func != None]
-                heapify(self.tlisteners)
-                self.twasted = 0
+            self.timers.compact()
             if (timeout != None and self.last_ts > etime) or self.endloop:
                 self.endloop = False
                 break
+            if self.profiler is not None:
+                # Signals and timers, cross-thread calls are run from
+                # inside procrastinate() and are not part of this
+                self.profiler.iteration.observe(MonoTime().monot - self.last_ts.monot)
             self.elp.procrastinate()
             self.last_ts = MonoTime()
             if self._exception is not None:
@@ -311,4 +419,4 @@ class EventDispatcher2(Singleton):
         #import sys
         #traceback.print_stack(file = sys.stdout)
 
-ED2 = EventDispatcher2()
+ED2 = EventDispatcher2(timers = os.environ.get('SIPPY_ED2_TIMERS', 'heap'))
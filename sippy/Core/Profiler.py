@@ -0,0 +1,174 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from functools import partial
+from time import clock_gettime
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Metrics import MetricsHistogram, DEFAULT_BUCKETS
+from sippy.Time.clock_dtime import CLOCK_MONOTONIC
+
+# Same clock as MonoTime, so that it can be compared to the timer etime,
+# without going through ctypes
+monotonic = partial(clock_gettime, CLOCK_MONOTONIC)
+
+# Finer buckets at the low end, most callbacks take microseconds
+CALLBACK_BUCKETS = (0.00001, 0.00005, 0.0001, 0.00025) + DEFAULT_BUCKETS
+
+def callback_site(cb):
+    # Callbacks created in the same place share the code object, so
+    # that e.g. a lambda or a bound method of many objects is one site
+    while isinstance(cb, partial):
+        cb = cb.func
+    cb = getattr(cb, '__func__', cb)
+    return getattr(cb, '__code__', cb)
+
+def site_name(site):
+    if hasattr(site, 'co_filename'):
+        return '%s (%s:%d)' % (getattr(site, 'co_qualname', site.co_name), \
+          site.co_filename, site.co_firstlineno)
+    return repr(site)
+
+class EDCallbackStats(object):
+    kind = None
+    count = 0
+    total = 0.0
+    max = 0.0
+    hist = None
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.hist = MetricsHistogram(CALLBACK_BUCKETS)
+
+class EDProfiler(object):
+    # Opt-in instrumentation for EventDispatcher2: wall time spent in each
+    # callback site (timers, signals, cross-thread calls), how late timers
+    # fire against their scheduled time and how long each loop iteration
+    # keeps the loop away from polling. Costs two clock reads and a dict
+    # lookup per callback.
+    sites = None
+    lateness = None
+    iteration = None
+    started = None
+
+    def __init__(self):
+        self.reset()
+
+    @staticmethod
+    def enable(registry = None):
+        if ED2.profiler is None:
+            ED2.profiler = EDProfiler()
+            if registry is not None:
+                ED2.profiler.register(registry)
+        return ED2.profiler
+
+    @staticmethod
+    def disable(registry = None):
+        ED2.profiler = None
+        if registry is not None:
+            for name in ('sippy_ed_profiler', 'sippy_ed_timer_lateness_seconds', \
+              'sippy_ed_iteration_seconds'):
+                registry.unregister(name)
+
+    def reset(self):
+        self.sites = {}
+        self.lateness = MetricsHistogram(CALLBACK_BUCKETS)
+        self.iteration = MetricsHistogram(CALLBACK_BUCKETS)
+        self.started = monotonic()
+
+    clock = staticmethod(monotonic)
+
+    def record(self, kind, cb, t0):
+        elapsed = monotonic() - t0
+        site = callback_site(cb)
+        stats = self.sites.get(site, None)
+        if stats is None:
+            stats = EDCallbackStats(kind)
+            self.sites[site] = stats
+        stats.count += 1
+        stats.total += elapsed
+        if elapsed > stats.max:
+            stats.max = elapsed
+        stats.hist.observe(elapsed)
+
+    def timer_late(self, lateness):
+        self.lateness.observe(lateness if lateness > 0.0 else 0.0)
+
+    def top(self, n = 10, key = 'total'):
+        sites = sorted(self.sites.items(), key = lambda x: getattr(x[1], key), reverse = True)
+        return sites[:n]
+
+    def report(self, n = 10):
+        res = ['EventDispatcher2 profile for the last %.1f sec:' % (monotonic() - self.started)]
+        for title, hist in (('timer lateness', self.lateness), ('loop iteration', self.iteration)):
+            if hist.count == 0:
+                continue
+            res.append('  %s: count=%d avg=%.6f p99<=%s' % (title, hist.count, \
+              hist.sum / hist.count, self.quantile(hist, 0.99)))
+        for key in ('total', 'max'):
+            res.append('  top %d callbacks by %s time:' % (n, key))
+            for site, stats in self.top(n, key):
+                res.append('    %.6f total %.6f max %.6f avg p99<=%-8s %8d calls %-6s %s' % \
+                  (stats.total, stats.max, stats.total / stats.count, \
+                  self.quantile(stats.hist, 0.99), stats.count, stats.kind, site_name(site)))
+        return '\n'.join(res) + '\n'
+
+    def quantile(self, hist, q):
+        # Upper bound of the bucket the quantile falls into
+        rank = q * hist.count
+        total = 0
+        for le, count in zip(hist.buckets + ('+Inf',), hist.counts):
+            total += count
+            if total >= rank:
+                return le
+        return '+Inf'
+
+    def collect(self):
+        # Collector for MetricsRegistry
+        seconds, calls, durations = [], [], []
+        for site, stats in self.sites.items():
+            labels = (('kind', stats.kind), ('site', site_name(site)))
+            seconds.append((labels, stats.total))
+            calls.append((labels, stats.count))
+            durations.append((labels, stats.hist))
+        return (('sippy_ed_callback_seconds_total', 'counter', \
+           'Wall time spent in event loop callbacks', seconds),
+          ('sippy_ed_callback_calls_total', 'counter', \
+           'Event loop callbacks invoked', calls),
+          ('sippy_ed_callback_duration_seconds', 'histogram', \
+           'Duration of the individual event loop callbacks', durations))
+
+    def register(self, registry):
+        registry.register('sippy_ed_profiler', self.collect)
+        for name, help, hist in (('sippy_ed_timer_lateness_seconds', \
+          'Delay of the timer callbacks past their scheduled time', 'lateness'), \
+          ('sippy_ed_iteration_seconds', 'Time the event loop spends ' \
+          'running callbacks between two polls', 'iteration')):
+            registry.register(name, partial(self.collect_hist, name, help, hist))
+
+    def collect_hist(self, name, help, attr):
+        # The histograms are replaced on reset()
+        return ((name, 'histogram', help, (((), getattr(self, attr)),)),)
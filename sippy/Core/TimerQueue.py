@@ -0,0 +1,199 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from heapq import heappush, heappop, heapify
+
+class TimerHeap(object):
+    '''
+    Binary heap of pending timers. Cancelled timers are left in place and
+    skipped when they surface, the heap is rebuilt once they make up more
+    than half of it.
+    '''
+    tlisteners = None
+    twasted = 0
+
+    def __init__(self):
+        self.tlisteners = []
+
+    def __len__(self):
+        return len(self.tlisteners) - self.twasted
+
+    def add(self, el):
+        el.tqueued = True
+        heappush(self.tlisteners, el)
+
+    def remove(self, el):
+        if el.tqueued:
+            self.twasted += 1
+
+    def pop_due(self, now):
+        due = []
+        while len(self.tlisteners) != 0:
+            el = self.tlisteners[0]
+            if el.cb_func != None and el.etime.monot > now:
+                break
+            el = heappop(self.tlisteners)
+            el.tqueued = False
+            if el.cb_func == None:
+                # Skip any already removed timers
+                self.twasted -= 1
+                continue
+            due.append(el)
+        return due
+
+    def compact(self):
+        if self.twasted * 2 > len(self.tlisteners):
+            # Clean-up removed timers when their share becomes more than 50%
+            self.tlisteners = [x for x in self.tlisteners if x.cb_func != None]
+            heapify(self.tlisteners)
+            self.twasted = 0
+
+# Geometry of the wheel: 256 slots of one tick each at the bottom level
+# and 64 slots for each of the upper levels, each upper slot spanning the
+# whole range of the level below it. At 100 ticks per second that covers
+# about 7.7 days, anything beyond that is kept in the overflow set.
+_TW_L0_BITS = 8
+_TW_LN_BITS = 6
+_TW_NLEVELS = 4
+_TW_L0_MASK = (1 << _TW_L0_BITS) - 1
+_TW_LN_MASK = (1 << _TW_LN_BITS) - 1
+
+class TimerWheel(object):
+    '''
+    Hierarchical timing wheel. Adding and cancelling a timer is O(1) and
+    cancelled timers are removed right away, at the price of timers only
+    being ordered at the resolution of one tick, which is fixed up by
+    sorting whatever becomes due on each pass.
+    '''
+    tick = None
+    cur_tick = None
+    levels = None
+    overflow = None
+    ntimers = 0
+    l0_ntimers = 0
+
+    def __init__(self, tick, now):
+        self.tick = tick
+        self.cur_tick = int(now / tick)
+        self.levels = [[set() for i in range(1 << _TW_L0_BITS)],]
+        for i in range(1, _TW_NLEVELS):
+            self.levels.append([set() for i in range(1 << _TW_LN_BITS)])
+        self.overflow = set()
+
+    def __len__(self):
+        return self.ntimers
+
+    def _getslot(self, el):
+        t = int(el.etime.monot / self.tick)
+        delta = t - self.cur_tick
+        if delta < (1 << _TW_L0_BITS):
+            # Timers that are already late go into the current slot
+            return (self.levels[0][max(t, self.cur_tick) & _TW_L0_MASK], True)
+        shift = _TW_L0_BITS
+        for level in self.levels[1:]:
+            if delta < (1 << (shift + _TW_LN_BITS)):
+                return (level[(t >> shift) & _TW_LN_MASK], False)
+            shift += _TW_LN_BITS
+        return (self.overflow, False)
+
+    def _place(self, el):
+        slot, el.wl0 = self._getslot(el)
+        slot.add(el)
+        el.wslot = slot
+        if el.wl0:
+            self.l0_ntimers += 1
+
+    def add(self, el):
+        self._place(el)
+        self.ntimers += 1
+
+    def remove(self, el):
+        if el.wslot is None:
+            return
+        el.wslot.discard(el)
+        el.wslot = None
+        self.ntimers -= 1
+        if el.wl0:
+            self.l0_ntimers -= 1
+
+    def _redistribute(self, slot):
+        els = tuple(slot)
+        slot.clear()
+        for el in els:
+            self._place(el)
+
+    def _cascade(self):
+        # Called every time cur_tick enters a new round of the bottom
+        # level, refill it from the level above, and that one from the
+        # next one when it wraps too.
+        shift = _TW_L0_BITS
+        for level in self.levels[1:]:
+            idx = (self.cur_tick >> shift) & _TW_LN_MASK
+            self._redistribute(level[idx])
+            if idx != 0:
+                return
+            shift += _TW_LN_BITS
+        self._redistribute(self.overflow)
+
+    def pop_due(self, now):
+        now_tick = int(now / self.tick)
+        if self.ntimers == 0:
+            if now_tick > self.cur_tick:
+                self.cur_tick = now_tick
+            return []
+        due = []
+        l0 = self.levels[0]
+        while True:
+            if self.l0_ntimers == 0 and self.cur_tick < now_tick:
+                # Nothing at the bottom level, fast forward to the point
+                # where it is refilled from above
+                self.cur_tick = min((self.cur_tick | _TW_L0_MASK) + 1, now_tick)
+                if (self.cur_tick & _TW_L0_MASK) == 0:
+                    self._cascade()
+                continue
+            slot = l0[self.cur_tick & _TW_L0_MASK]
+            if len(slot) > 0:
+                if self.cur_tick < now_tick:
+                    due.extend(slot)
+                    slot.clear()
+                else:
+                    ready = [el for el in slot if el.etime.monot <= now]
+                    slot.difference_update(ready)
+                    due.extend(ready)
+            if self.cur_tick >= now_tick:
+                break
+            self.cur_tick += 1
+            if (self.cur_tick & _TW_L0_MASK) == 0:
+                self._cascade()
+        for el in due:
+            el.wslot = None
+        self.ntimers -= len(due)
+        self.l0_ntimers -= len(due)
+        due.sort()
+        return due
+
+    def compact(self):
+        pass
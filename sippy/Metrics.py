@@ -0,0 +1,347 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socket import AF_INET6
+from threading import Thread
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Core.Exceptions import dump_exception
+from sippy.Time.MonoTime import MonoTime
+from sippy.Time.Timeout import Timeout
+
+# Runtime metrics in the Prometheus text exposition format. Counters and
+# histograms are updated in place by the code being measured, everything
+# else is read at scrape time through collectors from the stats() of the
+# respective objects, so the scrape costs O(number of metrics) and never
+# walks calls or transactions. All updates and scrapes happen on the main
+# thread.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, \
+  0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SETUP_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, \
+  60.0, 120.0)
+
+class MetricsCounter(object):
+    value = 0
+
+    def inc(self, amount = 1):
+        self.value += amount
+
+    def samples(self, name, labels):
+        return ((name, labels, self.value),)
+
+class MetricsGauge(MetricsCounter):
+    def set(self, value):
+        self.value = value
+
+    def dec(self, amount = 1):
+        self.value -= amount
+
+class MetricsHistogram(object):
+    buckets = None
+    counts = None
+    sum = 0.0
+    count = 0
+
+    def __init__(self, buckets = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0,] * (len(self.buckets) + 1)
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        res = []
+        total = 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            res.append((name + '_bucket', labels + (('le', le),), total))
+        res.append((name + '_sum', labels, self.sum))
+        res.append((name + '_count', labels, self.count))
+        return res
+
+class MetricsFamily(object):
+    name = None
+    mtype = None
+    help = None
+    labelnames = None
+    children = None
+    factory = None
+
+    def __init__(self, name, mtype, help, labelnames, factory):
+        self.name, self.mtype, self.help, self.labelnames, self.factory = \
+          name, mtype, help, tuple(labelnames), factory
+        self.children = {}
+
+    def labels(self, *values):
+        try:
+            return self.children[values]
+        except KeyError:
+            pass
+        if len(values) != len(self.labelnames):
+            raise ValueError('%s: expected %d label values, got %d' % \
+              (self.name, len(self.labelnames), len(values)))
+        child = self.factory()
+        self.children[values] = child
+        return child
+
+    def collect(self):
+        res = []
+        for values, child in self.children.items():
+            res.extend(child.samples(self.name, tuple(zip(self.labelnames, values))))
+        return res
+
+def _fmt_value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+def _fmt_label(value):
+    if isinstance(value, float):
+        value = repr(value)
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class MetricsRegistry(object):
+    families = None
+    collectors = None
+    lag_probe = None
+    httpd = None
+
+    def __init__(self):
+        self.families = {}
+        self.collectors = {}
+
+    def family(self, name, mtype, help, labelnames, factory):
+        family = self.families.get(name, None)
+        if family is None:
+            family = MetricsFamily(name, mtype, help, labelnames, factory)
+            self.families[name] = family
+        elif family.mtype != mtype or family.labelnames != tuple(labelnames):
+            raise ValueError('%s: already registered with different type or labels' % name)
+        # Metric without labels is used directly
+        return family if len(family.labelnames) > 0 else family.labels()
+
+    def counter(self, name, help, labelnames = ()):
+        return self.family(name, 'counter', help, labelnames, MetricsCounter)
+
+    def gauge(self, name, help, labelnames = ()):
+        return self.family(name, 'gauge', help, labelnames, MetricsGauge)
+
+    def histogram(self, name, help, labelnames = (), buckets = DEFAULT_BUCKETS):
+        return self.family(name, 'histogram', help, labelnames, \
+          lambda: MetricsHistogram(buckets))
+
+    def register(self, name, collect_f):
+        # collect_f() returns a list of (name, type, help, [(labels, value), ...]),
+        # labels being a tuple of (name, value) pairs and value a number
+        # or MetricsHistogram. Registering the collector with the same
+        # name again replaces the old one.
+        self.collectors[name] = collect_f
+
+    def unregister(self, name):
+        self.collectors.pop(name, None)
+
+    def register_stats(self, prefix, stats_f, counters = (), labels = (), name = None):
+        # Exposes numeric values from the stats() dict, the keys listed in
+        # counters as counters and the rest as gauges. Several objects can
+        # share the prefix as long as they are registered under different
+        # names and with different labels.
+        def collect_stats():
+            res = []
+            for key, value in stats_f().items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if key in counters:
+                    res.append(('%s_%s_total' % (prefix, key), 'counter', None, ((labels, value),)))
+                else:
+                    res.append(('%s_%s' % (prefix, key), 'gauge', None, ((labels, value),)))
+            return res
+        self.register(prefix if name is None else name, collect_stats)
+
+    @staticmethod
+    def fromConfig(global_config):
+        registry = MetricsRegistry()
+        registry.register('sippy_cft_queue', collect_cft_queue)
+        registry.lag_probe = EventLoopLagProbe(registry)
+        if 'metrics_http' in global_config:
+            registry.httpd = MetricsHTTPServer(registry, \
+              parse_metrics_address(global_config['metrics_http']))
+        return registry
+
+    def render(self):
+        out = []
+        for family in self.families.values():
+            out.append(self.render_family(family.name, family.mtype, family.help, family.collect()))
+        # Same metric can come from more than one collector
+        cmetrics = {}
+        for cname, collect_f in tuple(self.collectors.items()):
+            try:
+                metrics = collect_f()
+            except Exception:
+                dump_exception('MetricsRegistry: collector %s has failed' % cname)
+                continue
+            for name, mtype, help, csamples in metrics:
+                samples = []
+                for labels, value in csamples:
+                    if isinstance(value, MetricsHistogram):
+                        samples.extend(value.samples(name, labels))
+                    else:
+                        samples.append((name, labels, value))
+                if name in cmetrics:
+                    cmetrics[name][2].extend(samples)
+                else:
+                    cmetrics[name] = (mtype, help, samples)
+        for name, (mtype, help, samples) in cmetrics.items():
+            out.append(self.render_family(name, mtype, help, samples))
+        return ''.join(out)
+
+    def render_family(self, name, mtype, help, samples):
+        res = []
+        if help is not None:
+            res.append('# HELP %s %s\n' % (name, help))
+        res.append('# TYPE %s %s\n' % (name, mtype))
+        for sname, labels, value in samples:
+            if len(labels) > 0:
+                labels = ','.join(['%s="%s"' % (k, _fmt_label(v)) for k, v in labels])
+                res.append('%s{%s} %s\n' % (sname, labels, _fmt_value(value)))
+            else:
+                res.append('%s %s\n' % (sname, _fmt_value(value)))
+        return ''.join(res)
+
+    def shutdown(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd = None
+        if self.lag_probe is not None:
+            self.lag_probe.shutdown()
+            self.lag_probe = None
+
+class EventLoopLagProbe(object):
+    # Periodic timer that measures how late it gets to run, i.e. for how
+    # long the event loop has been busy with something else.
+    ival = 0.1
+    timer = None
+    expected = None
+    lag = None
+    lag_max = None
+
+    def __init__(self, registry, ival = None):
+        if ival is not None:
+            self.ival = ival
+        self.lag = registry.histogram('sippy_event_loop_lag_seconds', \
+          'Delay of the timer events past their scheduled time')
+        self.lag_max = registry.gauge('sippy_event_loop_lag_max_seconds', \
+          'Maximum delay of the timer events since the last scrape')
+        registry.register('sippy_event_loop_lag_max', self.reset_max)
+        self.expected = MonoTime().monot + self.ival
+        self.timer = Timeout(self.probe, self.ival, -1)
+
+    def probe(self):
+        now = MonoTime().monot
+        lag = max(now - self.expected, 0.0)
+        self.lag.observe(lag)
+        if lag > self.lag_max.value:
+            self.lag_max.set(lag)
+        # Do not carry the stall over to the following runs
+        self.expected = max(self.expected + self.ival, now)
+
+    def reset_max(self):
+        # Called during the scrape after the families have been rendered
+        self.lag_max.set(0.0)
+        return ()
+
+    def shutdown(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+def collect_cft_queue():
+    s = ED2.cft_stats.snapshot()
+    return (('sippy_cft_queue_depth', 'gauge', 'Cross-thread calls waiting ' \
+       'for the main thread', (((), s['depth']),)),
+      ('sippy_cft_queue_dispatched_total', 'counter', 'Cross-thread calls ' \
+       'dispatched by the main thread', (((), s['dispatched']),)),
+      ('sippy_cft_queue_latency_max_seconds', 'gauge', 'Maximum time a ' \
+       'cross-thread call waited in the queue', (((), s['max_latency']),)))
+
+class _MetricsHTTPHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        try:
+            body = ED2.callFromThreadSync(self.server.registry.render).encode('utf-8')
+        except Exception:
+            dump_exception('MetricsHTTPServer: cannot render metrics')
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class _MetricsHTTPServer6(ThreadingHTTPServer):
+    address_family = AF_INET6
+
+class MetricsHTTPServer(Thread):
+    # Scrape endpoint, serves registry on http://<address>/metrics. The
+    # rendering itself is done on the main thread.
+    daemon = True
+    httpd = None
+
+    def __init__(self, registry, address):
+        Thread.__init__(self)
+        server_class = _MetricsHTTPServer6 if ':' in address[0] else ThreadingHTTPServer
+        self.httpd = server_class(address, _MetricsHTTPHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.registry = registry
+        self.address = self.httpd.server_address
+        self.start()
+
+    def run(self):
+        self.httpd.serve_forever()
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.join()
+
+def parse_metrics_address(spec):
+    # "[address:]port" -> (address, port), local-only by default
+    address, sep, port = spec.rpartition(':')
+    if sep == '':
+        address = '127.0.0.1'
+    return (address.strip('[]'), int(port))
@@ -34,18 +34,46 @@ except ImportError:
     _boolean_states = RawConfigParser.BOOLEAN_STATES
 from sippy.SipConf import SipConf
 from sippy.B2B.Transforms import getTransProc
+from sippy.SipAdmission import parse_rate
+from sippy.Rtp_proxy.balancer import RTPP_BALANCERS
+from sippy.RadiusAuthCache import auth_cache_key_f
 
 SUPPORTED_OPTIONS = { \
  'acct_enable':       ('B', 'enable or disable Radius accounting'), \
+ 'acct_spool':        ('S', 'path to the journal file to spool Radius ' \
+                             'accounting records in before sending them, ' \
+                             'records not acknowledged by the server are ' \
+                             'resent after restart'), \
+ 'acct_spool_inflight': ('I', 'maximum number of spooled Radius accounting ' \
+                             'records to have in flight at a time'), \
  'precise_acct':      ('B', 'do Radius accounting with millisecond precision'), \
  'alive_acct_int':    ('I', 'interval for sending alive Radius accounting in ' \
                              'second (0 to disable alive accounting)'), \
  'config':            ('S', 'load configuration from file (path to file)'), \
  'auth_enable':       ('B', 'enable or disable Radius authentication'), \
+ 'auth_cache_ttl':    ('I', 'time to reuse accepted Radius authorisation ' \
+                             'results for the calls authenticated by IP with ' \
+                             'the same auth_cache_key, identical requests in ' \
+                             'flight are coalesced (seconds, 0 to disable)'), \
+ 'auth_cache_neg_ttl': ('I', 'time to reuse rejected Radius authorisation ' \
+                             'results (seconds, 0 to disable)'), \
+ 'auth_cache_size':   ('I', 'maximum number of cached Radius authorisation ' \
+                             'results'), \
+ 'auth_cache_key':    ('S', 'what cached Radius authorisation results are ' \
+                             'keyed by, comma-separated list of ip, cli, cld, ' \
+                             'cli:N and cld:N (first N characters of the ' \
+                             'number), "ip,cli,cld" by default'), \
+ 'b2bua_workers':     ('I', 'number of B2BUA worker processes sharing the SIP port, ' \
+                             'each with its own calls and transactions, with ' \
+                             'in-dialog requests routed to the owning worker by ' \
+                             'Call-ID (0 or 1 to run a single process)'), \
  'b2bua_socket':      ('S', 'path to the B2BUA command socket or address to listen ' \
                              'for commands in the format "udp:host[:port]"'), \
  'digest_auth':       ('B', 'enable or disable SIP Digest authentication of ' \
                              'incoming INVITE requests'), \
+ 'ed_profile':        ('B', 'profile event loop callbacks, report is printed ' \
+                             'to the log on SIGQUIT or returned by the "p" ' \
+                             'command'), \
  'foreground':        ('B', 'run in foreground'), \
  'hide_call_id':      ('B', 'do not pass Call-ID header value from ingress call ' \
                              'leg to egress call leg'), \
@@ -60,10 +88,51 @@ SUPPORTED_OPTIONS = { \
  'logfile':           ('S', 'path to the B2BUA log file'), \
  'max_credit_time':   ('I', 'upper limit of session time for all calls in ' \
                              'seconds'), \
- 'max_radiusclients': ('I', 'maximum number of Radius Client helper ' \
-                             'processes to start'), \
+ 'max_radiusclients': ('I', 'maximum number of UDP sockets used by the ' \
+                             'Radius client, each allows for up to 256 ' \
+                             'requests in flight'), \
+ 'metrics_http':      ('S', 'serve runtime metrics in the Prometheus text ' \
+                             'format over HTTP on the specified ' \
+                             '"[address:]port" (127.0.0.1 by default)'), \
  'pidfile':           ('S', 'path to the B2BUA PID file'), \
- 'radiusclient.conf': ('S', 'path to the radiusclient.conf file'), \
+ 'radiusclient.conf': ('S', 'path to the radiusclient.conf file, ' \
+                             'authserver, acctserver, servers, dictionary, ' \
+                             'bindaddr, radius_timeout and radius_retries ' \
+                             'are taken from it'), \
+ 'radius_acct_servers': ('S', 'Radius accounting servers to try in that ' \
+                             'order, in the format "host[:port][:secret]" ' \
+                             '(comma-separated list). Overrides acctserver ' \
+                             'from the radiusclient.conf'), \
+ 'radius_auth_servers': ('S', 'Radius authentication servers to try in that ' \
+                             'order, in the format "host[:port][:secret]" ' \
+                             '(comma-separated list). Overrides authserver ' \
+                             'from the radiusclient.conf'), \
+ 'radius_retries':    ('I', 'number of times to send Radius request to each ' \
+                             'server before failing over to the next one'), \
+ 'radius_timeout':    ('I', 'time to wait for reply to each Radius request ' \
+                             'sent (seconds)'), \
+ 'rcache_max_bytes':  ('I', 'maximum total size of SIP replies kept in the ' \
+                             'retransmission cache (bytes)'), \
+ 'rcache_max_entries': ('I', 'maximum number of messages kept in the SIP ' \
+                             'retransmission cache'), \
+ 'route_cache_size':  ('I', 'number of parsed routes from the RADIUS replies to ' \
+                             'keep for reuse with the next calls, 0 to parse ' \
+                             'each one anew'), \
+ 'route_cache_ttl':   ('I', 'time to keep parsed routes in the cache, hostnames ' \
+                             'in routes are resolved again after it expires ' \
+                             '(seconds)'), \
+ 'route_table':       ('S', 'path to the local routing table file, routes are ' \
+                             'looked up by the longest CLD prefix instead of ' \
+                             'coming from the RADIUS server, the file is ' \
+                             're-read on the "rt reload" command'), \
+ 'setup_trace':       ('B', 'record the timeline of each call setup (INVITE, ' \
+                             'authorisation, RTPproxy, 100/18x/200 from the ' \
+                             'callee), returned by the "st" command and ' \
+                             'exported as per-stage histograms'), \
+ 'setup_trace_file':  ('S', 'append the finished call setup timelines to the ' \
+                             'file as JSON lines, implies setup_trace'), \
+ 'setup_trace_keep':  ('I', 'number of the finished call setup timelines kept ' \
+                             'in memory for the "st" command'), \
  'sip_address':       ('S', 'local SIP address to listen for incoming SIP requests ' \
                              '("*", "0.0.0.0" or "::" to listen on all IPv4 ' \
                              'or IPv6 interfaces)'),
@@ -86,6 +155,37 @@ SUPPORTED_OPTIONS = { \
                              'is not specified, we will accept from any IP and ' \
                              'then either try to authenticate if authentication ' \
                              'is enabled, or just let them to pass through'),
+ 'admission_accept_ips': ('B', 'drop incoming INVITE requests that start a new ' \
+                             'dialog and come from IP addresses not listed in ' \
+                             'accept_ips (or from the sip_proxy if [[PROXY]] is ' \
+                             'in it) before parsing them'), \
+ 'admission_ip_rate': ('S', 'limit on the rate of requests other than ACK and ' \
+                             'CANCEL, in-dialog ones included, accepted from a ' \
+                             'single IP address, checked before ' \
+                             'parsing, in the format "rate[/burst]" (requests ' \
+                             'per second)'), \
+ 'admission_method_rates': ('S', 'limit on the rate of new (out-of-dialog) ' \
+                             'requests accepted for a given method, checked before ' \
+                             'parsing, in the format "METHOD:rate[/burst]" ' \
+                             '(comma-separated list)'), \
+ 'admission_retry_after': ('I', 'answer requests over the admission_ip_rate or ' \
+                             'admission_method_rates limit with 503 and ' \
+                             'Retry-After of that many seconds instead of dropping ' \
+                             'them silently (0 to drop)'), \
+ 'capture_buffer':    ('I', 'size of the in-memory buffer for the SIP ' \
+                             'messages waiting to be written to capture_file ' \
+                             '/ capture_hep (bytes)'), \
+ 'capture_file':      ('S', 'path to the pcapng file to capture all SIP ' \
+                             'messages sent and received into'), \
+ 'capture_file_size': ('I', 'rotate the capture_file once it grows over ' \
+                             'that many bytes (0 to disable)'), \
+ 'capture_hep':       ('S', 'address of the HEPv3 collector to send copies ' \
+                             'of all SIP messages sent and received to, in ' \
+                             'the format "host:port[:capture_id]"'), \
+ 'digest_store':      ('S', 'path to the file with digest HA1 values to ' \
+                             'authenticate calls and registrations locally ' \
+                             'instead of with RADIUS, re-read on the ' \
+                             '"da reload" command'), \
  'digest_auth_only':  ('B', 'only use SIP Digest method to authenticate ' \
                              'incoming INVITE requests. If the option is not ' \
                              'specified or set to "off" then B2BUA will try to ' \
@@ -94,7 +194,15 @@ SUPPORTED_OPTIONS = { \
                              'challenge response comes in'), \
  'rtp_proxy_clients': ('S', 'comma-separated list of paths or addresses of the ' \
                              'RTPproxy control socket. Address in the format ' \
-                             '"udp:host[:port]" (comma-separated list)'), \
+                             '"udp:host[:port]" (comma-separated list), ' \
+                             'each optionally followed by ";weight=N" for ' \
+                             'the load balancer'), \
+ 'rtp_proxy_balancer': ('S', 'policy to distribute new sessions among ' \
+                             'RTPproxies: "random" (default), ' \
+                             '"least_sessions", "p2c" (power of two ' \
+                             'choices), "rtt" (least sessions penalised ' \
+                             'by the command round-trip time) or "hash" ' \
+                             '(sticky to Call-ID)'), \
  'sip_proxy':         ('S', 'address of the helper proxy to handle "REGISTER" ' \
                              'and "SUBSCRIBE" messages. Address in the format ' \
                              '"host[:port]"'),
@@ -201,12 +309,60 @@ class MyConfigParser(RawConfigParser):
         if key in ('keepalive_ans', 'keepalive_orig'):
             if _value < 0:
                 raise ValueError('keepalive_ans should be non-negative')
+        elif key == 'b2bua_workers':
+            if _value < 0:
+                raise ValueError('b2bua_workers should be non-negative')
+        elif key in ('auth_cache_ttl', 'auth_cache_neg_ttl'):
+            if _value < 0:
+                raise ValueError('%s should be non-negative' % key)
+        elif key == 'auth_cache_size':
+            if _value <= 0:
+                raise ValueError('auth_cache_size should be more than zero')
+        elif key == 'auth_cache_key':
+            auth_cache_key_f(value)
+        elif key == 'setup_trace_keep':
+            if _value <= 0:
+                raise ValueError('setup_trace_keep should be more than zero')
+        elif key == 'route_cache_size':
+            if _value < 0:
+                raise ValueError('route_cache_size should be non-negative')
+        elif key in ('rcache_max_bytes', 'rcache_max_entries', 'route_cache_ttl'):
+            if _value <= 0:
+                raise ValueError('%s should be more than zero' % key)
         elif key == 'max_credit_time':
             if _value <= 0:
                 raise ValueError('max_credit_time should be more than zero')
         elif key == 'allowed_pts':
             self['_allowed_pts'] = [int(x) if not (x.startswith('[') and x.endswith(']')) \
                                            else x[1:-1] for x in value.split(',')]
+        elif key == 'admission_retry_after':
+            if _value < 0:
+                raise ValueError('admission_retry_after should be non-negative')
+        elif key == 'admission_ip_rate':
+            self['_' + key] = parse_rate(value)
+        elif key == 'admission_method_rates':
+            rates = {}
+            for x in value.split(','):
+                method, rate = x.split(':', 1)
+                rates[method.strip().upper()] = parse_rate(rate.strip())
+            self['_' + key] = rates
+        elif key == 'rtp_proxy_balancer':
+            if value not in RTPP_BALANCERS:
+                raise ValueError('rtp_proxy_balancer should be one of: %s' % \
+                  ', '.join(sorted(RTPP_BALANCERS.keys())))
+        elif key in ('radius_timeout', 'radius_retries', 'acct_spool_inflight', \
+          'capture_buffer'):
+            if _value <= 0:
+                raise ValueError('%s should be positive' % key)
+        elif key == 'capture_file_size':
+            if _value < 0:
+                raise ValueError('capture_file_size should be non-negative')
+        elif key == 'metrics_http':
+            port = int(value.rpartition(':')[2])
+            if port <= 0 or port > 65535:
+                raise ValueError('metrics_http port should be in the range 1-65535')
+        elif key in ('radius_auth_servers', 'radius_acct_servers'):
+            self['_' + key] = [x.strip() for x in value.split(',')]
         elif key in ('accept_ips', 'rtp_proxy_clients'):
             self['_' + key] = [x.strip() for x in value.split(',')]
         elif key == 'pass_headers':
@@ -259,6 +415,8 @@ if __name__ == '__main__':
     assert m['pass_headers'] == 'a,b'
     assert m['_pass_headers'][0] == 'a'
     assert m['_pass_headers'][1] == 'b'
+    m.check_and_set('admission_method_rates', 'invite:10/20, REGISTER:5')
+    assert m['_admission_method_rates'] == {'INVITE':(10.0, 20.0), 'REGISTER':(5.0, 5.0)}
     m.check_and_set('accept_ips', '1.2.3.4, 5.6.7.8')
     assert m['accept_ips'] == '1.2.3.4, 5.6.7.8'
     assert m['_accept_ips'][0] == '1.2.3.4'
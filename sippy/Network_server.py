@@ -117,6 +117,10 @@ class Network_server(ABC):
                     raise 
                 dump_exception(f'{self.__class__}: unhandled exception when processing incoming data')
 
+    def handle_read_batch(self, batch:List[Tuple[bytes, Remote_address]], rtime:MonoTime):
+        for data, address in batch:
+            self.handle_read(data, address, rtime)
+
     @abstractmethod
     def join(self):
         pass
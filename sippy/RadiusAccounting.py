@@ -164,7 +164,11 @@ class RadiusAccounting(object):
         pattributes = ['%-32s = \'%s\'\n' % (x[0], str(x[1])) for x in attributes]
         pattributes.insert(0, 'sending Acct %s (%s):\n' % (type, self.origin.capitalize()))
         self.global_config['_sip_logger'].write(call_id = self.sip_cid, *pattributes)
-        self.global_config['_radius_client'].do_acct(attributes, self._process_result, self.sip_cid, time())
+        if '_acct_spool' in self.global_config:
+            rclient = self.global_config['_acct_spool']
+        else:
+            rclient = self.global_config['_radius_client']
+        rclient.do_acct(attributes, self._process_result, self.sip_cid, time())
 
     def ftime(self, t):
         gt = gmtime(t)
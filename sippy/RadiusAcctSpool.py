@@ -0,0 +1,268 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import deque
+from json import dumps, loads
+from os import fsync, replace
+from os.path import exists
+from queue import Queue, Empty
+from threading import Thread
+from time import monotonic
+
+from sippy.Core.Exceptions import dump_exception
+from sippy.Radius_client import Radius_client, RC_ERROR
+from sippy.Time.Timeout import Timeout
+
+class RadiusAcctRecord(object):
+    seq = None
+    attributes = None
+    result_callback = None
+    callback_parameters = None
+
+    def __init__(self, seq, attributes, result_callback = None, callback_parameters = ()):
+        self.seq, self.attributes, self.result_callback, self.callback_parameters = \
+          seq, attributes, result_callback, callback_parameters
+
+class RadiusAcctJournal(Thread):
+    # Does all the journal I/O off the main thread, so that a busy disk
+    # does not hold up the call processing: appends the lines it is given,
+    # fsync()s them at most once per sync_ival and rewrites the journal
+    # with the records still pending when asked to. Everything goes
+    # through the same queue, so the rewrite sees the journal exactly as
+    # it was at the time of the request.
+    daemon = True
+    path = None
+    f = None
+    wi = None
+    sync_ival = 1.0
+
+    def __init__(self, path, sync_ival = None):
+        Thread.__init__(self)
+        self.path = path
+        if sync_ival != None:
+            self.sync_ival = sync_ival
+        self.wi = Queue()
+        self.start()
+
+    def append(self, entry):
+        self.wi.put(dumps(entry) + '\n')
+
+    def compact(self, records):
+        # records is a list of (seq, attributes) that are still pending
+        self.wi.put(records)
+
+    def shutdown(self):
+        self.wi.put(None)
+        self.join()
+
+    def run(self):
+        deadline = None
+        while True:
+            timeout = None if deadline == None else max(deadline - monotonic(), 0)
+            try:
+                wi = self.wi.get(timeout = timeout)
+            except Empty:
+                wi = ''
+            try:
+                if wi == None:
+                    break
+                if isinstance(wi, str):
+                    if len(wi) > 0:
+                        self.f.write(wi)
+                        if deadline == None:
+                            deadline = monotonic() + self.sync_ival
+                    if self.wi.empty():
+                        # Make it to the OS right away, so that the record
+                        # survives the process crash
+                        self.f.flush()
+                        if deadline != None and deadline <= monotonic():
+                            fsync(self.f.fileno())
+                            deadline = None
+                    continue
+                self.rewrite(wi)
+                deadline = None
+            except Exception:
+                dump_exception('RadiusAcctJournal: cannot write %s' % self.path)
+        if self.f != None:
+            try:
+                self.f.flush()
+                fsync(self.f.fileno())
+            except Exception:
+                dump_exception('RadiusAcctJournal: cannot sync %s' % self.path)
+            self.f.close()
+            self.f = None
+
+    def rewrite(self, records):
+        if self.f != None:
+            self.f.close()
+            self.f = None
+        tpath = self.path + '.new'
+        f = open(tpath, 'w')
+        for seq, attributes in records:
+            f.write(dumps({'s':seq, 'a':attributes}) + '\n')
+        f.flush()
+        fsync(f.fileno())
+        f.close()
+        replace(tpath, self.path)
+        self.f = open(self.path, 'a')
+
+class RadiusAcctSpool(object):
+    # Accounting records go into an append-only journal first and then
+    # are sent out by a Radius client of their own, at most max_inflight
+    # at a time, so that a burst of Stops does not compete with the AUTH
+    # requests. A record is marked done in the journal once the server
+    # has answered it; the records that have not been answered when the
+    # process went down are sent again on the next start. When none of
+    # the accounting servers answers, sending is paused with exponential
+    # backoff while new records keep accumulating in the spool.
+    #
+    # Journal lines are {"s":seq,"a":attributes} for a new record and
+    # {"k":seq} for an answered one.
+    global_config = None
+    path = None
+    journal = None
+    rclient = None
+    queue = None
+    inflight = None
+    max_inflight = 64
+    next_seq = 1
+    backoff = 0.0
+    backoff_min = 1.0
+    backoff_max = 60.0
+    paused = None
+    nacked = 0
+    compact_every = 10000
+    nspooled = 0
+    nreplayed = 0
+    nfailures = 0
+
+    def __init__(self, global_config, path, rclient = None):
+        self.global_config = global_config
+        self.path = path
+        self.queue = deque()
+        self.inflight = {}
+        self.max_inflight = global_config.getdefault('acct_spool_inflight', self.max_inflight)
+        self.rclient = rclient if rclient != None else \
+          Radius_client(global_config, metrics_label = 'acct_spool')
+        if '_metrics' in global_config:
+            global_config['_metrics'].register_stats('sippy_acct_spool', self.stats, \
+              ('spooled', 'replayed', 'failures'))
+        if exists(path):
+            self.replay()
+        self.journal = RadiusAcctJournal(path)
+        self.compact()
+        self.pump()
+
+    def replay(self):
+        records = {}
+        for line in open(self.path, 'r'):
+            try:
+                entry = loads(line)
+            except ValueError:
+                # Partial write at the time of crash
+                continue
+            if 's' in entry:
+                records[entry['s']] = entry['a']
+            elif 'k' in entry:
+                records.pop(entry['k'], None)
+        for seq in sorted(records.keys()):
+            self.queue.append(RadiusAcctRecord(seq, [tuple(x) for x in records[seq]]))
+        if len(records) > 0:
+            self.next_seq = max(records.keys()) + 1
+        self.nreplayed = len(records)
+
+    def compact(self):
+        # Rewrite the journal with the records that are still pending
+        records = sorted(list(self.inflight.values()) + list(self.queue), key = lambda x: x.seq)
+        self.journal.compact([(rec.seq, rec.attributes) for rec in records])
+        self.nacked = 0
+
+    def log(self, entry):
+        self.journal.append(entry)
+
+    def do_acct(self, attributes, result_callback = None, *callback_parameters):
+        attributes = [(str(a), v if isinstance(v, int) else str(v)) for a, v in attributes]
+        try:
+            # Reject what would never make it to the server right away
+            self.rclient.encode_attributes(self.rclient._prepare_attributes('ACCT', attributes))
+        except (ValueError, KeyError):
+            dump_exception('RadiusAcctSpool: cannot encode accounting record')
+            if result_callback != None:
+                Timeout(result_callback, 0, 1, ((), RC_ERROR), *callback_parameters)
+            return
+        rec = RadiusAcctRecord(self.next_seq, attributes, result_callback, callback_parameters)
+        self.next_seq += 1
+        self.log({'s':rec.seq, 'a':rec.attributes})
+        self.nspooled += 1
+        self.queue.append(rec)
+        self.pump()
+
+    def pump(self):
+        while self.paused == None and len(self.inflight) < self.max_inflight and len(self.queue) > 0:
+            rec = self.queue.popleft()
+            self.inflight[rec.seq] = rec
+            self.rclient.do_acct(rec.attributes, self.acct_result, rec)
+
+    def acct_result(self, results, rec):
+        del self.inflight[rec.seq]
+        if results[1] == RC_ERROR:
+            # No server has answered, put the record back and hold off
+            self.nfailures += 1
+            self.queue.appendleft(rec)
+            if self.paused == None:
+                self.backoff = min(max(self.backoff * 2, self.backoff_min), self.backoff_max)
+                self.paused = Timeout(self.resume, self.backoff)
+            return
+        self.backoff = 0.0
+        self.log({'k':rec.seq})
+        self.nacked += 1
+        if self.nacked >= self.compact_every and len(self.inflight) + len(self.queue) < self.compact_every:
+            self.compact()
+        if rec.result_callback != None:
+            try:
+                rec.result_callback(results, *rec.callback_parameters)
+            except Exception:
+                dump_exception('RadiusAcctSpool: unhandled exception in accounting results callback')
+        self.pump()
+
+    def resume(self):
+        self.paused = None
+        self.pump()
+
+    def stats(self):
+        return {'queued':len(self.queue), 'inflight':len(self.inflight), \
+          'spooled':self.nspooled, 'replayed':self.nreplayed, \
+          'failures':self.nfailures, 'backoff':self.backoff}
+
+    def __str__(self):
+        return ', '.join(['%s=%s' % x for x in self.stats().items()])
+
+    def shutdown(self):
+        if self.paused != None:
+            self.paused.cancel()
+            self.paused = None
+        self.journal.shutdown()
+        self.rclient.shutdown()
@@ -0,0 +1,223 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import OrderedDict
+from functools import partial
+from time import monotonic
+
+# Answers to the IP-based RADIUS authorisation requests, kept for a while
+# and reused for the calls with the same key (by default the remote IP,
+# CLI and CLD), since the answer for a given trunk and number rarely
+# changes. Accepts are kept for ttl seconds, rejects for neg_ttl (0
+# disables negative caching), errors are not cached. Lookups for the key
+# that already has a request in flight wait for its answer instead of
+# sending another one.
+#
+# Key composition is a comma-separated list of ip, cli, cld, cli:N or
+# cld:N, the latter two use the first N characters of the number.
+
+AUTH_CACHE_KEY_FIELDS = ('ip', 'cli', 'cld')
+
+def auth_cache_key_f(spec):
+    fields = []
+    for field in [x.strip() for x in spec.split(',')]:
+        name, sep, plen = field.partition(':')
+        if name not in AUTH_CACHE_KEY_FIELDS or (sep != '' and name == 'ip'):
+            raise ValueError('invalid auth cache key field: %s' % field)
+        plen = int(plen) if sep != '' else None
+        if plen is not None and plen <= 0:
+            raise ValueError('invalid auth cache key field: %s' % field)
+        fields.append((AUTH_CACHE_KEY_FIELDS.index(name), plen))
+    fields = tuple(fields)
+    def key_f(remote_ip, caller, callee):
+        values = (remote_ip, caller, callee)
+        return tuple([values[i] if plen is None or values[i] is None else values[i][:plen] \
+          for i, plen in fields])
+    return key_f
+
+class RadiusAuthCacheWaiter(object):
+    cache = None
+    key = None
+    res_cb = None
+    sip_cid = None
+
+    def __init__(self, cache, key, res_cb, sip_cid):
+        self.cache = cache
+        self.key = key
+        self.res_cb = res_cb
+        self.sip_cid = sip_cid
+
+    def cancel(self):
+        if self.cache is not None:
+            self.cache.cancel(self)
+            self.cache = None
+        self.res_cb = None
+
+class RadiusAuthCacheInflight(object):
+    req = None
+    waiters = None
+
+    def __init__(self):
+        self.waiters = []
+
+class RadiusAuthCache(object):
+    global_config = None
+    rclient = None
+    key_f = None
+    max_entries = 10000
+    ttl = 60
+    neg_ttl = 0
+    entries = None
+    inflight = None
+    hits = 0
+    neg_hits = 0
+    misses = 0
+    coalesced = 0
+    inserts = 0
+    evictions = 0
+    expirations = 0
+
+    def __init__(self, global_config, rclient, ttl = None, neg_ttl = None, \
+      max_entries = None, key = 'ip,cli,cld'):
+        self.global_config = global_config
+        self.rclient = rclient
+        if ttl is not None:
+            self.ttl = ttl
+        if neg_ttl is not None:
+            self.neg_ttl = neg_ttl
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.key_f = auth_cache_key_f(key)
+        self.entries = OrderedDict()
+        self.inflight = {}
+
+    def do_auth(self, username, caller, callee, sip_cid, remote_ip, res_cb, \
+      realm = None, nonce = None, uri = None, response = None, extra_attributes = None):
+        if None not in (realm, nonce, uri, response):
+            # Digest responses are never the same twice
+            return self.rclient.do_auth(username, caller, callee, sip_cid, remote_ip, \
+              res_cb, realm, nonce, uri, response, extra_attributes)
+        sip_cid = str(sip_cid)
+        key = self.key_f(remote_ip, caller, callee)
+        if extra_attributes is not None:
+            key += tuple([(x[0], str(x[1])) for x in extra_attributes])
+        now = monotonic()
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            if entry[0] > now:
+                self.entries.move_to_end(key)
+                results = entry[1]
+                if results[1] == 0:
+                    self.hits += 1
+                else:
+                    self.neg_hits += 1
+                self.global_config['_sip_logger'].write('AAA request %s from cache ' \
+                  '(age is %.3f)' % ('accepted' if results[1] == 0 else 'rejected', \
+                  now - entry[2]), call_id = sip_cid)
+                self.rclient.process_result(res_cb, results)
+                return None
+            del self.entries[key]
+            self.expirations += 1
+        waiter = RadiusAuthCacheWaiter(self, key, res_cb, sip_cid)
+        inflight = self.inflight.get(key, None)
+        if inflight is not None:
+            self.coalesced += 1
+            inflight.waiters.append(waiter)
+            self.global_config['_sip_logger'].write('AAA request coalesced with the ' \
+              'one in flight', call_id = sip_cid)
+            return waiter
+        self.misses += 1
+        inflight = RadiusAuthCacheInflight()
+        inflight.waiters.append(waiter)
+        self.inflight[key] = inflight
+        inflight.req = self.rclient.do_auth(username, caller, callee, sip_cid, remote_ip, \
+          partial(self.done, key, inflight), extra_attributes = extra_attributes)
+        return waiter
+
+    def done(self, key, inflight, results):
+        if self.inflight.get(key, None) is inflight:
+            del self.inflight[key]
+        rcode = results[1]
+        ttl = self.ttl if rcode == 0 else self.neg_ttl if rcode == 1 else 0
+        if ttl > 0:
+            now = monotonic()
+            self.entries.pop(key, None)
+            self.entries[key] = (now + ttl, results, now)
+            self.inserts += 1
+            self.expire(now)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+                self.evictions += 1
+        for i, waiter in enumerate(inflight.waiters):
+            res_cb = waiter.res_cb
+            waiter.cache = None
+            waiter.res_cb = None
+            if res_cb is None:
+                continue
+            if i > 0:
+                self.global_config['_sip_logger'].write('AAA request %s by the ' \
+                  'coalesced request' % ('accepted' if rcode == 0 else 'rejected' \
+                  if rcode == 1 else 'failed'), call_id = waiter.sip_cid)
+            self.rclient.process_result(res_cb, results)
+
+    def cancel(self, waiter):
+        inflight = self.inflight.get(waiter.key, None)
+        if inflight is None or waiter not in inflight.waiters:
+            return
+        waiter.res_cb = None
+        if len([x for x in inflight.waiters if x.res_cb is not None]) > 0:
+            return
+        # Nobody is waiting for the answer anymore
+        del self.inflight[waiter.key]
+        inflight.req.cancel()
+
+    def expire(self, now):
+        # Entries with the shorter negative TTL can get stuck behind the
+        # positive ones, lookups take care of those
+        entries = self.entries
+        while len(entries) > 0:
+            key, entry = next(iter(entries.items()))
+            if entry[0] > now:
+                break
+            del entries[key]
+            self.expirations += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.neg_hits + self.misses + self.coalesced
+        hit_rate = (self.hits + self.neg_hits) / lookups if lookups > 0 else 0.0
+        return {'entries':len(self.entries), 'inflight':len(self.inflight), \
+          'hits':self.hits, 'neg_hits':self.neg_hits, 'misses':self.misses, \
+          'coalesced':self.coalesced, 'hit_rate':hit_rate, 'inserts':self.inserts, \
+          'evictions':self.evictions, 'expirations':self.expirations}
+
+    def __str__(self):
+        return 'entries=%(entries)d inflight=%(inflight)d hits=%(hits)d ' \
+          'neg_hits=%(neg_hits)d misses=%(misses)d coalesced=%(coalesced)d ' \
+          'hit_rate=%(hit_rate).3f evictions=%(evictions)d ' \
+          'expirations=%(expirations)d' % self.stats()
@@ -50,7 +50,7 @@ class RadiusAuthorisation(Radius_client):
         message = 'sending AAA request:\n' 
         message += reduce(lambda x, y: x + y, ['%-32s = \'%s\'\n' % (x[0], str(x[1])) for x in attributes])
         self.global_config['_sip_logger'].write(message, call_id = sip_cid)
-        Radius_client.do_auth(self, attributes, self._process_result, res_cb, sip_cid, time())
+        return Radius_client.do_auth(self, attributes, self._process_result, res_cb, sip_cid, time())
 
     def _process_result(self, results, res_cb, sip_cid, btime):
         delay = time() - btime
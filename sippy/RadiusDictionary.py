@@ -0,0 +1,120 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from os.path import dirname, join as p_join, isabs
+
+DEFAULT_DICTIONARY = p_join(dirname(__file__), 'dictionary')
+
+# FreeRADIUS ATTRIBUTE flags that go without value
+ATTRIBUTE_FLAGS = ('has_tag', 'concat', 'virtual', 'secret', 'array', 'long')
+
+class RadiusAttribute(object):
+    name = None
+    code = None
+    type = None
+    vendor = 0
+    values = None
+    rvalues = None
+
+    def __init__(self, name, code, type, vendor = 0):
+        self.name, self.code, self.type, self.vendor = name, code, type, vendor
+        self.values = {}
+        self.rvalues = {}
+
+class RadiusDictionary(object):
+    # radiusclient(-ng) / FreeRADIUS style dictionary: ATTRIBUTE, VALUE,
+    # VENDOR, BEGIN-VENDOR / END-VENDOR and $INCLUDE directives. The
+    # attribute name lookups are case-insensitive, just like they are in
+    # radiusclient.
+    vendors = None
+    by_name = None
+    by_code = None
+
+    def __init__(self, path = DEFAULT_DICTIONARY):
+        self.vendors = {}
+        self.by_name = {}
+        self.by_code = {}
+        self.load(path)
+
+    def load(self, path):
+        vendor = 0
+        for lineno, line in enumerate(open(path, 'r'), 1):
+            parts = line.split('#', 1)[0].split()
+            if len(parts) == 0:
+                continue
+            try:
+                if parts[0] == '$INCLUDE':
+                    ipath = parts[1]
+                    if not isabs(ipath):
+                        ipath = p_join(dirname(path), ipath)
+                    self.load(ipath)
+                elif parts[0] == 'VENDOR':
+                    self.vendors[parts[1].lower()] = int(parts[2])
+                elif parts[0] == 'BEGIN-VENDOR':
+                    vendor = self.vendors[parts[1].lower()]
+                elif parts[0] == 'END-VENDOR':
+                    vendor = 0
+                elif parts[0] == 'ATTRIBUTE':
+                    avendor = vendor
+                    if len(parts) > 4:
+                        # Either the vendor name (radiusclient) or the
+                        # flags like "encrypt=1,has_tag" (FreeRADIUS),
+                        # the latter do not matter to us
+                        avendor = self.vendors.get(parts[4].lower(), None)
+                        if avendor == None:
+                            if not self.isflags(parts[4]):
+                                raise KeyError(parts[4])
+                            avendor = vendor
+                    attr = RadiusAttribute(parts[1], int(parts[2], 0), parts[3], avendor)
+                    self.by_name[attr.name.lower()] = attr
+                    self.by_code[(attr.vendor, attr.code)] = attr
+                elif parts[0] == 'VALUE':
+                    attr = self.by_name[parts[1].lower()]
+                    num = int(parts[3], 0)
+                    attr.values[parts[2].lower()] = num
+                    attr.rvalues[num] = parts[2]
+            except (IndexError, KeyError, ValueError):
+                raise ValueError('%s:%d: malformed dictionary entry: %s' % \
+                  (path, lineno, line.strip()))
+
+    def isflags(self, s):
+        return len([x for x in s.split(',') if '=' not in x and \
+          x not in ATTRIBUTE_FLAGS]) == 0
+
+    def getAttr(self, name):
+        return self.by_name.get(name.lower(), None)
+
+    def getAttrByCode(self, code, vendor = 0):
+        return self.by_code.get((vendor, code), None)
+
+if __name__ == '__main__':
+    d = RadiusDictionary()
+    attr = d.getAttr('h323-credit-time')
+    assert (attr.vendor, attr.code, attr.type) == (9, 102, 'string')
+    assert d.getAttrByCode(1).name == 'User-Name'
+    assert d.getAttrByCode(1, 9).name == 'Cisco-AVPair'
+    assert d.getAttr('acct-status-type').values['stop'] == 2
+    print('RadiusDictionary: all tests passed')
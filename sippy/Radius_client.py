@@ -25,10 +25,205 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from sippy.External_command import External_command
+from collections import deque
+from functools import partial
+from hashlib import md5
+from heapq import heappush, heappop
+from itertools import count
+from os import urandom
+from os.path import exists
+from random import shuffle
+from socket import socket, getaddrinfo, inet_aton, inet_ntoa, inet_pton, AF_INET, \
+  AF_INET6, SOCK_DGRAM
+from struct import pack, unpack_from
 
-class Radius_client(External_command):
+from sippy.Core.Exceptions import dump_exception
+from sippy.RadiusDictionary import RadiusDictionary
+from sippy.Time.MonoTime import MonoTime
+from sippy.Time.Timeout import Timeout
+from sippy.Udp_server import Udp_server, Udp_server_opts
+
+ACCESS_REQUEST = 1
+ACCESS_ACCEPT = 2
+ACCESS_REJECT = 3
+ACCOUNTING_REQUEST = 4
+ACCOUNTING_RESPONSE = 5
+
+# Result codes, same as returned by the radiusclient(1)
+RC_OK = 0
+RC_REJECT = 1
+RC_ERROR = -1
+
+ATTR_PASSWORD = 2
+ATTR_NAS_IP_ADDRESS = 4
+ATTR_VENDOR_SPECIFIC = 26
+ATTR_NAS_IPV6_ADDRESS = 95
+# Digest-* attributes have codes outside of the 8-bit range, on the wire
+# they go as sub-attributes of the Digest-Attributes, the same way the
+# radiusclient-ng does it
+ATTR_DIGEST_ATTRIBUTES = 207
+ATTR_DIGEST_REALM = 1063
+ATTR_DIGEST_USER_NAME = 1072
+
+RADIUSCLIENT_CONFS = ('/usr/local/etc/radiusclient-ng/radiusclient.conf', \
+  '/usr/local/etc/radiusclient/radiusclient.conf', \
+  '/etc/radiusclient-ng/radiusclient.conf', '/etc/radiusclient/radiusclient.conf')
+
+def parse_radiusclient_conf(path):
+    conf = {}
+    for line in open(path, 'r'):
+        parts = line.split('#', 1)[0].split(None, 1)
+        if len(parts) == 2:
+            conf[parts[0]] = parts[1].strip()
+    return conf
+
+def parse_servers_file(path):
+    # "host[:port] secret" lines
+    secrets = {}
+    for line in open(path, 'r'):
+        parts = line.split('#', 1)[0].split()
+        if len(parts) >= 2:
+            secrets[parts[0]] = parts[1]
+    return secrets
+
+class RadiusServer(object):
+    address = None
+    family = AF_INET
+    secret = None
+    nas_ip = None
+    dead_until = None
+
+    def __init__(self, spec, default_port, secrets = {}):
+        # "host[:port][:secret]"
+        if spec.startswith('['):
+            host, rest = spec[1:].split(']', 1)
+            rest = rest[1:].split(':', 1) if len(rest) > 0 else []
+        else:
+            host, *rest = spec.split(':', 1)
+            rest = rest[0].split(':', 1) if len(rest) > 0 else []
+        port = default_port
+        if len(rest) > 0 and rest[0].isdigit():
+            port = int(rest.pop(0))
+        if len(rest) > 0:
+            self.secret = rest[0].encode()
+        else:
+            secret = secrets.get('%s:%d' % (host, port), secrets.get(host, None))
+            if secret == None:
+                raise ValueError('no secret for RADIUS server %s' % spec)
+            self.secret = secret.encode()
+        ai = getaddrinfo(host, port, 0, SOCK_DGRAM)[0]
+        self.family = ai[0]
+        # The source address the packets to this server would have, goes
+        # as NAS-IP-Address or NAS-IPv6-Address (RFC 3162)
+        s = socket(self.family, SOCK_DGRAM)
+        try:
+            s.connect(ai[4])
+            laddr = s.getsockname()[0]
+        finally:
+            s.close()
+        if self.family == AF_INET6:
+            # Udp_server keeps IPv6 addresses in brackets
+            self.address = ('[%s]' % ai[4][0], ai[4][1])
+            self.nas_ip = pack('!BB', ATTR_NAS_IPV6_ADDRESS, 18) + inet_pton(AF_INET6, laddr)
+        else:
+            self.address = ai[4]
+            self.nas_ip = pack('!BB', ATTR_NAS_IP_ADDRESS, 6) + inet_aton(laddr)
+
+    def __str__(self):
+        return '%s:%d' % self.address
+
+class RadiusRequest(object):
+    code = None
+    avps = None
+    password = None
+    has_nas_ip = False
+    result_callback = None
+    callback_parameters = None
+    servers = None
+    server = None
+    ntries = 0
+    channel = None
+    id = None
+    authenticator = None
+    packet = None
+    deadline = None
+    stime = None
+
+    def __init__(self, code, avps, password, servers, result_callback, \
+      callback_parameters):
+        self.code, self.avps, self.password, self.servers, \
+          self.result_callback, self.callback_parameters = code, avps, \
+          password, servers, result_callback, callback_parameters
+
+    def cancel(self):
+        # The reply or timeout still has to be processed to free up the
+        # request ID, just don't report it
+        self.result_callback = None
+        self.callback_parameters = None
+
+class RadiusChannel(object):
+    # Space of 256 request IDs, with one UDP socket per address family
+    # that is opened when the first request to the server of that family
+    # goes out
     global_config = None
+    bind_addresses = None
+    process_reply = None
+    uservs = None
+    free_ids = None
+    pending = None
+
+    def __init__(self, global_config, bind_addresses, process_reply):
+        self.global_config = global_config
+        self.bind_addresses = bind_addresses
+        self.process_reply = process_reply
+        self.uservs = {}
+        ids = list(range(256))
+        shuffle(ids)
+        self.free_ids = deque(ids)
+        self.pending = {}
+
+    def send_to(self, data, server):
+        userv = self.uservs.get(server.family, None)
+        if userv == None:
+            uopts = Udp_server_opts(self.bind_addresses[server.family], \
+              partial(self.process_reply, self))
+            uopts.flags = 0
+            uopts.nworkers = 1
+            uopts.rbatch_size = 16
+            userv = Udp_server(self.global_config, uopts)
+            self.uservs[server.family] = userv
+        userv.send_to(data, server.address)
+
+    def shutdown(self):
+        for userv in self.uservs.values():
+            userv.shutdown()
+        self.uservs = {}
+        self.process_reply = None
+
+class Radius_client(object):
+    global_config = None
+    rdict = None
+    auth_servers = None
+    acct_servers = None
+    bind_addresses = None
+    timeout = 10.0
+    retries = 3
+    dead_time = 30.0
+    max_channels = 20
+    channels = None
+    backlog = None
+    deadlines = None
+    deadlines_seq = None
+    timer = None
+    tick_ival = 0.05
+    nsent = 0
+    nretransmits = 0
+    nfailovers = 0
+    ntimeouts = 0
+    naccepts = 0
+    nrejects = 0
+    m_latency = None
+    metrics_label = None
     _avpair_names = ('call-id', 'h323-session-protocol', 'h323-ivr-out', 'h323-incoming-conf-id', \
       'release-source', 'alert-timepoint', 'provisional-timepoint')
     _cisco_vsa_names = ('h323-remote-address', 'h323-conf-id', 'h323-setup-time', 'h323-call-origin', \
@@ -36,40 +231,308 @@ class Radius_client(External_command):
       'h323-voice-quality', 'h323-credit-time', 'h323-return-code', 'h323-redirect-number', \
       'h323-preferred-lang', 'h323-billing-model', 'h323-currency')
 
-    def __init__(self, global_config = {}):
+    def __init__(self, global_config = {}, metrics_label = 'main'):
         self.global_config = global_config
-        command = global_config.getdefault('radiusclient', '/usr/local/sbin/radiusclient')
         config = global_config.getdefault('radiusclient.conf', None)
-        max_workers = global_config.getdefault('max_radiusclients', 20)
-        if config != None:
-            External_command.__init__(self, (command, '-f', config, '-s'), max_workers = max_workers)
+        if config == None:
+            config = ([x for x in RADIUSCLIENT_CONFS if exists(x)] + [None])[0]
+        rconf = parse_radiusclient_conf(config) if config != None else {}
+        secrets = parse_servers_file(rconf['servers']) if 'servers' in rconf else {}
+        self.rdict = RadiusDictionary()
+        if 'dictionary' in rconf and exists(rconf['dictionary']):
+            self.rdict.load(rconf['dictionary'])
+        self.auth_servers = self.getservers(global_config, '_radius_auth_servers', \
+          rconf.get('authserver', ''), 1812, secrets)
+        self.acct_servers = self.getservers(global_config, '_radius_acct_servers', \
+          rconf.get('acctserver', ''), 1813, secrets)
+        if len(self.auth_servers) == 0 and len(self.acct_servers) == 0:
+            raise ValueError('no RADIUS servers configured, use radius_auth_servers / ' \
+              'radius_acct_servers or radiusclient.conf')
+        self.timeout = float(global_config.getdefault('radius_timeout', \
+          rconf.get('radius_timeout', self.timeout)))
+        self.retries = max(int(global_config.getdefault('radius_retries', \
+          rconf.get('radius_retries', self.retries))), 1)
+        self.max_channels = global_config.getdefault('max_radiusclients', self.max_channels)
+        bindaddr = rconf.get('bindaddr', '*')
+        self.bind_addresses = {AF_INET:('0.0.0.0', 0), AF_INET6:('[::]', 0)}
+        if bindaddr != '*':
+            if ':' in bindaddr:
+                self.bind_addresses[AF_INET6] = ('[%s]' % bindaddr.strip('[]'), 0)
+            else:
+                self.bind_addresses[AF_INET] = (bindaddr, 0)
+        self.channels = []
+        self.backlog = deque()
+        self.deadlines = []
+        self.deadlines_seq = count()
+        if '_metrics' in global_config:
+            metrics = global_config['_metrics']
+            self.m_latency = metrics.histogram('sippy_radius_latency_seconds', \
+              'Time from RADIUS request to reply, including retries', \
+              ('client', 'type')).labels
+            metrics.register_stats('sippy_radius', self.stats, ('sent', \
+              'retransmits', 'failovers', 'timeouts', 'accepts', 'rejects'), \
+              (('client', metrics_label),), 'sippy_radius.' + metrics_label)
+            self.metrics_label = metrics_label
+
+    def getservers(self, global_config, key, rconf_servers, default_port, secrets):
+        if key in global_config:
+            specs = global_config[key]
         else:
-            External_command.__init__(self, (command, '-s'), max_workers = max_workers)
+            specs = [x.strip() for x in rconf_servers.replace(',', ' ').split()]
+        return [RadiusServer(x, default_port, secrets) for x in specs if len(x) > 0]
 
     def _prepare_attributes(self, type, attributes):
-        data = [type]
+        data = []
         for a, v in attributes:
             if a in self._avpair_names:
                 v = '%s=%s' % (str(a), str(v))
                 a = 'Cisco-AVPair'
             elif a in self._cisco_vsa_names:
                 v = '%s=%s' % (str(a), str(v))
-            data.append('%s="%s"' % (str(a), str(v)))
+            data.append((str(a), v))
         return data
 
+    def encode_value(self, attr, v):
+        if attr.type in ('integer', 'date'):
+            if not isinstance(v, int):
+                v = str(v)
+                v = attr.values[v.lower()] if v.lower() in attr.values else int(v)
+            return pack('!I', v)
+        if attr.type == 'ipaddr':
+            return inet_aton(str(v))
+        if isinstance(v, bytes):
+            return v
+        return str(v).encode()
+
+    def encode_attributes(self, attributes):
+        # Everything but the password is secret-independent, so it is only
+        # encoded once per request
+        avps = []
+        password = None
+        for a, v in attributes:
+            attr = self.rdict.getAttr(a)
+            if attr == None:
+                raise ValueError('unknown RADIUS attribute: %s' % a)
+            value = self.encode_value(attr, v)
+            if attr.vendor != 0:
+                value = pack('!IBB', attr.vendor, attr.code, len(value) + 2) + value
+                code = ATTR_VENDOR_SPECIFIC
+            elif ATTR_DIGEST_REALM <= attr.code <= ATTR_DIGEST_USER_NAME:
+                value = pack('!BB', attr.code - ATTR_DIGEST_REALM + 1, len(value) + 2) + value
+                code = ATTR_DIGEST_ATTRIBUTES
+            elif attr.code > 255:
+                # Non-protocol attribute, nothing to send
+                continue
+            else:
+                code = attr.code
+            if code == ATTR_PASSWORD:
+                password = value
+                continue
+            if len(value) > 253:
+                raise ValueError('RADIUS attribute is too long: %s' % a)
+            avps.append(pack('!BB', code, len(value) + 2) + value)
+        return (avps, password)
+
+    def encrypt_password(self, password, secret, authenticator):
+        # RFC 2865, section 5.2
+        password = password.ljust(max((len(password) + 15) // 16 * 16, 16), b'\x00')
+        if len(password) > 128:
+            raise ValueError('RADIUS password is too long')
+        result = []
+        last = authenticator
+        for i in range(0, len(password), 16):
+            b = md5(secret + last).digest()
+            last = bytes([x ^ y for x, y in zip(password[i:i + 16], b)])
+            result.append(last)
+        return b''.join(result)
+
+    def build_packet(self, req):
+        server = req.server
+        avps = req.avps
+        if req.code == ACCESS_REQUEST:
+            req.authenticator = urandom(16)
+            if req.password != None:
+                password = self.encrypt_password(req.password, server.secret, req.authenticator)
+                avps = avps + [pack('!BB', ATTR_PASSWORD, len(password) + 2) + password]
+        if not req.has_nas_ip:
+            avps = avps + [server.nas_ip]
+        body = b''.join(avps)
+        header = pack('!BBH', req.code, req.id, 20 + len(body))
+        if req.code != ACCESS_REQUEST:
+            req.authenticator = md5(header + b'\x00' * 16 + body + server.secret).digest()
+        if len(body) + 20 > 4096:
+            raise ValueError('RADIUS request is too large')
+        req.packet = header + req.authenticator + body
+
     def do_auth(self, attributes, result_callback, *callback_parameters):
-        return External_command.process_command(self, self._prepare_attributes('AUTH', attributes), result_callback, *callback_parameters)
+        return self.send_request(ACCESS_REQUEST, self.auth_servers, \
+          self._prepare_attributes('AUTH', attributes), result_callback, callback_parameters)
 
     def do_acct(self, attributes, result_callback = None, *callback_parameters):
-        External_command.process_command(self, self._prepare_attributes('ACCT', attributes), result_callback, *callback_parameters)
+        return self.send_request(ACCOUNTING_REQUEST, self.acct_servers, \
+          self._prepare_attributes('ACCT', attributes), result_callback, callback_parameters)
 
-    def process_result(self, result_callback, result, *callback_parameters):
-        if result_callback == None:
+    def send_request(self, code, servers, attributes, result_callback, callback_parameters):
+        try:
+            avps, password = self.encode_attributes(attributes)
+        except (ValueError, KeyError):
+            dump_exception('Radius_client: cannot encode request')
+            avps = None
+        if avps == None or len(servers) == 0:
+            req = RadiusRequest(code, None, None, None, result_callback, callback_parameters)
+            Timeout(self.complete, 0, 1, req, (), RC_ERROR)
+            return req
+        # Start with the first server that is not known to be dead
+        now = MonoTime().monot
+        alive = [i for i, x in enumerate(servers) if x.dead_until == None or x.dead_until <= now]
+        start = alive[0] if len(alive) > 0 else 0
+        req = RadiusRequest(code, avps, password, servers[start:] + servers[:start], \
+          result_callback, callback_parameters)
+        req.has_nas_ip = len([x for x in avps if x[0] in (ATTR_NAS_IP_ADDRESS, \
+          ATTR_NAS_IPV6_ADDRESS)]) > 0
+        req.stime = now
+        if not self.assign_id(req):
+            self.backlog.append(req)
+            return req
+        self.send_next(req)
+        return req
+
+    def assign_id(self, req):
+        for channel in self.channels:
+            if len(channel.free_ids) > 0:
+                break
+        else:
+            if len(self.channels) >= self.max_channels:
+                return False
+            channel = RadiusChannel(self.global_config, self.bind_addresses, self.process_reply)
+            self.channels.append(channel)
+        req.channel = channel
+        req.id = channel.free_ids.popleft()
+        channel.pending[req.id] = req
+        return True
+
+    def release_id(self, req):
+        channel = req.channel
+        del channel.pending[req.id]
+        channel.free_ids.append(req.id)
+        req.channel = None
+        while len(self.backlog) > 0 and len(channel.free_ids) > 0:
+            nreq = self.backlog.popleft()
+            self.assign_id(nreq)
+            self.send_next(nreq)
+
+    def send_next(self, req):
+        # Send request to the next server on the list, or give up
+        if len(req.servers) == 0:
+            self.ntimeouts += 1
+            self.release_id(req)
+            self.complete(req, (), RC_ERROR)
+            return
+        if req.server != None:
+            self.nfailovers += 1
+        req.server = req.servers.pop(0)
+        req.ntries = 0
+        try:
+            self.build_packet(req)
+        except ValueError:
+            dump_exception('Radius_client: cannot encode request')
+            self.release_id(req)
+            self.complete(req, (), RC_ERROR)
+            return
+        self.transmit(req)
+
+    def transmit(self, req):
+        req.ntries += 1
+        self.nsent += 1
+        req.channel.send_to(req.packet, req.server)
+        req.deadline = MonoTime().monot + self.timeout
+        heappush(self.deadlines, (req.deadline, next(self.deadlines_seq), req))
+        if self.timer == None:
+            self.timer = Timeout(self.tick, self.tick_ival, -1)
+
+    def tick(self):
+        now = MonoTime().monot
+        deadlines = self.deadlines
+        while len(deadlines) > 0 and deadlines[0][0] <= now:
+            deadline, seq, req = heappop(deadlines)
+            if req.channel == None or req.deadline != deadline:
+                # Answered or rescheduled
+                continue
+            if req.ntries < self.retries:
+                self.nretransmits += 1
+                self.transmit(req)
+                continue
+            req.server.dead_until = now + self.dead_time
+            self.send_next(req)
+        if len(deadlines) == 0 and self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+
+    def process_reply(self, channel, data, address, udp_server, rtime):
+        if len(data) < 20:
             return
+        code, id, length = unpack_from('!BBH', data)
+        req = channel.pending.get(id, None)
+        if req == None or address.address != req.server.address or length > len(data) or length < 20:
+            return
+        data = data[:length]
+        if md5(data[:4] + req.authenticator + data[20:] + req.server.secret).digest() != data[4:20]:
+            # Not ours, spoofed or stale reply to the request that used
+            # the same ID before
+            return
+        if code in (ACCESS_ACCEPT, ACCOUNTING_RESPONSE):
+            self.naccepts += 1
+            rc = RC_OK
+        elif code == ACCESS_REJECT:
+            self.nrejects += 1
+            rc = RC_REJECT
+        else:
+            rc = RC_ERROR
+        req.server.dead_until = None
+        if self.m_latency is not None:
+            self.m_latency(self.metrics_label, 'auth' if req.code == ACCESS_REQUEST \
+              else 'acct').observe(rtime.monot - req.stime)
+        self.release_id(req)
+        try:
+            nav = self.decode_attributes(data[20:])
+        except Exception:
+            dump_exception('Radius_client: malformed reply from %s' % str(req.server))
+            nav, rc = (), RC_ERROR
+        self.complete(req, nav, rc)
+
+    def decode_value(self, attr, value):
+        if attr.type in ('integer', 'date'):
+            v = unpack_from('!I', value)[0]
+            return attr.rvalues.get(v, str(v))
+        if attr.type == 'ipaddr':
+            return inet_ntoa(value)
+        return value.decode('utf-8', 'replace')
+
+    def decode_attributes(self, data):
+        avps = []
+        i = 0
+        while i + 2 <= len(data):
+            code, length = data[i], data[i + 1]
+            if length < 2:
+                raise ValueError('invalid attribute length')
+            value = data[i + 2:i + length]
+            i += length
+            if code == ATTR_VENDOR_SPECIFIC and len(value) >= 6:
+                vendor = unpack_from('!I', value)[0]
+                j = 4
+                while j + 2 <= len(value):
+                    vcode, vlength = value[j], value[j + 1]
+                    if vlength < 2:
+                        raise ValueError('invalid vendor attribute length')
+                    avps.append((self.rdict.getAttrByCode(vcode, vendor), value[j + 2:j + vlength]))
+                    j += vlength
+            else:
+                avps.append((self.rdict.getAttrByCode(code), value))
         nav = []
-        for av in result[:-1]:
-            a, v = [x.strip() for x in av.decode().split(' = ', 1)]
-            v = v.strip('\'')
+        for attr, value in avps:
+            if attr == None:
+                continue
+            a, v = attr.name, self.decode_value(attr, value)
             if (a == 'Cisco-AVPair' or a in self._cisco_vsa_names):
                 t = v.split('=', 1)
                 if len(t) > 1:
@@ -77,4 +540,37 @@ class Radius_client(External_command):
             elif v.startswith(a + '='):
                 v = v[len(a) + 1:]
             nav.append((a, v))
-        External_command.process_result(self, result_callback, (tuple(nav), int(result[-1])), *callback_parameters)
+        return tuple(nav)
+
+    def complete(self, req, nav, rc):
+        result_callback, callback_parameters = req.result_callback, req.callback_parameters
+        req.cancel()
+        if result_callback == None:
+            return
+        self.process_result(result_callback, (nav, rc), *callback_parameters)
+
+    def process_result(self, result_callback, result, *callback_parameters):
+        try:
+            result_callback(result, *callback_parameters)
+        except Exception as ex:
+            if isinstance(ex, SystemExit):
+                raise
+            dump_exception('Radius_client: unhandled exception in RADIUS results callback')
+
+    def stats(self):
+        return {'inflight':sum([len(x.pending) for x in self.channels]), \
+          'queued':len(self.backlog), 'sockets':len(self.channels), \
+          'sent':self.nsent, 'retransmits':self.nretransmits, \
+          'failovers':self.nfailovers, 'timeouts':self.ntimeouts, \
+          'accepts':self.naccepts, 'rejects':self.nrejects}
+
+    def __str__(self):
+        return ', '.join(['%s=%d' % x for x in self.stats().items()])
+
+    def shutdown(self):
+        if self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+        for channel in self.channels:
+            channel.shutdown()
+        self.channels = []
@@ -0,0 +1,244 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from threading import Thread, Lock
+from errno import EINTR
+from queue import Empty
+from secrets import token_hex
+from itertools import count
+import socket
+
+from sippy.Time.MonoTime import MonoTime
+from sippy.Core.Exceptions import dump_exception
+from sippy.Core.EventDispatcher import ED2
+
+_MAX_RECONNECT = 10
+_MAX_BATCH = 64
+
+class RTPPLReceiver(Thread):
+    daemon = True
+    worker = None
+    s = None
+
+    def __init__(self, worker, s):
+        Thread.__init__(self)
+        self.worker = worker
+        self.s = s
+        self.start()
+
+    def run(self):
+        worker = self.worker
+        buf = b''
+        cookie = None
+        while True:
+            try:
+                data = self.s.recv(65536)
+            except socket.error as why:
+                if why.errno == EINTR:
+                    continue
+                data = b''
+            if len(data) == 0:
+                break
+            buf += data
+            lines = buf.split(b'\n')
+            buf = lines.pop()
+            for line in lines:
+                # Garbage from the other side must not kill the thread,
+                # that would leave every command in flight hanging
+                line = line.decode('ascii', 'replace')
+                parts = line.split(None, 1)
+                if len(parts) > 0 and parts[0] in worker.pending:
+                    # Only the first line of the reply carries the cookie,
+                    # so the next one also ends the reply being collected
+                    if cookie is not None:
+                        worker.complete(cookie, reply)
+                        cookie = None
+                    reply = [parts[1] if len(parts) > 1 else '',]
+                    if parts[0] in worker.multiline:
+                        cookie = parts[0]
+                    else:
+                        worker.complete(parts[0], reply)
+                elif cookie is not None:
+                    # Continuation of a multi-line reply
+                    reply.append(line)
+        if worker.disconnected(self.s):
+            # Connection went away under us, whatever is still in flight
+            # is lost
+            worker.fail(socket.error('Connection closed'))
+        self.worker = None
+        self.s = None
+
+class RTPPLWorker_pipelined(Thread):
+    # Runs many commands over a single stream connection at the same time.
+    # Every command is tagged with a cookie and replies are matched back by
+    # it, so they do not have to arrive in order. Replies are collected by
+    # the separate receiver thread.
+    #
+    # The replies to the info commands span several lines and the stream
+    # has no end-of-reply marker, so each of them is followed by a "V"
+    # command: rtpproxy answers the commands of a connection in order and
+    # the cookie line of the "V" reply marks the end of the info reply.
+    daemon = True
+    userv = None
+    s = None
+    pending = None
+    multiline = None
+    cookie_pfx = None
+    cookie_seq = None
+    lock = None
+
+    def __init__(self, userv):
+        Thread.__init__(self)
+        self.userv = userv
+        self.pending = {}
+        self.multiline = set()
+        self.cookie_pfx = token_hex(4)
+        self.cookie_seq = count(1)
+        self.lock = Lock()
+        self.start()
+
+    def connect(self):
+        s = socket.socket(self.userv.family, socket.SOCK_STREAM)
+        if self.userv.family == socket.AF_INET6:
+            address = (self.userv.address[0][1:-1], self.userv.address[1])
+        else:
+            address = self.userv.address
+        s.connect(address)
+        self.s = s
+        RTPPLReceiver(self, s)
+
+    def send_raw(self, data):
+        nreconnects = 0
+        ex = None
+        while True:
+            if self.s is None:
+                if nreconnects >= _MAX_RECONNECT:
+                    raise Exception('Cannot reconnect: %s' % (str(self.userv.address),)) from ex
+                nreconnects += 1
+                self.connect()
+                # Whatever had been sent over the previous connection
+                # and has not been answered yet goes out again
+                with self.lock:
+                    data = b''.join([x[0] for x in self.pending.values()])
+            try:
+                self.s.sendall(data)
+                return
+            except socket.error as why:
+                if why.errno == EINTR:
+                    continue
+                ex = why
+                self.disconnected(self.s)
+
+    def disconnected(self, s):
+        with self.lock:
+            if self.s is not s:
+                return False
+            self.s = None
+        try:
+            s.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        s.close()
+        return True
+
+    def complete(self, cookie, reply):
+        with self.lock:
+            preq = self.pending.pop(cookie, None)
+            self.multiline.discard(cookie)
+        if preq is None:
+            return
+        command, result_callback, callback_parameters, stime = preq
+        data = '\n'.join(reply).strip()
+        if len(data) == 0:
+            data, rtpc_delay = None, None
+        else:
+            rtpc_delay = stime.offsetFromNow()
+        ED2.callFromThread(self.dispatch, result_callback, data, None, \
+          callback_parameters, rtpc_delay)
+
+    def fail(self, ex):
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending = {}
+            self.multiline = set()
+        for command, result_callback, callback_parameters, stime in pending:
+            ED2.callFromThread(self.dispatch, result_callback, None, ex, \
+              callback_parameters, None)
+
+    def register(self, command, result_callback, callback_parameters, multiline = False):
+        cookie = '%s_%d' % (self.cookie_pfx, next(self.cookie_seq))
+        cdata = ('%s %s' % (cookie, command)).encode()
+        with self.lock:
+            self.pending[cookie] = (cdata, result_callback, \
+              callback_parameters, MonoTime())
+            if multiline:
+                self.multiline.add(cookie)
+        return cdata
+
+    def run(self):
+        wi_queue = self.userv.wi
+        while True:
+            wis = [wi_queue.get(),]
+            # Pick up whatever else is waiting, to send it in one go
+            while wis[-1] is not None and len(wis) < _MAX_BATCH:
+                try:
+                    wis.append(wi_queue.get_nowait())
+                except Empty:
+                    break
+            out = []
+            for wi in wis:
+                if wi is None:
+                    break
+                command, result_callback, callback_parameters = wi
+                multiline = command.startswith('I')
+                out.append(self.register(command, result_callback, \
+                  callback_parameters, multiline))
+                if multiline:
+                    out.append(self.register('V\n', None, ()))
+            if len(out) > 0:
+                try:
+                    self.send_raw(b''.join(out))
+                except Exception as ex:
+                    self.fail(ex)
+            if wis[-1] is None:
+                # Shutdown request, relay it further
+                wi_queue.put(None)
+                break
+        if self.s is not None:
+            self.disconnected(self.s)
+        self.userv = None
+
+    def dispatch(self, result_callback, data, ex, callback_parameters, rtpc_delay):
+        if rtpc_delay is not None and self.userv is not None:
+            self.userv.register_delay(rtpc_delay)
+        if result_callback is None:
+            if ex is not None:
+                dump_exception('RTPPLWorker_pipelined: unhandled exception I/O RTPproxy')
+            return
+        try:
+            result_callback(data, *callback_parameters, ex=ex)
+        except:
+            dump_exception('RTPPLWorker_pipelined: unhandled exception when processing RTPproxy reply')
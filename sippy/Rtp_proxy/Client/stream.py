@@ -33,6 +33,7 @@ from sippy.Core.EventDispatcher import ED2
 from ...Rtp_proxy.cmd import Rtp_proxy_cmd
 from .net import Rtp_proxy_client_net
 from .Worker.external import RTPPLWorker_external as _RTPPLWorker
+from .Worker.pipelined import RTPPLWorker_pipelined as _RTPPLWorker_pipelined
 
 class Rtp_proxy_client_stream(Rtp_proxy_client_net):
     is_local = None
@@ -46,7 +47,7 @@ class Rtp_proxy_client_stream(Rtp_proxy_client_net):
     worker_class = _RTPPLWorker
 
     def __init__(self, global_config, address = '/var/run/rtpproxy.sock', \
-      bind_address = None, nworkers = 1, family = socket.AF_UNIX):
+      bind_address = None, nworkers = 1, family = socket.AF_UNIX, pipelined = False):
         #print('Rtp_proxy_client_stream.__init__', address, bind_address, nworkers, family)
         if family == socket.AF_UNIX:
             self.is_local = True
@@ -55,6 +56,11 @@ class Rtp_proxy_client_stream(Rtp_proxy_client_net):
             self.is_local = False
             self.address = self.getdestbyaddr(address, family)
         self.family = family
+        if pipelined:
+            # Commands are tagged with cookies and many of them are kept
+            # in flight over each connection, rtpproxy has to be set up to
+            # expect cookies on that socket (e.g. "cunix:").
+            self.worker_class = _RTPPLWorker_pipelined
         self.wi = Queue()
         self.nworkers = nworkers
         self.workers = []
@@ -33,6 +33,8 @@ from sippy.Math.recfilter import recfilter
 from sippy.Rtp_proxy.cmd import Rtp_proxy_cmd
 from sippy.Rtp_proxy.Client.net import Rtp_proxy_client_net
 
+from heapq import heappush, heappop, heapify
+from itertools import count
 from socket import SOCK_DGRAM, AF_INET
 from secrets import token_hex
 
@@ -52,21 +54,65 @@ class Rtp_proxy_pending_req(object):
     retransmits = 0
     next_retr = None
     triesleft = None
-    timer = None
+    deadline = None
     command = None
     result_callback = None
     stime = None
     callback_parameters = None
 
-    def __init__(self, next_retr, nretr, timer, command, result_callback, \
+    def __init__(self, next_retr, nretr, command, result_callback, \
       callback_parameters):
         self.stime = MonoTime()
-        self.next_retr, self.triesleft, self.timer, self.command, self.result_callback, \
-          self.callback_parameters = next_retr, nretr, timer, command, \
+        self.deadline = self.stime.monot + next_retr
+        self.next_retr, self.triesleft, self.command, self.result_callback, \
+          self.callback_parameters = next_retr, nretr, command, \
           result_callback, callback_parameters
 
+class Rtp_proxy_retr_scheduler(object):
+    # Retransmission deadlines of all in-flight commands of a client are
+    # kept in a local heap and checked from a single periodic timer, which
+    # only runs while there is something pending. Entries are never
+    # removed on reply, they are simply skipped once due if the command is
+    # no longer pending, or dropped in bulk by compact().
+    tick_ival = 0.01
+    deadlines = None
+    timer = None
+    retransmit = None
+    seq = None
+
+    def __init__(self, retransmit):
+        self.deadlines = []
+        self.retransmit = retransmit
+        self.seq = count()
+
+    def schedule(self, deadline, cookie):
+        heappush(self.deadlines, (deadline, next(self.seq), cookie))
+        if self.timer == None:
+            self.timer = Timeout(self.tick, self.tick_ival, -1)
+
+    def tick(self):
+        now = MonoTime().monot
+        deadlines = self.deadlines
+        while len(deadlines) > 0 and deadlines[0][0] <= now:
+            self.retransmit(heappop(deadlines)[2])
+        if len(deadlines) == 0 and self.timer != None:
+            self.timer.cancel()
+            self.timer = None
+
+    def compact(self, pending):
+        self.deadlines = [x for x in self.deadlines if x[2] in pending]
+        heapify(self.deadlines)
+
+    def __len__(self):
+        return len(self.deadlines)
+
 class Rtp_proxy_client_udp(Rtp_proxy_client_net):
     pending_requests = None
+    retr_sched = None
+    cookie_prefix = None
+    cookie_seq = None
+    nretransmitted = 0
+    nexpired = 0
     is_local = False
     worker = None
     uopts = None
@@ -87,11 +133,14 @@ class Rtp_proxy_client_udp(Rtp_proxy_client_net):
         self.uopts.nworkers = 1 if nworkers is None else nworkers
         self.worker = Udp_server(global_config, self.uopts)
         self.pending_requests = {}
+        self.retr_sched = Rtp_proxy_retr_scheduler(self.retransmit)
+        self.cookie_prefix = token_hex(4) + '_'
+        self.cookie_seq = count(1)
         self.global_config = global_config
         self.delay_flt = recfilter(0.95, 0.25)
 
     def send_command(self, command, result_callback = None, *callback_parameters):
-        cookie = token_hex(16)
+        cookie = self.cookie_prefix + str(next(self.cookie_seq))
         next_retr = self.delay_flt.lastval * 4.0
         exp_time = 3.0
         if isinstance(command, Rtp_proxy_cmd):
@@ -110,24 +159,30 @@ class Rtp_proxy_client_udp(Rtp_proxy_client_net):
         if nretr == None:
             nretr = getnretrans(next_retr, exp_time)
         command = '%s %s' % (cookie, command)
-        timer = Timeout(self.retransmit, next_retr, 1, cookie)
-        preq = Rtp_proxy_pending_req(next_retr, nretr - 1, timer, command, \
+        preq = Rtp_proxy_pending_req(next_retr, nretr - 1, command, \
           result_callback, callback_parameters)
         self.worker.send_to(command, self.address)
         self.pending_requests[cookie] = preq
+        self.retr_sched.schedule(preq.deadline, cookie)
 
     def retransmit(self, cookie):
-        preq = self.pending_requests[cookie]
+        preq = self.pending_requests.get(cookie, None)
+        if preq == None:
+            # Answered already
+            return
         #print('command to %s timeout %s cookie %s triesleft %d' % (str(self.address), preq.command, cookie, preq.triesleft))
         if preq.triesleft <= 0 or self.worker == None:
             del self.pending_requests[cookie]
+            self.nexpired += 1
             self.go_offline()
             if preq.result_callback != None:
                 preq.result_callback(None, *preq.callback_parameters)
             return
         preq.retransmits += 1
+        self.nretransmitted += 1
         preq.next_retr *= 2
-        preq.timer = Timeout(self.retransmit, preq.next_retr, 1, cookie)
+        preq.deadline += preq.next_retr
+        self.retr_sched.schedule(preq.deadline, cookie)
         self.worker.send_to(preq.command, self.address)
         preq.triesleft -= 1
 
@@ -146,7 +201,8 @@ class Rtp_proxy_client_udp(Rtp_proxy_client_net):
         preq = self.pending_requests.pop(cookie, None)
         if preq == None:
             return
-        preq.timer.cancel()
+        if len(self.retr_sched) > 2 * len(self.pending_requests) + 64:
+            self.retr_sched.compact(self.pending_requests)
         if rtime <= preq.stime:
             # MonoTime as the name suggests is supposed to be monotonic,
             # so if we get response earlier than request went out something
@@ -176,6 +232,10 @@ class Rtp_proxy_client_udp(Rtp_proxy_client_net):
     def get_rtpc_delay(self):
         return self.delay_flt.lastval
 
+    def get_rtpc_stats(self):
+        return {'inflight':len(self.pending_requests), \
+          'retransmitted':self.nretransmitted, 'expired':self.nexpired}
+
 class selftest(object):
 
     def gotreply(self, ED2, rtpc, *args, ex=None):
@@ -0,0 +1,136 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from hashlib import blake2b
+from math import log
+from random import random
+
+# Picking RTPproxy to handle a new session. All policies take the list of
+# online clients and the Call-ID, the weight of each client (1.0 unless
+# configured otherwise) is taken into account. Load of the client is the
+# number of active sessions as reported by the last heartbeat plus the
+# number of sessions we have sent its way since.
+
+def rtpp_load(rtpc):
+    active_sessions = rtpc.active_sessions if rtpc.active_sessions is not None else 0
+    return active_sessions + rtpc.sessions_placed
+
+def rtpp_weight(rtpc):
+    return rtpc.weight
+
+class Rtpp_balancer_random(object):
+    # Weighted random choice
+    name = 'random'
+
+    def pick(self, rtpcs, call_id):
+        total = sum([rtpp_weight(x) for x in rtpcs])
+        point = random() * total
+        for rtpc in rtpcs:
+            point -= rtpp_weight(rtpc)
+            if point < 0:
+                return rtpc
+        return rtpcs[-1]
+
+    def select(self, rtpcs, call_id = None):
+        if len(rtpcs) == 1:
+            rtpc = rtpcs[0]
+        else:
+            rtpc = self.pick(rtpcs, call_id)
+        rtpc.sessions_placed += 1
+        return rtpc
+
+class Rtpp_balancer_lsessions(Rtpp_balancer_random):
+    # Weighted least-sessions, ties are broken at random
+    name = 'least_sessions'
+
+    def score(self, rtpc):
+        return (rtpp_load(rtpc) + 1) / rtpp_weight(rtpc)
+
+    def pick(self, rtpcs, call_id):
+        scores = [(self.score(x), random(), i) for i, x in enumerate(rtpcs)]
+        return rtpcs[min(scores)[2]]
+
+class Rtpp_balancer_p2c(Rtpp_balancer_lsessions):
+    # Power of two choices: out of two clients picked at random take the
+    # one that is less loaded, does not herd onto one node when the load
+    # data is stale
+    name = 'p2c'
+    rnd = None
+
+    def __init__(self):
+        self.rnd = Rtpp_balancer_random()
+
+    def pick(self, rtpcs, call_id):
+        c1 = self.rnd.pick(rtpcs, call_id)
+        c2 = self.rnd.pick([x for x in rtpcs if x is not c1], call_id)
+        return c1 if self.score(c1) <= self.score(c2) else c2
+
+class Rtpp_balancer_rtt(Rtpp_balancer_lsessions):
+    # Weighted least-sessions with a penalty for the clients that take
+    # longer to answer, the score doubles for every rtt_ref seconds of the
+    # command round-trip time
+    name = 'rtt'
+    rtt_ref = 0.01
+
+    def score(self, rtpc):
+        try:
+            rtt = rtpc.get_rtpc_delay()
+        except Exception:
+            rtt = None
+        if rtt is None or rtt < 0:
+            rtt = 0.0
+        return Rtpp_balancer_lsessions.score(self, rtpc) * (1.0 + rtt / self.rtt_ref)
+
+class Rtpp_balancer_hash(Rtpp_balancer_random):
+    # Weighted rendezvous hashing on Call-ID: the same call always ends up
+    # on the same client for as long as it is online, and when a client
+    # goes away or comes back only its share of calls is moved
+    name = 'hash'
+
+    def score(self, rtpc, call_id):
+        h = blake2b(('%s %s' % (rtpc.spath, call_id)).encode(), digest_size = 8).digest()
+        h = (int.from_bytes(h, 'big') + 1) / float(1 << 64)
+        return -rtpp_weight(rtpc) / log(h)
+
+    def pick(self, rtpcs, call_id):
+        if call_id is None:
+            return Rtpp_balancer_random.pick(self, rtpcs, call_id)
+        scores = [(self.score(x, call_id), i) for i, x in enumerate(rtpcs)]
+        return rtpcs[max(scores)[1]]
+
+RTPP_BALANCERS = dict([(x.name, x) for x in (Rtpp_balancer_random, \
+  Rtpp_balancer_lsessions, Rtpp_balancer_p2c, Rtpp_balancer_rtt, \
+  Rtpp_balancer_hash)])
+
+def parse_rtpp_spec(spec):
+    # "<address>[;weight=<n>]" -> (address, weight)
+    address, sep, param = spec.rpartition(';weight=')
+    if sep == '':
+        return (spec, 1.0)
+    weight = float(param)
+    if weight <= 0:
+        raise ValueError('invalid RTPproxy weight: %s' % spec)
+    return (address, weight)
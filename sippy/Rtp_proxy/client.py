@@ -82,6 +82,9 @@ class Rtp_proxy_client(Rtp_proxy_client_udp, Rtp_proxy_client_stream):
     hrtb_retr_ival = 60.0
     rtpp_class = None
     notify_socket = None
+    weight = 1.0
+    sessions_placed = 0
+    spath = None
 
     def __init_udp(self, global_config, a, kwargs):
         a = a.split(':', 2)
@@ -146,6 +149,7 @@ class Rtp_proxy_client(Rtp_proxy_client_udp, Rtp_proxy_client_stream):
             rtppa = a[5:]
         elif a.startswith('cunix:'):
             rtppa = a[6:]
+            kwargs['pipelined'] = True
         else:
             rtppa = a
         self.proxy_address = global_config['_sip_address']
@@ -169,6 +173,7 @@ class Rtp_proxy_client(Rtp_proxy_client_udp, Rtp_proxy_client_stream):
         if len(address) == 0 and 'spath' in kwargs:
             a = kwargs['spath']
             del kwargs['spath']
+            self.spath = a
             if a.startswith('udp:'):
                 proto__init = self.__init_udp
             elif a.startswith('udp6:'):
@@ -186,11 +191,13 @@ class Rtp_proxy_client(Rtp_proxy_client_udp, Rtp_proxy_client_stream):
         elif len(address) > 0 and type(address[0]) in (tuple, list):
             self.rtpp_class = Rtp_proxy_client_udp
             self.proxy_address = address[0][0]
+            self.spath = 'udp:%s:%s' % tuple(address[0][:2])
             self.rtpp_class.__init__(self, global_config, *address, \
               **kwargs)
         else:
             self.rtpp_class = Rtp_proxy_client_stream
             self.proxy_address = global_config['_sip_address']
+            self.spath = str(address[0]) if len(address) > 0 else None
             self.rtpp_class.__init__(self, global_config, *address, \
               **kwargs)
         if not no_version_check:
@@ -276,6 +283,7 @@ class Rtp_proxy_client(Rtp_proxy_client_udp, Rtp_proxy_client_stream):
     def update_active(self, active_sessions, sessions_created, active_streams, preceived, ptransmitted):
         self.sessions_created = sessions_created
         self.active_sessions = active_sessions
+        self.sessions_placed = 0
         self.active_streams = active_streams
         self.preceived = preceived
         self.ptransmitted = ptransmitted
@@ -290,6 +298,27 @@ class Rtp_proxy_client(Rtp_proxy_client_udp, Rtp_proxy_client_stream):
     def get_rtpc_delay(self):
         return self.rtpp_class.get_rtpc_delay(self)
 
+def collect_rtpp_metrics(rtpcs):
+    # Per-node metrics for MetricsRegistry, RTT is the filtered value
+    # that is also used to set retransmit intervals
+    online, rtt, sessions, weight = [], [], [], []
+    for rtpc in rtpcs:
+        labels = (('node', rtpc.spath),)
+        online.append((labels, rtpc.online))
+        weight.append((labels, rtpc.weight))
+        if rtpc.active_sessions is not None:
+            sessions.append((labels, rtpc.active_sessions))
+        try:
+            delay = rtpc.get_rtpc_delay()
+        except Exception:
+            delay = None
+        if delay is not None:
+            rtt.append((labels, delay))
+    return (('sippy_rtpp_online', 'gauge', 'RTPproxy is online', online),
+      ('sippy_rtpp_rtt_seconds', 'gauge', 'RTPproxy command round-trip time', rtt),
+      ('sippy_rtpp_sessions', 'gauge', 'Active sessions reported by RTPproxy', sessions),
+      ('sippy_rtpp_weight', 'gauge', 'Configured RTPproxy weight', weight))
+
 def test(cmd = 'VF 123456', **kwargs):
     from sippy.Core.EventDispatcher import ED2
     from sippy.Time.Timeout import Timeout
@@ -69,7 +69,11 @@ class Rtp_proxy_session(object):
             n = len(rtp_proxy_clients)
             if n == 0:
                 raise RtpProxyError('No online RTP proxy client has been found')
-            self.rtp_proxy_client = rtp_proxy_clients[int(random() * n)]
+            if '_rtpp_balancer' in global_config:
+                self.rtp_proxy_client = global_config['_rtpp_balancer'].select(rtp_proxy_clients, \
+                  str(call_id) if call_id != None else None)
+            else:
+                self.rtp_proxy_client = rtp_proxy_clients[int(random() * n)]
         else:
             self.rtp_proxy_client = global_config['rtp_proxy_client']
             if not self.rtp_proxy_client.online:
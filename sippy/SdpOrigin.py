@@ -61,7 +61,7 @@ class SdpOrigin(object):
         return '%s %s %s %s %s %s' % (self.username, self.session_id, self.version, self.network_type, self.address_type, self.address)
 
     def localStr(self, local_addr = None):
-        if local_addr != None and 'my' in dir(self.address):
+        if local_addr != None and hasattr(self.address, 'my'):
             (local_addr, local_port), local_transport = local_addr
             if local_addr.startswith('['):
                 address_type = 'IP6'
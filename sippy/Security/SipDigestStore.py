@@ -0,0 +1,297 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from hashlib import blake2b
+from mmap import mmap, ACCESS_READ
+from os import replace
+from os.path import dirname
+from secrets import token_bytes
+from struct import Struct
+from tempfile import NamedTemporaryFile, TemporaryFile
+
+from sippy.SipHeader import SipHeader
+from sippy.SipWWWAuthenticate import SipWWWAuthenticate
+from sippy.SipAuthorization import DigestCalcHA1Sess
+from sippy.Security.SipNonce import NonceCountWindow
+
+# Local store of precomputed digest HA1 values, so that SIP digest
+# authentication can be done without asking the RADIUS server.
+#
+# The source is an htdigest-style text file, one entry per line:
+#
+# username:realm:HA1[:algorithm]
+#
+# where HA1 is the hex H(username:realm:password) and algorithm is one of
+# MD5 (default for the 32 digit HA1), SHA-256 (default for 64 digits) or
+# SHA-512-256. The -sess variants of the algorithms use the same HA1.
+#
+# The text is compiled into a sorted table of fixed size records keyed by
+# a salted hash of realm, username and algorithm, the table is mmap()ed
+# and binary searched, so that a large subscriber base does not have to
+# be loaded into the heap and the pages are shared between the workers.
+
+SDS_MAGIC = b'SDST'
+SDS_VERSION = 1
+SDS_HEADER = Struct('!4sBBxxQ16s')
+SDS_KEY_SIZE = 16
+SDS_RECORD = Struct('!%dsB32s' % SDS_KEY_SIZE)
+
+SDS_ALGORITHMS = ('SHA-512-256', 'SHA-256', 'MD5')
+
+def sds_key(salt, realm, username, algorithm):
+    h = blake2b(('%s\0%s\0%s' % (realm, username, algorithm)).encode(), \
+      digest_size = SDS_KEY_SIZE, key = salt)
+    return h.digest()
+
+def sds_parse_line(line):
+    parts = line.split(':')
+    if len(parts) not in (3, 4):
+        raise ValueError('invalid entry, username:realm:HA1[:algorithm] expected')
+    username, realm, ha1 = parts[:3]
+    digest = bytes.fromhex(ha1)
+    if len(parts) == 4:
+        algorithm = parts[3]
+    else:
+        algorithm = 'MD5' if len(digest) == 16 else 'SHA-256'
+    if algorithm not in SDS_ALGORITHMS:
+        raise ValueError('unsupported algorithm: %s' % algorithm)
+    if len(digest) != (16 if algorithm == 'MD5' else 32):
+        raise ValueError('HA1 length does not match the algorithm')
+    return (username, realm, algorithm, digest)
+
+def sds_compile(src, dst):
+    # src: iterable of text lines, dst: binary file to write the table into
+    salt = token_bytes(16)
+    records = []
+    algorithms = set()
+    for lnum, line in enumerate(src, 1):
+        line = line.strip()
+        if len(line) == 0 or line.startswith('#'):
+            continue
+        try:
+            username, realm, algorithm, digest = sds_parse_line(line)
+        except ValueError as ex:
+            raise ValueError('line %d: %s' % (lnum, ex))
+        records.append(SDS_RECORD.pack(sds_key(salt, realm, username, algorithm), \
+          len(digest), digest))
+        algorithms.add(algorithm)
+    records.sort()
+    for i in range(1, len(records)):
+        if records[i][:SDS_KEY_SIZE] == records[i - 1][:SDS_KEY_SIZE]:
+            raise ValueError('duplicate entries in the digest store')
+    algmask = sum([1 << i for i, x in enumerate(SDS_ALGORITHMS) if x in algorithms])
+    dst.write(SDS_HEADER.pack(SDS_MAGIC, SDS_VERSION, algmask, len(records), salt))
+    dst.writelines(records)
+    dst.flush()
+    return len(records)
+
+class SipDigestStore(object):
+    fname = None
+    mm = None
+    salt = None
+    nrecords = 0
+    algorithms = None
+    lookups = 0
+    misses = 0
+    reload_errors = 0
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.swap(self.load())
+
+    def load(self):
+        # Compiles and maps the new table, does not touch the one in use,
+        # so that it can run outside of the main thread
+        with open(self.fname, 'rb') as f:
+            compiled = f.read(len(SDS_MAGIC)) == SDS_MAGIC
+        if compiled:
+            tf = open(self.fname, 'rb')
+        else:
+            # Plain text, compile it into an unnamed temporary file
+            tf = TemporaryFile()
+            with open(self.fname, 'r') as f:
+                try:
+                    sds_compile(f, tf)
+                except ValueError as ex:
+                    tf.close()
+                    raise ValueError('%s: %s' % (self.fname, ex))
+        try:
+            mm = mmap(tf.fileno(), 0, access = ACCESS_READ)
+        finally:
+            tf.close()
+        magic, version, algmask, nrecords, salt = SDS_HEADER.unpack_from(mm, 0)
+        if magic != SDS_MAGIC or version != SDS_VERSION or \
+          len(mm) != SDS_HEADER.size + nrecords * SDS_RECORD.size:
+            mm.close()
+            raise ValueError('%s: corrupt digest store' % self.fname)
+        algorithms = tuple([x for i, x in enumerate(SDS_ALGORITHMS) if algmask & (1 << i)])
+        return (mm, salt, nrecords, algorithms)
+
+    def swap(self, table):
+        omm = self.mm
+        self.mm, self.salt, self.nrecords, self.algorithms = table
+        if omm is not None:
+            omm.close()
+        return self.nrecords
+
+    def reload(self):
+        try:
+            table = self.load()
+        except:
+            self.reloadFailed()
+            raise
+        return self.swap(table)
+
+    def reloadFailed(self):
+        self.reload_errors += 1
+
+    def lookup(self, realm, username, algorithm = 'MD5'):
+        # Returns hex HA1 as bytes (the way DigestCalcHA1() does) or None
+        self.lookups += 1
+        key = sds_key(self.salt, realm, username, algorithm)
+        mm, rsize, base = self.mm, SDS_RECORD.size, SDS_HEADER.size
+        lo, hi = 0, self.nrecords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            off = base + mid * rsize
+            rkey = mm[off:off + SDS_KEY_SIZE]
+            if rkey < key:
+                lo = mid + 1
+            elif rkey > key:
+                hi = mid
+            else:
+                dlen = mm[off + SDS_KEY_SIZE]
+                off += SDS_KEY_SIZE + 1
+                return mm[off:off + dlen].hex().encode()
+        self.misses += 1
+        return None
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+    def stats(self):
+        return {'fname':self.fname, 'entries':self.nrecords, \
+          'lookups':self.lookups, 'misses':self.misses, \
+          'reload_errors':self.reload_errors}
+
+class SipDigestAuth(object):
+    # Challenges requests and verifies their credentials against the
+    # SipDigestStore, with nonce-count replay protection
+    store = None
+    ncw = None
+    accepted = 0
+    rejected = 0
+
+    def __init__(self, fname):
+        self.store = SipDigestStore(fname)
+        self.ncw = NonceCountWindow()
+
+    def challenges(self, realm):
+        # One WWW-Authenticate per algorithm in the store, the strongest
+        # first as per RFC 8760
+        res = []
+        for algorithm in self.store.algorithms:
+            body = SipWWWAuthenticate(realm = realm, algorithm = algorithm)
+            res.append(SipHeader(name = 'www-authenticate', body = body))
+        return res
+
+    def knows(self, auth):
+        # Whether the credentials name a user that is in the store, only
+        # those are for us to verify
+        if not auth.parsed:
+            auth.parse()
+        if auth.username is None or auth.realm is None:
+            return False
+        for algorithm in self.store.algorithms:
+            if self.store.lookup(auth.realm, auth.username, algorithm) is not None:
+                return True
+        return False
+
+    def verify(self, auth, method, body = None):
+        if not auth.parsed:
+            auth.parse()
+        algorithm = auth.algorithm if auth.algorithm is not None else 'MD5'
+        if algorithm.endswith('-sess'):
+            balgorithm = algorithm[:-5]
+        else:
+            balgorithm = algorithm
+        if auth.username is None or auth.realm is None or auth.nonce is None or \
+          auth.response is None or auth.uri is None or balgorithm not in SDS_ALGORITHMS:
+            self.rejected += 1
+            return False
+        HA1 = self.store.lookup(auth.realm, auth.username, balgorithm)
+        if HA1 is None:
+            self.rejected += 1
+            return False
+        if balgorithm != algorithm:
+            if auth.cnonce is None:
+                self.rejected += 1
+                return False
+            HA1 = DigestCalcHA1Sess(algorithm, HA1, auth.nonce, auth.cnonce)
+        if not auth.verifyHA1(HA1, method, body, self.ncw):
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def reload(self):
+        return self.store.reload()
+
+    def load(self):
+        return self.store.load()
+
+    def swap(self, table):
+        return self.store.swap(table)
+
+    def reloadFailed(self):
+        self.store.reloadFailed()
+
+    def stats(self):
+        res = self.store.stats()
+        res.update(self.ncw.stats())
+        res['accepted'] = self.accepted
+        res['rejected'] = self.rejected
+        return res
+
+    def __str__(self):
+        return 'SipDigestAuth(%(fname)s): %(entries)d entries, %(accepted)d accepted, ' \
+          '%(rejected)d rejected, %(replays)d replays, %(nonces)d nonces' % self.stats()
+
+if __name__ == '__main__':
+    # Compiles the text file into the binary table that can be used
+    # directly and does not have to be recompiled on each start
+    import sys
+
+    if len(sys.argv) != 3:
+        sys.stderr.write('usage: SipDigestStore.py htdigest_file store_file\n')
+        sys.exit(1)
+    with open(sys.argv[1], 'r') as src:
+        with NamedTemporaryFile(dir = dirname(sys.argv[2]) or '.', delete = False) as dst:
+            nrecords = sds_compile(src, dst)
+    replace(dst.name, sys.argv[2])
+    print('%d entries compiled into %s' % (nrecords, sys.argv[2]))
@@ -25,6 +25,7 @@
 
 #import sys; sys.path.append('..')
 
+from collections import OrderedDict
 from functools import partial
 from base64 import b64encode, b64decode
 from hmac import compare_digest, new as hmac_new
@@ -33,6 +34,7 @@ from secrets import token_bytes
 from Crypto.Cipher import AES
 
 from sippy.Time.clock_dtime import clock_getntime, CLOCK_MONOTONIC
+from time import monotonic
 
 AES_BLOCK_SIZE = AES.block_size
 MAC_SIZE = 16
@@ -113,6 +115,87 @@ class HashOracle(object):
             return False
         return True
 
+class NonceCountWindow(object):
+    # Replay protection for the nonces that HashOracle only checks for age.
+    # For each nonce in use the highest nonce-count seen so far is kept
+    # along with the bitmap of the wsize values just below it, a request
+    # is rejected if its nc has been seen already or is too far behind.
+    # Requests without qop carry no nc and are counted as nc=1, i.e. such
+    # nonces can be used only once.
+    #
+    # Entries are dropped once the nonce is too old for HashOracle to
+    # accept it anyway. When there are max_entries of them new nonces are
+    # refused rather than forgetting the ones still in use, which would
+    # let their nc values be replayed.
+    wsize = 64
+    max_entries = 65536
+    ttl = HashOracle.vtime / 10**9
+    entries = None
+    accepted = 0
+    replays = 0
+    overflows = 0
+
+    def __init__(self, wsize = None, max_entries = None):
+        if wsize is not None:
+            self.wsize = wsize
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def check(self, nonce, nc, now = None):
+        if nc is None:
+            nc = 1
+        else:
+            try:
+                nc = int(nc, 16)
+            except ValueError:
+                return False
+        if nc <= 0:
+            return False
+        if now is None:
+            now = monotonic()
+        entries = self.entries
+        entry = entries.get(nonce, None)
+        if entry is None or entry[0] <= now:
+            if entry is not None:
+                del entries[nonce]
+            self.expire(now)
+            if len(entries) >= self.max_entries:
+                self.overflows += 1
+                return False
+            entries[nonce] = [now + self.ttl, nc, 1]
+            self.accepted += 1
+            return True
+        top, bitmap = entry[1], entry[2]
+        if nc > top:
+            shift = nc - top
+            entry[1] = nc
+            entry[2] = ((bitmap << shift) | 1) & ((1 << self.wsize) - 1) if shift < self.wsize else 1
+            self.accepted += 1
+            return True
+        offset = top - nc
+        if offset >= self.wsize or bitmap & (1 << offset):
+            self.replays += 1
+            return False
+        entry[2] = bitmap | (1 << offset)
+        self.accepted += 1
+        return True
+
+    def expire(self, now):
+        entries = self.entries
+        while len(entries) > 0:
+            nonce, entry = next(iter(entries.items()))
+            if entry[0] > now:
+                break
+            del entries[nonce]
+
+    def stats(self):
+        return {'nonces':len(self.entries), 'accepted':self.accepted, \
+          'replays':self.replays, 'overflows':self.overflows}
+
 if __name__ == '__main__':
     from threading import Thread
 
@@ -0,0 +1,219 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import OrderedDict
+from secrets import token_hex
+from time import monotonic
+import re
+
+from sippy.SipConf import SipConf
+from sippy.B2B.Route import SRC_PROXY
+
+_to_re = re.compile(rb'\n(?:to|t)[ \t]*:([^\r\n]*)', re.I)
+_tag_re = re.compile(rb';[ \t]*tag[ \t]*=', re.I)
+_hfs_re = re.compile(rb'^(?:via|v|from|f|to|t|call-id|i|cseq)[ \t]*:[^\r\n]*', re.I | re.M)
+
+def parse_rate(value):
+    # "<rate>[/<burst>]", burst defaults to one second worth of tokens
+    parts = value.split('/', 1)
+    rate = float(parts[0])
+    burst = float(parts[1]) if len(parts) > 1 else max(rate, 1.0)
+    if rate <= 0 or burst < 1:
+        raise ValueError('invalid rate specification: %s' % value)
+    return (rate, burst)
+
+class SipAdmissionControl(object):
+    # Cheap checks done on the raw datagram before it is logged or
+    # parsed, so that a flood of junk does not cost us a full parse of
+    # every packet.
+    #
+    # Responses, ACKs and CANCELs are always let through. Requests with a
+    # To tag (in-dialog) are only subject to the per-IP limit, otherwise
+    # adding a tag would be enough to get past the checks. The accept_ips
+    # list, which can also let the calls from the SIP proxy in, applies to
+    # new INVITEs. Rate-limited requests are either dropped or, if
+    # retry_after is set, answered with 503 put together from the
+    # pre-built template and the Via/From/To/Call-ID/CSeq lines of the
+    # request.
+    ip_rate = None
+    method_rates = None
+    accept_ips = None
+    proxy_source = None
+    retry_after = 0
+    max_sources = 65536
+    ip_buckets = None
+    method_buckets = None
+    resp_head = None
+    resp_tail = None
+    to_tag = None
+    admitted = 0
+    passed = 0
+    dropped_acl = 0
+    limited_ip = 0
+    limited_method = 0
+    rejected = 0
+
+    def __init__(self, ip_rate = None, method_rates = None, accept_ips = None, \
+      retry_after = 0, max_sources = None, proxy_source = None):
+        self.ip_rate = ip_rate
+        self.method_rates = dict([(m.upper().encode(), r) for m, r in method_rates.items()]) \
+          if method_rates is not None else {}
+        if accept_ips is not None:
+            self.accept_ips = frozenset(accept_ips)
+        # ((host, port), transport) of the SIP proxy
+        self.proxy_source = proxy_source
+        self.retry_after = retry_after
+        if max_sources is not None:
+            self.max_sources = max_sources
+        self.ip_buckets = OrderedDict()
+        self.method_buckets = {}
+        self.resp_head = b'SIP/2.0 503 Service Unavailable\r\n'
+        self.resp_tail = ('Retry-After: %d\r\nServer: %s\r\nContent-Length: 0\r\n\r\n' % \
+          (retry_after, SipConf.my_uaname)).encode()
+        self.to_tag = (';tag=' + token_hex(8)).encode()
+
+    @staticmethod
+    def fromConfig(global_config):
+        # None if there is nothing configured
+        if '_admission_ip_rate' not in global_config and \
+          '_admission_method_rates' not in global_config and \
+          not ('admission_accept_ips' in global_config and global_config['admission_accept_ips']):
+            return None
+        kwargs = {}
+        if '_admission_ip_rate' in global_config:
+            kwargs['ip_rate'] = global_config['_admission_ip_rate']
+        if '_admission_method_rates' in global_config:
+            kwargs['method_rates'] = global_config['_admission_method_rates']
+        if 'admission_accept_ips' in global_config and global_config['admission_accept_ips'] \
+          and '_accept_ips' in global_config:
+            kwargs['accept_ips'] = global_config['_accept_ips']
+            # Same as CallMap.remoteIPAuth()
+            if SRC_PROXY in global_config['_accept_ips'] and '_sip_proxy' in global_config:
+                kwargs['proxy_source'] = (global_config['_sip_proxy'], 'udp')
+        if 'admission_retry_after' in global_config:
+            kwargs['retry_after'] = global_config['admission_retry_after']
+        return SipAdmissionControl(**kwargs)
+
+    @staticmethod
+    def take(bucket, rate, burst, now):
+        # bucket is [tokens, last update time]
+        tokens = bucket[0] + (now - bucket[1]) * rate
+        if tokens > burst:
+            tokens = burst
+        bucket[1] = now
+        if tokens < 1.0:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - 1.0
+        return True
+
+    def admit(self, data, ra, server, now = None):
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        if data.startswith(b'SIP/2.0 '):
+            self.passed += 1
+            return True
+        method = data[:data.find(b' ')]
+        if method in (b'ACK', b'CANCEL'):
+            self.passed += 1
+            return True
+        hend = data.find(b'\r\n\r\n')
+        if hend == -1:
+            hend = len(data)
+        to = _to_re.search(data, 0, hend)
+        in_dialog = to is not None and _tag_re.search(to.group(1)) is not None
+        source = ra.address[0]
+        if self.accept_ips is not None and method == b'INVITE' and not in_dialog and \
+          ra.transport != 'wss' and source not in self.accept_ips and \
+          (self.proxy_source is None or (ra.address, ra.transport) != self.proxy_source):
+            self.dropped_acl += 1
+            return False
+        if now is None:
+            now = monotonic()
+        if self.ip_rate is not None:
+            bucket = self.ip_buckets.get(source, None)
+            if bucket is None:
+                bucket = [self.ip_rate[1], now]
+                self.ip_buckets[source] = bucket
+                if len(self.ip_buckets) > self.max_sources:
+                    self.ip_buckets.popitem(last = False)
+            else:
+                self.ip_buckets.move_to_end(source)
+            if not self.take(bucket, self.ip_rate[0], self.ip_rate[1], now):
+                self.limited_ip += 1
+                self.reject(data, hend, ra, server)
+                return False
+        rate = self.method_rates.get(method, None) if not in_dialog else None
+        if rate is not None:
+            bucket = self.method_buckets.get(method, None)
+            if bucket is None:
+                bucket = [rate[1], now]
+                self.method_buckets[method] = bucket
+            if not self.take(bucket, rate[0], rate[1], now):
+                self.limited_method += 1
+                self.reject(data, hend, ra, server)
+                return False
+        self.admitted += 1
+        return True
+
+    def reject(self, data, hend, ra, server):
+        if self.retry_after <= 0 or server is None:
+            return
+        resp = self.genResponse(data, hend)
+        if resp is None:
+            return
+        server.send_to(resp, ra.address)
+        self.rejected += 1
+
+    def genResponse(self, data, hend = None):
+        if hend is None:
+            hend = data.find(b'\r\n\r\n')
+            if hend == -1:
+                hend = len(data)
+        hfs = _hfs_re.findall(data, data.find(b'\n') + 1, hend)
+        if len(hfs) < 5:
+            # Something is missing, not worth answering
+            return None
+        res = [self.resp_head,]
+        for hf in hfs:
+            res.append(hf)
+            if hf.split(b':', 1)[0].strip().lower() in (b'to', b't') and \
+              _tag_re.search(hf) is None:
+                res.append(self.to_tag)
+            res.append(b'\r\n')
+        res.append(self.resp_tail)
+        return b''.join(res)
+
+    def stats(self):
+        return {'admitted':self.admitted, 'passed':self.passed, \
+          'dropped_acl':self.dropped_acl, 'limited_ip':self.limited_ip, \
+          'limited_method':self.limited_method, 'rejected':self.rejected, \
+          'sources':len(self.ip_buckets)}
+
+    def __str__(self):
+        return 'admitted=%(admitted)d passed=%(passed)d dropped_acl=%(dropped_acl)d ' \
+          'limited_ip=%(limited_ip)d limited_method=%(limited_method)d ' \
+          'rejected=%(rejected)d sources=%(sources)d' % self.stats()
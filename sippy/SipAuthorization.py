@@ -133,7 +133,9 @@ class SipAuthorization(SipGenericHF):
         HA1 = DigestCalcHA1(self.algorithm, self.username, self.realm, password, self.nonce, self.cnonce)
         return self.verifyHA1(HA1, method, body)
 
-    def verifyHA1(self, HA1, method, body):
+    def verifyHA1(self, HA1, method, body, ncw = None):
+        # ncw: optional NonceCountWindow to reject requests that reuse the
+        # nonce-count value of the nonce they come with
         if not self.parsed:
             self.parse()
         if self.algorithm not in _HASH_FUNC:
@@ -145,7 +147,11 @@ class SipAuthorization(SipGenericHF):
             return False
         response = DigestCalcResponse(self.algorithm, HA1, self.nonce, self.nc, \
           self.cnonce, self.qop, method, self.uri, body)
-        return response == self.response
+        if response != self.response:
+            return False
+        if ncw is not None:
+            return ncw.check(self.nonce, self.nc if self.qop is not None else None)
+        return True
 
     def getCanName(self, name, compact = False):
         return 'Authorization'
@@ -167,15 +173,20 @@ def DigestCalcHA1(pszAlg, pszUserName, pszRealm, pszPassword, pszNonce, pszCNonc
     m.update(pszPassword.encode())
     HA1 = m.hexdigest().encode()
     if pszAlg and pszAlg.endswith('-sess'):
-        m = hashfunc()
-        m.update(HA1)
-        m.update(delim)
-        m.update(pszNonce.encode())
-        m.update(delim)
-        m.update(pszCNonce.encode())
-        HA1 = m.hexdigest().encode()
+        HA1 = DigestCalcHA1Sess(pszAlg, HA1, pszNonce, pszCNonce)
     return HA1
 
+def DigestCalcHA1Sess(pszAlg, HA1, pszNonce, pszCNonce):
+    delim = ':'.encode()
+    hashfunc = _HASH_FUNC[pszAlg][0]
+    m = hashfunc()
+    m.update(HA1)
+    m.update(delim)
+    m.update(pszNonce.encode())
+    m.update(delim)
+    m.update(pszCNonce.encode())
+    return m.hexdigest().encode()
+
 def DigestCalcResponse(pszAlg, HA1, pszNonce, pszNonceCount, pszCNonce, pszQop, pszMethod, pszDigestUri, pszHEntity):
     delim = ':'.encode()
     hashfunc = _HASH_FUNC[pszAlg][0]
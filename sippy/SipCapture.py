@@ -0,0 +1,311 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from socket import socket, inet_pton, AF_INET, AF_INET6, SOCK_DGRAM, \
+  getaddrinfo
+from struct import Struct
+from threading import Thread, Condition
+import os
+
+from sippy.Core.Exceptions import dump_exception
+
+# Record header in the ring: total length, timestamp, IP protocol,
+# address family, source address/port, destination address/port.
+_rec_hdr = Struct('!IdBB16sH16sH')
+
+_ip4_hdr = Struct('!BBHHHBBH4s4s')
+_ip6_hdr = Struct('!IHBB16s16s')
+_udp_hdr = Struct('!HHHH')
+
+_IPPROTO = {'udp':17, 'tcp':6, 'tls':6, 'ws':6, 'wss':6}
+
+class CaptureRecord(object):
+    ts = None
+    proto = None
+    family = None
+    src = None
+    sport = None
+    dst = None
+    dport = None
+    data = None
+
+def ip4_checksum(hdr):
+    s = sum([(hdr[i] << 8) + hdr[i + 1] for i in range(0, len(hdr), 2)])
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    return ~s & 0xffff
+
+class PcapngSink(object):
+    # Raw IP (LINKTYPE_RAW) capture, each message is put into synthetic
+    # IPv4/IPv6 + UDP headers so that any SIP-aware tool picks it up,
+    # whatever the transport it has been received over.
+    path = None
+    f = None
+    rotate_size = 0
+    rotate_keep = 5
+
+    def __init__(self, path, rotate_size = 0):
+        self.path = path
+        self.rotate_size = rotate_size
+        self.open()
+
+    def open(self):
+        self.f = open(self.path, 'ab')
+        if self.f.tell() == 0:
+            # Section Header Block + Interface Description Block
+            self.f.write(Struct('<IIIHHqI').pack(0x0a0d0d0a, 28, 0x1a2b3c4d, 1, 0, -1, 28))
+            self.f.write(Struct('<IIHHII').pack(0x00000001, 20, 101, 0, 0, 20))
+
+    def packet(self, rec):
+        ulen = 8 + len(rec.data)
+        udp = _udp_hdr.pack(rec.sport, rec.dport, ulen & 0xffff, 0)
+        if rec.family == AF_INET:
+            ip = bytearray(_ip4_hdr.pack(0x45, 0, (20 + ulen) & 0xffff, 0, 0x4000, 64, \
+              17, 0, rec.src[:4], rec.dst[:4]))
+            ip[10:12] = ip4_checksum(ip).to_bytes(2, 'big')
+            ip = bytes(ip)
+        else:
+            ip = _ip6_hdr.pack(0x60000000, ulen & 0xffff, 17, 64, rec.src, rec.dst)
+        return ip + udp + rec.data
+
+    def write(self, records):
+        blocks = []
+        for rec in records:
+            pkt = self.packet(rec)
+            pad = -len(pkt) % 4
+            ts = int(rec.ts * 1000000)
+            blen = 32 + len(pkt) + pad
+            blocks.append(Struct('<IIIIIII').pack(0x00000006, blen, 0, ts >> 32, \
+              ts & 0xffffffff, len(pkt), len(pkt)))
+            blocks.append(pkt)
+            blocks.append(b'\x00' * pad + blen.to_bytes(4, 'little'))
+        self.f.write(b''.join(blocks))
+        self.f.flush()
+        if self.rotate_size > 0 and self.f.tell() >= self.rotate_size:
+            self.rotate()
+
+    def rotate(self):
+        self.f.close()
+        for i in range(self.rotate_keep - 1, 0, -1):
+            if os.path.exists('%s.%d' % (self.path, i)):
+                os.rename('%s.%d' % (self.path, i), '%s.%d' % (self.path, i + 1))
+        os.rename(self.path, '%s.1' % self.path)
+        self.open()
+
+    def close(self):
+        self.f.close()
+
+class HepSink(object):
+    # HEP version 3 stream to a collector over UDP
+    address = None
+    agent_id = 0
+    skt = None
+
+    def __init__(self, spec):
+        # "host:port[:agent_id]", IPv6 address in brackets
+        if spec.startswith('['):
+            host, rest = spec[1:].split(']:', 1)
+            parts = rest.split(':')
+        else:
+            host, *parts = spec.split(':')
+        port = int(parts[0])
+        if len(parts) > 1:
+            self.agent_id = int(parts[1])
+        ai = getaddrinfo(host, port, 0, SOCK_DGRAM)[0]
+        self.address = ai[4]
+        self.skt = socket(ai[0], SOCK_DGRAM)
+
+    def chunk(self, ctype, value):
+        return (0).to_bytes(2, 'big') + ctype.to_bytes(2, 'big') + \
+          (len(value) + 6).to_bytes(2, 'big') + value
+
+    def packet(self, rec):
+        chunk = self.chunk
+        if rec.family == AF_INET:
+            chunks = [chunk(1, b'\x02'), chunk(3, rec.src[:4]), chunk(4, rec.dst[:4])]
+        else:
+            chunks = [chunk(1, b'\x0a'), chunk(5, rec.src), chunk(6, rec.dst)]
+        ts_us = int(rec.ts * 1000000)
+        chunks.extend((chunk(2, bytes((rec.proto,))), chunk(7, rec.sport.to_bytes(2, 'big')), \
+          chunk(8, rec.dport.to_bytes(2, 'big')), chunk(9, (ts_us // 1000000).to_bytes(4, 'big')), \
+          chunk(10, (ts_us % 1000000).to_bytes(4, 'big')), chunk(11, b'\x01'), \
+          chunk(12, self.agent_id.to_bytes(4, 'big')), chunk(15, rec.data)))
+        body = b''.join(chunks)
+        return b'HEP3' + (len(body) + 6).to_bytes(2, 'big') + body
+
+    def write(self, records):
+        for rec in records:
+            try:
+                self.skt.sendto(self.packet(rec), self.address)
+            except OSError:
+                pass
+
+    def close(self):
+        self.skt.close()
+
+class SipCapture(Thread):
+    # Raw SIP messages are copied into the pre-allocated ring buffer by
+    # the main thread together with the addresses and timestamp, and the
+    # writer thread picks up whatever has accumulated and feeds it to the
+    # sinks. When the ring is full new messages are dropped and counted.
+    daemon = True
+    capacity = 4 * 1024 * 1024
+    ring = None
+    wpos = 0
+    rpos = 0
+    cond = None
+    sinks = None
+    addr_cache = None
+    ncaptured = 0
+    ndropped = 0
+    nwritten = 0
+    shut_down = False
+
+    def __init__(self, sinks, capacity = None):
+        Thread.__init__(self)
+        if capacity != None:
+            self.capacity = capacity
+        self.ring = bytearray(self.capacity)
+        self.cond = Condition()
+        self.sinks = sinks
+        self.addr_cache = {}
+        self.start()
+
+    @staticmethod
+    def fromConfig(global_config):
+        sinks = []
+        if 'capture_file' in global_config:
+            rotate_size = global_config['capture_file_size'] if 'capture_file_size' in global_config else 0
+            sinks.append(PcapngSink(global_config['capture_file'], rotate_size))
+        if 'capture_hep' in global_config:
+            sinks.append(HepSink(global_config['capture_hep']))
+        if len(sinks) == 0:
+            return None
+        capacity = global_config['capture_buffer'] if 'capture_buffer' in global_config else None
+        return SipCapture(sinks, capacity)
+
+    def paddr(self, host):
+        try:
+            return self.addr_cache[host]
+        except KeyError:
+            pass
+        h = host.strip('[]')
+        try:
+            res = (AF_INET6, inet_pton(AF_INET6, h)) if ':' in h else \
+              (AF_INET, inet_pton(AF_INET, h) + b'\x00' * 12)
+        except OSError:
+            res = (AF_INET, b'\x00' * 16)
+        if len(self.addr_cache) > 4096:
+            self.addr_cache.clear()
+        self.addr_cache[host] = res
+        return res
+
+    def capture(self, data, src, dst, transport, ts):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        sfamily, saddr = self.paddr(src[0])
+        dfamily, daddr = self.paddr(dst[0])
+        if sfamily != dfamily:
+            # Wildcard local address of the other family
+            saddr = b'\x00' * 16
+        reclen = _rec_hdr.size + len(data)
+        proto = _IPPROTO.get(transport, 17)
+        cond = self.cond
+        cond.acquire()
+        if self.wpos - self.rpos + reclen > self.capacity:
+            self.ndropped += 1
+            cond.release()
+            return
+        off = self.wpos % self.capacity
+        ring = self.ring
+        if off + reclen <= self.capacity:
+            _rec_hdr.pack_into(ring, off, reclen, ts, proto, dfamily, saddr, \
+              src[1], daddr, dst[1])
+            ring[off + _rec_hdr.size:off + reclen] = data
+        else:
+            rec = _rec_hdr.pack(reclen, ts, proto, dfamily, saddr, src[1], \
+              daddr, dst[1]) + data
+            first = self.capacity - off
+            ring[off:] = rec[:first]
+            ring[:reclen - first] = rec[first:]
+        self.wpos += reclen
+        self.ncaptured += 1
+        cond.notify()
+        cond.release()
+
+    def run(self):
+        cond = self.cond
+        while True:
+            cond.acquire()
+            while self.wpos == self.rpos and not self.shut_down:
+                cond.wait()
+            if self.wpos == self.rpos:
+                cond.release()
+                break
+            start, end = self.rpos % self.capacity, self.wpos % self.capacity
+            if start < end:
+                buf = bytes(self.ring[start:end])
+            else:
+                buf = bytes(self.ring[start:]) + bytes(self.ring[:end])
+            self.rpos = self.wpos
+            cond.release()
+            records = self.parse(buf)
+            for sink in self.sinks:
+                try:
+                    sink.write(records)
+                except Exception:
+                    dump_exception('SipCapture: cannot write capture')
+            self.nwritten += len(records)
+        for sink in self.sinks:
+            sink.close()
+
+    def parse(self, buf):
+        records = []
+        i = 0
+        hsize = _rec_hdr.size
+        while i < len(buf):
+            rec = CaptureRecord()
+            reclen, rec.ts, rec.proto, rec.family, rec.src, rec.sport, rec.dst, \
+              rec.dport = _rec_hdr.unpack_from(buf, i)
+            rec.data = buf[i + hsize:i + reclen]
+            records.append(rec)
+            i += reclen
+        return records
+
+    def stats(self):
+        return {'captured':self.ncaptured, 'dropped':self.ndropped, \
+          'written':self.nwritten, 'buffered':self.wpos - self.rpos}
+
+    def __str__(self):
+        return ', '.join(['%s=%d' % x for x in self.stats().items()])
+
+    def shutdown(self):
+        # Whatever is in the ring gets written out first
+        self.cond.acquire()
+        self.shut_down = True
+        self.cond.notify()
+        self.cond.release()
+        self.join()
@@ -82,5 +82,5 @@ class SipConf(object):
 
     @staticmethod
     def port_needed(port, transport, local_transport):
-        return not('my' in dir(transport) and local_transport == SipConf.default_transport \
+        return not(hasattr(transport, 'my') and local_transport == SipConf.default_transport \
                    and int(port) == SipConf.default_port)
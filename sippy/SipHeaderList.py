@@ -0,0 +1,157 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from itertools import islice
+
+class SipHeaderList(object):
+    # Ordered list of header fields with per-name index on the side, so
+    # that looking up headers by name does not require scanning the whole
+    # message. Both are kept in sync, headers of the same name are listed
+    # in the index in the same order as they appear in the message.
+    headers = None
+    byname = None
+
+    def __init__(self, headers = ()):
+        self.headers = []
+        self.byname = {}
+        self.extend(headers)
+
+    def __iter__(self):
+        return iter(self.headers)
+
+    def __len__(self):
+        return len(self.headers)
+
+    def __getitem__(self, idx):
+        return self.headers[idx]
+
+    def __link(self, idx, header):
+        name = header.name
+        same = self.byname.get(name, None)
+        if same is None:
+            self.byname[name] = [header,]
+            return
+        for nheader in islice(self.headers, idx + 1, None):
+            if nheader.name == name:
+                same.insert(same.index(nheader), header)
+                return
+        same.append(header)
+
+    def __unlink(self, header):
+        same = self.byname[header.name]
+        same.remove(header)
+        if len(same) == 0:
+            del self.byname[header.name]
+
+    def get(self, name):
+        # Do not modify the list returned, make a copy if needed
+        return self.byname.get(name, ())
+
+    def count(self, name):
+        return len(self.byname.get(name, ()))
+
+    def index(self, header):
+        return self.headers.index(header)
+
+    def append(self, header):
+        self.headers.append(header)
+        same = self.byname.get(header.name, None)
+        if same is None:
+            self.byname[header.name] = [header,]
+        else:
+            same.append(header)
+
+    def extend(self, headers):
+        for header in headers:
+            self.append(header)
+
+    def insert(self, idx, header):
+        if idx < 0:
+            idx += len(self.headers)
+        idx = max(0, min(idx, len(self.headers)))
+        self.headers.insert(idx, header)
+        self.__link(idx, header)
+
+    def insertAfter(self, iheader, header):
+        self.insert(self.headers.index(iheader) + 1, header)
+
+    def insertBefore(self, iheader, header):
+        self.insert(self.headers.index(iheader), header)
+
+    def replace(self, oheader, *nheaders):
+        idx = self.headers.index(oheader)
+        self.headers[idx:idx + 1] = nheaders
+        if len(nheaders) > 0 and nheaders[0].name == oheader.name and \
+          all(x.name == oheader.name for x in nheaders):
+            same = self.byname[oheader.name]
+            sidx = same.index(oheader)
+            same[sidx:sidx + 1] = nheaders
+            return
+        self.__unlink(oheader)
+        for i, header in enumerate(nheaders):
+            self.__link(idx + i, header)
+
+    def remove(self, header):
+        self.headers.remove(header)
+        self.__unlink(header)
+
+    def delname(self, name):
+        if self.byname.pop(name, None) is None:
+            return
+        self.headers = [x for x in self.headers if x.name != name]
+
+if __name__ == '__main__':
+    class H(object):
+        def __init__(self, name, tag):
+            self.name = name
+            self.tag = tag
+
+    def check(hl):
+        for name, same in hl.byname.items():
+            assert same == [x for x in hl if x.name == name], (name, same)
+        assert sorted(hl.byname.keys()) == sorted(set(x.name for x in hl))
+
+    v1, v2, f, t = H('via', 1), H('via', 2), H('from', 0), H('to', 0)
+    hl = SipHeaderList((v1, f, t))
+    hl.insertAfter(f, v2)
+    check(hl)
+    assert hl.get('via') == [v1, v2]
+    v0 = H('via', 0)
+    hl.insertBefore(v1, v0)
+    check(hl)
+    assert [x.tag for x in hl.get('via')] == [0, 1, 2]
+    hl.replace(v1, H('via', 10), H('via', 11))
+    check(hl)
+    assert [x.tag for x in hl.get('via')] == [0, 10, 11, 2]
+    hl.replace(f, H('contact', 0))
+    check(hl)
+    assert hl.count('from') == 0 and hl.count('contact') == 1
+    hl.remove(v0)
+    check(hl)
+    hl.delname('via')
+    check(hl)
+    assert len(hl) == 2 and hl.get('via') == ()
+    print('passed')
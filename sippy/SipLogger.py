@@ -25,6 +25,7 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 from sippy.Signal import LogSignal
+from collections import deque
 from time import time, localtime, strftime
 from fcntl import flock, LOCK_EX, LOCK_UN
 from signal import SIGUSR1
@@ -44,32 +45,82 @@ class AsyncLogger(Thread):
     log = None
     app = None
     master = None
+    ndiscarded = 0
+    rotate_size = 0
+    rotate_ival = 0
+    rotate_keep = 5
+    next_rotate = None
+    max_chunk = 1024 * 1024
 
     def __init__(self, app, master):
         Thread.__init__(self)
         self.master = master
         self.app = app
+        self.rotate_size = int(os.environ.get('SIPLOG_ROTATE_SIZE', self.rotate_size))
+        self.rotate_ival = int(os.environ.get('SIPLOG_ROTATE_INTERVAL', self.rotate_ival))
+        self.rotate_keep = int(os.environ.get('SIPLOG_ROTATE_KEEP', self.rotate_keep))
+        if self.rotate_ival > 0:
+            self.next_rotate = (time() // self.rotate_ival + 1) * self.rotate_ival
         self.start()
 
     def run(self):
+        # Group commit: take everything that has been queued since the
+        # last round, format it and write it out in one go
         self.safe_open()
+        master = self.master
         while True:
-            self.master.wi_available.acquire()
-            while len(self.master.wi) == 0:
-                self.master.wi_available.wait()
-            op, args, kwargs = self.master.wi.pop(0)
-            self.master.wi_available.release()
-            if op == 'reopen':
-                self.safe_open()
+            master.wi_available.acquire()
+            while len(master.wi) == 0:
+                master.wi_available.wait()
+            batch = master.wi
+            master.wi = deque()
+            master.wi_bytes = 0
+            discarded = master.discarded
+            master.wi_available.release()
+            records = []
+            if discarded > self.ndiscarded:
+                records.append(master.format(('SipLogger: %d records discarded, ' \
+                  'I/O too slow' % (discarded - self.ndiscarded),), {}))
+                self.ndiscarded = discarded
+            for op, args, kwargs, size in batch:
+                if op in ('reopen', 'shutdown'):
+                    self.write_batch(records)
+                    records = []
+                    if op == 'shutdown':
+                        self.closelog()
+                        return
+                    self.safe_open()
+                    continue
+                try:
+                    if op == 'dwrite':
+                        fmt, fargs = args
+                        args = (fmt(*fargs),)
+                    records.append(master.format(args, kwargs))
+                except:
+                    # Drop message and continue
+                    pass
+            self.write_batch(records)
+
+    def write_batch(self, records):
+        # Chunks are capped, so that the rotation is checked often
+        # enough and the lock is not held for too long
+        chunk_size = self.max_chunk
+        if self.rotate_size > 0:
+            chunk_size = min(chunk_size, self.rotate_size)
+        chunk = []
+        size = 0
+        for i, obuf in enumerate(records):
+            chunk.append(obuf)
+            size += len(obuf)
+            if size < chunk_size and i < len(records) - 1:
                 continue
-            if op == 'shutdown':
-                self.closelog()
-                return
             try:
-                self.do_write(self.master.format(args, kwargs))
+                self.do_write(''.join(chunk))
             except:
-                # Reopen on any errror, drop message and continue
+                # Reopen on any errror, drop messages and continue
                 self.safe_open()
+            chunk = []
+            size = 0
 
     def do_write(self, obuf):
         my_flock = flock
@@ -80,6 +131,12 @@ class AsyncLogger(Thread):
             if e.args[0] != 45:
                 raise e
             my_flock = lambda x, y: None
+        if self.rotate_size > 0 or self.rotate_ival > 0:
+            if self.check_rotate():
+                # The file has been rotated under us
+                my_flock(self.log, LOCK_UN)
+                self.safe_open()
+                return self.do_write(obuf)
         try:
             self.log.write(obuf)
             self.log.flush()
@@ -87,6 +144,40 @@ class AsyncLogger(Thread):
             pass
         my_flock(self.log, LOCK_UN)
 
+    def check_rotate(self):
+        # Called with the lock held. Other processes may be writing into
+        # the same file, the one that gets to rotate it first does it and
+        # the rest notice that the file they have open is no longer there
+        # and reopen it.
+        now = time()
+        st = os.fstat(self.log.fileno())
+        try:
+            stale = os.stat(self.master.logfile).st_ino != st.st_ino
+        except FileNotFoundError:
+            stale = True
+        if self.next_rotate != None and now >= self.next_rotate:
+            self.next_rotate = (now // self.rotate_ival + 1) * self.rotate_ival
+            if stale:
+                return True
+            self.rotate()
+            return True
+        if stale:
+            return True
+        if self.rotate_size > 0 and st.st_size >= self.rotate_size:
+            self.rotate()
+            return True
+        return False
+
+    def rotate(self):
+        logfile = self.master.logfile
+        for i in range(self.rotate_keep - 1, 0, -1):
+            if os.path.exists('%s.%d' % (logfile, i)):
+                os.rename('%s.%d' % (logfile, i), '%s.%d' % (logfile, i + 1))
+        if self.rotate_keep > 0:
+            os.rename(logfile, '%s.1' % logfile)
+        else:
+            os.unlink(logfile)
+
     def safe_open(self):
         try:
             self.log = open(self.master.logfile, 'a')
@@ -95,7 +186,7 @@ class AsyncLogger(Thread):
 
     def shutdown(self):
         self.master.wi_available.acquire()
-        self.master.wi.append(('shutdown', None, None))
+        self.master.wi.append(('shutdown', None, None, 0))
         self.master.wi_available.notify()
         self.master.wi_available.release()
         self.join()
@@ -111,6 +202,10 @@ class AsyncLoggerSyslog(AsyncLogger):
         except Exception as e:
             print(e)
 
+    def write_batch(self, records):
+        for obuf in records:
+            self.do_write(obuf)
+
     def do_write(self, obuf):
         try:
             syslog.syslog(syslog.LOG_NOTICE, obuf)
@@ -126,8 +221,11 @@ class SipLogger(object):
     call_id = None
     level = None
     write = None
+    dwrite = None
     logfile = None
     discarded = 0
+    wi_bytes = 0
+    max_queue_bytes = 16 * 1024 * 1024
     pid = None
     logger = None
     signal_handler = None
@@ -147,15 +245,18 @@ class SipLogger(object):
         self.level = eval('SIPLOG_' + os.environ.get('SIPLOG_LVL', 'INFO'))
         if bend == 'stderr':
             self.write = self.write_stderr
+            self.dwrite = self.dwrite_stderr
         elif bend == 'none':
-            self.write = self.donoting
+            self.write = self.dwrite = self.donoting
         else:
             self.write = self.write_logfile
+            self.dwrite = self.dwrite_logfile
             self.wi_available = Condition()
-            self.wi = []
+            self.wi = deque()
+            self.max_queue_bytes = int(os.environ.get('SIPLOG_QUEUE_MAX', self.max_queue_bytes))
             if bend != 'syslog':
-                self.logger = AsyncLogger(app, self)
                 self.logfile = os.environ.get('SIPLOG_LOGFILE_FILE', logfile)
+                self.logger = AsyncLogger(app, self)
                 self.signal_handler = LogSignal(self, SIGUSR1, self.reopen)
             else:
                 self.logger = AsyncLoggerSyslog(app, self)
@@ -185,19 +286,41 @@ class SipLogger(object):
     def write_logfile(self, *args, **kwargs):
         if kwargs.get('level', SIPLOG_INFO) < self.level:
             return
-        discarded = False
+        self.enqueue('write', args, kwargs, self.rsize(args))
+
+    # Deferred versions of the write(): the message is produced by calling
+    # fmt(*args) and only if the record is going to be emitted, in the
+    # writer thread if there is one. The args should not be modified
+    # after the call.
+    def dwrite_stderr(self, fmt, *args, **kwargs):
+        if kwargs.get('level', SIPLOG_INFO) < self.level:
+            return
+        sys.__stderr__.write(self.format((fmt(*args),), kwargs))
+
+    def dwrite_logfile(self, fmt, *args, **kwargs):
+        if kwargs.get('level', SIPLOG_INFO) < self.level:
+            return
+        if 'ltime' not in kwargs:
+            kwargs['ltime'] = time()
+        self.enqueue('dwrite', (fmt, args), kwargs, self.rsize(args))
+
+    def rsize(self, args):
+        # Rough estimate of the memory held by the queued record
+        return 128 + sum([len(x) for x in args if isinstance(x, (str, bytes))])
+
+    def enqueue(self, op, args, kwargs, size = 0):
         self.wi_available.acquire()
-        if len(self.wi) > 1000:
-            # Discard some items, as the writer doesn't seems to be able
-            # to keep up pace with incoming requests
-            self.discarded += len(self.wi) - 1000
-            self.wi = self.wi[-1000:]
-            discarded = True
-        self.wi.append(('write', args, kwargs))
+        if size > 0 and self.wi_bytes + size > self.max_queue_bytes:
+            # The writer doesn't seem to be able to keep up pace with
+            # incoming requests, drop the record; the writer reports the
+            # number of records lost in the log
+            self.discarded += 1
+            self.wi_available.release()
+            return
+        self.wi_bytes += size
+        self.wi.append((op, args, kwargs, size))
         self.wi_available.notify()
         self.wi_available.release()
-        if discarded and self.discarded % 1000 == 0:
-            print('SipLogger: discarded %d requests, I/O too slow' % self.discarded)
 
     def format(self, args, kwargs):
         ltime = kwargs.get('ltime', None)
@@ -214,7 +337,7 @@ class SipLogger(object):
 
     def reopen(self, signum = None):
         self.wi_available.acquire()
-        self.wi.append(('reopen', None, None))
+        self.wi.append(('reopen', None, None, 0))
         self.wi_available.notify()
         self.wi_available.release()
 
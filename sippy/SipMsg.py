@@ -24,7 +24,11 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-from sippy.SipHeader import SipHeader
+from sippy.SipHeader import SipHeader, hf_types
+from sippy.SipHeaderList import SipHeaderList
+from sippy.SipGenericHF import SipGenericHF
+from sippy.SipAddressHF import SipAddressHF
+from sippy.SipVia import SipVia
 from sippy.SipContentLength import SipContentLength
 from sippy.SipContentType import SipContentType
 from sippy.MsgBody import MsgBody
@@ -33,6 +37,68 @@ from sippy.ESipHeaderIgnore import ESipHeaderIgnore
 from sippy.Exceptions.SipParseError import SipParseError
 from sippy.Network_server import Remote_address
 
+# Canonical (long) header field name for every name or alias we know about
+_canon_names = dict([(name, hf_type.hf_names[0]) for name, hf_type in hf_types.items()])
+# Raw header name as seen on the wire -> canonical name, bounded so that
+# random junk in the incoming messages could not blow it up
+_hf_names_cache = {}
+_HF_NAMES_CACHE_MAX = 1024
+
+def _hf_canon_name(rname):
+    name = rname.strip().lower().decode()
+    name = _canon_names.get(name, name)
+    if len(_hf_names_cache) < _HF_NAMES_CACHE_MAX:
+        _hf_names_cache[rname] = name
+    return name
+
+# Header field types that may split a single line into several headers
+_csv_types = (SipAddressHF, SipVia)
+# (canonical name, compact) -> name to put on the wire
+_hf_out_names = {}
+
+def _hf_out_name(name, compact):
+    rval = _hf_out_names.get((name, compact), None)
+    if rval is not None:
+        return rval
+    hf_type = hf_types.get(name, SipGenericHF)
+    # getCanName() does not depend on the instance state
+    rval = hf_type.getCanName(object.__new__(hf_type), name, compact)
+    if len(_hf_out_names) < _HF_NAMES_CACHE_MAX:
+        _hf_out_names[(name, compact)] = rval
+    return rval
+
+class LazySipHeader(object):
+    # Placeholder for a header field that has been located in the incoming
+    # message, but not parsed yet. It is replaced with one or more real
+    # SipHeader objects on first access by name.
+    __slots__ = ('name', 'value')
+
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def materialize(self):
+        try:
+            return (SipHeader(name = self.name, bodys = self.value.decode(), fixname = True),)
+        except ESipHeaderCSV as einst:
+            return tuple([SipHeader(name = einst.name, bodys = body, fixname = True) \
+              for body in einst.bodys])
+        except ESipHeaderIgnore:
+            return ()
+
+    def getCopy(self):
+        return self
+
+    def __str__(self):
+        return self.localStr()
+
+    def localStr(self, local_addr = None, compact = False):
+        # Header that nobody has touched goes out exactly as it came in,
+        # unless it has to be split into several ones.
+        if b',' in self.value and issubclass(hf_types.get(self.name, SipGenericHF), _csv_types):
+            return '\r\n'.join([x.localStr(local_addr, compact) for x in self.materialize()])
+        return _hf_out_name(self.name, compact) + ': ' + self.value.decode()
+
 class SipMsg(object):
     headers = None
     body = None
@@ -41,65 +107,81 @@ class SipMsg(object):
     source = None
     nated = False
     rtime = None
+    lazy_headers = None
 
     def __init__(self, buf = None):
-        self.headers = []
+        self.headers = SipHeaderList()
+        self.lazy_headers = set()
         if buf == None:
             return
+        if not isinstance(buf, bytes):
+            buf = buf.encode('utf-8')
         # Locate a body
         self.__mbody = None
-        for bdel in ('\r\n\r\n', '\r\r', '\n\n'):
+        for bdel in (b'\r\n\r\n', b'\r\r', b'\n\n'):
             boff = buf.find(bdel)
             if boff != -1:
-                self.__mbody = buf[boff + len(bdel):]
+                if boff + len(bdel) < len(buf):
+                    self.__mbody = buf[boff + len(bdel):].decode()
                 buf = buf[:boff]
-                if len(self.__mbody) == 0:
-                    self.__mbody = None
                 break
+        # Header values stay bytes until somebody asks for them, make sure
+        # they can be decoded then, so that broken input fails right here
+        if not buf.isascii():
+            buf.decode()
         # Split message into lines and put aside start line
         lines = buf.splitlines()
-        self.setSL(lines[0])
-        i = 2
-        while i < len(lines):
-            if len(lines[i]) == 0 or lines[i][0] in (' ', '\t'):
-                lines[i - 1] += ' ' + lines[i].strip()
-                del lines[i]
-            else:
-                i += 1
-        # Parse headers
+        self.setSL(lines[0].decode())
+        # Index header fields, folded lines (rare) are glued back to the
+        # header they belong to first. Header objects are only built when
+        # somebody asks for them, except Content-Type and Content-Length.
         self.__content_type = None
         self.__content_length = None
-        header_names = []
-        for line in lines[1:]:
-            try:
-                header = SipHeader(line, fixname = True)
-                if header.name == 'content-type':
-                    self.__content_type = header
-                elif header.name == 'content-length':
-                    self.__content_length = header
+        lines = lines[1:]
+        if b'\n ' in buf or b'\n\t' in buf or b'\r ' in buf or b'\r\t' in buf:
+            i = 1
+            while i < len(lines):
+                if len(lines[i]) == 0 or lines[i][0] in (0x20, 0x09):
+                    lines[i - 1] += b' ' + lines[i].strip()
+                    del lines[i]
                 else:
-                    self.headers.append(header)
-                    header_names.append(header.name)
-            except ESipHeaderCSV as einst:
-                for body in einst.bodys:
-                    header = SipHeader(name = einst.name, bodys = body, fixname = True)
-                    if header.name == 'content-type':
+                    i += 1
+        names_cache = _hf_names_cache
+        headers = self.headers
+        for rname, value in [line.split(b':', 1) for line in lines]:
+            name = names_cache.get(rname, None)
+            if name is None:
+                name = _hf_canon_name(rname)
+            header = LazySipHeader(name, value.strip())
+            if name in ('content-type', 'content-length'):
+                # Needed right away to get the body out
+                for header in header.materialize():
+                    if name == 'content-type':
                         self.__content_type = header
-                    elif header.name == 'content-length':
-                        self.__content_length = header
                     else:
-                        self.headers.append(header)
-                        header_names.append(header.name)
-            except ESipHeaderIgnore:
+                        self.__content_length = header
+                continue
+            headers.append(header)
+        for name, cname in (('via', 'Via'), ('to', 'To'), ('from', 'From'), ('cseq', 'CSeq')):
+            if headers.count(name) == 0:
+                raise Exception('%s HF is missed' % cname)
+        self.lazy_headers.update(headers.byname.keys())
+
+    def __materialize(self, *names):
+        # Replace placeholders for the given header names (or all of them)
+        # with the real header objects.
+        lazy_headers = self.lazy_headers
+        if len(lazy_headers) == 0:
+            return
+        if len(names) == 0:
+            names = tuple(lazy_headers)
+        headers = self.headers
+        for name in names:
+            if name not in lazy_headers:
                 continue
-        if 'via' not in header_names:
-            raise Exception('Via HF is missed')
-        if 'to' not in header_names:
-            raise Exception('To HF is missed')
-        if 'from' not in header_names:
-            raise Exception('From HF is missed')
-        if 'cseq' not in header_names:
-            raise Exception('CSeq HF is missed')
+            lazy_headers.remove(name)
+            for header in [x for x in headers.get(name) if isinstance(x, LazySipHeader)]:
+                headers.replace(header, *header.materialize())
 
     def init_body(self):
         if self.__content_length != None:
@@ -150,37 +232,37 @@ class SipMsg(object):
                 self.body = MsgBody(self.__mbody)
 
     def __str__(self):
-        s = self.getSL() + '\r\n'
+        l = [self.getSL()]; w = l.append
         for header in self.headers:
-            s += str(header) + '\r\n'
+            w(str(header))
         if self.body is not None:
             mbody = str(self.body)
-            s += 'Content-Type: %s\r\n' % self.body.mtype
-            s += 'Content-Length: %d\r\n\r\n' % len(mbody)
-            s += mbody
+            w('Content-Type: %s' % self.body.mtype)
+            w('Content-Length: %d\r\n' % len(mbody))
+            w(mbody)
         else:
-            s += 'Content-Length: 0\r\n\r\n'
-        return s
+            w('Content-Length: 0\r\n\r\n')
+        return '\r\n'.join(l)
 
     def localStr(self, local_addr = None, compact = False):
-        s = self.getSL(local_addr) + '\r\n'
+        l = [self.getSL(local_addr)]; w = l.append
         for header in self.headers:
-            s += header.localStr(local_addr, compact) + '\r\n'
+            w(header.localStr(local_addr, compact))
         if self.body is not None:
             mbody = self.body.localStr(local_addr)
             if compact:
-                s += 'c: %s\r\n' % self.body.mtype
-                s += 'l: %d\r\n\r\n' % len(mbody)
+                w('c: %s' % self.body.mtype)
+                w('l: %d\r\n' % len(mbody))
             else:
-                s += 'Content-Type: %s\r\n' % self.body.mtype
-                s += 'Content-Length: %d\r\n\r\n' % len(mbody)
-            s += mbody
+                w('Content-Type: %s' % self.body.mtype)
+                w('Content-Length: %d\r\n' % len(mbody))
+            w(mbody)
         else:
             if compact:
-                s += 'l: 0\r\n\r\n'
+                w('l: 0\r\n\r\n')
             else:
-                s += 'Content-Length: 0\r\n\r\n'
-        return s
+                w('Content-Length: 0\r\n\r\n')
+        return '\r\n'.join(l)
 
     def setSL(self, startline):
         self.startline = startline
@@ -189,31 +271,39 @@ class SipMsg(object):
         return self.startline
 
     def getHFs(self, name):
-        return [x for x in self.headers if x.name == name]
+        self.__materialize(name)
+        return list(self.headers.get(name))
 
     def countHFs(self, name):
-        return len([x for x in self.headers if x.name == name])
+        self.__materialize(name)
+        return self.headers.count(name)
 
     def delHFs(self, name):
-        self.headers = [x for x in self.headers if x.name != name]
+        self.lazy_headers.discard(name)
+        self.headers.delname(name)
 
     def getHF(self, name):
-        return [x for x in self.headers if x.name == name][0]
+        self.__materialize(name)
+        return self.headers.get(name)[0]
 
     def getHFBodys(self, name):
-        return [x.getBody() for x in self.headers if x.name == name]
+        self.__materialize(name)
+        return [x.getBody() for x in self.headers.get(name)]
 
     def getHFBody(self, name, idx = 0):
-        return [x for x in self.headers if x.name == name][idx].getBody()
+        self.__materialize(name)
+        return self.headers.get(name)[idx].getBody()
 
     def getHFBCopys(self, name):
-        return [x.getBCopy() for x in self.headers if x.name == name]
+        self.__materialize(name)
+        return [x.getBCopy() for x in self.headers.get(name)]
 
     def getHFBCopy(self, name, idx = 0):
-        return [x for x in self.headers if x.name == name][idx].getBCopy()
+        self.__materialize(name)
+        return self.headers.get(name)[idx].getBCopy()
 
     def replaceHeader(self, oheader, nheader):
-        self.headers[self.headers.index(oheader)] = nheader
+        self.headers.replace(oheader, nheader)
 
     def removeHeader(self, header):
         self.headers.remove(header)
@@ -225,10 +315,10 @@ class SipMsg(object):
         self.headers.extend(headers)
 
     def insertHeaderAfter(self, iheader, header):
-        self.headers.insert(self.headers.index(iheader) + 1, header)
+        self.headers.insertAfter(iheader, header)
 
     def insertHeaderBefore(self, iheader, header):
-        self.headers.insert(self.headers.index(iheader), header)
+        self.headers.insertBefore(iheader, header)
 
     def getBody(self):
         return self.body
@@ -251,7 +341,8 @@ class SipMsg(object):
         self.source = (ra.address, ra.transport)
 
     def getTId(self, wCSM = False, wBRN = False, wTTG = False):
-        headers_dict = dict([(x.name, x) for x in self.headers if x.name in ('cseq', 'call-id', 'from')])
+        self.__materialize('cseq', 'call-id', 'from')
+        headers_dict = dict([(name, self.headers.get(name)[-1]) for name in ('cseq', 'call-id', 'from')])
         cseq, method = headers_dict['cseq'].getBody().getCSeq()
         rval = [str(headers_dict['call-id'].getBody()), headers_dict['from'].getBody().getTag(), cseq]
         if wCSM:
@@ -263,7 +354,8 @@ class SipMsg(object):
         return tuple(rval)
 
     def getTIds(self):
-        headers_dict = dict([(x.name, x) for x in self.headers if x.name in ('cseq', 'call-id', 'from')])
+        self.__materialize('cseq', 'call-id', 'from')
+        headers_dict = dict([(name, self.headers.get(name)[-1]) for name in ('cseq', 'call-id', 'from')])
         call_id = str(headers_dict['call-id'].getBody())
         ftag = headers_dict['from'].getBody().getTag()
         cseq, method = headers_dict['cseq'].getBody().getCSeq()
@@ -273,6 +365,7 @@ class SipMsg(object):
         cself = self.__class__()
         for header in self.headers:
             cself.appendHeader(header.getCopy())
+        cself.lazy_headers = set(self.lazy_headers)
         if self.body is not None:
             cself.body = self.body.getCopy()
         cself.startline = self.startline
@@ -0,0 +1,137 @@
+# Copyright (c) 2026 Sippy Software, Inc. All rights reserved.
+#
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation and/or
+# other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR
+# ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON
+# ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+from collections import OrderedDict
+from time import monotonic
+
+# RFC 3261 timer values
+T1 = 0.5
+T4 = 5.0
+
+class SipTMRetransmitCache(object):
+    # Recently seen incoming messages, keyed by fingerprint of the raw
+    # message, with either the reply to retransmit when the same message
+    # arrives again, or nothing if it should be silently dropped.
+    #
+    # Each entry lives for 64*T1 (timers B/F/H/J, i.e. the longest the
+    # other side keeps retransmitting) unless told otherwise, e.g. T4
+    # (timer K) for the final responses to our non-INVITE requests. The total
+    # number of entries and size of the cached replies are capped, the
+    # oldest entries are evicted first once either budget is exceeded.
+    max_entries = 65536
+    max_bytes = 32 * 1024 * 1024
+    ttl = 64 * T1
+    entries = None
+    nbytes = 0
+    hits = 0
+    misses = 0
+    inserts = 0
+    evictions = 0
+    expirations = 0
+
+    def __init__(self, max_entries = None, max_bytes = None, ttl = None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if ttl is not None:
+            self.ttl = ttl
+        self.entries = OrderedDict()
+
+    @staticmethod
+    def fingerprint(data):
+        # hash() of str/bytes is SipHash keyed with a random per-process
+        # seed, which is way cheaper than md5 and still does not let anyone
+        # outside to craft colliding messages.
+        return hash(data)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key, now = None):
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            if now is None:
+                now = monotonic()
+            if entry[0] > now:
+                self.hits += 1
+                return entry[1]
+            del self.entries[key]
+            self.nbytes -= entry[2]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def put(self, key, value, ttl = None, now = None):
+        if now is None:
+            now = monotonic()
+        if ttl is None:
+            ttl = self.ttl
+        size = len(value.data) if value.data is not None else 0
+        entries = self.entries
+        oentry = entries.pop(key, None)
+        if oentry is not None:
+            self.nbytes -= oentry[2]
+        entries[key] = (now + ttl, value, size)
+        self.nbytes += size
+        self.inserts += 1
+        self.expire(now)
+        while len(entries) > self.max_entries or self.nbytes > self.max_bytes:
+            okey, oentry = entries.popitem(last = False)
+            self.nbytes -= oentry[2]
+            self.evictions += 1
+
+    def expire(self, now = None):
+        # Entries are mostly kept in the order of expiration, the ones with
+        # the non-default TTL that got stuck behind are taken care of by
+        # get().
+        if now is None:
+            now = monotonic()
+        entries = self.entries
+        while len(entries) > 0:
+            key, entry = next(iter(entries.items()))
+            if entry[0] > now:
+                break
+            del entries[key]
+            self.nbytes -= entry[2]
+            self.expirations += 1
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups if lookups > 0 else 0.0
+        return {'entries':len(self.entries), 'bytes':self.nbytes, \
+          'hits':self.hits, 'misses':self.misses, 'hit_rate':hit_rate, \
+          'inserts':self.inserts, 'evictions':self.evictions, \
+          'expirations':self.expirations}
+
+    def __str__(self):
+        return 'entries=%(entries)d bytes=%(bytes)d hits=%(hits)d ' \
+          'misses=%(misses)d hit_rate=%(hit_rate).3f inserts=%(inserts)d ' \
+          'evictions=%(evictions)d expirations=%(expirations)d' % self.stats()
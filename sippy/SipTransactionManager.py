@@ -38,10 +38,11 @@ from sippy.Exceptions.SdpParseError import SdpParseError
 from sippy.Exceptions.RtpProxyError import RtpProxyError
 from sippy.Udp_server import Udp_server, Udp_server_opts
 from sippy.Network_server import Remote_address
+from sippy.SipTMRetransmitCache import SipTMRetransmitCache, T4
+from sippy.SipAdmission import SipAdmissionControl
 from datetime import datetime
-from hashlib import md5
 from functools import reduce
-from time import monotonic
+from time import monotonic, time
 import sys, socket
 
 class NETS_1918(object):
@@ -141,6 +142,21 @@ class local4remote(object):
         self.cache_r2l_old = {}
         self.cache_l2s = {}
         self.handleIncoming = handleIncoming
+        laddresses, self.fixed = self.getLAddresses(global_config)
+        # Since we are (an)using SO_REUSEXXX do a quick dry run to make
+        # sure no existing app is running on the same port. When the port
+        # is deliberately shared with sibling worker processes the check
+        # has been done by the parent before forking them.
+        if '_sip_port_shared' not in global_config:
+            dryruns = (True, False)
+        else:
+            dryruns = (False,)
+        for dryr in dryruns:
+            for laddress in laddresses:
+                self.initServer(laddress, dryr)
+
+    @staticmethod
+    def getLAddresses(global_config):
         try:
             # Python can be compiled with IPv6 support, but if kernel
             # has not we would get exception creating the socket.
@@ -154,14 +170,8 @@ class local4remote(object):
                 laddresses = (('0.0.0.0', global_config['_sip_port']), ('[::]', global_config['_sip_port']))
             else:
                 laddresses = (('0.0.0.0', global_config['_sip_port']),)
-        else:
-            laddresses = ((global_config['_sip_address'], global_config['_sip_port']),)
-            self.fixed = True
-        # Since we are (an)using SO_REUSEXXX do a quick dry run to make
-        # sure no existing app is running on the same port.
-        for dryr in (True, False):
-            for laddress in laddresses:
-                self.initServer(laddress, dryr)
+            return (laddresses, False)
+        return (((global_config['_sip_address'], global_config['_sip_port']),), True)
 
     def initServer(self, laddress, dryr=False):
         sopts = self.Udp_server_opts(laddress, self.handleIncoming)
@@ -223,6 +233,18 @@ class local4remote(object):
             userv.shutdown()
         self.cache_l2s = {}
 
+def _ldecode(data):
+    if isinstance(data, bytes):
+        return data.decode(errors = 'backslashreplace')
+    return data
+
+# Log record formatters for SipLogger.dwrite()
+def _lfmt_received(ra, data):
+    return f'RECEIVED message from {ra}:\n' + _ldecode(data)
+
+def _lfmt_sent(logop, userv, address, data):
+    return f'{logop} message to {userv.addr2str(address)}:\n{data}'
+
 class SipTMRetransmitO(object):
     userv = None
     data = None
@@ -244,8 +266,11 @@ class SipTransactionManager(object):
     tclient = None
     tserver = None
     req_cb = None
-    l1rcache = None
-    l2rcache = None
+    rcache = None
+    admission = None
+    capture = None
+    metrics = None
+    m_tstates = None
     nat_traversal = False
     req_consumers = None
     provisional_retr = 0
@@ -263,54 +288,86 @@ class SipTransactionManager(object):
         self.tclient = {}
         self.tserver = {}
         self.req_cb = req_cb
-        self.l1rcache = {}
-        self.l2rcache = {}
+        rcache_args = [global_config[x] if x in global_config else None \
+          for x in ('rcache_max_entries', 'rcache_max_bytes')]
+        self.rcache = SipTMRetransmitCache(*rcache_args)
+        self.admission = SipAdmissionControl.fromConfig(global_config)
+        if '_sip_capture' in global_config:
+            self.capture = global_config['_sip_capture']
+        if '_metrics' in global_config:
+            self.initMetrics(global_config['_metrics'])
         self.req_consumers = {}
         self.cp_timer = Timeout(self.rCachePurge, 32, -1)
         self.init_time = monotonic()
 
+    def initMetrics(self, metrics):
+        self.metrics = metrics
+        self.m_tstates = metrics.counter('sippy_sip_transaction_states_total', \
+          'SIP transactions entering each state', ('role', 'state'))
+        metrics.register_stats('sippy_sip_rcache', self.rcache.stats, \
+          ('hits', 'misses', 'inserts', 'evictions', 'expirations'))
+        metrics.register('sippy_sip_transactions', self.collectMetrics)
+        if self.admission is not None:
+            metrics.register_stats('sippy_sip_admission', self.admission.stats, \
+              ('admitted', 'passed', 'dropped_acl', 'limited_ip', \
+              'limited_method', 'rejected'))
+
+    def collectMetrics(self):
+        if self.tclient is None:
+            return ()
+        return (('sippy_sip_transactions', 'gauge', 'SIP transactions in memory', \
+          (((('role', 'client'),), len(self.tclient)), \
+          ((('role', 'server'),), len(self.tserver)))),)
+
+    def setTState(self, t, state, role):
+        t.state = state
+        if self.m_tstates is not None:
+            self.m_tstates.labels(role, state.__name__).inc()
+
     def handleIncoming(self, data_in, ra:Remote_address, server, rtime):
         if len(data_in) < 32:
             return
+        if self.capture is not None:
+            self.capture.capture(data_in, ra.address, server.uopts.laddress, \
+              ra.transport, rtime.realt)
+        checksum = self.rcache.fingerprint(data_in)
+        retrans = self.rcache.get(checksum)
+        # Policy checks that do not need the message to be parsed, known
+        # retransmissions are not subject to them
+        if retrans is None and self.admission is not None and \
+          not self.admission.admit(data_in, ra, server):
+            return
+        self.global_config['_sip_logger'].dwrite(_lfmt_received, ra, data_in, \
+          ltime = rtime.realt)
+        # The parser works on raw bytes, decoded copy is only for logging
         if isinstance(data_in, bytes):
-            lmsg = data_in.decode(errors = 'backslashreplace')
-        else:
-            lmsg = data_in
-        self.global_config['_sip_logger'].write(f'RECEIVED message from {ra}:\n', \
-          lmsg, ltime = rtime.realt)
-        if isinstance(data_in, bytes):
-            data = data_in.decode()
-            checksum = md5(data_in).digest()
+            is_response = data_in.startswith(b'SIP/2.0 ')
         else:
-            data = data_in
-            checksum = md5(data_in.encode('utf-8')).digest()
-        retrans = self.l1rcache.get(checksum, None)
-        if retrans == None:
-            retrans = self.l2rcache.get(checksum, None)
+            is_response = data_in.startswith('SIP/2.0 ')
         if retrans != None:
             if retrans.data == None:
                 return
             self.transmitData(retrans.userv, retrans.data, retrans.address, \
               lossemul = retrans.lossemul)
             return
-        if data.startswith('SIP/2.0 '):
+        if is_response:
             try:
-                resp = SipResponse(data)
+                resp = SipResponse(data_in)
                 tid = resp.getTId(True, True)
             except Exception as exception:
-                dump_exception(f'can\'t parse SIP response from {ra}', extra = data)
-                self.l1rcache[checksum] = SipTMRetransmitO()
+                dump_exception(f'can\'t parse SIP response from {ra}', extra = _ldecode(data_in))
+                self.rcache.put(checksum, SipTMRetransmitO())
                 return
             if resp.getSCode()[0] < 100 or resp.getSCode()[0] > 999:
                 print(datetime.now(), f'invalid status code in SIP response from {ra}:')
-                print(data)
+                print(_ldecode(data_in))
                 sys.stdout.flush()
-                self.l1rcache[checksum] = SipTMRetransmitO()
+                self.rcache.put(checksum, SipTMRetransmitO())
                 return
             resp.rtime = rtime
             if not tid in self.tclient:
                 #print('no transaction with tid of %s in progress' % str(tid))
-                self.l1rcache[checksum] = SipTMRetransmitO()
+                self.rcache.put(checksum, SipTMRetransmitO())
                 return
             t = self.tclient[tid]
             if self.nat_traversal and resp.countHFs('contact') > 0 and not check1918(t.address[0]):
@@ -328,15 +385,15 @@ class SipTransactionManager(object):
             self.incomingResponse(resp, t, checksum)
         else:
             try:
-                req = SipRequest(data)
+                req = SipRequest(data_in)
                 tids = req.getTIds()
             except Exception as exception:
                 if isinstance(exception, SipParseError):
                     resp = exception.getResponse()
                     if resp is not None:
                         self.transmitMsg(server, resp, ra.address, checksum)
-                dump_exception(f'can\'t parse SIP request from {ra}', extra = data)
-                self.l1rcache[checksum] = SipTMRetransmitO()
+                dump_exception(f'can\'t parse SIP request from {ra}', extra = _ldecode(data_in))
+                self.rcache.put(checksum, SipTMRetransmitO())
                 return
             call_id = tids[0][0]
             req.rtime = rtime
@@ -358,8 +415,8 @@ class SipTransactionManager(object):
                 try:
                     return req.getHFBody('contact')
                 except Exception as exception:
-                    dump_exception(f'can\'t parse SIP request from {ra}', extra = data)
-                    self.l1rcache[checksum] = SipTMRetransmitO()
+                    dump_exception(f'can\'t parse SIP request from {ra}', extra = _ldecode(data_in))
+                    self.rcache.put(checksum, SipTMRetransmitO())
                     return None
 
             if self.nat_traversal and usable_contact():
@@ -444,7 +501,7 @@ class SipTransactionManager(object):
             t.r408 = msg.genResponse(408, 'Request Timeout')
         t.teB = Timeout(self.timerB, 32.0, 1, t)
         t.teC = None
-        t.state = TRYING
+        self.setTState(t, TRYING, 'client')
         self.tclient[t.tid] = t
         self.transmitData(t.userv, t.data, t.address)
         if t.req_out_cb != None:
@@ -482,12 +539,12 @@ class SipTransactionManager(object):
                 # Privisional response - leave everything as is, except that
                 # change state and reload timeout timer
                 if t.state == TRYING:
-                    t.state = RINGING
+                    self.setTState(t, RINGING, 'client')
                     if t.cancelPending:
                         self.newTransaction(t.cancel, userv = t.userv)
                         t.cancelPending = False
                 t.teB = Timeout(self.timerB, t.expires, 1, t)
-                self.l1rcache[checksum] = SipTMRetransmitO()
+                self.rcache.put(checksum, SipTMRetransmitO())
                 if t.resp_cb != None:
                     if t.cb_ifver == 1:
                         t.resp_cb(msg)
@@ -535,13 +592,15 @@ class SipTransactionManager(object):
                         if t.req_out_cb != None:
                             t.req_out_cb(t.ack)
                     else:
-                        t.state = UACK
+                        self.setTState(t, UACK, 'client')
                         t.ack_rAddr = rAddr
                         t.ack_checksum = checksum
-                        self.l1rcache[checksum] = SipTMRetransmitO()
+                        self.rcache.put(checksum, SipTMRetransmitO())
                         t.teG = Timeout(self.timerG, 64, 1, t)
                 else:
-                    self.l1rcache[checksum] = SipTMRetransmitO()
+                    # Non-INVITE: retransmissions of the final response
+                    # only come for as long as Timer K runs
+                    self.rcache.put(checksum, SipTMRetransmitO(), T4)
                 if t.resp_cb != None:
                     if t.cb_ifver == 1:
                         t.resp_cb(msg)
@@ -564,7 +623,7 @@ class SipTransactionManager(object):
         if t.teA != None:
             t.teA.cancel()
             t.teA = None
-        t.state = TERMINATED
+        self.setTState(t, TERMINATED, 'client')
         #print('2: Timeout(self.timerC, 32.0, 1, t)', t)
         t.teC = Timeout(self.timerC, 32.0, 1, t)
         if t.resp_cb == None:
@@ -617,7 +676,7 @@ class SipTransactionManager(object):
                 if t.state in (TRYING, RINGING):
                     self.doCancel(t, msg.rtime, msg)
             elif msg.getMethod() == 'ACK' and t.state == COMPLETED:
-                t.state = CONFIRMED
+                self.setTState(t, CONFIRMED, 'server')
                 if t.teA != None:
                     t.teA.cancel()
                     t.teA = None
@@ -627,14 +686,14 @@ class SipTransactionManager(object):
                 if t.ack_cb != None:
                     t.ack_cb(msg)
                 t.cleanup()
-                self.l1rcache[checksum] = SipTMRetransmitO()
+                self.rcache.put(checksum, SipTMRetransmitO())
         elif msg.getMethod() == 'ACK':
             # Some ACK that doesn't match any existing transaction.
             # Drop and forget it - upper layer is unlikely to be interested
             # to seeing this anyway.
             #print(datetime.now(), 'unmatched ACK transaction - ignoring')
             #sys.stdout.flush()
-            self.l1rcache[checksum] = SipTMRetransmitO()
+            self.rcache.put(checksum, SipTMRetransmitO())
         elif msg.getMethod() == 'CANCEL':
             resp = msg.genResponse(481, 'Call Leg/Transaction Does Not Exist')
             self.transmitMsg(server, resp, resp.getHFBody('via').getTAddr(), checksum)
@@ -642,7 +701,7 @@ class SipTransactionManager(object):
             #print('new transaction', msg.getMethod())
             t = SipTransaction()
             t.tid = tid
-            t.state = TRYING
+            self.setTState(t, TRYING, 'server')
             t.teA = None
             t.teD = None
             t.teE = None
@@ -686,7 +745,7 @@ class SipTransactionManager(object):
                     break
             else:
                 if self.req_cb == None:
-                    self.l1rcache[checksum] = SipTMRetransmitO()
+                    self.rcache.put(checksum, SipTMRetransmitO())
                     return
                 rval = self.req_cb(msg, t)
             if rval == None:
@@ -739,13 +798,13 @@ class SipTransactionManager(object):
         if t.res_out_cb != None:
             t.res_out_cb(resp)
         if scode < 200:
-            t.state = RINGING
+            self.setTState(t, RINGING, 'server')
             if self.provisional_retr > 0 and scode > 100:
                 if t.teF != None:
                     t.teF.cancel()
                 t.teF = Timeout(self.timerF, self.provisional_retr, 1, t)
         else:
-            t.state = COMPLETED
+            self.setTState(t, COMPLETED, 'server')
             if t.teE != None:
                 t.teE.cancel()
                 t.teE = None
@@ -820,8 +879,7 @@ class SipTransactionManager(object):
             print(datetime.now(), 'INVITE transaction stuck in the UACK state, possible UAC bug')
 
     def rCachePurge(self):
-        self.l2rcache = self.l1rcache
-        self.l1rcache = {}
+        self.rcache.expire()
         self.l4r.rotateCache()
 
     def transmitMsg(self, userv, msg, address, cachesum, compact = False):
@@ -832,17 +890,18 @@ class SipTransactionManager(object):
       lossemul = 0):
         if lossemul == 0:
             userv.send_to(data, address)
+            if self.capture is not None:
+                self.capture.capture(data, userv.uopts.laddress, address, \
+                  userv.transport, time())
             logop = 'SENDING'
         else:
             logop = 'DISCARDING'
-        paddr = userv.addr2str(address)
-        msg = f'{logop} message to {paddr}:\n'
-        self.global_config['_sip_logger'].write(msg, data)
+        self.global_config['_sip_logger'].dwrite(_lfmt_sent, logop, userv, address, data)
         if cachesum != None:
             if lossemul > 0:
                 lossemul -= 1
-            self.l1rcache[cachesum] = SipTMRetransmitO(userv, data, address, \
-              None, lossemul)
+            self.rcache.put(cachesum, SipTMRetransmitO(userv, data, address, \
+              None, lossemul))
 
     def sendACK(self, t):
         #print('sendACK', t.state)
@@ -858,5 +917,9 @@ class SipTransactionManager(object):
     def shutdown(self):
         self.cp_timer.cancel()
         self.l4r.shutdown()
-        self.l1rcache = self.l2rcache = self.req_cb = self.req_consumers = None
+        if self.metrics is not None:
+            for name in ('sippy_sip_rcache', 'sippy_sip_transactions', 'sippy_sip_admission'):
+                self.metrics.unregister(name)
+            self.metrics = self.m_tstates = None
+        self.rcache = self.req_cb = self.req_consumers = None
         self.global_config = self.cp_timer = self.tclient = self.tserver = None
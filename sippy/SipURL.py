@@ -250,7 +250,7 @@ class SipURL(object):
             if self.password != None:
                 w(':%s' % self.password)
             w('@')
-        if local_addr != None and 'my' in dir(self.host):
+        if local_addr != None and hasattr(self.host, 'my'):
             w(local_addr)
         else:
             w(str(self.host))
@@ -259,7 +259,7 @@ class SipURL(object):
             return SipConf.port_needed(port, self.transport, local_transport)
 
         if self.port != None:
-            if local_port is not None and 'my' in dir(self.port):
+            if local_port is not None and hasattr(self.port, 'my'):
                 if port_needed(local_port):
                     w(':%d' % local_port)
             elif port_needed(self.port):
@@ -278,7 +278,7 @@ class SipURL(object):
         for n in ('transport', 'ttl', 'maddr', 'method', 'tag'):
             v = getattr(self, n)
             if v is None: continue
-            if n == 'transport' and 'my' in dir(v):
+            if n == 'transport' and hasattr(v, 'my'):
                 if local_transport in (None, SipConf.default_transport):
                     continue
                 v = local_transport
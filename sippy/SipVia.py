@@ -100,7 +100,7 @@ class SipVia(SipGenericHF):
             (local_addr, local_port), local_transport = local_addr
         else:
             local_addr = local_port = local_transport = None
-        if 'my' in dir(self.transport):
+        if hasattr(self.transport, 'my'):
             transport = str(self.transport) if local_transport is None \
                                             else local_transport
             transport = transport.upper()
@@ -108,12 +108,12 @@ class SipVia(SipGenericHF):
         else:
             transport = self.transport
         sipver = f'{self.sipver}/{transport}'
-        if local_addr != None and 'my' in dir(self.hostname):
+        if local_addr != None and hasattr(self.hostname, 'my'):
             s = sipver + ' ' + local_addr
         else:
             s = sipver + ' ' + str(self.hostname)
         if self.port != None:
-            if local_port != None and 'my' in dir(self.port):
+            if local_port != None and hasattr(self.port, 'my'):
                 if SipConf.port_needed(local_port, self.transport, local_transport):
                     s += ':' + str(local_port)
             else:
@@ -91,7 +91,7 @@ class SipWWWAuthenticate(SipGenericHF):
     def localStr(self, local_addr = None):
         if not self.parsed:
             return self.body
-        if local_addr == None or 'my' not in dir(self.realm):
+        if local_addr == None or not hasattr(self.realm, 'my'):
             local_addr = self.realm
         rval = 'Digest realm="%s",nonce="%s"' % (local_addr, self.nonce)
         if self.qop != None:
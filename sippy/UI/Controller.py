@@ -116,9 +116,8 @@ class UIController(Thread):
         return tuple(str(x.cId) for x in self.siprec_uas)
 
     def getActiveStats(self):
-        calls = self.global_config['_cmap'].getActiveCalls()
-        nconnected = len([x for x in calls if x.state == CCStateConnected])
-        return nconnected, len(calls)
+        cmap = self.global_config['_cmap']
+        return cmap.ccmap.count(CCStateConnected), cmap.countActiveCalls()
 
     def getRouting(self):
         routing = self.global_config['_static_routes'][''].getCopy()
@@ -136,7 +135,7 @@ class UIController(Thread):
         update_with_json(sysconfig, data)
 
     def getCallsById(self, callid):
-        dlist = tuple(x for x in self.global_config['_cmap'].ccmap if str(x.cId) == callid)
+        dlist = self.global_config['_cmap'].ccmap.getByCallId(callid)
         if len(dlist) == 0:
             raise CallNotFound(f"Call ID {callid} not found")
         return dlist
@@ -164,11 +163,11 @@ class UIController(Thread):
 
     def doShutdown(self):
         self.global_config['_cmap'].safeStop(signum=666)
-        return len(self.listActiveCalls())
+        return len(self.global_config['_cmap'].ccmap)
 
     def doRestart(self):
         self.global_config['_cmap'].safeRestart(signum=667)
-        return len(self.listActiveCalls())
+        return len(self.global_config['_cmap'].ccmap)
 
     def get_menu_items(self):
         return tuple((url, mi) for url, mi in self.menu.items() if 'name' in mi)
@@ -94,8 +94,25 @@ class AsyncReceiver(Thread):
         self.userv = userv
         self.start()
 
+    def drain(self, batch, rbatch_size):
+        # Opportunistically pick up whatever else is already sitting in
+        # the socket buffer without blocking, so that the whole lot can
+        # be handed over to the main thread in one go.
+        skt = self.userv.skt
+        while len(batch) < rbatch_size:
+            try:
+                data, address = skt.recvfrom(8192, socket.MSG_DONTWAIT)
+            except socket.error:
+                # EAGAIN/EWOULDBLOCK means we are done, anything else
+                # would be picked up by the next blocking recvfrom()
+                break
+            if not data and address == None:
+                break
+            batch.append((data, address))
+
     def run(self):
         maxemptydata = 100
+        rbatch_size = self.userv.uopts.rbatch_size
         while True:
             try:
                 data, address = self.userv.skt.recvfrom(8192)
@@ -122,6 +139,12 @@ class AsyncReceiver(Thread):
                 dump_exception('Udp_server[%d]: unhandled exception when receiving incoming data' % self.my_pid)
                 sleep(1)
                 continue
+            if rbatch_size > 1:
+                batch = [(data, address)]
+                self.drain(batch, rbatch_size)
+                if len(batch) > 1:
+                    self.dispatch_batch(batch, rtime)
+                    continue
             if self.userv.uopts.family == socket.AF_INET6:
                 address = ('[%s]' % address[0], address[1])
             if not self.userv.uopts.direct_dispatch:
@@ -131,6 +154,15 @@ class AsyncReceiver(Thread):
                 self.userv.handle_read(data, address, rtime)
         self.userv = None
 
+    def dispatch_batch(self, batch, rtime):
+        if self.userv.uopts.family == socket.AF_INET6:
+            batch = [(data, ('[%s]' % address[0], address[1])) for data, address in batch]
+        if not self.userv.uopts.direct_dispatch:
+            batch = [(data, Remote_address(address, self.userv.transport)) for data, address in batch]
+            ED2.callFromThread(self.userv.handle_read_batch, batch, rtime)
+        else:
+            self.userv.handle_read_batch(batch, rtime)
+
 _DEFAULT_FLAGS = socket.SO_REUSEADDR
 if hasattr(socket, 'SO_REUSEPORT'):
     _DEFAULT_FLAGS |= socket.SO_REUSEPORT
@@ -140,11 +172,15 @@ class Udp_server_opts(Network_server_opts):
     family = None
     flags = _DEFAULT_FLAGS
     nworkers = _DEFAULT_NWORKERS
+    # Maximum number of datagrams each receiver picks up per wakeup of
+    # the main thread, 1 disables batching
+    rbatch_size = 1
 
     def __init__(self, *args, family = None, o = None):
         super().__init__(*args, o=o)
         if o != None:
             self.family = o.family
+            self.rbatch_size = o.rbatch_size
             return
         if family == None:
             if self.laddress != None and self.laddress[0].startswith('['):
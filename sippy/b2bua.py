@@ -36,23 +36,33 @@ from sippy.Time.MonoTime import MonoTime
 from sippy.Time.Timeout import Timeout
 from sippy.Signal import Signal
 from sippy.UA import UA
-from sippy.CCEvents import CCEventDisconnect, CCEventTry,CCEventFail
+from sippy.CCEvents import CCEventDisconnect, CCEventTry,CCEventFail, CCEventRing, \
+  CCEventConnect, CCEventPreConnect
 from sippy.SipConf import SipConf
 from sippy.SipHeader import SipHeader
 from sippy.RadiusAuthorisation import RadiusAuthorisation
+from sippy.RadiusAuthCache import RadiusAuthCache
 from sippy.RadiusAccounting import RadiusAccounting
+from sippy.RadiusAcctSpool import RadiusAcctSpool
 from sippy.FakeAccounting import FakeAccounting
 from sippy.SipLogger import SipLogger
+from sippy.SipCapture import SipCapture
+from sippy.Metrics import MetricsRegistry, SETUP_BUCKETS
+from sippy.Core.Profiler import EDProfiler
 from sippy.Rtp_proxy.session import Rtp_proxy_session
 from sippy.Rtp_proxy.Session.webrtc import Rtp_proxy_session_webrtc2sip, \
  Rtp_proxy_session_sip2webrtc
-from sippy.Rtp_proxy.client import Rtp_proxy_client
-from signal import SIGHUP, SIGPROF, SIGUSR1, SIGUSR2, SIGTERM
+from sippy.Rtp_proxy.client import Rtp_proxy_client, collect_rtpp_metrics
+from sippy.Rtp_proxy.balancer import RTPP_BALANCERS, parse_rtpp_spec
+from signal import SIGHUP, SIGPROF, SIGQUIT, SIGUSR1, SIGUSR2, SIGTERM
 from sippy.SipTransactionManager import SipTransactionManager
 from sippy.SipCallId import SipCallId
 from sippy.StatefulProxy import StatefulProxy
 from sippy.misc import daemonize
-from sippy.B2B.Route import B2BRoute, SRC_PROXY, SRC_WSS, DST_SIP_UA, DST_WSS_UA
+from sippy.B2B.Route import B2BRoute, B2BRouteCache, SRC_PROXY, SRC_WSS, DST_SIP_UA, DST_WSS_UA
+from sippy.B2B.RouteTable import B2BRouteTable
+from sippy.B2B.SetupTrace import B2BSetupTracer
+from sippy.Security.SipDigestStore import SipDigestAuth
 from sippy.Wss_server import Wss_server, Wss_server_opts
 from sippy.SipURL import SipURL
 from sippy.Exceptions.SdpParseError import SdpParseError
@@ -60,6 +70,8 @@ from sippy.Exceptions.SdpParseError import SdpParseError
 from sippy.B2B.States import CCStateIdle, CCStateWaitRoute, CCStateARComplete, \
   CCStateConnected, CCStateDead, CCStateDisconnecting
 from sippy.B2B.SimpleAPI import B2BSimpleAPI
+from sippy.B2B.CallRegistry import B2BCallRegistry
+from sippy.B2B.Workers import B2BWorkerSet
 
 import gc, getopt, os
 from re import sub
@@ -96,7 +108,8 @@ class CallController(object):
     id = 1
     uaA = None
     uaO = None
-    state = None
+    _state = None
+    registry = None
     cId = None
     cld = None
     eTry = None
@@ -113,6 +126,8 @@ class CallController(object):
     auth_proc = None
     proxied = False
     challenge = None
+    local_auth = None
+    strace = None
     req_source: str
     req_target: SipURL
     extra_attributes = None
@@ -138,6 +153,17 @@ class CallController(object):
         if '_allowed_pts' in self.global_config:
             self.uaA.on_remote_sdp_change = self.filter_SDP
 
+    @property
+    def state(self):
+        return self._state
+
+    @state.setter
+    def state(self, state):
+        # Keep per-state indexes of the call registry current
+        if self.registry is not None:
+            self.registry.stateChanged(self, self._state, state)
+        self._state = state
+
     def filter_SDP(self, body, done_cb, prev_orc = None):
         if prev_orc is not None:
             prev_orc = prev_orc()
@@ -184,18 +210,28 @@ class CallController(object):
                 if 'static_tr_in' in self.global_config:
                     self.cld = re_replace(self.global_config['static_tr_in'], self.cld)
                     event.data = (self.cId, self.cli, self.cld, body, auth, self.caller_name)
+                if self.strace is not None:
+                    self.strace.cli, self.strace.cld = self.cli, self.cld
                 if '_rtp_proxy_clients' in self.global_config:
                     self.rtp_proxy_session = self.rtpps_cls(self.global_config, call_id = self.cId, \
                       notify_tag = quote('r %s' % str(self.id)))
                     self.rtp_proxy_session.callee.raddress = (self.remote_ip, 5060)
                 self.eTry = event
                 self.state = CCStateWaitRoute
-                if not self.global_config['auth_enable']:
+                if self.local_auth is not None:
+                    # Credentials have been verified against the local store
+                    self.username = self.local_auth
+                    self.rDone(((), 0))
+                elif not self.global_config['auth_enable']:
                     self.username = self.remote_ip
                     self.rDone(((), 0))
                 elif auth == None or auth.username == None or len(auth.username) == 0:
                     self.username = self.remote_ip
-                    self.auth_proc = self.global_config['_radius_client'].do_auth(self.remote_ip, self.cli, self.cld, \
+                    if '_radius_auth_cache' in self.global_config:
+                        rclient = self.global_config['_radius_auth_cache']
+                    else:
+                        rclient = self.global_config['_radius_client']
+                    self.auth_proc = rclient.do_auth(self.remote_ip, self.cli, self.cld, \
                       self.cId, self.remote_ip, self.rDone, extra_attributes=self.extra_attributes)
                 else:
                     self.username = auth.username
@@ -207,6 +243,8 @@ class CallController(object):
                 return
             self.uaO.recvEvent(event)
         else:
+            if self.strace is not None:
+                self.traceEvent(event)
             if (isinstance(event, CCEventFail) or isinstance(event, CCEventDisconnect)) and self.state == CCStateARComplete and \
               (isinstance(self.uaA.state, self.uaA.UasStateTrying) or isinstance(self.uaA.state, self.uaA.UasStateRinging)) and len(self.routes) > 0:
                 if isinstance(event, CCEventFail):
@@ -218,7 +256,28 @@ class CallController(object):
                     return
             self.uaA.recvEvent(event)
 
+    def traceEvent(self, event):
+        if isinstance(event, CCEventRing):
+            self.strace.mark('100' if event.getData()[0] == 100 else '18x', event.rtime)
+        elif isinstance(event, (CCEventConnect, CCEventPreConnect)):
+            self.strace.mark('200', event.rtime)
+
+    def traceSdpChange(self, sdp_change_f, body, done_cb):
+        return sdp_change_f(body, partial(self.traceRtpp, done_cb))
+
+    def traceRtpp(self, done_cb, *args, **kwargs):
+        if self.strace is not None:
+            self.strace.mark('rtpp')
+        return done_cb(*args, **kwargs)
+
+    def traceDone(self, result):
+        if self.strace is not None:
+            self.global_config['_setup_tracer'].finish(self.strace, result)
+            self.strace = None
+
     def rDone(self, results):
+        if self.strace is not None:
+            self.strace.mark('aaa')
         # Check that we got necessary result from Radius
         if len(results) != 2 or results[1] != 0:
             if isinstance(self.uaA.state, self.uaA.UasStateTrying):
@@ -257,13 +316,25 @@ class CallController(object):
             credit_time = int(credit_time[0][1])
         else:
             credit_time = None
-        if not '_static_routes' in self.global_config:
+        if '_route_table' in self.global_config:
+            routing = self.global_config['_route_table'].lookup(self.cld, self.cli, self.remote_ip)
+        else:
+            routing = None
+        if routing is not None:
+            # Local routing table takes precedence, the RADIUS / static
+            # routes are only used for the CLDs that it has no rule for
+            pass
+        elif not '_static_routes' in self.global_config:
             routing = [x for x in results[0] if x[0] == 'h323-ivr-in' and x[1].startswith('Routing:')]
             if len(routing) == 0:
                 self.uaA.recvEvent(CCEventFail((500, 'Internal Server Error (2)')))
                 self.state = CCStateDead
                 return
-            routing = [B2BRoute(x[1][8:]) for x in routing]
+            if '_route_cache' in self.global_config:
+                rcache = self.global_config['_route_cache']
+                routing = [rcache.get(x[1][8:]) for x in routing]
+            else:
+                routing = [B2BRoute(x[1][8:]) for x in routing]
         elif self.req_source == SRC_PROXY and SRC_PROXY in self.global_config['_static_routes']:
             routing = [self.global_config['_static_routes'][SRC_PROXY].getCopy(),]
         else:
@@ -326,6 +397,9 @@ class CallController(object):
             self.uaO.outbound_proxy = oroute.params.get('outbound_proxy', None)
         if self.rtp_proxy_session != None and oroute.params.get('rtpp', True):
             self.uaO.on_local_sdp_change = self.rtp_proxy_session.on_caller_sdp_change
+            if self.strace is not None:
+                self.uaO.on_local_sdp_change = partial(self.traceSdpChange, \
+                  self.uaO.on_local_sdp_change)
             self.uaO.on_remote_sdp_change = self.rtp_proxy_session.on_callee_sdp_change
             if not nh_address[0].endswith('.invalid'):
                 self.rtp_proxy_session.caller.raddress = nh_address
@@ -344,7 +418,8 @@ class CallController(object):
             timeout, skipto = oroute.params['group_timeout']
             Timeout(self.group_expires, timeout, 1, skipto)
         if self.global_config.getdefault('hide_call_id', False):
-            cId = SipCallId(md5(str(cId).encode()).hexdigest() + ('-b2b_%d' % oroute.rnum))
+            cId = SipCallId(md5(str(cId).encode()).hexdigest() + \
+              self.global_config.getdefault('_cid_affinity_tag', '') + ('-b2b_%d' % oroute.rnum))
         else:
             cId += '-b2b_%d' % oroute.rnum
         event = CCEventTry((cId, oroute.cli, cld, body, auth, \
@@ -359,6 +434,8 @@ class CallController(object):
         po_proc = oroute.params.get('po_proc', None)
         if po_proc is not None:
             po_proc(self, event)
+        if self.strace is not None:
+            self.strace.mark('originate')
         self.uaO.recvEvent(event)
 
     def disconnect(self, rtime = None, origin = None, media_index = None):
@@ -372,9 +449,15 @@ class CallController(object):
 
     def aConn(self, ua, rtime, origin):
         self.state = CCStateConnected
+        cmap = self.global_config['_cmap']
+        if cmap.m_setup is not None:
+            cmap.m_connected.inc()
+            cmap.m_setup.observe(rtime - ua.setup_ts)
+        self.traceDone(200)
         self.acctA.conn(ua, rtime, origin)
 
     def aDisc(self, ua, rtime, origin, result = 0):
+        self.traceDone(result if result != 0 else origin)
         if self.state == CCStateWaitRoute and self.auth_proc != None:
             self.auth_proc.cancel()
             self.auth_proc = None
@@ -425,13 +508,18 @@ class CallMap(object):
     safe_stop = False
     global_config = None
     proxy = None
+    m_calls = None
+    m_connected = None
+    m_setup = None
     #rc1 = None
     #rc2 = None
 
     def __init__(self, global_config):
         self.global_config = global_config
-        self.ccmap = []
+        self.ccmap = B2BCallRegistry()
         self.el = Timeout(self.GClector, 60, -1)
+        if '_metrics' in global_config:
+            self.initMetrics(global_config['_metrics'])
         Signal(SIGHUP, self.discAll, SIGHUP)
         Signal(SIGUSR2, self.toggleDebug, SIGUSR2)
         Signal(SIGPROF, self.safeRestart, SIGPROF)
@@ -441,6 +529,20 @@ class CallMap(object):
         #gc.set_threshold(0)
         #print(gc.collect())
 
+    def initMetrics(self, metrics):
+        self.m_calls = metrics.counter('sippy_calls_total', 'Incoming calls')
+        self.m_connected = metrics.counter('sippy_calls_connected_total', \
+          'Incoming calls that have been answered')
+        self.m_setup = metrics.histogram('sippy_call_setup_seconds', \
+          'Time from the incoming INVITE to the call being answered', \
+          buckets = SETUP_BUCKETS)
+        metrics.register('sippy_calls', self.collectMetrics)
+
+    def collectMetrics(self):
+        bystate = [(((('state', state.sname),), n)) for state, n in self.ccmap.counts().items()]
+        return (('sippy_calls', 'gauge', 'Calls in memory', (((), len(self.ccmap)),)),
+          ('sippy_calls_state', 'gauge', 'Calls in memory by state', bystate))
+
     def remoteIPAuth(self, stran):
         aips = self.global_config.getdefault('_accept_ips', None)
         if stran[1] == 'wss':
@@ -480,8 +582,18 @@ class CallMap(object):
             source, transport = stran
             remote_ip = via.getTAddr()[0] if req_source != SRC_WSS else source[0]
 
+            local_auth = None
+            if '_digest_auth' in self.global_config:
+                # Callers without the local credentials are left to the IP
+                # or RADIUS authentication when there is one
+                fallback = self.global_config['auth_enable'] or req_source == SRC_PROXY or \
+                  '_accept_ips' in self.global_config
+                resp, local_auth = self.localDigestAuth(req, fallback)
+                if resp is not None:
+                    return (resp, None, None)
+
             challenge = None
-            if self.global_config['auth_enable']:
+            if local_auth is None and self.global_config['auth_enable']:
                 # Prepare challenge if no authorization header is present.
                 # Depending on configuration, we might try remote ip auth
                 # first and then challenge it or challenge immediately.
@@ -503,21 +615,58 @@ class CallMap(object):
                     pass_headers.extend(hfs)
             req_target = req.getRURI()
             cc = CallController(remote_ip, source, req_source, req_target, self.global_config, pass_headers)
+            if '_setup_tracer' in self.global_config:
+                cc.strace = self.global_config['_setup_tracer'].start(cc.id, \
+                  str(req.getHFBody('call-id')), req.rtime)
+                cc.strace.mark('accepted')
 
             if '_pre_auth_proc' in self.global_config:
                 self.global_config['_pre_auth_proc'](cc, req)
 
             cc.challenge = challenge
+            cc.local_auth = local_auth
             rval = cc.uaA.recvRequest(req, sip_t)
-            self.ccmap.append(cc)
+            self.ccmap.add(cc, str(req.getHFBody('call-id')))
+            if self.m_calls is not None:
+                self.m_calls.inc()
             return rval
         if self.proxy != None and req.getMethod() in ('REGISTER', 'SUBSCRIBE'):
+            if '_digest_auth' in self.global_config:
+                resp, username = self.localDigestAuth(req)
+                if resp is not None:
+                    return (resp, None, None)
             return self.proxy.recvRequest(req)
         if req.getMethod() in ('NOTIFY', 'PING'):
             # Whynot?
             return (req.genResponse(200, 'OK'), None, None)
         return (req.genResponse(501, 'Not Implemented'), None, None)
 
+    def localDigestAuth(self, req, fallback = False):
+        # Returns (None, username) if the request carries credentials for
+        # a user in the local digest store that check out, (401 reply, None)
+        # if they don't. Requests with no credentials for the local users
+        # get (None, None) if fallback is set, so that they can be
+        # authenticated some other way, and the 401 reply otherwise
+        dauth = self.global_config['_digest_auth']
+        known = False
+        for hf in req.getHFs('authorization'):
+            try:
+                auth = hf.getBody()
+                if not dauth.knows(auth):
+                    continue
+            except Exception:
+                dump_exception('can\'t parse Authorization header', extra = req)
+                continue
+            if dauth.verify(auth, req.getMethod()):
+                return (None, auth.username)
+            known = True
+        if fallback and not known:
+            return (None, None)
+        resp = req.genResponse(401, 'Unauthorized')
+        for challenge in dauth.challenges(req.getRURI().host):
+            resp.appendHeader(challenge)
+        return (resp, None)
+
     def discAll(self, signum = None):
         if signum != None:
             print('Signal %d received, disconnecting all calls' % signum)
@@ -543,19 +692,21 @@ class CallMap(object):
         self.er_timer = Timeout(self.executeStop, 0.5, -1)
 
     def getActiveCalls(self):
-        return tuple(x for x in self.ccmap if x.state in (CCStateConnected, CCStateARComplete))
+        return self.ccmap.inState(CCStateConnected, CCStateARComplete)
+
+    def countActiveCalls(self):
+        return self.ccmap.count(CCStateConnected, CCStateARComplete)
 
     def executeStop(self):
         if not self.safe_stop:
             return
         self.global_config['_executeStop_count'] += 1
-        acalls = self.getActiveCalls()
-        nactive = len(acalls)
+        nactive = self.countActiveCalls()
         print('[%d]: executeStop is invoked, %d calls in map, %d active' % \
           (self.global_config['_my_pid'], len(self.ccmap), nactive))
         if self.global_config['_executeStop_count'] >= 5 and nactive > 0:
             print('executeStop: some sessions would not die, forcing exit:')
-            for cc in acalls:
+            for cc in self.getActiveCalls():
                 print('\t' + str(cc))
             nactive = 0
         if nactive > 0:
@@ -580,8 +731,13 @@ class CallMap(object):
             print('[%d]: %d client, %d server transactions in memory' % \
               (os.getpid(), len(self.global_config['_sip_tm'].tclient), len(self.global_config['_sip_tm'].tserver)))
         if self.safe_restart:
-            if len(self.getActiveCalls()) == 0:
+            if self.countActiveCalls() == 0:
                 self.global_config['_sip_tm'].shutdown()
+                if '_b2bua_worker' in self.global_config:
+                    # The supervisor re-executes the whole worker set
+                    # once all of them are gone
+                    ED2.breakLoop()
+                    return
                 os.chdir(self.global_config['_orig_cwd'])
                 argv = [sys.executable,]
                 argv.extend(self.global_config['_orig_argv'])
@@ -603,7 +759,7 @@ class CallMap(object):
             else:
                 r.append(None)
             if cc.uaO != None:
-                (_h, _p), _t = cc.uaA.getRAddr0()
+                (_h, _p), _t = cc.uaO.getRAddr0()
                 r.append((cc.uaO.state.sname, _t, _h, _p,
                          cc.uaO.getCLI(), cc.uaO.getCLD()))
             else:
@@ -611,6 +767,13 @@ class CallMap(object):
             rr.append(tuple(r))
         return tuple(rr)
 
+def dump_profile(signum):
+    if ED2.profiler is None:
+        print('EventDispatcher2 profiler is off, use --ed_profile or the "p on" command')
+    else:
+        print(ED2.profiler.report())
+    sys.stdout.flush()
+
 def reopen(signum, logfile):
     print('Signal %d received, reopening logs' % signum)
     fd = os.open(logfile, os.O_WRONLY | os.O_CREAT | os.O_APPEND)
@@ -757,34 +920,110 @@ def main_func():
 
     if 'static_route' in global_config:
         global_config['_static_routes'] = {'':B2BRoute(global_config['static_route'])}
-    elif not global_config['auth_enable']:
-        sys.__stderr__.write('ERROR: static route should be specified when Radius auth is disabled\n')
+    elif not global_config['auth_enable'] and not 'route_table' in global_config:
+        sys.__stderr__.write('ERROR: static route or routing table should be specified when Radius auth is disabled\n')
+        usage(global_config, True)
+    elif 'digest_store' in global_config and not 'route_table' in global_config:
+        sys.__stderr__.write('ERROR: static route or routing table should be specified with the local digest store\n')
         usage(global_config, True)
 
+    if 'digest_store' in global_config:
+        # Opened before the workers are forked, so that they share the pages
+        global_config['_digest_auth'] = SipDigestAuth(global_config['digest_store'])
+
     if writeconf != None:
         global_config.write(open(writeconf, 'w'))
 
     if not global_config['foreground']:
         daemonize(logfile = global_config['logfile'])
 
+    nworkers = global_config.getdefault('b2bua_workers', 0)
+    if nworkers > 1:
+        if 'wss_socket' in global_config:
+            sys.__stderr__.write('ERROR: wss_socket is not supported with b2bua_workers\n')
+            sys.exit(1)
+        # Fork workers before anything in this process starts threads
+        wset = B2BWorkerSet(global_config, nworkers, reopen)
+        if not wset.spawn():
+            if not global_config['foreground']:
+                open(global_config['pidfile'], 'w').write(str(os.getpid()) + '\n')
+            wset.run()
+            return
+
     global_config['_sip_logger'] = SipLogger('b2bua')
+    global_config['_metrics'] = MetricsRegistry.fromConfig(global_config)
+    if global_config.getdefault('ed_profile', False):
+        EDProfiler.enable(global_config['_metrics'])
+    # The profiler can be turned on at run time with the "p on" command,
+    # so the handler is always there
+    Signal(SIGQUIT, dump_profile, SIGQUIT)
+    sip_capture = SipCapture.fromConfig(global_config)
+    if sip_capture != None:
+        global_config['_sip_capture'] = sip_capture
+        global_config['_metrics'].register_stats('sippy_sip_capture', \
+          sip_capture.stats, ('captured', 'dropped', 'written'))
 
     if global_config['auth_enable'] or global_config['acct_enable']:
         global_config['_radius_client'] = RadiusAuthorisation(global_config)
+    if global_config['auth_enable'] and global_config.getdefault('auth_cache_ttl', 0) > 0:
+        acache_args = [global_config[x] if x in global_config else None \
+          for x in ('auth_cache_ttl', 'auth_cache_neg_ttl', 'auth_cache_size')]
+        if 'auth_cache_key' in global_config:
+            acache_args.append(global_config['auth_cache_key'])
+        global_config['_radius_auth_cache'] = RadiusAuthCache(global_config, \
+          global_config['_radius_client'], *acache_args)
+        global_config['_metrics'].register_stats('sippy_radius_auth_cache', \
+          global_config['_radius_auth_cache'].stats, ('hits', 'neg_hits', 'misses', \
+          'coalesced', 'inserts', 'evictions', 'expirations'))
+    if global_config['acct_enable'] and 'acct_spool' in global_config:
+        global_config['_acct_spool'] = RadiusAcctSpool(global_config, global_config['acct_spool'])
     global_config['_uaname'] = 'Sippy B2BUA (RADIUS)'
 
+    if 'static_route' not in global_config and \
+      global_config.getdefault('route_cache_size', 1) > 0:
+        rcache_args = [global_config[x] if x in global_config else None \
+          for x in ('route_cache_size', 'route_cache_ttl')]
+        global_config['_route_cache'] = B2BRouteCache(*rcache_args)
+        global_config['_metrics'].register_stats('sippy_route_cache', \
+          global_config['_route_cache'].stats, ('hits', 'misses', 'evictions', \
+          'expirations'))
+
+    if 'route_table' in global_config:
+        global_config['_route_table'] = B2BRouteTable(global_config['route_table'])
+        global_config['_metrics'].register_stats('sippy_route_table', \
+          global_config['_route_table'].stats, ('lookups', 'misses', 'reloads', \
+          'reload_errors'))
+    if '_digest_auth' in global_config:
+        global_config['_metrics'].register_stats('sippy_digest_auth', \
+          global_config['_digest_auth'].stats, ('lookups', 'misses', 'accepted', \
+          'rejected', 'replays', 'overflows', 'reload_errors'))
+
+    setup_tracer = B2BSetupTracer.fromConfig(global_config, global_config['_metrics'])
+    if setup_tracer is not None:
+        global_config['_setup_tracer'] = setup_tracer
+        global_config['_metrics'].register_stats('sippy_setup_trace', \
+          setup_tracer.stats, ('started', 'finished', 'written', 'write_errors'))
+
     global_config['_cmap'] = CallMap(global_config)
 
     clis = B2BSimpleAPI(global_config)
 
     if len(rtp_proxy_clients) > 0:
         global_config['_rtp_proxy_clients'] = []
-        for address in rtp_proxy_clients:
+        for spec in rtp_proxy_clients:
+            address, weight = parse_rtpp_spec(spec)
             kwa = {'nsetup_f': clis.set_rtp_io_socket} if address.startswith('rtp.io:') else {}
             rtpc = Rtp_proxy_client(global_config, spath = address, **kwa)
+            rtpc.weight = weight
             if not address.startswith('rtp.io:'):
                 rtpc.notify_socket = global_config['b2bua_socket']
             global_config['_rtp_proxy_clients'].append(rtpc)
+        global_config['_metrics'].register('sippy_rtpp', \
+          partial(collect_rtpp_metrics, global_config['_rtp_proxy_clients']))
+        # Default one is weighted random, so that the weights count even
+        # if no policy has been chosen explicitly
+        balancer = global_config.getdefault('rtp_proxy_balancer', 'random')
+        global_config['_rtpp_balancer'] = RTPP_BALANCERS[balancer]()
 
     if 'sip_proxy' in global_config:
         host_port = global_config['sip_proxy'].split(':', 1)
@@ -796,7 +1035,10 @@ def main_func():
 
     if global_config.getdefault('xmpp_b2bua_id', None) != None:
         global_config['_xmpp_mode'] = True
-    stm = SipTransactionManager(global_config, global_config['_cmap'].recvRequest)
+    stm_class = global_config.getdefault('_sip_tm_class', SipTransactionManager)
+    stm = stm_class(global_config, global_config['_cmap'].recvRequest)
+    if '_b2bua_worker' in global_config:
+        global_config['_b2bua_worker'].attach(stm)
 
     if 'wss_socket' in global_config:
         parts = global_config['wss_socket'].split(':', 3)
@@ -811,12 +1053,14 @@ def main_func():
     global_config['_sip_tm'] = stm
     global_config['_sip_tm'].nat_traversal = global_config.getdefault('nat_traversal', False)
 
-    if 'ui' in global_config:
+    if 'ui' in global_config and ('_b2bua_worker' not in global_config or \
+      global_config['_b2bua_worker'].wid == 0):
         from sippy.UI.Controller import UIController
         global_config['_ui_controller'] = UIController(global_config)
 
     if not global_config['foreground']:
-        open(global_config['pidfile'], 'w').write(str(os.getpid()) + '\n')
+        if '_b2bua_worker' not in global_config:
+            open(global_config['pidfile'], 'w').write(str(os.getpid()) + '\n')
         Signal(SIGUSR1, reopen, SIGUSR1, global_config['logfile'])
 
     try:
@@ -825,6 +1069,13 @@ def main_func():
         if '_wss_server' in global_config:
             global_config['_wss_server'].shutdown()
         clis.shutdown()
+        if '_b2bua_worker' in global_config:
+            global_config['_b2bua_worker'].shutdown()
+        if '_sip_capture' in global_config:
+            global_config['_sip_capture'].shutdown()
+        if '_setup_tracer' in global_config:
+            global_config['_setup_tracer'].shutdown()
+        global_config['_metrics'].shutdown()
 
 if __name__ == '__main__':
     main_func()
@@ -0,0 +1,81 @@
+import os
+import unittest
+from time import monotonic
+
+from sippy.b2bua import CallController
+from sippy.B2B.CallRegistry import B2BCallRegistry
+from sippy.B2B.States import CCStateIdle, CCStateWaitRoute, CCStateARComplete, \
+  CCStateConnected, CCStateDead
+
+def mkcall(id, call_id):
+    # Bare controller, only what the registry needs
+    cc = CallController.__new__(CallController)
+    cc.id = id
+    cc.cId = call_id
+    cc.state = CCStateIdle
+    return cc
+
+class TestB2BCallRegistry(unittest.TestCase):
+    def test_registry(self):
+        reg = B2BCallRegistry()
+        ccs = [mkcall(i, 'cid%d@example.com' % (i // 2)) for i in range(10)]
+        for cc in ccs:
+            reg.add(cc)
+        self.assertEqual(len(reg), 10)
+        self.assertEqual(list(reg), ccs)
+        self.assertIs(reg.get(3), ccs[3])
+        self.assertIsNone(reg.get(100))
+        self.assertEqual(reg.getByCallId('cid1@example.com'), (ccs[2], ccs[3]))
+        self.assertEqual(reg.getByCallId('nonexistent'), ())
+        self.assertRaises(ValueError, reg.add, ccs[0])
+        # Counters follow the state changes
+        for cc in ccs[:4]:
+            cc.state = CCStateWaitRoute
+            cc.state = CCStateARComplete
+        ccs[0].state = CCStateConnected
+        self.assertEqual(reg.count(CCStateIdle), 6)
+        self.assertEqual(reg.count(CCStateConnected, CCStateARComplete), 4)
+        self.assertEqual(set(reg.inState(CCStateARComplete)), set(ccs[1:4]))
+        self.assertEqual(reg.counts()[CCStateWaitRoute], 0)
+        # Removal
+        ccs[2].state = CCStateDead
+        reg.remove(ccs[2])
+        self.assertNotIn(ccs[2], reg)
+        self.assertIn(ccs[3], reg)
+        self.assertEqual(reg.getByCallId('cid1@example.com'), (ccs[3],))
+        self.assertEqual(reg.count(CCStateDead), 0)
+        self.assertRaises(ValueError, reg.remove, ccs[2])
+        # Not tracked any more
+        ccs[2].state = CCStateIdle
+        self.assertEqual(reg.count(CCStateIdle), 6)
+        reg.remove(ccs[3])
+        self.assertEqual(reg.getByCallId('cid1@example.com'), ())
+        self.assertNotIn('cid1@example.com', reg.by_call_id)
+        # Iteration is over a snapshot
+        for cc in reg:
+            reg.remove(cc)
+        self.assertEqual(len(reg), 0)
+        self.assertEqual(reg.count(CCStateIdle, CCStateConnected, CCStateARComplete), 0)
+
+    def test_speed(self):
+        ncalls = int(os.environ.get('SIPPY_CALLREG_NCALLS', '50000'))
+        reg = B2BCallRegistry()
+        ccs = [mkcall(i, 'cid%d@example.com' % i) for i in range(ncalls)]
+        start = monotonic()
+        for cc in ccs:
+            reg.add(cc)
+        for cc in ccs:
+            cc.state = CCStateConnected
+        for i in range(0, ncalls, 7):
+            self.assertIs(reg.get(i), ccs[i])
+            self.assertEqual(reg.getByCallId('cid%d@example.com' % i), (ccs[i],))
+            self.assertEqual(reg.count(CCStateConnected, CCStateARComplete), ncalls)
+        for cc in reversed(ccs):
+            reg.remove(cc)
+        elapsed = monotonic() - start
+        print('B2BCallRegistry: %d calls added, looked up and removed in %.3f sec' % \
+          (ncalls, elapsed))
+        self.assertEqual(len(reg), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
+import os
 import unittest
-from sippy.B2B.Route import B2BRoute
+from time import perf_counter
+
+from sippy.B2B.Route import B2BRoute, B2BRouteCache
 
 class TestB2BRoute(unittest.TestCase):
     test_route = '200110508667@b2bua.org;cli=16046288900;rid=-1;expires=30;np_expires=5;ash=Name%3AValue'
@@ -23,5 +26,64 @@ class TestB2BRoute(unittest.TestCase):
         self.assertEqual(route.no_progress_expires, 5)
         self.assertEqual(str(route.extra_headers[0]), 'Name: Value')
 
+class TestB2BRouteCache(unittest.TestCase):
+    test_route = '200110508667@192.0.2.1:5070;cli=16046288900;credit-time=60;gt=10,1;ash=Name%3AValue'
+
+    def test_getCopy(self):
+        route = B2BRoute(self.test_route)
+        copy = route.getCopy()
+        copy.customize(2, '123', '456', None, (), 30)
+        self.assertEqual(copy.credit_time, 30)
+        self.assertEqual(copy.params['group_timeout'], (10, 3))
+        self.assertIsNot(copy.extra_headers[0], route.extra_headers[0])
+        # The original is not affected by customizing the copy
+        self.assertEqual(route.credit_time, 60)
+        self.assertNotIn('group_timeout', route.params)
+        self.assertEqual(len(route.extra_headers), 1)
+        self.assertIsNone(route.rnum)
+        self.assertEqual(copy.hostonly, '192.0.2.1')
+        self.assertEqual(copy.getNHAddr(('192.0.2.10', 5060)), (('192.0.2.1', 5070), True))
+
+    def test_cache(self):
+        rcache = B2BRouteCache(max_entries = 2, ttl = 10.0)
+        r1 = rcache.get(self.test_route, now = 0.0)
+        r2 = rcache.get(self.test_route, now = 1.0)
+        self.assertIsNot(r1, r2)
+        self.assertEqual(r1.cld, r2.cld)
+        r1.customize(1, '123', '456', None, (), 30)
+        r3 = rcache.get(self.test_route, now = 2.0)
+        self.assertEqual(r3.credit_time, 60)
+        self.assertIsNone(r3.rnum)
+        self.assertEqual((rcache.hits, rcache.misses), (2, 1))
+        # LRU eviction
+        rcache.get('192.0.2.2', now = 3.0)
+        rcache.get(self.test_route, now = 4.0)
+        rcache.get('192.0.2.3', now = 5.0)
+        self.assertEqual(list(rcache.entries.keys()), [self.test_route, '192.0.2.3'])
+        self.assertEqual(rcache.evictions, 1)
+        # Expiry
+        rcache.get(self.test_route, now = 20.0)
+        self.assertEqual(rcache.expirations, 1)
+        self.assertEqual(rcache.stats()['misses'], 4)
+        with self.assertRaises(ValueError):
+            rcache.get('192.0.2.4;expires=x')
+        self.assertNotIn('192.0.2.4;expires=x', rcache.entries)
+
+    def test_speed(self):
+        # Per-call route materialization, parsing vs cached template
+        iterations = int(os.environ.get('SIPPY_ROUTE_ITERATIONS', '20000'))
+        rcache = B2BRouteCache()
+        start = perf_counter()
+        for i in range(iterations):
+            B2BRoute(self.test_route).customize(1, '123', '456', None, (), None)
+        parse_rate = iterations / (perf_counter() - start)
+        start = perf_counter()
+        for i in range(iterations):
+            rcache.get(self.test_route).customize(1, '123', '456', None, (), None)
+        cache_rate = iterations / (perf_counter() - start)
+        print('B2BRoute: %.0f routes/sec parsed, %.0f routes/sec from cache' % \
+          (parse_rate, cache_rate))
+        self.assertGreater(cache_rate, parse_rate)
+
 if __name__ == '__main__':
     unittest.main()
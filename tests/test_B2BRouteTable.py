@@ -0,0 +1,167 @@
+import os
+import unittest
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from sippy.B2B.RouteTable import B2BRouteTable
+from sippy.B2B.SimpleAPI import B2BSimpleAPI
+from sippy.Core.EventDispatcher import ED2
+
+class FakeCLI(object):
+    def __init__(self):
+        self.replies = []
+
+    def send(self, data):
+        self.replies.append(data)
+
+class FakeLogger(object):
+    def __init__(self):
+        self.records = []
+
+    def write(self, *args):
+        self.records.append(''.join(args))
+        ED2.breakLoop()
+
+TABLE = '''# test table
+*                                  192.0.2.1:5060
+1604                               @192.0.2.2 192.0.2.3:5070;expires=30
+1604628                            192.0.2.4;credit-time=60
+1604          cli=1800             192.0.2.5
+1604          cli=18005            192.0.2.6
+1604          src=198.51.100.0/24  192.0.2.7
+1604          cli=1800 src=198.51.100.0/24 192.0.2.8
+44            src=2001:db8::/32    192.0.2.9
+'''
+
+class TestB2BRouteTable(unittest.TestCase):
+    def mktable(self, tdir, text):
+        fname = os.path.join(tdir, 'routes')
+        with open(fname, 'w') as f:
+            f.write(text)
+        return B2BRouteTable(fname)
+
+    def hosts(self, rtable, *args):
+        return [x.hostport for x in rtable.match(*args)]
+
+    def test_lookup(self):
+        with TemporaryDirectory() as tdir:
+            rtable = self.mktable(tdir, TABLE)
+            self.assertEqual(self.hosts(rtable, '9999'), ['192.0.2.1:5060'])
+            self.assertEqual(self.hosts(rtable, ''), ['192.0.2.1:5060'])
+            self.assertEqual(self.hosts(rtable, '16041112222'), ['192.0.2.2', '192.0.2.3:5070'])
+            self.assertEqual(self.hosts(rtable, '16046281111'), ['192.0.2.4'])
+            self.assertEqual(self.hosts(rtable, '160462'), ['192.0.2.2', '192.0.2.3:5070'])
+            # Qualified rules, the most specific one that matches wins
+            self.assertEqual(self.hosts(rtable, '1604555', '18001234'), ['192.0.2.5'])
+            self.assertEqual(self.hosts(rtable, '1604555', '18005555'), ['192.0.2.6'])
+            self.assertEqual(self.hosts(rtable, '1604555', None, '198.51.100.10'), ['192.0.2.7'])
+            self.assertEqual(self.hosts(rtable, '1604555', '1800', '198.51.100.10'), ['192.0.2.8'])
+            self.assertEqual(self.hosts(rtable, '1604555', '1700', '203.0.113.1'), \
+              ['192.0.2.2', '192.0.2.3:5070'])
+            # Longer prefix beats the qualified shorter one
+            self.assertEqual(self.hosts(rtable, '1604628', '1800', '198.51.100.10'), ['192.0.2.4'])
+            self.assertEqual(self.hosts(rtable, '4420', None, '[2001:db8::1]'), ['192.0.2.9'])
+            self.assertEqual(self.hosts(rtable, '4420', None, '198.51.100.10'), ['192.0.2.1:5060'])
+            self.assertEqual(self.hosts(rtable, '4420', None, 'garbage'), ['192.0.2.1:5060'])
+            routes = rtable.lookup('16041112222')
+            self.assertIsNone(routes[0].cld)
+            self.assertEqual(routes[1].expires, 30)
+            self.assertIsNot(routes[1], rtable.match('16041112222')[1])
+            # Same route string is parsed once
+            self.assertIs(rtable.match('1604')[0], rtable.match('160499')[0])
+            self.assertEqual(rtable.stats()['rules'], 8)
+            self.assertEqual(rtable.stats()['routes'], 9)
+
+    def test_miss(self):
+        with TemporaryDirectory() as tdir:
+            rtable = self.mktable(tdir, '1604 192.0.2.1\n')
+            self.assertIsNone(rtable.match('1605'))
+            self.assertIsNone(rtable.lookup(None))
+            self.assertEqual(rtable.stats()['misses'], 2)
+            self.assertEqual(rtable.stats()['lookups'], 2)
+
+    def test_reload(self):
+        with TemporaryDirectory() as tdir:
+            rtable = self.mktable(tdir, '1604 192.0.2.1\n')
+            with open(rtable.fname, 'w') as f:
+                f.write('1604 192.0.2.2\n1605 192.0.2.3\n')
+            self.assertEqual(rtable.reload(), 2)
+            self.assertEqual(self.hosts(rtable, '1604'), ['192.0.2.2'])
+            # Broken table does not replace the working one
+            for bad in ('1604\n', '1606 192.0.2.5\n', \
+              '1604 src=300.0.0.0/8 192.0.2.1\n', '1604 192.0.2.1;expires=x\n'):
+                with open(rtable.fname, 'w') as f:
+                    f.write('1606 192.0.2.4\n' + bad)
+                with self.assertRaises(ValueError) as cm:
+                    rtable.reload()
+                self.assertIn('routes:2:', str(cm.exception))
+                self.assertEqual(self.hosts(rtable, '1605'), ['192.0.2.3'])
+                self.assertIsNone(rtable.match('1606'))
+            os.unlink(rtable.fname)
+            with self.assertRaises(OSError):
+                rtable.reload()
+            self.assertEqual(self.hosts(rtable, '1604'), ['192.0.2.2'])
+            self.assertEqual(rtable.stats()['reloads'], 1)
+            self.assertEqual(rtable.stats()['reload_errors'], 5)
+
+    def test_cli_reload(self):
+        with TemporaryDirectory() as tdir:
+            rtable = self.mktable(tdir, '1604 192.0.2.1\n')
+            api = B2BSimpleAPI.__new__(B2BSimpleAPI)
+            api.global_config = {'_route_table':rtable, '_sip_logger':FakeLogger()}
+            api.reloading = {}
+            clim = FakeCLI()
+            def reload():
+                api.tableCommand(clim, 'rt', ['reload'], '_route_table', 'routing table')
+            with open(rtable.fname, 'w') as f:
+                f.write('1604 192.0.2.2\n1605 192.0.2.3\n')
+            reload()
+            # Only one reload at a time, the table is swapped on the main
+            # thread once the new one is built
+            reload()
+            self.assertEqual(clim.replies, ['OK: reloading\n', \
+              'ERROR: routing table reload is already in progress\n'])
+            ED2.loop(5.0)
+            self.assertEqual(api.global_config['_sip_logger'].records, \
+              ['routing table reloaded: 2 entries'])
+            self.assertEqual(self.hosts(rtable, '1604'), ['192.0.2.2'])
+            with open(rtable.fname, 'w') as f:
+                f.write('1604\n')
+            reload()
+            ED2.loop(5.0)
+            self.assertIn('reload failed, keeping the old one', \
+              api.global_config['_sip_logger'].records[-1])
+            self.assertEqual(self.hosts(rtable, '1604'), ['192.0.2.2'])
+            self.assertEqual((rtable.stats()['reloads'], rtable.stats()['reload_errors']), (1, 1))
+            self.assertEqual(api.reloading, {})
+
+    @unittest.skipUnless('SIPPY_ROUTETABLE_NPREFIXES' in os.environ, \
+      'benchmark, set SIPPY_ROUTETABLE_NPREFIXES (e.g. 1000000) to run')
+    def test_speed(self):
+        # Lookups per second against a table of random CLD prefixes
+        nprefixes = int(os.environ['SIPPY_ROUTETABLE_NPREFIXES'])
+        nlookups = int(os.environ.get('SIPPY_ROUTETABLE_NLOOKUPS', '200000'))
+        rnd = Random(1)
+        routes = ['192.0.2.%d:5060;credit-time=3600' % (x + 1) for x in range(16)]
+        with TemporaryDirectory() as tdir:
+            fname = os.path.join(tdir, 'routes')
+            with open(fname, 'w') as f:
+                f.write('* %s\n' % routes[0])
+                for i in range(nprefixes):
+                    f.write('%d %s\n' % (rnd.randrange(10 ** 3, 10 ** 10) + i * 10 ** 10, \
+                      routes[i % len(routes)]))
+            start = perf_counter()
+            rtable = B2BRouteTable(fname)
+            load_time = perf_counter() - start
+        clds = ['%d' % rnd.randrange(10 ** 19) for i in range(nlookups)]
+        match = rtable.match
+        start = perf_counter()
+        for cld in clds:
+            match(cld)
+        rate = nlookups / (perf_counter() - start)
+        print('B2BRouteTable: %d prefixes loaded in %.2f sec, %.0f lookups/sec' % \
+          (rtable.stats()['rules'], load_time, rate))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+from json import loads
+from tempfile import mkdtemp
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Metrics import MetricsRegistry
+from sippy.MyConfigParser import MyConfigParser
+from sippy.Time.MonoTime import MonoTime
+from sippy.Time.Timeout import Timeout
+from sippy.B2B.SetupTrace import B2BSetupTracer
+
+class TestB2BSetupTrace(unittest.TestCase):
+    def mktrace(self, tracer, id, offsets):
+        t0 = MonoTime()
+        trace = tracer.start(id, 'cid%d' % id, t0)
+        trace.cli, trace.cld = '1', '2'
+        for stage, offset in offsets:
+            trace.mark(stage, t0.getOffsetCopy(offset))
+        return trace
+
+    def test_trace(self):
+        metrics = MetricsRegistry()
+        tracer = B2BSetupTracer(keep = 2, metrics = metrics)
+        trace = self.mktrace(tracer, 1, (('accepted', 0.001), ('aaa', 0.011), \
+          ('originate', 0.012), ('100', 0.02), ('18x', 0.5), ('18x', 0.7), \
+          ('200', 2.5)))
+        spans = trace.spans()
+        self.assertEqual([x[0] for x in spans], ['invite', 'accepted', 'aaa', \
+          'originate', '100', '18x', '18x', '200'])
+        self.assertAlmostEqual(spans[2][1], 0.01, places = 6)
+        self.assertAlmostEqual(spans[-1][1], 1.8, places = 6)
+        self.assertAlmostEqual(spans[-1][2], 2.5, places = 6)
+        tracer.finish(trace, 200)
+        # Marks after the call is done and second finish are ignored
+        trace.mark('200')
+        tracer.finish(trace, 487)
+        self.assertEqual(trace.result, 200)
+        self.assertEqual(len(trace.marks), 8)
+        m_18x = tracer.m_stages.labels('18x')
+        self.assertEqual(m_18x.count, 1)
+        self.assertAlmostEqual(m_18x.sum, 0.48, places = 6)
+        self.assertEqual(tracer.m_stages.labels('200').count, 1)
+        self.assertIn('sippy_call_setup_stage_seconds_bucket{stage="aaa"', metrics.render())
+        for i in (2, 3):
+            tracer.finish(self.mktrace(tracer, i, (('accepted', 0.001),)), 'caller')
+        # Only the last keep traces can be found
+        self.assertEqual(tracer.find('1'), [])
+        self.assertEqual([x.id for x in tracer.find('cid3')], [3])
+        stats = tracer.stats()
+        self.assertEqual((stats['started'], stats['finished'], stats['kept']), (3, 3, 2))
+        self.assertIn('accepted', str(tracer))
+        self.assertIn('cid3', str(tracer.find('3')[0]))
+
+    def test_export(self):
+        tdir = mkdtemp()
+        fname = os.path.join(tdir, 'setup.json')
+        global_config = MyConfigParser()
+        self.assertIsNone(B2BSetupTracer.fromConfig(global_config))
+        global_config.check_and_set('setup_trace_file', fname)
+        global_config.check_and_set('setup_trace_keep', '10')
+        tracer = B2BSetupTracer.fromConfig(global_config)
+        tracer.flush_timer.cancel()
+        tracer.flush_timer = Timeout(tracer.flush, 0.01, -1)
+        for i in range(3):
+            tracer.finish(self.mktrace(tracer, i, (('aaa', 0.1), ('200', 1.0))), 200)
+        Timeout(ED2.breakLoop, 0.1)
+        ED2.loop(1.0)
+        tracer.finish(self.mktrace(tracer, 3, ()), 503)
+        tracer.shutdown()
+        # The writer reports back through the event loop
+        Timeout(ED2.breakLoop, 0.01)
+        ED2.loop(1.0)
+        with open(fname) as f:
+            records = [loads(x) for x in f]
+        self.assertEqual([x['id'] for x in records], [0, 1, 2, 3])
+        self.assertEqual(records[0]['marks'], [['invite', 0.0], ['aaa', 0.1], ['200', 1.0]])
+        self.assertEqual((records[3]['result'], records[3]['cld']), (503, '2'))
+        self.assertEqual(tracer.stats()['written'], 4)
+        dname = os.path.join(tdir, 'dump.json')
+        self.assertEqual(tracer.dump(dname), 4)
+        with open(dname) as f:
+            self.assertEqual(len(f.readlines()), 4)
+        os.unlink(fname)
+        os.unlink(dname)
+        os.rmdir(tdir)
+
+    def test_write_error(self):
+        tracer = B2BSetupTracer(fname = '/nonexistent/setup.json')
+        tracer.finish(self.mktrace(tracer, 0, ()), 200)
+        tracer.shutdown()
+        Timeout(ED2.breakLoop, 0.01)
+        ED2.loop(1.0)
+        self.assertEqual((tracer.stats()['written'], tracer.stats()['write_errors']), (0, 1))
+
+if __name__ == '__main__':
+    unittest.main()
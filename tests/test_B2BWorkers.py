@@ -0,0 +1,90 @@
+import unittest
+import socket
+from hashlib import md5
+from pickle import loads
+
+from sippy.B2B.Workers import B2BWorker, call_id_owner, raw_call_id, worker_cmdfile
+from sippy.Network_server import Remote_address
+from sippy.SipCallId import SipCallId, gen_test_cid
+from sippy.Time.MonoTime import MonoTime
+
+_REQ = 'NOTIFY sip:foo@127.0.0.1 SIP/2.0\r\n' \
+  'Via: SIP/2.0/UDP 127.0.0.1:5061;branch=z9hG4bK1\r\n' \
+  'From: <sip:bar@127.0.0.1>;tag=1\r\n' \
+  'To: <sip:foo@127.0.0.1>\r\n' \
+  '%s: %s\r\n' \
+  'CSeq: 1 NOTIFY\r\n' \
+  'Content-Length: 13\r\n\r\n' \
+  'Call-ID: body'
+
+class FakeL4R():
+    def __init__(self, userv): self.cache_l2s = {('0.0.0.0', 5060): userv}
+    def getServer(self, address): raise AssertionError('should not be called')
+
+class FakeSTM():
+    def __init__(self, userv): self.l4r = FakeL4R(userv)
+
+class TestB2BWorkers(unittest.TestCase):
+
+    def test_raw_call_id(self):
+        for name in ('Call-ID', 'call-id', 'i'):
+            with self.subTest(name=name):
+                data = (_REQ % (name, 'abc@1.2.3.4')).encode()
+                self.assertEqual(raw_call_id(data), 'abc@1.2.3.4')
+        self.assertIsNone(raw_call_id(b'SIP/2.0 200 OK\r\n\r\nCall-ID: body'))
+
+    def test_call_id_owner(self):
+        nworkers = 7
+        for i in range(1000):
+            cid = gen_test_cid() if i % 2 else str(SipCallId())
+            owner = call_id_owner(cid, nworkers)
+            self.assertTrue(0 <= owner < nworkers)
+            # Egress legs have to map to the ingress leg owner
+            self.assertEqual(call_id_owner(cid + '-b2b_1', nworkers), owner)
+            self.assertEqual(call_id_owner(cid + '-b2b_1-b2b_3', nworkers), owner)
+            hidden = md5(cid.encode()).hexdigest() + ('.w%d' % owner) + '-b2b_1'
+            self.assertEqual(call_id_owner(hidden, nworkers), owner)
+        self.assertEqual(call_id_owner('foo.w9', 7), call_id_owner('foo.w9', 7))
+
+    def test_worker_cmdfile(self):
+        self.assertEqual(worker_cmdfile('/var/run/b2bua.sock', 1), '/var/run/b2bua.sock.1')
+        self.assertEqual(worker_cmdfile('tcp:127.0.0.1', 0), 'tcp:127.0.0.1:12346')
+        self.assertEqual(worker_cmdfile('tcp:127.0.0.1:5000', 2), 'tcp:127.0.0.1:5003')
+
+    def test_forward(self):
+        nworkers = 3
+        socks = [socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM) for i in range(nworkers)]
+        wsocks = [w for r, w in socks]
+        userv = object()
+        workers = [B2BWorker(wid, socks[wid][0], wsocks) for wid in range(nworkers)]
+        for w in workers:
+            w.stm = FakeSTM(userv)
+        ra = Remote_address(('127.0.0.1', 5061), 'udp')
+        rtime = MonoTime()
+        nfwd = 0
+        for i in range(30):
+            cid = gen_test_cid()
+            owner = call_id_owner(cid, nworkers)
+            data = (_REQ % ('Call-ID', cid)).encode()
+            for w in workers:
+                fwd = w.forward(data, ra, userv, rtime)
+                self.assertEqual(fwd, w.wid != owner)
+                if not fwd:
+                    continue
+                nfwd += 1
+                socks[owner][0].settimeout(1.0)
+                msg = socks[owner][0].recv(65536)
+                laddress, address, transport, monot, realt, rdata = loads(msg)
+                self.assertEqual(laddress, ('0.0.0.0', 5060))
+                self.assertEqual(address, ra.address)
+                self.assertEqual(transport, 'udp')
+                self.assertEqual(monot, rtime.monot)
+                self.assertEqual(rdata, data)
+        self.assertEqual(sum(w.stats[1] for w in workers), nfwd)
+        self.assertEqual(sum(w.stats[0] for w in workers), 30)
+        for r, w in socks:
+            r.close()
+            w.close()
+
+if __name__ == '__main__':
+    unittest.main()
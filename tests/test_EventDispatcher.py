@@ -0,0 +1,137 @@
+import os
+import unittest
+from threading import Thread
+from time import monotonic, sleep
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Core.Profiler import EDProfiler, callback_site
+from sippy.Metrics import MetricsRegistry
+from sippy.Time.Timeout import Timeout
+
+class TestEventDispatcherCFT(unittest.TestCase):
+    def test_callFromThread_coalesced(self):
+        nthreads, ncalls = 4, 5000
+        got = {}
+        def cb(tnum, i):
+            got.setdefault(tnum, []).append(i)
+            if sum(len(x) for x in got.values()) == nthreads * ncalls:
+                ED2.breakLoop()
+        def producer(tnum):
+            for i in range(ncalls):
+                ED2.callFromThread(cb, tnum, i)
+        dispatched = ED2.cft_stats.dispatched
+        wakeups = ED2.cft_stats.wakeups
+        producers = [Thread(target = producer, args = (i,)) for i in range(nthreads)]
+        for p in producers:
+            p.start()
+        ED2.loop(10.0)
+        for p in producers:
+            p.join()
+        # Every producer's calls arrive complete and in order
+        for tnum in range(nthreads):
+            self.assertEqual(got[tnum], list(range(ncalls)))
+        stats = ED2.cft_stats.snapshot()
+        self.assertEqual(stats['dispatched'] - dispatched, nthreads * ncalls)
+        self.assertLess(stats['wakeups'] - wakeups, nthreads * ncalls)
+        self.assertEqual(stats['depth'], 0)
+        self.assertGreaterEqual(stats['max_latency'], stats['avg_latency'])
+
+    def test_callFromThreadSync(self):
+        res = []
+        def worker():
+            res.append(ED2.callFromThreadSync(lambda x: x * 2, 21))
+            ED2.callFromThread(ED2.breakLoop)
+        w = Thread(target = worker)
+        w.start()
+        ED2.loop(5.0)
+        w.join()
+        self.assertEqual(res, [42])
+
+def slow_timer():
+    sleep(0.05)
+
+class TestEventDispatcherProfiler(unittest.TestCase):
+    def tearDown(self):
+        EDProfiler.disable()
+
+    def test_profile(self):
+        registry = MetricsRegistry()
+        prof = EDProfiler.enable(registry)
+        self.assertIs(ED2.profiler, prof)
+        self.assertIs(EDProfiler.enable(registry), prof)
+        fast = []
+        def fast_timer():
+            fast.append(1)
+        def from_thread():
+            ED2.callFromThread(fast_timer)
+        Timeout(slow_timer, 0.01)
+        Timeout(fast_timer, 0.01)
+        Timeout(fast_timer, 0.02, 5)
+        Thread(target = from_thread).start()
+        Timeout(ED2.breakLoop, 0.3)
+        ED2.loop()
+        EDProfiler.disable(registry)
+        self.assertIsNone(ED2.profiler)
+        slow = prof.sites[callback_site(slow_timer)]
+        self.assertEqual((slow.kind, slow.count), ('timer', 1))
+        self.assertGreaterEqual(slow.max, 0.05)
+        # Lambdas and bound methods made in the same place are one site
+        mklambda = lambda: (lambda: 1)
+        self.assertEqual(callback_site(mklambda()), callback_site(mklambda()))
+        self.assertEqual(callback_site(self.tearDown), callback_site(TestEventDispatcherProfiler().tearDown))
+        fsite = prof.sites[callback_site(fast_timer)]
+        self.assertEqual(fsite.count, len(fast))
+        self.assertEqual(fsite.count, 7)
+        self.assertEqual(prof.top(1)[0][0], callback_site(slow_timer))
+        # The timers due while the slow one runs are late
+        self.assertGreater(prof.lateness.count, 7)
+        self.assertGreater(prof.lateness.sum, 0.03)
+        self.assertGreater(prof.iteration.count, 0)
+        report = prof.report(3)
+        self.assertIn('slow_timer', report)
+        self.assertIn('timer lateness', report)
+        # Profiling stopped
+        Timeout(slow_timer, 0.01)
+        Timeout(ED2.breakLoop, 0.1)
+        ED2.loop()
+        self.assertEqual(slow.count, 1)
+
+    def test_metrics(self):
+        registry = MetricsRegistry()
+        prof = EDProfiler.enable(registry)
+        Timeout(slow_timer, 0.01)
+        Timeout(ED2.breakLoop, 0.1)
+        ED2.loop()
+        text = registry.render()
+        self.assertIn('# TYPE sippy_ed_timer_lateness_seconds histogram', text)
+        self.assertIn('sippy_ed_iteration_seconds_count', text)
+        self.assertIn('sippy_ed_callback_calls_total{kind="timer",site="slow_timer', text)
+        self.assertIn('sippy_ed_callback_duration_seconds_bucket{kind="timer",site="slow_timer', text)
+        prof.reset()
+        self.assertEqual(len(prof.sites), 0)
+        EDProfiler.disable(registry)
+        self.assertNotIn('sippy_ed_', registry.render())
+
+    def test_overhead(self):
+        ntimers = int(os.environ.get('SIPPY_EDPROF_NTIMERS', '20000'))
+        def run():
+            done = []
+            def cb():
+                done.append(1)
+                if len(done) == ntimers:
+                    ED2.breakLoop()
+            for i in range(ntimers):
+                Timeout(cb, 0.0)
+            start = monotonic()
+            ED2.loop(10)
+            return monotonic() - start
+        plain = run()
+        EDProfiler.enable()
+        profiled = run()
+        EDProfiler.disable()
+        print('EDProfiler: %d timers, %.3f sec plain, %.3f sec profiled' % \
+          (ntimers, plain, profiled))
+        self.assertLess(profiled, plain * 5 + 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+import os
+import unittest
+from threading import Thread
+from time import monotonic, sleep
+from urllib.request import urlopen
+from urllib.error import HTTPError
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.MyConfigParser import MyConfigParser
+from sippy.Metrics import MetricsRegistry, MetricsHTTPServer, EventLoopLagProbe, \
+  parse_metrics_address
+from sippy.Radius_client import Radius_client
+from sippy.Time.Timeout import Timeout
+from tests.test_Radius_client import StubRadiusServer
+
+def parse_exposition(text):
+    # {name: {labels: value}} out of the text format, checks that each
+    # metric has exactly one TYPE line that comes before its samples
+    types = {}
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('# TYPE '):
+            name, mtype = line[7:].split(' ')
+            assert name not in types, name
+            types[name] = mtype
+            continue
+        if line.startswith('#'):
+            continue
+        name, value = line.rsplit(' ', 1)
+        labels = ''
+        if '{' in name:
+            name, labels = name[:-1].split('{', 1)
+        base = name
+        for suffix in ('_bucket', '_sum', '_count'):
+            if name.endswith(suffix) and name[:-len(suffix)] in types:
+                base = name[:-len(suffix)]
+        assert base in types, name
+        samples.setdefault(name, {})[labels] = float(value)
+    return types, samples
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        registry = MetricsRegistry()
+        c = registry.counter('test_requests_total', 'Requests', ('method',))
+        c.labels('INVITE').inc()
+        c.labels('INVITE').inc(2)
+        c.labels('BYE').inc()
+        g = registry.gauge('test_level', 'Level')
+        g.set(1.5)
+        h = registry.histogram('test_latency_seconds', 'Latency', buckets = (0.1, 1.0))
+        for v in (0.05, 0.1, 0.5, 5.0):
+            h.observe(v)
+        # Same object comes back on repeated registration
+        self.assertIs(registry.counter('test_requests_total', 'Requests', ('method',)), c)
+        self.assertRaises(ValueError, registry.gauge, 'test_requests_total', 'Requests')
+        stats = {'hits':3, 'entries':7, 'name':'foo'}
+        registry.register_stats('test_cache', lambda: stats, ('hits',), (('cache', 'a"b'),), 'a')
+        registry.register_stats('test_cache', lambda: stats, ('hits',), (('cache', 'c'),), 'c')
+        types, samples = parse_exposition(registry.render())
+        self.assertEqual(types['test_requests_total'], 'counter')
+        self.assertEqual(samples['test_requests_total'], {'method="INVITE"':3, 'method="BYE"':1})
+        self.assertEqual(samples['test_level'], {'':1.5})
+        self.assertEqual(types['test_latency_seconds'], 'histogram')
+        self.assertEqual(samples['test_latency_seconds_bucket'], \
+          {'le="0.1"':2, 'le="1.0"':3, 'le="+Inf"':4})
+        self.assertEqual(samples['test_latency_seconds_count'], {'':4})
+        self.assertAlmostEqual(samples['test_latency_seconds_sum'][''], 5.65)
+        # Two collectors, one metric
+        self.assertEqual(types['test_cache_hits_total'], 'counter')
+        self.assertEqual(samples['test_cache_hits_total'], {'cache="a\\"b"':3, 'cache="c"':3})
+        self.assertEqual(types['test_cache_entries'], 'gauge')
+        self.assertNotIn('test_cache_name', types)
+        registry.unregister('c')
+        types, samples = parse_exposition(registry.render())
+        self.assertEqual(samples['test_cache_hits_total'], {'cache="a\\"b"':3})
+
+    def test_address(self):
+        self.assertEqual(parse_metrics_address('9100'), ('127.0.0.1', 9100))
+        self.assertEqual(parse_metrics_address('0.0.0.0:9100'), ('0.0.0.0', 9100))
+        self.assertEqual(parse_metrics_address('[::1]:9100'), ('::1', 9100))
+        global_config = MyConfigParser()
+        self.assertRaises(ValueError, global_config.check_and_set, 'metrics_http', 'foo:bar')
+        self.assertRaises(ValueError, global_config.check_and_set, 'metrics_http', '70000')
+
+    def test_lag(self):
+        registry = MetricsRegistry()
+        probe = EventLoopLagProbe(registry, 0.01)
+        def stall():
+            sleep(0.2)
+        Timeout(stall, 0.05)
+        Timeout(ED2.breakLoop, 0.4)
+        ED2.loop()
+        probe.shutdown()
+        types, samples = parse_exposition(registry.render())
+        self.assertGreater(samples['sippy_event_loop_lag_seconds_count'][''], 5)
+        self.assertGreaterEqual(samples['sippy_event_loop_lag_max_seconds'][''], 0.15)
+        self.assertEqual(samples['sippy_event_loop_lag_seconds_bucket']['le="0.1"'] + 1, \
+          samples['sippy_event_loop_lag_seconds_bucket']['le="0.25"'])
+        # Maximum is since the last scrape
+        types, samples = parse_exposition(registry.render())
+        self.assertEqual(samples['sippy_event_loop_lag_max_seconds'][''], 0.0)
+
+    def test_http(self):
+        registry = MetricsRegistry.fromConfig({'metrics_http':'127.0.0.1:0'})
+        registry.counter('test_scrapes_total', 'Scrapes').inc()
+        url = 'http://127.0.0.1:%d' % registry.httpd.address[1]
+        results = []
+        def scrape():
+            try:
+                for path in ('/metrics', '/'):
+                    with urlopen(url + path, timeout = 5) as r:
+                        results.append((r.status, r.headers['Content-Type'], r.read().decode()))
+                try:
+                    urlopen(url + '/foo', timeout = 5)
+                except HTTPError as e:
+                    results.append(e.code)
+            finally:
+                ED2.callFromThread(ED2.breakLoop)
+        Thread(target = scrape, daemon = True).start()
+        ED2.loop(10)
+        registry.shutdown()
+        self.assertEqual(len(results), 3)
+        status, ctype, body = results[0]
+        self.assertEqual(status, 200)
+        self.assertTrue(ctype.startswith('text/plain; version=0.0.4'))
+        types, samples = parse_exposition(body)
+        self.assertEqual(samples['test_scrapes_total'], {'':1})
+        self.assertIn('sippy_cft_queue_depth', types)
+        self.assertEqual(parse_exposition(results[1][2])[1]['test_scrapes_total'], {'':1})
+        self.assertEqual(results[2], 404)
+
+    def test_radius(self):
+        stub = StubRadiusServer()
+        global_config = MyConfigParser()
+        global_config.check_and_set('radius_auth_servers', stub.spec)
+        global_config['_metrics'] = registry = MetricsRegistry()
+        rc = Radius_client(global_config)
+        results = []
+        def gotresult(result):
+            results.append(result)
+            if len(results) == 3:
+                ED2.breakLoop()
+        for i in range(3):
+            rc.do_auth((('User-Name', 'accept'), ('Password', 'cisco')), gotresult)
+        ED2.loop(5)
+        rc.shutdown()
+        stub.close()
+        types, samples = parse_exposition(registry.render())
+        self.assertEqual(samples['sippy_radius_latency_seconds_count'], {'client="main",type="auth"':3})
+        self.assertEqual(samples['sippy_radius_accepts_total'], {'client="main"':3})
+
+    def test_speed(self):
+        # Cost of the instrumentation on the hot path
+        iterations = int(os.environ.get('SIPPY_METRICS_ITERATIONS', '200000'))
+        registry = MetricsRegistry()
+        c = registry.counter('test_states_total', 'States', ('role', 'state'))
+        h = registry.histogram('test_latency_seconds', 'Latency')
+        start = monotonic()
+        for i in range(iterations):
+            c.labels('server', 'TRYING').inc()
+            h.observe(0.003)
+        rate = iterations / (monotonic() - start)
+        start = monotonic()
+        for i in range(100):
+            registry.render()
+        render_time = (monotonic() - start) / 100
+        print('Metrics: %.0f updates/sec, %.6f sec/scrape' % (rate, render_time))
+        self.assertGreater(rate, 10000)
+
+if __name__ == '__main__':
+    unittest.main()
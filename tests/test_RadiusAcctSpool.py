@@ -0,0 +1,133 @@
+import os
+import unittest
+from json import loads
+from tempfile import TemporaryDirectory
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.MyConfigParser import MyConfigParser
+from sippy.RadiusAcctSpool import RadiusAcctSpool
+from sippy.Radius_client import Radius_client, RC_OK, RC_ERROR
+from sippy.Time.Timeout import Timeout
+from tests.test_Radius_client import StubRadiusServer
+
+def stop_record(i):
+    return (('User-Name', 'foo'), ('Acct-Status-Type', 'Stop'), ('Acct-Session-Id', 'call%d' % i), \
+      ('Acct-Session-Time', i), ('h323-disconnect-cause', '10'))
+
+class TestRadiusAcctSpool(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'acct.spool')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def mkspool(self, stub, **kwargs):
+        global_config = MyConfigParser()
+        global_config.check_and_set('radius_acct_servers', stub.spec)
+        global_config.check_and_set('radius_retries', '1')
+        for k, v in kwargs.items():
+            global_config.check_and_set(k, str(v))
+        rclient = Radius_client(global_config)
+        rclient.timeout = 0.1
+        spool = RadiusAcctSpool(global_config, self.path, rclient)
+        spool.backoff_min = 0.1
+        return spool
+
+    def pending(self):
+        records = {}
+        for line in open(self.path):
+            entry = loads(line)
+            if 's' in entry:
+                records[entry['s']] = entry['a']
+            else:
+                del records[entry['k']]
+        return records
+
+    def test_spool(self):
+        stub = StubRadiusServer()
+        spool = self.mkspool(stub)
+        results = []
+        def gotresult(result, i):
+            results.append((i, result))
+            if len(results) == 10:
+                ED2.breakLoop()
+        for i in range(10):
+            spool.do_acct(stop_record(i), gotresult, i)
+        ED2.loop(5.0)
+        spool.shutdown()
+        stub.close()
+        self.assertEqual(sorted(results), [(i, ((), RC_OK)) for i in range(10)])
+        self.assertEqual(len(stub.requests), 10)
+        self.assertEqual(self.pending(), {})
+        # Records that cannot be encoded are not spooled
+        spool = self.mkspool(stub)
+        spool.do_acct((('No-Such-Attribute', 'foo'),), lambda r: (results.append(r), ED2.breakLoop()))
+        ED2.loop(1.0)
+        spool.shutdown()
+        self.assertEqual(results[-1], ((), RC_ERROR))
+        self.assertEqual(os.path.getsize(self.path), 0)
+
+    def test_replay(self):
+        dead = StubRadiusServer(answer = False)
+        spool = self.mkspool(dead, acct_spool_inflight = 4)
+        for i in range(100):
+            spool.do_acct(stop_record(i))
+        ED2.loop(0.5)
+        stats = spool.stats()
+        self.assertLessEqual(stats['inflight'], 4)
+        self.assertGreater(stats['failures'], 0)
+        self.assertEqual(stats['inflight'] + stats['queued'], 100)
+        # Failed records go back to the head of the queue, so it is only
+        # ever the first ones that are being retried
+        sids = set([dead.decode(x)[3][44][0] for x in list(dead.seen.keys())])
+        self.assertLessEqual(sids, set([b'call%d' % i for i in range(4)]))
+        # "Crash": the spool is abandoned with nothing acknowledged and
+        # a partially written line at the end
+        spool.rclient.shutdown()
+        spool.journal.shutdown()
+        with open(self.path, 'a') as f:
+            f.write('{"s": 101, "a": [["User-')
+        dead.close()
+        stub = StubRadiusServer()
+        spool = self.mkspool(stub)
+        self.assertEqual(spool.stats()['replayed'], 100)
+        def check():
+            if spool.stats()['queued'] + spool.stats()['inflight'] == 0:
+                ED2.breakLoop()
+        timer = Timeout(check, 0.05, -1)
+        ED2.loop(5.0)
+        timer.cancel()
+        spool.shutdown()
+        stub.close()
+        sids = sorted([int(x[1][44][0][4:]) for x in stub.requests])
+        self.assertEqual(sids, list(range(100)))
+        self.assertEqual(self.pending(), {})
+
+    def test_auth_not_starved(self):
+        # A pile of accounting records against slow/dead accounting
+        # servers should not hold up the authorisation
+        dead = StubRadiusServer(answer = False)
+        auth = StubRadiusServer()
+        spool = self.mkspool(dead)
+        global_config = MyConfigParser()
+        global_config.check_and_set('radius_auth_servers', auth.spec)
+        aclient = Radius_client(global_config)
+        for i in range(5000):
+            spool.do_acct(stop_record(i))
+        results = []
+        def gotresult(result):
+            results.append(result)
+            ED2.breakLoop()
+        aclient.do_auth((('User-Name', 'accept'), ('Password', 'cisco')), gotresult)
+        ED2.loop(2.0)
+        self.assertEqual(results[0][1], RC_OK)
+        self.assertEqual(spool.stats()['inflight'] + spool.stats()['queued'], 5000)
+        aclient.shutdown()
+        spool.shutdown()
+        auth.close()
+        dead.close()
+        self.assertEqual(len(self.pending()), 5000)
+
+if __name__ == '__main__':
+    unittest.main()
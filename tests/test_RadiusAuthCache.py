@@ -0,0 +1,132 @@
+import unittest
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.MyConfigParser import MyConfigParser
+from sippy.RadiusAuthorisation import RadiusAuthorisation
+from sippy.RadiusAuthCache import RadiusAuthCache, auth_cache_key_f
+from sippy.Radius_client import RC_OK, RC_REJECT, RC_ERROR
+
+from tests.test_Radius_client import StubRadiusServer
+
+class NullLogger(object):
+    def write(self, *args, **kwargs):
+        pass
+
+class TestRadiusAuthCache(unittest.TestCase):
+    def mkcache(self, stub, rtimeout = 1.0, **kwargs):
+        global_config = MyConfigParser()
+        global_config.check_and_set('radius_auth_servers', stub.spec)
+        global_config.check_and_set('radius_retries', '1')
+        global_config['_sip_logger'] = NullLogger()
+        rc = RadiusAuthorisation(global_config)
+        rc.timeout = rtimeout
+        return RadiusAuthCache(global_config, rc, **kwargs)
+
+    def run_auths(self, cache, requests, timeout = 5.0, cancel = ()):
+        # requests: (remote_ip, cli, cld) tuples, all sent at once
+        results = {}
+        def gotresult(result, i):
+            results[i] = result
+            if len(results) == len(requests) - len(cancel):
+                ED2.breakLoop()
+        handles = []
+        for i, (remote_ip, cli, cld) in enumerate(requests):
+            handles.append(cache.do_auth(remote_ip, cli, cld, 'cid%d' % i, remote_ip, \
+              lambda r, i = i: gotresult(r, i)))
+        for i in cancel:
+            handles[i].cancel()
+        if len(results) < len(requests) - len(cancel):
+            ED2.loop(timeout)
+        return results
+
+    def nauths(self, stub):
+        return len([x for x in stub.requests if x[0] == 1])
+
+    def test_cache(self):
+        stub = StubRadiusServer()
+        cache = self.mkcache(stub, neg_ttl = 60)
+        # Same key in flight is sent once
+        results = self.run_auths(cache, (('accept', '1', '2'),) * 3 + (('reject', '1', '2'),) * 2)
+        self.assertEqual([results[i][1] for i in range(5)], [RC_OK] * 3 + [RC_REJECT] * 2)
+        self.assertEqual(results[0][0], results[2][0])
+        self.assertEqual(self.nauths(stub), 2)
+        # Both answers come from the cache now
+        results = self.run_auths(cache, (('accept', '1', '2'), ('reject', '1', '2')))
+        self.assertEqual((results[0][1], results[1][1]), (RC_OK, RC_REJECT))
+        self.assertEqual(self.nauths(stub), 2)
+        # Different CLD is a different key
+        results = self.run_auths(cache, (('accept', '1', '3'),))
+        self.assertEqual(self.nauths(stub), 3)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['neg_hits'], stats['misses'], stats['coalesced']), \
+          (1, 1, 3, 3))
+        self.assertEqual(stats['entries'], 3)
+        self.assertEqual(stats['inflight'], 0)
+        cache.rclient.shutdown()
+        stub.close()
+
+    def test_no_neg_cache(self):
+        stub = StubRadiusServer()
+        cache = self.mkcache(stub, max_entries = 1)
+        for i in range(2):
+            results = self.run_auths(cache, (('reject', None, '2'),))
+            self.assertEqual(results[0][1], RC_REJECT)
+        self.assertEqual(self.nauths(stub), 2)
+        self.run_auths(cache, (('accept', '1', '2'), ('accept', '1', '3')))
+        self.run_auths(cache, (('accept', '1', '2'),))
+        self.assertEqual(self.nauths(stub), 5)
+        self.assertEqual(cache.stats()['evictions'], 2)
+        cache.rclient.shutdown()
+        stub.close()
+
+    def test_errors(self):
+        dead = StubRadiusServer(answer = False)
+        cache = self.mkcache(dead, rtimeout = 0.2)
+        results = self.run_auths(cache, (('accept', '1', '2'),) * 2)
+        self.assertEqual((results[0][1], results[1][1]), (RC_ERROR, RC_ERROR))
+        self.assertEqual(cache.stats()['entries'], 0)
+        cache.rclient.shutdown()
+        dead.close()
+
+    def test_cancel(self):
+        stub = StubRadiusServer()
+        cache = self.mkcache(stub)
+        # The request carries on for the ones that are still waiting
+        results = self.run_auths(cache, (('accept', '1', '2'),) * 3, cancel = (0, 2))
+        self.assertEqual(list(results.keys()), [1])
+        self.assertEqual(results[1][1], RC_OK)
+        self.assertEqual(cache.stats()['entries'], 1)
+        # Nobody waiting, the request is cancelled
+        results = self.run_auths(cache, (('accept', '1', '3'),) * 2, cancel = (0, 1))
+        self.assertEqual(cache.stats()['inflight'], 0)
+        ED2.loop(0.5)
+        self.assertEqual(cache.stats()['entries'], 1)
+        cache.rclient.shutdown()
+        stub.close()
+
+    def test_key(self):
+        key_f = auth_cache_key_f('ip,cld:4')
+        self.assertEqual(key_f('1.2.3.4', '555', '16045551234'), ('1.2.3.4', '1604'))
+        self.assertEqual(key_f('1.2.3.4', '555', None), ('1.2.3.4', None))
+        self.assertEqual(auth_cache_key_f('cli:2, cld')('1.2.3.4', '555', '1604'), ('55', '1604'))
+        for bad in ('ip:3', 'cld:0', 'cld:x', 'foo', ''):
+            with self.assertRaises(ValueError):
+                auth_cache_key_f(bad)
+        stub = StubRadiusServer()
+        cache = self.mkcache(stub, key = 'ip,cld:4')
+        self.run_auths(cache, (('accept', '1', '16041111'),))
+        self.run_auths(cache, (('accept', '2', '16042222'),))
+        self.assertEqual(self.nauths(stub), 1)
+        cache.rclient.shutdown()
+        stub.close()
+        # Digest requests are passed through as is
+        passed = []
+        cache.rclient.do_auth = lambda *args: passed.append(args)
+        cache.do_auth('alice', '1', '16041111', 'cid', '1.2.3.4', None, \
+          'example.com', 'nonce', 'sip:1604@example.com', 'response')
+        self.assertEqual(len(passed), 1)
+        self.assertEqual(passed[0][6:10], ('example.com', 'nonce', 'sip:1604@example.com', 'response'))
+        self.assertEqual(cache.stats()['misses'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+import unittest
+
+from sippy.RadiusDictionary import RadiusDictionary
+
+class TestRadiusDictionary(unittest.TestCase):
+    def load(self, text):
+        fd, path = tempfile.mkstemp()
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        try:
+            return RadiusDictionary(path)
+        finally:
+            os.unlink(path)
+
+    def test_default(self):
+        d = RadiusDictionary()
+        attr = d.getAttr('h323-credit-time')
+        self.assertEqual((attr.vendor, attr.code, attr.type), (9, 102, 'string'))
+        self.assertEqual(d.getAttrByCode(1, 9).name, 'Cisco-AVPair')
+
+    def test_flags(self):
+        d = self.load('VENDOR Cisco 9\n' \
+          'ATTRIBUTE User-Password 2 string encrypt=1\n' \
+          'ATTRIBUTE Tunnel-Password 69 string has_tag,encrypt=2\n' \
+          'ATTRIBUTE Cisco-AVPair 1 string Cisco\n' \
+          'BEGIN-VENDOR Cisco\n' \
+          'ATTRIBUTE h323-remote-address 23 string has_tag\n' \
+          'END-VENDOR Cisco\n')
+        self.assertEqual(d.getAttr('user-password').vendor, 0)
+        self.assertEqual(d.getAttr('tunnel-password').code, 69)
+        self.assertEqual(d.getAttr('cisco-avpair').vendor, 9)
+        self.assertEqual(d.getAttr('h323-remote-address').vendor, 9)
+        # Neither the vendor, nor the flags
+        self.assertRaises(ValueError, self.load, 'ATTRIBUTE Foo 1 string NoSuchVendor\n')
+
+if __name__ == '__main__':
+    unittest.main()
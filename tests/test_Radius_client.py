@@ -0,0 +1,236 @@
+import os
+import socket
+import unittest
+from hashlib import md5
+from struct import pack, unpack_from
+from threading import Thread
+from time import monotonic
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.MyConfigParser import MyConfigParser
+from sippy.Radius_client import Radius_client, RC_OK, RC_REJECT, RC_ERROR
+
+SECRET = b'testing123'
+
+def cisco_vsa(code, value):
+    value = value.encode()
+    return pack('!BBIBB', 26, len(value) + 8, 9, code, len(value) + 2) + value
+
+class StubRadiusServer(object):
+    # Answers Access-Requests from "accept" user with Access-Accept that
+    # carries h323-credit-time and Cisco-AVPair, anything else with
+    # Access-Reject; Accounting-Requests get Accounting-Response. The
+    # first ndrop copies of each request are ignored.
+    def __init__(self, ndrop = 0, answer = True, secret = SECRET, family = socket.AF_INET):
+        self.ndrop = ndrop
+        self.answer = answer
+        self.secret = secret
+        self.seen = {}
+        self.requests = []
+        self.s = socket.socket(family, socket.SOCK_DGRAM)
+        if family == socket.AF_INET6:
+            self.s.bind(('::1', 0))
+            host = '[::1]'
+        else:
+            self.s.bind(('127.0.0.1', 0))
+            host = '127.0.0.1'
+        self.address = self.s.getsockname()
+        self.spec = '%s:%d:%s' % (host, self.address[1], secret.decode())
+        Thread(target = self.run, daemon = True).start()
+
+    def decode(self, data):
+        code, id, length = unpack_from('!BBH', data)
+        authenticator = data[4:20]
+        avps = {}
+        i = 20
+        while i < length:
+            t, l = data[i], data[i + 1]
+            avps.setdefault(t, []).append(data[i + 2:i + l])
+            i += l
+        return code, id, authenticator, avps
+
+    def reply(self, code, id, authenticator, avps):
+        body = b''.join(avps)
+        header = pack('!BBH', code, id, 20 + len(body))
+        rauth = md5(header + authenticator + body + self.secret).digest()
+        return header + rauth + body
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.s.recvfrom(4096)
+            except OSError:
+                break
+            code, id, authenticator, avps = self.decode(data)
+            n = self.seen.get(data, 0)
+            self.seen[data] = n + 1
+            if not self.answer or n < self.ndrop:
+                continue
+            self.requests.append((code, avps))
+            if code == 4:
+                body = data[20:]
+                if md5(data[:4] + b'\x00' * 16 + body + self.secret).digest() != authenticator:
+                    continue
+                self.s.sendto(self.reply(5, id, authenticator, ()), address)
+                continue
+            # User-Password, RFC 2865 section 5.2
+            cpw = avps[2][0]
+            b = md5(self.secret + authenticator).digest()
+            password = bytes([x ^ y for x, y in zip(cpw[:16], b)]).rstrip(b'\x00')
+            if avps[1][0] == b'accept' and password == b'cisco':
+                ravps = (cisco_vsa(102, 'h323-credit-time=60'), cisco_vsa(1, 'foo=bar'), \
+                  pack('!BBI', 27, 6, 3600))
+                self.s.sendto(self.reply(2, id, authenticator, ravps), address)
+            else:
+                self.s.sendto(self.reply(3, id, authenticator, ()), address)
+
+    def close(self):
+        self.s.close()
+
+class TestRadiusClient(unittest.TestCase):
+    def mkclient(self, auth_servers, acct_servers = (), **kwargs):
+        global_config = MyConfigParser()
+        global_config.check_and_set('radius_auth_servers', ','.join([x.spec for x in auth_servers]))
+        if len(acct_servers) > 0:
+            global_config.check_and_set('radius_acct_servers', ','.join([x.spec for x in acct_servers]))
+        for k, v in kwargs.items():
+            global_config.check_and_set(k, str(v))
+        rc = Radius_client(global_config)
+        # Sub-second timeouts, so that the tests do not take forever
+        rc.timeout = 0.2
+        return rc
+
+    def run_requests(self, rc, requests, timeout = 5.0):
+        results = {}
+        def gotresult(result, i):
+            results[i] = result
+            if len(results) == len(requests):
+                ED2.breakLoop()
+        for i, (method, attributes) in enumerate(requests):
+            method(attributes, gotresult, i)
+        ED2.loop(timeout)
+        return results
+
+    def test_auth(self):
+        stub = StubRadiusServer()
+        rc = self.mkclient((stub,))
+        results = self.run_requests(rc, ( \
+          (rc.do_auth, (('User-Name', 'accept'), ('Password', 'cisco'), ('Calling-Station-Id', '123'), \
+            ('call-id', 'abc@1.2.3.4'), ('h323-remote-address', '1.2.3.4'))), \
+          (rc.do_auth, (('User-Name', 'reject'), ('Password', 'cisco'))), \
+          (rc.do_auth, (('User-Name', 'accept'), ('Password', 'cisco'), ('Digest-Realm', 'example.com'))), \
+        ))
+        rc.shutdown()
+        stub.close()
+        self.assertEqual(results[0], ((('h323-credit-time', '60'), ('foo', 'bar'), ('Session-Timeout', '3600')), RC_OK))
+        self.assertEqual(results[1], ((), RC_REJECT))
+        self.assertEqual(results[2][1], RC_OK)
+        # Retransmits are possible under load, go by the content
+        avps = [x[1] for x in stub.requests if 26 in x[1]][0]
+        self.assertIn(b'call-id=abc@1.2.3.4', avps[26][0])
+        self.assertIn(b'h323-remote-address=1.2.3.4', avps[26][1])
+        # NAS-IP-Address is added automatically
+        self.assertEqual(avps[4], [socket.inet_aton('127.0.0.1')])
+        # Digest-* go as sub-attributes of Digest-Attributes
+        self.assertIn([b'\x01\x0dexample.com'], [x[1].get(207, None) for x in stub.requests])
+        self.assertEqual(rc.stats()['inflight'], 0)
+
+    def test_acct(self):
+        stub = StubRadiusServer()
+        rc = self.mkclient((), (stub,))
+        results = self.run_requests(rc, ((rc.do_acct, (('User-Name', 'foo'), ('Acct-Status-Type', 'Stop'), \
+          ('Acct-Session-Time', '10'), ('h323-disconnect-cause', '10'))),))
+        rc.shutdown()
+        stub.close()
+        self.assertEqual(results[0], ((), RC_OK))
+        self.assertEqual(stub.requests[0][1][40], [pack('!I', 2)])
+        self.assertEqual(stub.requests[0][1][46], [pack('!I', 10)])
+
+    @unittest.skipUnless(socket.has_ipv6, 'IPv6 is not supported')
+    def test_ipv6(self):
+        try:
+            stub6 = StubRadiusServer(family = socket.AF_INET6)
+        except OSError:
+            self.skipTest('IPv6 loopback is not available')
+        stub = StubRadiusServer()
+        rc = self.mkclient((stub6,), (stub6, stub))
+        results = self.run_requests(rc, ((rc.do_auth, (('User-Name', 'accept'), ('Password', 'cisco'))), \
+          (rc.do_acct, (('User-Name', 'foo'), ('Acct-Status-Type', 'Start')))))
+        self.assertEqual(results[0][1], RC_OK)
+        self.assertEqual(results[1], ((), RC_OK))
+        # NAS-IPv6-Address instead of the NAS-IP-Address
+        self.assertEqual(stub6.requests[0][1][95], [socket.inet_pton(socket.AF_INET6, '::1')])
+        self.assertNotIn(4, stub6.requests[0][1])
+        # Failover to the server of the other address family uses the same
+        # request ID space, with a separate socket
+        stub6.close()
+        results = self.run_requests(rc, ((rc.do_acct, (('User-Name', 'foo'), ('Acct-Status-Type', 'Stop'))),))
+        self.assertEqual(results[0], ((), RC_OK))
+        self.assertEqual(stub.requests[-1][1][4], [socket.inet_aton('127.0.0.1')])
+        self.assertEqual(rc.stats()['sockets'], 1)
+        rc.shutdown()
+        stub.close()
+
+    def test_retransmit_failover(self):
+        lossy = StubRadiusServer(ndrop = 1)
+        dead = StubRadiusServer(answer = False)
+        backup = StubRadiusServer()
+        rc = self.mkclient((lossy,), (dead, backup), radius_retries = 2)
+        results = self.run_requests(rc, ((rc.do_auth, (('User-Name', 'accept'), ('Password', 'cisco'))), \
+          (rc.do_acct, (('User-Name', 'foo'), ('Acct-Status-Type', 'Start')))))
+        self.assertEqual(results[0][1], RC_OK)
+        self.assertEqual(results[1], ((), RC_OK))
+        self.assertEqual(len(dead.seen), 1)
+        self.assertEqual(list(dead.seen.values()), [2])
+        stats = rc.stats()
+        self.assertEqual((stats['retransmits'], stats['failovers'], stats['timeouts']), (2, 1, 0))
+        # The server that has failed is skipped for a while
+        results = self.run_requests(rc, ((rc.do_acct, (('User-Name', 'foo'), ('Acct-Status-Type', 'Stop'))),))
+        self.assertEqual(results[0], ((), RC_OK))
+        self.assertEqual(len(dead.seen), 1)
+        rc.shutdown()
+        for stub in (lossy, dead, backup):
+            stub.close()
+
+    def test_errors(self):
+        dead = StubRadiusServer(answer = False)
+        wrong_secret = StubRadiusServer(secret = b'wrong')
+        wrong_secret.spec = wrong_secret.spec.replace('wrong', SECRET.decode())
+        rc = self.mkclient((dead, wrong_secret), radius_retries = 1)
+        stime = monotonic()
+        results = self.run_requests(rc, ((rc.do_auth, (('User-Name', 'accept'), ('Password', 'cisco'))), \
+          (rc.do_auth, (('No-Such-Attribute', 'foo'),))))
+        self.assertEqual(results, {0:((), RC_ERROR), 1:((), RC_ERROR)})
+        self.assertLess(monotonic() - stime, 1.0)
+        self.assertEqual(rc.stats()['timeouts'], 1)
+        # Cancelled requests are not reported
+        req = rc.do_auth((('User-Name', 'accept'), ('Password', 'cisco')), lambda *args: self.fail())
+        req.cancel()
+        ED2.loop(0.6)
+        self.assertEqual(rc.stats()['inflight'], 0)
+        rc.shutdown()
+        dead.close()
+        wrong_secret.close()
+
+    def test_speed(self):
+        nreqs = int(os.environ.get('SIPPY_RADIUS_REQUESTS', '2000'))
+        stub = StubRadiusServer()
+        rc = self.mkclient((stub,), max_radiusclients = 4)
+        rc.timeout = 5.0
+        attributes = (('User-Name', 'accept'), ('Password', 'cisco'), ('Calling-Station-Id', '123'), \
+          ('Called-Station-Id', '456'), ('call-id', 'abc@1.2.3.4'), ('h323-remote-address', '1.2.3.4'), \
+          ('h323-session-protocol', 'sipv2'))
+        stime = monotonic()
+        results = self.run_requests(rc, [(rc.do_auth, attributes)] * nreqs, timeout = 30.0)
+        etime = monotonic() - stime
+        stats = rc.stats()
+        rc.shutdown()
+        stub.close()
+        print('Radius_client: %d requests in %.3f sec, %.0f requests/sec, %s' % \
+          (nreqs, etime, nreqs / etime, str(stats)))
+        self.assertEqual(len(results), nreqs)
+        self.assertEqual(set([x[1] for x in results.values()]), {RC_OK})
+        self.assertEqual(stats['sockets'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
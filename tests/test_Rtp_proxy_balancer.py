@@ -0,0 +1,127 @@
+import unittest
+from random import random, seed
+
+from sippy.Rtp_proxy.balancer import RTPP_BALANCERS, parse_rtpp_spec, rtpp_load
+from sippy.Rtp_proxy.session import Rtp_proxy_session
+
+class FakeRtpc(object):
+    online = True
+    notify_socket = None
+    active_sessions = None
+    sessions_placed = 0
+    weight = 1.0
+    rtt = None
+
+    def __init__(self, spath, weight = 1.0, rtt = None):
+        self.spath = spath
+        self.weight = weight
+        self.rtt = rtt
+
+    def get_rtpc_delay(self):
+        return self.rtt
+
+    def heartbeat(self, active_sessions):
+        # Mimics Rtp_proxy_client.update_active()
+        self.active_sessions = active_sessions
+        self.sessions_placed = 0
+
+def simulate(policy, rtpcs, ncalls, hrtb_every = 50, hangup_p = 0.0):
+    # Place ncalls sessions, with the load reported back every hrtb_every
+    # calls; each active session on a node ends with probability hangup_p
+    # per heartbeat.
+    balancer = RTPP_BALANCERS[policy]()
+    active = dict([(x.spath, 0) for x in rtpcs])
+    for i in range(ncalls):
+        if i % hrtb_every == 0:
+            for rtpc in rtpcs:
+                active[rtpc.spath] -= sum([1 for _ in range(active[rtpc.spath]) if random() < hangup_p])
+                rtpc.heartbeat(active[rtpc.spath])
+        rtpc = balancer.select(rtpcs, 'call%d' % i)
+        active[rtpc.spath] += 1
+    return active
+
+class TestRtpProxyBalancer(unittest.TestCase):
+    def setUp(self):
+        seed(42)
+
+    def test_parse_spec(self):
+        self.assertEqual(parse_rtpp_spec('udp:1.2.3.4:22222'), ('udp:1.2.3.4:22222', 1.0))
+        self.assertEqual(parse_rtpp_spec('unix:/var/run/rtpp.sock;weight=2.5'), \
+          ('unix:/var/run/rtpp.sock', 2.5))
+        self.assertRaises(ValueError, parse_rtpp_spec, 'udp:1.2.3.4;weight=0')
+        self.assertRaises(ValueError, parse_rtpp_spec, 'udp:1.2.3.4;weight=foo')
+
+    def test_least_sessions(self):
+        rtpcs = [FakeRtpc('a'), FakeRtpc('b', weight = 3.0)]
+        rtpcs[0].heartbeat(10)
+        rtpcs[1].heartbeat(10)
+        balancer = RTPP_BALANCERS['least_sessions']()
+        # Placement is accounted for locally before the next heartbeat
+        picks = [balancer.select(rtpcs).spath for i in range(20)]
+        self.assertEqual(picks.count('b'), 20)
+        picks = [balancer.select(rtpcs).spath for i in range(40)]
+        self.assertEqual(picks.count('b'), 30)
+        self.assertEqual([rtpp_load(x) for x in rtpcs], [20, 60])
+        rtpcs[1].heartbeat(60)
+        self.assertEqual(rtpcs[1].sessions_placed, 0)
+
+    def test_weighted_spread(self):
+        # Node "c" has twice the capacity of the others: all load-aware
+        # policies should converge onto the 1:1:2 split, the unweighted
+        # random placement would have it at 1:1:1
+        for policy in ('random', 'least_sessions', 'p2c', 'rtt', 'hash'):
+            rtpcs = [FakeRtpc('a'), FakeRtpc('b'), FakeRtpc('c', weight = 2.0)]
+            active = simulate(policy, rtpcs, 4000)
+            share = active['c'] / 4000.0
+            self.assertTrue(0.45 < share < 0.55, '%s: %f' % (policy, share))
+
+    def test_skew(self):
+        # Pre-existing skew (e.g. one node has just been restarted) is
+        # evened out by the load-aware policies
+        for policy in ('least_sessions', 'p2c', 'rtt'):
+            rtpcs = [FakeRtpc('a'), FakeRtpc('b'), FakeRtpc('c')]
+            rtpcs[0].heartbeat(300)
+            rtpcs[1].heartbeat(300)
+            picks = [RTPP_BALANCERS[policy]().select(rtpcs).spath for i in range(300)]
+            self.assertGreater(picks.count('c'), 180, policy)
+        rtpcs = [FakeRtpc('a'), FakeRtpc('b'), FakeRtpc('c')]
+        rtpcs[0].heartbeat(300)
+        rtpcs[1].heartbeat(300)
+        picks = [RTPP_BALANCERS['random']().select(rtpcs).spath for i in range(300)]
+        self.assertLess(picks.count('c'), 150)
+
+    def test_rtt(self):
+        rtpcs = [FakeRtpc('fast', rtt = 0.001), FakeRtpc('slow', rtt = 0.05), FakeRtpc('unknown')]
+        active = simulate('rtt', rtpcs, 3000)
+        self.assertGreater(active['fast'], 2 * active['slow'])
+        self.assertGreater(active['unknown'], active['fast'])
+
+    def test_hash_sticky(self):
+        rtpcs = [FakeRtpc('r%d' % i) for i in range(5)]
+        balancer = RTPP_BALANCERS['hash']()
+        placement = dict([('call%d' % i, balancer.select(rtpcs, 'call%d' % i).spath) for i in range(1000)])
+        for call_id, spath in placement.items():
+            self.assertEqual(balancer.select(rtpcs, call_id).spath, spath)
+        # Losing one node only remaps the calls that were on it
+        down = rtpcs.pop(2)
+        moved = 0
+        for call_id, spath in placement.items():
+            nspath = balancer.select(rtpcs, call_id).spath
+            if spath == down.spath:
+                moved += 1
+            else:
+                self.assertEqual(nspath, spath)
+        self.assertTrue(150 < moved < 250)
+
+    def test_session(self):
+        rtpcs = [FakeRtpc('a'), FakeRtpc('b'), FakeRtpc('c')]
+        rtpcs[0].online = False
+        gc = {'_rtp_proxy_clients':rtpcs, '_rtpp_balancer':RTPP_BALANCERS['hash']()}
+        rs1 = Rtp_proxy_session(gc, call_id = 'call1')
+        rs2 = Rtp_proxy_session(gc, call_id = 'call1')
+        self.assertIs(rs1.rtp_proxy_client, rs2.rtp_proxy_client)
+        self.assertIsNot(rs1.rtp_proxy_client, rtpcs[0])
+        self.assertEqual(rtpcs[1].sessions_placed + rtpcs[2].sessions_placed, 2)
+
+if __name__ == '__main__':
+    unittest.main()
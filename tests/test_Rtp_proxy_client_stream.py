@@ -0,0 +1,200 @@
+import os
+import socket
+import unittest
+from heapq import heappush, heappop
+from itertools import count
+from queue import Queue, Empty
+from random import Random
+from threading import Thread
+from time import monotonic, perf_counter
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Rtp_proxy.Client.stream import Rtp_proxy_client_stream
+from sippy.Rtp_proxy.Client.Worker.external import RTPPLWorker_external
+from sippy.Rtp_proxy.Client.Worker.pipelined import RTPPLWorker_pipelined, RTPPLReceiver
+
+class StubRtpproxyConn(object):
+    def __init__(self, stub, s):
+        self.stub = stub
+        self.s = s
+        self.replies = Queue()
+        self.seq = count()
+        Thread(target = self.reader, daemon = True).start()
+        Thread(target = self.writer, daemon = True).start()
+
+    def reader(self):
+        buf = b''
+        while True:
+            data = self.s.recv(65536)
+            if len(data) == 0:
+                self.replies.put(None)
+                break
+            buf += data
+            lines = buf.split(b'\n')
+            buf = lines.pop()
+            now = monotonic()
+            for line in lines:
+                self.replies.put((now + self.stub.delay(), self.stub.reply(line.decode())))
+
+    def writer(self):
+        # Answers go out once their "RTT" has passed, in the order of
+        # their deadlines
+        pending = []
+        while True:
+            try:
+                timeout = max(pending[0][0] - monotonic(), 0) if len(pending) > 0 else None
+                item = self.replies.get(timeout = timeout)
+            except Empty:
+                deadline, seq, reply = heappop(pending)
+                self.s.sendall(reply.encode())
+                continue
+            if item is None:
+                break
+            heappush(pending, (item[0], next(self.seq), item[1]))
+
+class StubRtpproxy(object):
+    # Replies "<arg>" to "VF <arg>", with cookie prepended if cookies are
+    # enabled, after simulated network delay
+    def __init__(self, rtt, cookies, jitter = 0.0):
+        self.rtt = rtt
+        self.cookies = cookies
+        self.jitter = jitter
+        self.rng = Random(1)
+        self.ls = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.ls.bind(('127.0.0.1', 0))
+        self.ls.listen(16)
+        self.address = self.ls.getsockname()
+        Thread(target = self.acceptor, daemon = True).start()
+
+    def acceptor(self):
+        while True:
+            try:
+                s, address = self.ls.accept()
+            except OSError:
+                break
+            StubRtpproxyConn(self, s)
+
+    def delay(self):
+        return self.rtt + self.rng.uniform(0, self.jitter)
+
+    def reply(self, line):
+        if self.cookies:
+            cookie, command = line.split(None, 1)
+            if command.startswith('I'):
+                return '%s sessions created: 0\nactive sessions: 0\n' % cookie
+            return '%s %s\n' % (cookie, command.split()[-1])
+        return '%s\n' % line.split()[-1]
+
+    def close(self):
+        self.ls.close()
+
+class ChunkedSocket(object):
+    # recv() returns the chunks given, one per call
+    def __init__(self, chunks):
+        self.chunks = list(chunks)
+
+    def recv(self, size):
+        return self.chunks.pop(0) if len(self.chunks) > 0 else b''
+
+class StubWorker(object):
+    def __init__(self, pending, multiline):
+        self.pending = dict([(x, None) for x in pending])
+        self.multiline = set(multiline)
+        self.replies = []
+
+    def complete(self, cookie, reply):
+        self.pending.pop(cookie)
+        self.replies.append((cookie, reply))
+
+    def disconnected(self, s):
+        return False
+
+def run_commands(rtpc, ncommands, timeout = 30.0):
+    res = {}
+    def gotreply(result, i, ex = None):
+        res[i] = (result, ex)
+        if len(res) == ncommands:
+            ED2.breakLoop()
+    start = perf_counter()
+    for i in range(ncommands):
+        rtpc.send_command('VF %d' % i, gotreply, i)
+    ED2.loop(timeout)
+    return (res, perf_counter() - start)
+
+class TestRtpProxyClientStream(unittest.TestCase):
+    def test_pipelined(self):
+        stub = StubRtpproxy(0.005, True, jitter = 0.02)
+        rtpc = Rtp_proxy_client_stream({}, address = stub.address, \
+          family = socket.AF_INET, pipelined = True)
+        self.assertEqual(rtpc.worker_class, RTPPLWorker_pipelined)
+        res, elapsed = run_commands(rtpc, 200)
+        rtpc.shutdown()
+        stub.close()
+        # Replies came out of order, but all have been matched right
+        self.assertEqual(res, dict([(i, (str(i), None)) for i in range(200)]))
+        self.assertGreater(rtpc.get_rtpc_delay(), 0.004)
+
+    def test_multiline(self):
+        # Multi-line reply split at the line boundary between two reads
+        worker = StubWorker(('c1', 'c2', 'c3'), ('c1',))
+        receiver = RTPPLReceiver(worker, ChunkedSocket((b'c1 sessions created: 1\n', \
+          b'active sessions: 1\nc2 20040107\nc3 0\n')))
+        receiver.join()
+        self.assertEqual(worker.replies, [('c1', ['sessions created: 1', 'active sessions: 1']), \
+          ('c2', ['20040107']), ('c3', ['0'])])
+        # Non-ASCII bytes do not stop the receiver
+        worker = StubWorker(('c1', 'c2'), ())
+        receiver = RTPPLReceiver(worker, ChunkedSocket((b'c1 E\xff\n', b'c2 0\n')))
+        receiver.join()
+        self.assertEqual(worker.replies, [('c1', ['E\ufffd']), ('c2', ['0'])])
+        stub = StubRtpproxy(0.001, True)
+        rtpc = Rtp_proxy_client_stream({}, address = stub.address, \
+          family = socket.AF_INET, pipelined = True)
+        res = {}
+        def gotreply(result, i, ex = None):
+            res[i] = result
+            if len(res) == 4:
+                ED2.breakLoop()
+        for i, command in enumerate(('Ib', 'VF 1', 'Ib', 'VF 3')):
+            rtpc.send_command(command, gotreply, i)
+        ED2.loop(10.0)
+        rtpc.shutdown()
+        stub.close()
+        self.assertEqual(res, {0:'sessions created: 0\nactive sessions: 0', 1:'1', \
+          2:'sessions created: 0\nactive sessions: 0', 3:'3'})
+
+    def test_connection_refused(self):
+        stub = StubRtpproxy(0.0, True)
+        address = stub.address
+        stub.close()
+        rtpc = Rtp_proxy_client_stream({}, address = address, \
+          family = socket.AF_INET, pipelined = True)
+        res, elapsed = run_commands(rtpc, 3)
+        rtpc.shutdown()
+        self.assertEqual(sorted(res.keys()), [0, 1, 2])
+        self.assertTrue(all(x[0] is None and x[1] is not None for x in res.values()))
+
+    def test_speed(self):
+        ncommands = int(os.environ.get('SIPPY_RTPC_STREAM_COMMANDS', '1000'))
+        rtt = float(os.environ.get('SIPPY_RTPC_STREAM_RTT', '0.002'))
+        nworkers = 4
+        rates = []
+        for pipelined in (False, True):
+            stub = StubRtpproxy(rtt, pipelined)
+            rtpc = Rtp_proxy_client_stream({}, address = stub.address, \
+              family = socket.AF_INET, nworkers = nworkers, pipelined = pipelined)
+            self.assertIs(rtpc.worker_class, RTPPLWorker_pipelined if pipelined \
+              else RTPPLWorker_external)
+            res, elapsed = run_commands(rtpc, ncommands)
+            rtpc.shutdown()
+            stub.close()
+            self.assertEqual(len(res), ncommands)
+            self.assertTrue(all(res[i] == (str(i), None) for i in range(ncommands)))
+            rates.append(ncommands / elapsed)
+        print('Rtp_proxy_client_stream: %d workers, RTT %.1fms: %.0f commands/sec ' \
+          'one-at-a-time, %.0f commands/sec pipelined' % (nworkers, rtt * 1000, \
+          rates[0], rates[1]))
+        self.assertGreater(rates[1], rates[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import os
+import socket
+import unittest
+from threading import Thread
+from time import monotonic
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Math.recfilter import recfilter
+from sippy.Rtp_proxy.Client.udp import Rtp_proxy_client_udp
+
+class StubRtpproxyUdp(object):
+    # Replies "<cookie> <arg>" to "<cookie> VF <arg>", ignoring the first
+    # ndrop copies of each command
+    def __init__(self, ndrop = 0, answer = True):
+        self.ndrop = ndrop
+        self.answer = answer
+        self.seen = {}
+        self.s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.s.bind(('127.0.0.1', 0))
+        self.address = self.s.getsockname()
+        Thread(target = self.run, daemon = True).start()
+
+    def run(self):
+        while True:
+            try:
+                data, address = self.s.recvfrom(8192)
+            except OSError:
+                break
+            cookie, command = data.decode().split(None, 1)
+            n = self.seen.get(cookie, 0)
+            self.seen[cookie] = n + 1
+            if not self.answer or n < self.ndrop:
+                continue
+            self.s.sendto(('%s %s\n' % (cookie, command.split()[-1])).encode(), address)
+
+    def close(self):
+        self.s.close()
+
+class TestRtpProxyClientUdp(unittest.TestCase):
+    def run_commands(self, stub, ncmds, rtt = 0.01, cmd = 'VF %d', timeout = 10.0):
+        rtpc = Rtp_proxy_client_udp({}, stub.address)
+        # Start from a realistic delay estimate, so the retransmits are
+        # scheduled within the test's time frame
+        rtpc.delay_flt = recfilter(0.95, rtt)
+        state = {'nreplies':0, 'results':{}, 'maxtimers':0}
+        def gotreply(result, i):
+            state['nreplies'] += 1
+            state['results'][i] = result
+            if state['nreplies'] == ncmds:
+                ED2.breakLoop()
+        stime = monotonic()
+        for i in range(ncmds):
+            rtpc.send_command(cmd % i, gotreply, i)
+        state['maxtimers'] = len(ED2.timers)
+        ED2.loop(timeout)
+        state['etime'] = monotonic() - stime
+        state['stats'] = rtpc.get_rtpc_stats()
+        state['sched'] = rtpc.retr_sched
+        rtpc.shutdown()
+        return state
+
+    def test_basic(self):
+        stub = StubRtpproxyUdp()
+        state = self.run_commands(stub, 100)
+        stub.close()
+        self.assertEqual(state['results'], dict([(i, str(i)) for i in range(100)]))
+        self.assertEqual(state['stats'], {'inflight':0, 'retransmitted':0, 'expired':0})
+        # Cookies are unique
+        self.assertEqual(len(stub.seen), 100)
+        self.assertEqual(set(stub.seen.values()), {1})
+
+    def test_retransmit(self):
+        stub = StubRtpproxyUdp(ndrop = 2)
+        state = self.run_commands(stub, 50)
+        stub.close()
+        self.assertEqual(state['results'], dict([(i, str(i)) for i in range(50)]))
+        self.assertEqual(state['stats'], {'inflight':0, 'retransmitted':100, 'expired':0})
+        self.assertEqual(set(stub.seen.values()), {3})
+
+    def test_expire(self):
+        stub = StubRtpproxyUdp(answer = False)
+        # "G" commands expire after 1 second
+        state = self.run_commands(stub, 20, cmd = 'G %d', timeout = 5.0)
+        stub.close()
+        self.assertEqual(state['results'], dict([(i, None) for i in range(20)]))
+        self.assertEqual(state['stats']['inflight'], 0)
+        self.assertEqual(state['stats']['expired'], 20)
+        self.assertEqual(state['stats']['retransmitted'], 20 * 3)
+        self.assertLess(state['etime'], 1.5)
+        # The tick stops once nothing is pending
+        self.assertIsNone(state['sched'].timer)
+        self.assertEqual(len(state['sched']), 0)
+
+    def test_timers_speed(self):
+        ncmds = int(os.environ.get('SIPPY_RTPC_UDP_COMMANDS', '5000'))
+        stub = StubRtpproxyUdp()
+        state = self.run_commands(stub, ncmds, rtt = 0.25)
+        stub.close()
+        print('Rtp_proxy_client_udp: %d commands in %.3f sec, %.0f commands/sec, ' \
+          '%d global timers at peak' % (ncmds, state['etime'], \
+          ncmds / state['etime'], state['maxtimers']))
+        self.assertEqual(len(state['results']), ncmds)
+        # All in-flight commands share one timer
+        self.assertLess(state['maxtimers'], 10)
+
+if __name__ == '__main__':
+    unittest.main()
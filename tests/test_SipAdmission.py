@@ -0,0 +1,128 @@
+import os
+import unittest
+from time import perf_counter
+
+from sippy.Network_server import Remote_address
+from sippy.SipAdmission import SipAdmissionControl, parse_rate
+from sippy.SipRequest import SipRequest
+from sippy.SipResponse import SipResponse
+
+INVITE = b'INVITE sip:100@192.0.2.20 SIP/2.0\r\n' \
+  b'Via: SIP/2.0/UDP 198.51.100.7:5060;branch=z9hG4bK-scan1\r\n' \
+  b'v: SIP/2.0/UDP 198.51.100.8:5060;branch=z9hG4bK-scan0\r\n' \
+  b'Max-Forwards: 70\r\n' \
+  b'From: "sipvicious" <sip:100@198.51.100.7>;tag=3937316334\r\n' \
+  b'To: "sipvicious" <sip:100@192.0.2.20>\r\n' \
+  b'Call-ID: 1234567890@198.51.100.7\r\n' \
+  b'CSeq: 1 INVITE\r\n' \
+  b'Contact: <sip:100@198.51.100.7:5060>\r\n' \
+  b'Content-Length: 0\r\n\r\n'
+
+BYE = INVITE.replace(b'INVITE', b'BYE').replace(b'192.0.2.20>\r\n', b'192.0.2.20>;tag=abc\r\n')
+ACK = INVITE.replace(b'INVITE', b'ACK')
+RESP = b'SIP/2.0 200 OK\r\n' + INVITE.split(b'\r\n', 1)[1]
+
+class FakeServer(object):
+    def __init__(self):
+        self.sent = []
+
+    def send_to(self, data, address):
+        self.sent.append((data, address))
+
+class TestSipAdmission(unittest.TestCase):
+    def test_acl(self):
+        ac = SipAdmissionControl(accept_ips = ('192.0.2.1',))
+        good = Remote_address(('192.0.2.1', 5060), 'udp')
+        bad = Remote_address(('198.51.100.7', 5060), 'udp')
+        self.assertTrue(ac.admit(INVITE, good, None))
+        self.assertFalse(ac.admit(INVITE, bad, None))
+        self.assertTrue(ac.admit(INVITE, Remote_address(('198.51.100.7', 443), 'wss'), None))
+        # In-dialog requests are not subject to the ACL, ACKs and responses
+        # are never looked at
+        for msg in (BYE, ACK, RESP):
+            self.assertTrue(ac.admit(msg, bad, None))
+        self.assertTrue(ac.admit(INVITE.replace(b'INVITE sip', b'OPTIONS sip'), bad, None))
+        stats = ac.stats()
+        self.assertEqual((stats['admitted'], stats['dropped_acl'], stats['passed']), (4, 1, 2))
+        # Calls from the SIP proxy
+        proxy = Remote_address(('198.51.100.7', 5070), 'udp')
+        self.assertFalse(ac.admit(INVITE, proxy, None))
+        ac = SipAdmissionControl(accept_ips = ('192.0.2.1', '[[PROXY]]'), \
+          proxy_source = (('198.51.100.7', 5070), 'udp'))
+        self.assertTrue(ac.admit(INVITE, proxy, None))
+        self.assertFalse(ac.admit(INVITE, bad, None))
+
+    def test_rates(self):
+        ac = SipAdmissionControl(ip_rate = parse_rate('1/3'), \
+          method_rates = {'OPTIONS':parse_rate('2/2')})
+        ra1 = Remote_address(('198.51.100.7', 5060), 'udp')
+        ra2 = Remote_address(('198.51.100.9', 5060), 'udp')
+        res = [ac.admit(INVITE, ra1, None, now = 10.0) for i in range(5)]
+        self.assertEqual(res, [True, True, True, False, False])
+        self.assertTrue(ac.admit(INVITE, ra2, None, now = 10.0))
+        self.assertTrue(ac.admit(INVITE, ra1, None, now = 11.0))
+        self.assertFalse(ac.admit(INVITE, ra1, None, now = 11.5))
+        # In-dialog requests are limited as well, ACKs are not
+        self.assertFalse(ac.admit(BYE, ra1, None, now = 11.5))
+        self.assertTrue(ac.admit(ACK, ra1, None, now = 11.5))
+        self.assertTrue(ac.admit(BYE, ra1, None, now = 12.5))
+        options = INVITE.replace(b'INVITE sip', b'OPTIONS sip')
+        res = [ac.admit(options, Remote_address(('203.0.113.%d' % i, 5060), 'udp'), \
+          None, now = 20.0) for i in range(4)]
+        self.assertEqual(res, [True, True, False, False])
+        # In-dialog requests do not count against the method limits
+        self.assertTrue(ac.admit(BYE.replace(b'BYE sip', b'OPTIONS sip'), ra2, None, now = 20.0))
+        stats = ac.stats()
+        self.assertEqual((stats['limited_ip'], stats['limited_method'], stats['rejected']), (4, 2, 0))
+
+    def test_lru(self):
+        ac = SipAdmissionControl(ip_rate = parse_rate('1/1'), max_sources = 2)
+        hot = Remote_address(('198.51.100.7', 5060), 'udp')
+        self.assertTrue(ac.admit(INVITE, hot, None, now = 1.0))
+        for i in range(4):
+            # The abusive source keeps hitting its empty bucket while the
+            # spoofed ones come and go
+            self.assertFalse(ac.admit(INVITE, hot, None, now = 1.0))
+            ra = Remote_address(('203.0.113.%d' % i, 5060), 'udp')
+            self.assertTrue(ac.admit(INVITE, ra, None, now = 1.0))
+        self.assertIn('198.51.100.7', ac.ip_buckets)
+        self.assertEqual(len(ac.ip_buckets), 2)
+
+    def test_503(self):
+        ac = SipAdmissionControl(ip_rate = parse_rate('1/1'), retry_after = 30)
+        ra = Remote_address(('198.51.100.7', 5070), 'udp')
+        server = FakeServer()
+        self.assertTrue(ac.admit(INVITE, ra, server, now = 1.0))
+        self.assertFalse(ac.admit(INVITE, ra, server, now = 1.0))
+        self.assertEqual(len(server.sent), 1)
+        data, address = server.sent[0]
+        self.assertEqual(address, ('198.51.100.7', 5070))
+        resp = SipResponse(data)
+        req = SipRequest(INVITE)
+        self.assertEqual(resp.getSCode(), (503, 'Service Unavailable'))
+        self.assertEqual(resp.getTId(True, True), req.getTId(True, True))
+        self.assertEqual(resp.countHFs('via'), 2)
+        self.assertIsNotNone(resp.getHFBody('to').getTag())
+        self.assertEqual(str(resp.getHFBody('retry-after')), '30')
+        self.assertEqual(ac.stats()['rejected'], 1)
+
+    def test_admit_speed(self):
+        iterations = int(os.environ.get('SIPPY_ADMISSION_ITERATIONS', '20000'))
+        ac = SipAdmissionControl(accept_ips = ('192.0.2.1',))
+        ra = Remote_address(('198.51.100.7', 5060), 'udp')
+
+        start = perf_counter()
+        for i in range(iterations):
+            ac.admit(INVITE, ra, None)
+        t_admit = perf_counter() - start
+
+        start = perf_counter()
+        for i in range(iterations):
+            SipRequest(INVITE).getTIds()
+        t_parse = perf_counter() - start
+        print('SipAdmissionControl: %.0f msgs/sec dropped, %.0f msgs/sec parsed' % \
+          (iterations / t_admit, iterations / t_parse))
+        self.assertLess(t_admit, t_parse)
+
+if __name__ == '__main__':
+    unittest.main()
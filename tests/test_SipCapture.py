@@ -0,0 +1,177 @@
+import os
+import socket
+import unittest
+from struct import unpack_from
+from tempfile import TemporaryDirectory
+from threading import Event
+from time import perf_counter, sleep, time
+
+from sippy.Network_server import Remote_address
+from sippy.SipCapture import SipCapture, PcapngSink, HepSink, ip4_checksum
+from sippy.SipLogger import SipLogger
+from sippy.SipTransactionManager import _lfmt_received
+from tests.test_SipLogger import MSG, SipLoggerEnv
+
+def read_pcapng(path):
+    # Returns linktype and list of (timestamp, packet) from the file
+    with open(path, 'rb') as f:
+        data = f.read()
+    i = 0
+    linktype = None
+    packets = []
+    while i < len(data):
+        btype, blen = unpack_from('<II', data, i)
+        if btype == 0x0a0d0d0a:
+            assert unpack_from('<I', data, i + 8)[0] == 0x1a2b3c4d
+        elif btype == 1:
+            linktype = unpack_from('<H', data, i + 8)[0]
+        elif btype == 6:
+            ifid, tsh, tsl, caplen, origlen = unpack_from('<IIIII', data, i + 8)
+            packets.append((((tsh << 32) + tsl) / 1000000.0, data[i + 28:i + 28 + caplen]))
+        assert unpack_from('<I', data, i + blen - 4)[0] == blen
+        i += blen
+    return linktype, packets
+
+def parse_ip_udp(pkt):
+    if pkt[0] >> 4 == 4:
+        assert ip4_checksum(pkt[:20]) == 0
+        src, dst = socket.inet_ntop(socket.AF_INET, pkt[12:16]), socket.inet_ntop(socket.AF_INET, pkt[16:20])
+        assert unpack_from('!H', pkt, 2)[0] == len(pkt)
+        pkt = pkt[20:]
+    else:
+        src, dst = socket.inet_ntop(socket.AF_INET6, pkt[8:24]), socket.inet_ntop(socket.AF_INET6, pkt[24:40])
+        pkt = pkt[40:]
+    sport, dport, ulen = unpack_from('!HHH', pkt)
+    assert ulen == len(pkt)
+    return (src, sport), (dst, dport), pkt[8:]
+
+class BlockingSink(object):
+    def __init__(self, sink):
+        self.sink = sink
+        self.gate = Event()
+        self.gate.set()
+
+    def write(self, records):
+        self.gate.wait()
+        self.sink.write(records)
+
+    def close(self):
+        self.sink.close()
+
+class TestSipCapture(unittest.TestCase):
+    def test_pcapng(self):
+        with TemporaryDirectory() as tdir:
+            path = os.path.join(tdir, 'sip.pcapng')
+            cap = SipCapture([PcapngSink(path)])
+            ts = time()
+            cap.capture(MSG, ('192.0.2.10', 5060), ('192.0.2.20', 5070), 'udp', ts)
+            cap.capture(MSG.decode(), ('[2001:db8::1]', 5060), ('[2001:db8::2]', 5061), 'tcp', ts + 1)
+            cap.capture(MSG, ('0.0.0.0', 5060), ('[2001:db8::2]', 5061), 'udp', ts + 2)
+            cap.shutdown()
+            linktype, packets = read_pcapng(path)
+        self.assertEqual(linktype, 101)
+        self.assertEqual(len(packets), 3)
+        self.assertAlmostEqual(packets[0][0], ts, places = 5)
+        self.assertEqual(parse_ip_udp(packets[0][1]), (('192.0.2.10', 5060), ('192.0.2.20', 5070), MSG))
+        self.assertEqual(parse_ip_udp(packets[1][1]), (('2001:db8::1', 5060), ('2001:db8::2', 5061), MSG))
+        self.assertEqual(parse_ip_udp(packets[2][1])[:2], (('::', 5060), ('2001:db8::2', 5061)))
+        self.assertEqual(cap.stats(), {'captured':3, 'dropped':0, 'written':3, 'buffered':0})
+
+    def test_hep(self):
+        collector = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        collector.bind(('127.0.0.1', 0))
+        collector.settimeout(5.0)
+        cap = SipCapture([HepSink('127.0.0.1:%d:2001' % collector.getsockname()[1])])
+        cap.capture(MSG, ('192.0.2.10', 5060), ('192.0.2.20', 5070), 'udp', 1700000000.25)
+        cap.shutdown()
+        data = collector.recv(65536)
+        collector.close()
+        self.assertEqual(data[:4], b'HEP3')
+        self.assertEqual(unpack_from('!H', data, 4)[0], len(data))
+        chunks = {}
+        i = 6
+        while i < len(data):
+            vendor, ctype, clen = unpack_from('!HHH', data, i)
+            chunks[ctype] = data[i + 6:i + clen]
+            i += clen
+        self.assertEqual(chunks[1], b'\x02')
+        self.assertEqual(chunks[2], b'\x11')
+        self.assertEqual(socket.inet_ntoa(chunks[3]), '192.0.2.10')
+        self.assertEqual(socket.inet_ntoa(chunks[4]), '192.0.2.20')
+        self.assertEqual((unpack_from('!H', chunks[7])[0], unpack_from('!H', chunks[8])[0]), (5060, 5070))
+        self.assertEqual((unpack_from('!I', chunks[9])[0], unpack_from('!I', chunks[10])[0]), (1700000000, 250000))
+        self.assertEqual(unpack_from('!I', chunks[12])[0], 2001)
+        self.assertEqual(chunks[15], MSG)
+
+    def test_ring(self):
+        # Ring much smaller than the data with the writer held up: the
+        # excess is dropped, the records that wrap around the end of the
+        # ring come out intact
+        with TemporaryDirectory() as tdir:
+            path = os.path.join(tdir, 'sip.pcapng')
+            sink = BlockingSink(PcapngSink(path))
+            cap = SipCapture([sink], capacity = 10000)
+            nsent = 0
+            for j in range(5):
+                sink.gate.clear()
+                for i in range(100):
+                    cap.capture(MSG, ('192.0.2.10', 5060), ('192.0.2.20', 5070), 'udp', time())
+                    nsent += 1
+                sink.gate.set()
+                while cap.stats()['buffered'] > 0:
+                    sleep(0.001)
+            cap.shutdown()
+            linktype, packets = read_pcapng(path)
+        stats = cap.stats()
+        self.assertGreater(stats['dropped'], 0)
+        self.assertEqual(stats['captured'] + stats['dropped'], nsent)
+        self.assertEqual(len(packets), stats['written'])
+        for ts, pkt in packets:
+            self.assertEqual(parse_ip_udp(pkt)[2], MSG)
+
+    def test_rotate(self):
+        with TemporaryDirectory() as tdir:
+            path = os.path.join(tdir, 'sip.pcapng')
+            cap = SipCapture([PcapngSink(path, rotate_size = 10000)])
+            for i in range(100):
+                cap.capture(MSG, ('192.0.2.10', 5060), ('192.0.2.20', 5070), 'udp', time())
+                if i % 10 == 0:
+                    while cap.stats()['buffered'] > 0:
+                        pass
+            cap.shutdown()
+            npackets = 0
+            for fname in os.listdir(tdir):
+                linktype, packets = read_pcapng(os.path.join(tdir, fname))
+                npackets += len(packets)
+            self.assertGreater(len(os.listdir(tdir)), 1)
+            self.assertLessEqual(len(os.listdir(tdir)), 6)
+
+    def test_speed(self):
+        # Main thread cost of capturing vs text logging of the same
+        # incoming messages
+        iterations = int(os.environ.get('SIPPY_SIPCAPTURE_ITERATIONS', '20000'))
+        ra = Remote_address(('192.0.2.10', 5060), 'udp')
+        laddr = ('192.0.2.20', 5060)
+        with TemporaryDirectory() as tdir:
+            with SipLoggerEnv(SIPLOG_BEND = 'file', SIPLOG_LOGFILE_FILE = os.path.join(tdir, 'sip.log')):
+                log = SipLogger('bench')
+                start = perf_counter()
+                for i in range(iterations):
+                    log.dwrite(_lfmt_received, ra, MSG, ltime = time())
+                    if i % 500 == 0:
+                        while len(log.wi) > 0:
+                            pass
+                log_rate = iterations / (perf_counter() - start)
+                log.shutdown()
+            cap = SipCapture([PcapngSink(os.path.join(tdir, 'sip.pcapng'))])
+            start = perf_counter()
+            for i in range(iterations):
+                cap.capture(MSG, ra.address, laddr, ra.transport, time())
+            cap_rate = iterations / (perf_counter() - start)
+            cap.shutdown()
+        print('SipCapture: %.0f msgs/sec captured, %.0f msgs/sec logged, %d dropped' % \
+          (cap_rate, log_rate, cap.stats()['dropped']))
+        self.assertGreater(cap_rate, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,221 @@
+import os
+import unittest
+from hashlib import md5, sha256
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from sippy.SipWWWAuthenticate import SipWWWAuthenticate
+from sippy.SipAuthorization import SipAuthorization
+from sippy.SipHeader import SipHeader
+from sippy.SipRequest import SipRequest
+from sippy.Security.SipNonce import NonceCountWindow
+from sippy.Security.SipDigestStore import SipDigestStore, SipDigestAuth, sds_compile
+from sippy.b2bua import CallMap
+
+INVITE = 'INVITE sip:1234@example.com SIP/2.0\r\n' \
+  'Via: SIP/2.0/UDP 192.0.2.10:5060;branch=z9hG4bK776asdhds\r\n' \
+  'From: <sip:5678@example.com>;tag=1928301774\r\n' \
+  'To: <sip:1234@example.com>\r\n' \
+  'Call-ID: a84b4c76e66710@192.0.2.10\r\n' \
+  'CSeq: 1 INVITE\r\n' \
+  'Contact: <sip:5678@192.0.2.10:5060>\r\n' \
+  'Content-Length: 0\r\n\r\n'
+
+def ha1(hashf, username, realm, password):
+    return hashf(('%s:%s:%s' % (username, realm, password)).encode()).hexdigest()
+
+def mkauth(username, password, realm = 'example.com', algorithm = 'MD5', qop = 'auth', \
+  method = 'INVITE', uri = 'sip:1234@example.com'):
+    challenge = SipWWWAuthenticate(realm = realm, algorithm = algorithm)
+    return challenge.genAuthHF(username, password, method, uri, qop = qop)
+
+class TestNonceCountWindow(unittest.TestCase):
+    def test_window(self):
+        ncw = NonceCountWindow(wsize = 8)
+        self.assertTrue(ncw.check('n1', '00000001', now = 0.0))
+        self.assertFalse(ncw.check('n1', '00000001', now = 0.1))
+        self.assertTrue(ncw.check('n1', '00000003', now = 0.2))
+        # Out of order within the window is fine, but only once
+        self.assertTrue(ncw.check('n1', '00000002', now = 0.3))
+        self.assertFalse(ncw.check('n1', '00000002', now = 0.4))
+        self.assertTrue(ncw.check('n1', '0000000c', now = 0.5))
+        # 3 is 9 behind the top now, outside of the window
+        self.assertFalse(ncw.check('n1', '00000003', now = 0.6))
+        self.assertTrue(ncw.check('n1', '00000005', now = 0.7))
+        self.assertFalse(ncw.check('n1', '00000005', now = 0.8))
+        self.assertFalse(ncw.check('n1', 'zz', now = 0.9))
+        self.assertFalse(ncw.check('n1', '00000000', now = 0.9))
+        # No qop: single use nonce
+        self.assertTrue(ncw.check('n2', None, now = 1.0))
+        self.assertFalse(ncw.check('n2', None, now = 1.1))
+        self.assertEqual(ncw.stats()['replays'], 5)
+        # Expired entries are forgotten
+        self.assertTrue(ncw.check('n3', None, now = 0.5 + ncw.ttl))
+        self.assertEqual(len(ncw), 2)
+
+    def test_overflow(self):
+        ncw = NonceCountWindow(max_entries = 2)
+        for nonce in ('n1', 'n2'):
+            self.assertTrue(ncw.check(nonce, None, now = 0.0))
+        # Full, new nonces are refused and the old ones stay protected
+        self.assertFalse(ncw.check('n3', None, now = 0.1))
+        self.assertFalse(ncw.check('n1', None, now = 0.2))
+        self.assertEqual(list(ncw.entries.keys()), ['n1', 'n2'])
+        self.assertEqual((ncw.overflows, ncw.replays), (1, 1))
+        # Room again once the old ones expire
+        self.assertTrue(ncw.check('n3', None, now = ncw.ttl))
+        self.assertEqual(list(ncw.entries.keys()), ['n3'])
+
+class TestSipDigestStore(unittest.TestCase):
+    def mkstore(self, tdir, lines):
+        fname = os.path.join(tdir, 'htdigest')
+        with open(fname, 'w') as f:
+            f.write('# comment\n\n')
+            for line in lines:
+                f.write(line + '\n')
+        return fname
+
+    def test_lookup(self):
+        with TemporaryDirectory() as tdir:
+            fname = self.mkstore(tdir, ( \
+              'alice:example.com:%s' % ha1(md5, 'alice', 'example.com', 'secret'), \
+              'alice:example.com:%s' % ha1(sha256, 'alice', 'example.com', 'secret'), \
+              'bob:example.org:%s:MD5' % ha1(md5, 'bob', 'example.org', 'pass')))
+            store = SipDigestStore(fname)
+            self.assertEqual(store.nrecords, 3)
+            self.assertEqual(store.algorithms, ('SHA-256', 'MD5'))
+            self.assertEqual(store.lookup('example.com', 'alice'), \
+              ha1(md5, 'alice', 'example.com', 'secret').encode())
+            self.assertEqual(store.lookup('example.com', 'alice', 'SHA-256'), \
+              ha1(sha256, 'alice', 'example.com', 'secret').encode())
+            self.assertIsNone(store.lookup('example.org', 'alice'))
+            self.assertIsNone(store.lookup('example.com', 'alice', 'SHA-512-256'))
+            self.assertIsNotNone(store.lookup('example.org', 'bob'))
+            self.assertEqual(store.stats()['misses'], 2)
+            # Precompiled table is used as is
+            cname = os.path.join(tdir, 'store')
+            with open(fname, 'r') as src, open(cname, 'wb') as dst:
+                sds_compile(src, dst)
+            cstore = SipDigestStore(cname)
+            self.assertEqual(cstore.lookup('example.org', 'bob'), store.lookup('example.org', 'bob'))
+            store.close()
+            cstore.close()
+
+    def test_errors(self):
+        with TemporaryDirectory() as tdir:
+            for bad in ('alice:example.com', 'alice:example.com:xyz', \
+              'alice:example.com:%s:SHA-256' % ('0' * 32), \
+              'alice:example.com:%s:MD4' % ('0' * 32), \
+              'alice:example.com:%s\nalice:example.com:%s' % ('0' * 32, '1' * 32)):
+                fname = self.mkstore(tdir, (bad,))
+                with self.assertRaises(ValueError):
+                    SipDigestStore(fname)
+            with open(fname, 'wb') as f:
+                f.write(b'SDST' + b'\0' * 40)
+            with self.assertRaises(ValueError):
+                SipDigestStore(fname)
+
+    def test_verify(self):
+        with TemporaryDirectory() as tdir:
+            fname = self.mkstore(tdir, ( \
+              'alice:example.com:%s' % ha1(md5, 'alice', 'example.com', 'secret'), \
+              'alice:example.com:%s' % ha1(sha256, 'alice', 'example.com', 'secret')))
+            dauth = SipDigestAuth(fname)
+            challenges = dauth.challenges('example.com')
+            self.assertEqual([x.getBody().algorithm for x in challenges], ['SHA-256', 'MD5'])
+            self.assertTrue(str(challenges[0]).startswith('WWW-Authenticate: Digest realm="example.com"'))
+            for algorithm in ('MD5', 'MD5-sess', 'SHA-256', 'SHA-256-sess'):
+                auth = mkauth('alice', 'secret', algorithm = algorithm)
+                pauth = SipAuthorization(str(auth))
+                self.assertTrue(dauth.verify(pauth, 'INVITE'), algorithm)
+                # Replay of the same nonce / nc
+                self.assertFalse(dauth.verify(SipAuthorization(str(auth)), 'INVITE'), algorithm)
+            self.assertFalse(dauth.verify(mkauth('alice', 'wrong'), 'INVITE'))
+            self.assertFalse(dauth.verify(mkauth('alice', 'secret'), 'BYE'))
+            self.assertFalse(dauth.verify(mkauth('mallory', 'secret'), 'INVITE'))
+            self.assertFalse(dauth.verify(mkauth('alice', 'secret', realm = 'example.org'), 'INVITE'))
+            self.assertFalse(dauth.verify(mkauth('alice', 'secret', algorithm = 'SHA-512-256'), 'INVITE'))
+            # Without qop the nonce can only be used once
+            auth = mkauth('alice', 'secret', algorithm = None, qop = None)
+            self.assertTrue(dauth.verify(auth, 'INVITE'))
+            self.assertFalse(dauth.verify(auth, 'INVITE'))
+            # Next nc with the same nonce is fine
+            auth = mkauth('alice', 'secret')
+            self.assertTrue(dauth.verify(auth, 'INVITE'))
+            auth.nc = '00000002'
+            auth.genAuthResponse('secret', 'INVITE', None)
+            self.assertTrue(dauth.verify(auth, 'INVITE'))
+            stats = dauth.stats()
+            self.assertEqual((stats['accepted'], stats['rejected'], stats['replays']), (7, 10, 5))
+            # Reload
+            with open(fname, 'a') as f:
+                f.write('mallory:example.com:%s\n' % ha1(md5, 'mallory', 'example.com', 'x'))
+            self.assertEqual(dauth.reload(), 3)
+            self.assertTrue(dauth.verify(mkauth('mallory', 'x'), 'INVITE'))
+            with open(fname, 'a') as f:
+                f.write('garbage\n')
+            with self.assertRaises(ValueError):
+                dauth.reload()
+            self.assertTrue(dauth.verify(mkauth('mallory', 'x'), 'INVITE'))
+
+    def test_local_auth(self):
+        with TemporaryDirectory() as tdir:
+            fname = self.mkstore(tdir, ( \
+              'alice:example.com:%s' % ha1(md5, 'alice', 'example.com', 'secret'),))
+            cmap = CallMap.__new__(CallMap)
+            cmap.global_config = {'_digest_auth':SipDigestAuth(fname)}
+            def mkreq(*auths):
+                req = SipRequest(INVITE)
+                for auth in auths:
+                    req.appendHeader(SipHeader(name = 'authorization', body = auth))
+                return req
+            # IP authenticated caller: no credentials or credentials that
+            # are not for the local store are left to the other methods
+            self.assertEqual(cmap.localDigestAuth(mkreq(), True), (None, None))
+            self.assertEqual(cmap.localDigestAuth(mkreq(mkauth('bob', 'x')), True), (None, None))
+            self.assertEqual(cmap.localDigestAuth(mkreq(mkauth('alice', 'x', \
+              realm = 'example.org')), True), (None, None))
+            # Local user with wrong password is challenged regardless
+            resp, username = cmap.localDigestAuth(mkreq(mkauth('alice', 'x')), True)
+            self.assertEqual((resp.getSCode()[0], username), (401, None))
+            self.assertEqual(resp.getHFBody('www-authenticate').realm, 'example.com')
+            self.assertEqual(cmap.localDigestAuth(mkreq(mkauth('bob', 'x'), \
+              mkauth('alice', 'secret')), True), (None, 'alice'))
+            # No other way to authenticate
+            resp, username = cmap.localDigestAuth(mkreq(), False)
+            self.assertEqual((resp.getSCode()[0], username), (401, None))
+            resp, username = cmap.localDigestAuth(mkreq(mkauth('bob', 'x')))
+            self.assertEqual(resp.getSCode()[0], 401)
+            self.assertEqual(cmap.localDigestAuth(mkreq(mkauth('alice', 'secret'))), \
+              (None, 'alice'))
+            cmap.global_config['_digest_auth'].store.close()
+
+    def test_speed(self):
+        # Verifications per second against a large store
+        nentries = int(os.environ.get('SIPPY_DIGESTSTORE_NENTRIES', '100000'))
+        iterations = int(os.environ.get('SIPPY_DIGESTSTORE_ITERATIONS', '5000'))
+        with TemporaryDirectory() as tdir:
+            fname = os.path.join(tdir, 'htdigest')
+            with open(fname, 'w') as f:
+                for i in range(nentries):
+                    f.write('u%d:example.com:%s\n' % (i, md5(b'%d' % i).hexdigest()))
+                f.write('alice:example.com:%s\n' % ha1(md5, 'alice', 'example.com', 'secret'))
+            start = perf_counter()
+            dauth = SipDigestAuth(fname)
+            load_time = perf_counter() - start
+            auths = [str(mkauth('alice', 'secret')) for i in range(iterations)]
+            start = perf_counter()
+            for auth in auths:
+                self.assertTrue(dauth.verify(SipAuthorization(auth), 'INVITE'))
+            rate = iterations / (perf_counter() - start)
+            start = perf_counter()
+            for i in range(iterations):
+                dauth.store.lookup('example.com', 'u%d' % i)
+            lookup_rate = iterations / (perf_counter() - start)
+            dauth.store.close()
+        print('SipDigestStore: %d entries loaded in %.2f sec, %.0f verifications/sec, ' \
+          '%.0f lookups/sec' % (nentries + 1, load_time, rate, lookup_rate))
+        self.assertGreater(rate, 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,162 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep, time
+
+from sippy.Network_server import Remote_address
+from sippy.SipLogger import SipLogger
+from sippy.SipTransactionManager import _lfmt_received
+
+MSG = b'OPTIONS sip:192.0.2.20 SIP/2.0\r\n' \
+  b'Via: SIP/2.0/UDP 192.0.2.10:5060;branch=z9hG4bK1\r\n' \
+  b'From: <sip:alice@192.0.2.10>;tag=1\r\n' \
+  b'To: <sip:192.0.2.20>\r\n' \
+  b'Call-ID: logbench@192.0.2.10\r\n' \
+  b'CSeq: 1 OPTIONS\r\n' \
+  b'Content-Length: 0\r\n\r\n'
+
+class SipLoggerEnv(object):
+    def __init__(self, **kwargs):
+        self.env = kwargs
+
+    def __enter__(self):
+        self.saved = dict([(k, os.environ.get(k, None)) for k in self.env])
+        os.environ.update(self.env)
+        # Keep benchmark output off the terminal
+        self.stderr = os.dup(2)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 2)
+        os.close(devnull)
+        return self
+
+    def __exit__(self, *args):
+        os.dup2(self.stderr, 2)
+        os.close(self.stderr)
+        for k, v in self.saved.items():
+            if v is None:
+                del os.environ[k]
+            else:
+                os.environ[k] = v
+
+def eager(log, ra, data, ltime):
+    # What SipTransactionManager used to do for every incoming message
+    lmsg = data.decode(errors = 'backslashreplace')
+    log.write(f'RECEIVED message from {ra}:\n', lmsg, ltime = ltime)
+
+def deferred(log, ra, data, ltime):
+    log.dwrite(_lfmt_received, ra, data, ltime = ltime)
+
+class TestSipLogger(unittest.TestCase):
+    def test_dwrite(self):
+        ra = Remote_address(('192.0.2.10', 5060), 'udp')
+        with TemporaryDirectory() as tdir:
+            lfile = os.path.join(tdir, 'sip.log')
+            with SipLoggerEnv(SIPLOG_BEND = 'file', SIPLOG_LOGFILE_FILE = lfile, \
+              SIPLOG_LVL = 'INFO', SIPLOG_TFORM = 'rel', SIPLOG_TSTART = '0'):
+                log = SipLogger('test')
+                eager(log, ra, MSG, 1.5)
+                deferred(log, ra, MSG, 1.5)
+                # Filtered out, must not be formatted at all
+                log.dwrite(self.fail, 'formatted', level = 0)
+                log.shutdown()
+            with open(lfile) as f:
+                records = f.read().split('00:00:01.500/GLOBAL/test: ')
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[1], records[2])
+        self.assertTrue(records[1].startswith('RECEIVED message from udp:192.0.2.10:5060:\n'))
+
+    def bench(self, name, iterations, **env):
+        ra = Remote_address(('192.0.2.10', 5060), 'udp')
+        rates = []
+        with SipLoggerEnv(**env):
+            for func in (eager, deferred):
+                log = SipLogger('bench')
+                elapsed = 0.0
+                for i in range(0, iterations, 500):
+                    start = perf_counter()
+                    for j in range(500):
+                        func(log, ra, MSG, time())
+                    elapsed += perf_counter() - start
+                    # Let the writer catch up outside of the measured time,
+                    # so that the queue does not overflow
+                    while log.logger is not None and len(log.wi) > 0:
+                        sleep(0.001)
+                log.shutdown()
+                rates.append(iterations / elapsed)
+        print('SipLogger %s: %.0f msgs/sec eager, %.0f msgs/sec deferred' % \
+          (name, rates[0], rates[1]))
+        return rates
+
+    def test_write_speed(self):
+        iterations = int(os.environ.get('SIPPY_SIPLOGGER_ITERATIONS', '20000'))
+        off = self.bench('off', iterations, SIPLOG_BEND = 'none')
+        self.bench('stderr', iterations, SIPLOG_BEND = 'stderr')
+        with TemporaryDirectory() as tdir:
+            self.bench('file', iterations, SIPLOG_BEND = 'file', \
+              SIPLOG_LOGFILE_FILE = os.path.join(tdir, 'sip.log'))
+        self.assertGreater(off[1], off[0])
+
+    def flood(self, lfile, nrecords, record = 'x' * 100, **env):
+        with SipLoggerEnv(SIPLOG_BEND = 'file', SIPLOG_LOGFILE_FILE = lfile, **env):
+            log = SipLogger('flood')
+            start = perf_counter()
+            for i in range(nrecords):
+                log.write('%d ' % i, record)
+            log.shutdown()
+            return (log, perf_counter() - start)
+
+    def test_group_commit(self):
+        nrecords = int(os.environ.get('SIPPY_SIPLOGGER_FLOOD', '100000'))
+        with TemporaryDirectory() as tdir:
+            lfile = os.path.join(tdir, 'sip.log')
+            # Queue cap that fits the whole flood, so that the result does
+            # not depend on how fast the writer thread keeps up; the cap
+            # itself is covered by the test_queue_cap
+            log, elapsed = self.flood(lfile, nrecords, SIPLOG_QUEUE_MAX = str(nrecords * 1024))
+            with open(lfile) as f:
+                nlines = len([x for x in f.readlines() if x.endswith('x' * 100 + '\n')])
+        print('SipLogger group commit: %d records written in %.3f sec, %.0f records/sec, ' \
+          '%d discarded' % (nrecords, elapsed, nrecords / elapsed, log.discarded))
+        self.assertEqual(log.discarded, 0)
+        self.assertEqual(nlines, nrecords)
+
+    def test_queue_cap(self):
+        with TemporaryDirectory() as tdir:
+            lfile = os.path.join(tdir, 'sip.log')
+            log, elapsed = self.flood(lfile, 2000, 'x' * 10000, SIPLOG_QUEUE_MAX = '100000')
+            with open(lfile) as f:
+                lines = f.readlines()
+        self.assertGreater(log.discarded, 0)
+        self.assertEqual(len([x for x in lines if x.endswith('x' * 10000 + '\n')]), \
+          2000 - log.discarded)
+        self.assertEqual(sum([int(x.split('SipLogger: ', 1)[1].split()[0]) for x in lines \
+          if 'records discarded' in x]), log.discarded)
+
+    def test_rotate(self):
+        with TemporaryDirectory() as tdir:
+            lfile = os.path.join(tdir, 'sip.log')
+            self.flood(lfile, 1000, SIPLOG_ROTATE_SIZE = '20000', SIPLOG_ROTATE_KEEP = '3')
+            files = sorted(os.listdir(tdir))
+            self.assertEqual(files, ['sip.log', 'sip.log.1', 'sip.log.2', 'sip.log.3'])
+            for fname in files[1:]:
+                self.assertLess(os.path.getsize(os.path.join(tdir, fname)), 40000)
+            with open(lfile) as f:
+                self.assertTrue(f.readlines()[-1].endswith('999 ' + 'x' * 100 + '\n'))
+        with TemporaryDirectory() as tdir:
+            lfile = os.path.join(tdir, 'sip.log')
+            with SipLoggerEnv(SIPLOG_BEND = 'file', SIPLOG_LOGFILE_FILE = lfile, \
+              SIPLOG_ROTATE_INTERVAL = '1'):
+                log = SipLogger('rotate')
+                log.write('first')
+                while len(log.wi) > 0 or not os.path.exists(lfile):
+                    sleep(0.01)
+                sleep(1.1)
+                log.write('second')
+                log.shutdown()
+            with open(lfile + '.1') as f:
+                self.assertIn('first', f.read())
+            with open(lfile) as f:
+                self.assertIn('second', f.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,230 @@
+import os
+import unittest
+from time import perf_counter
+
+from sippy.SipHeader import SipHeader
+from sippy.SipMsg import LazySipHeader
+from sippy.SipRequest import SipRequest
+from sippy.SipResponse import SipResponse
+from sippy.SipVia import SipVia
+
+_SDP = 'v=0\r\n' \
+  'o=- 1234567890 1234567890 IN IP4 192.0.2.10\r\n' \
+  's=-\r\n' \
+  'c=IN IP4 192.0.2.10\r\n' \
+  't=0 0\r\n' \
+  'm=audio 16384 RTP/AVP 0 8 18 101\r\n' \
+  'a=rtpmap:0 PCMU/8000\r\n' \
+  'a=rtpmap:8 PCMA/8000\r\n' \
+  'a=rtpmap:18 G729/8000\r\n' \
+  'a=fmtp:18 annexb=no\r\n' \
+  'a=rtpmap:101 telephone-event/8000\r\n' \
+  'a=fmtp:101 0-15\r\n' \
+  'a=ptime:20\r\n' \
+  'a=sendrecv\r\n'
+
+INVITE = 'INVITE sip:15551234567@192.0.2.20:5060 SIP/2.0\r\n' \
+  'Via: SIP/2.0/UDP 192.0.2.10:5060;branch=z9hG4bK776asdhds;rport\r\n' \
+  'Max-Forwards: 70\r\n' \
+  'From: "Alice" <sip:15557654321@192.0.2.10>;tag=1928301774\r\n' \
+  'To: <sip:15551234567@192.0.2.20>\r\n' \
+  'Call-ID: a84b4c76e66710@pc33.example.com\r\n' \
+  'CSeq: 314159 INVITE\r\n' \
+  'Contact: <sip:15557654321@192.0.2.10:5060>\r\n' \
+  'Allow: INVITE, ACK, CANCEL, OPTIONS, BYE, REFER, NOTIFY, INFO, UPDATE\r\n' \
+  'Supported: replaces, timer\r\n' \
+  'User-Agent: ExampleUA/1.2.3\r\n' \
+  'Session-Expires: 1800\r\n' \
+  'P-Asserted-Identity: "Alice" <sip:15557654321@192.0.2.10>\r\n' \
+  'Content-Type: application/sdp\r\n' \
+  'Content-Length: %d\r\n\r\n%s' % (len(_SDP), _SDP)
+
+OK200 = 'SIP/2.0 200 OK\r\n' \
+  'Via: SIP/2.0/UDP 192.0.2.10:5060;branch=z9hG4bK776asdhds;rport=5060;received=192.0.2.10\r\n' \
+  'Record-Route: <sip:192.0.2.30;lr>\r\n' \
+  'From: "Alice" <sip:15557654321@192.0.2.10>;tag=1928301774\r\n' \
+  'To: <sip:15551234567@192.0.2.20>;tag=a6c85cf\r\n' \
+  'Call-ID: a84b4c76e66710@pc33.example.com\r\n' \
+  'CSeq: 314159 INVITE\r\n' \
+  'Contact: <sip:15551234567@192.0.2.20:5060>\r\n' \
+  'Allow: INVITE, ACK, CANCEL, OPTIONS, BYE\r\n' \
+  'Server: ExampleGW/4.5\r\n' \
+  'Content-Type: application/sdp\r\n' \
+  'Content-Length: %d\r\n\r\n%s' % (len(_SDP), _SDP)
+
+ACK = 'ACK sip:15551234567@192.0.2.20:5060 SIP/2.0\r\n' \
+  'Via: SIP/2.0/UDP 192.0.2.10:5060;branch=z9hG4bKnashds9;rport\r\n' \
+  'Route: <sip:192.0.2.30;lr>\r\n' \
+  'Max-Forwards: 70\r\n' \
+  'From: "Alice" <sip:15557654321@192.0.2.10>;tag=1928301774\r\n' \
+  'To: <sip:15551234567@192.0.2.20>;tag=a6c85cf\r\n' \
+  'Call-ID: a84b4c76e66710@pc33.example.com\r\n' \
+  'CSeq: 314159 ACK\r\n' \
+  'Content-Length: 0\r\n\r\n'
+
+BYE = 'BYE sip:15551234567@192.0.2.20:5060 SIP/2.0\r\n' \
+  'Via: SIP/2.0/UDP 192.0.2.10:5060;branch=z9hG4bKnashds10;rport\r\n' \
+  'Route: <sip:192.0.2.30;lr>\r\n' \
+  'Max-Forwards: 70\r\n' \
+  'From: "Alice" <sip:15557654321@192.0.2.10>;tag=1928301774\r\n' \
+  'To: <sip:15551234567@192.0.2.20>;tag=a6c85cf\r\n' \
+  'Call-ID: a84b4c76e66710@pc33.example.com\r\n' \
+  'CSeq: 314160 BYE\r\n' \
+  'User-Agent: ExampleUA/1.2.3\r\n' \
+  'Content-Length: 0\r\n\r\n'
+
+CORPUS = ((SipRequest, INVITE), (SipResponse, OK200), (SipRequest, ACK), (SipRequest, BYE))
+
+FOLDED = 'OPTIONS sip:192.0.2.20 SIP/2.0\r\n' \
+  'v: SIP/2.0/UDP 192.0.2.10:5060;branch=z9hG4bK1,\r\n' \
+  '   SIP/2.0/UDP 192.0.2.11:5060;branch=z9hG4bK2\r\n' \
+  'f: <sip:alice@192.0.2.10>;tag=1\r\n' \
+  't: <sip:192.0.2.20>\r\n' \
+  'i: folded@192.0.2.10\r\n' \
+  'CSeq: 1 OPTIONS\r\n' \
+  'X-Custom: foo\r\n' \
+  '\tbar\r\n' \
+  'l: 0\r\n\r\n'
+
+class TestSipMsg(unittest.TestCase):
+    def test_lazy_headers(self):
+        req = SipRequest(FOLDED.encode())
+        self.assertTrue(all(isinstance(x, LazySipHeader) for x in req.headers))
+        self.assertEqual(str(req.getHFBody('call-id')), 'folded@192.0.2.10')
+        self.assertIsInstance(req.headers[3], SipHeader)
+        self.assertIsInstance(req.headers[0], LazySipHeader)
+        # Folded line with two comma-separated Vias
+        self.assertEqual(req.countHFs('via'), 2)
+        self.assertEqual(req.getHFBody('via', 1).getBranch(), 'z9hG4bK2')
+        self.assertEqual(str(req.getHFBody('x-custom')), 'foo bar')
+        self.assertEqual(req.getTId(True, True), ('folded@192.0.2.10', '1', 1, 'OPTIONS', 'z9hG4bK1'))
+
+    def test_header_index(self):
+        req = SipRequest(INVITE.encode())
+        via1 = req.getHF('via')
+        via0 = SipHeader(name = 'via', body = SipVia())
+        req.insertHeaderBefore(via1, via0)
+        via2 = SipHeader(name = 'via', body = SipVia())
+        req.insertHeaderAfter(req.getHF('contact'), via2)
+        self.assertEqual(req.getHFs('via'), [via0, via1, via2])
+        self.assertEqual(req.countHFs('via'), 3)
+        req.removeHeader(via1)
+        self.assertIs(req.getHF('via'), via0)
+        rr = SipHeader(name = 'record-route', bodys = '<sip:192.0.2.30;lr>')
+        req.replaceHeader(via2, rr)
+        self.assertEqual(req.getHFs('via'), [via0])
+        self.assertEqual(req.getHFs('record-route'), [rr])
+        req.delHFs('allow')
+        self.assertEqual(req.countHFs('allow'), 0)
+        self.assertRaises(IndexError, req.getHF, 'allow')
+        # Per-name lookups agree with the order headers are serialized in
+        names = [x.split(':', 1)[0].lower() for x in str(req).split('\r\n\r\n')[0].split('\r\n')[1:]]
+        self.assertEqual(names[:4], ['via', 'max-forwards', 'from', 'to'])
+        self.assertEqual(names.index('record-route'), names.index('contact') + 1)
+        self.assertNotIn('allow', names)
+        for name in set(names) - set(('content-type', 'content-length')):
+            self.assertEqual(req.getHFs(name), [x for x in req.headers if x.name == name])
+
+    def test_same_as_eager(self):
+        for c, m in CORPUS + ((SipRequest, FOLDED),):
+            msg = c(m.encode())
+            hdrs, body = m.split('\r\n\r\n', 1)
+            lines = hdrs.replace('\r\n ', ' ').replace('\r\n\t', ' ').split('\r\n')[1:]
+            expected = []
+            for line in lines:
+                line = ' '.join(line.split())
+                try:
+                    expected.append(str(SipHeader(line, fixname = True)))
+                except Exception as einst:
+                    expected.extend([str(SipHeader(name = einst.name, bodys = b, fixname = True)) \
+                      for b in einst.bodys])
+            expected = [x for x in expected if not x.startswith(('Content-Length', 'Content-Type'))]
+            with self.subTest(msg=lines[0]):
+                self.assertEqual(str(msg).split('\r\n')[1:len(expected) + 1], expected)
+                self.assertEqual(str(c(m)), str(msg))
+                if c is SipResponse:
+                    self.assertEqual(str(msg.getCopy()), str(msg))
+
+    def test_invalid_utf8(self):
+        # Undecodable header that is not needed for getTId() is still
+        # rejected by the parser, not by whoever touches it later
+        bad = BYE.replace('User-Agent: ExampleUA/1.2.3', 'Subject: ').encode()
+        bad = bad.replace(b'Subject: ', b'Subject: \xff\xfe')
+        self.assertRaises(UnicodeDecodeError, SipRequest, bad)
+        # Non-ASCII UTF-8 is fine
+        req = SipRequest(BYE.replace('ExampleUA', 'Bj\u00f6rnUA').encode())
+        self.assertEqual(str(req.getHFBody('user-agent')), 'Bj\u00f6rnUA/1.2.3')
+        self.assertIn('User-Agent: Bj\u00f6rnUA/1.2.3\r\n', str(req))
+
+    @unittest.skipUnless('SIPPY_SIPMSG_PARSE_ITERATIONS' in os.environ, \
+      'benchmark, set SIPPY_SIPMSG_PARSE_ITERATIONS to run')
+    def test_parse_speed(self):
+        iterations = int(os.environ['SIPPY_SIPMSG_PARSE_ITERATIONS'])
+        corpus = [(c, m.encode()) for c, m in CORPUS]
+
+        for c, m in corpus:
+            msg = c(m)
+            msg.getTId(True, True)
+
+        start = perf_counter()
+        for _ in range(iterations):
+            for c, m in corpus:
+                msg = c(m)
+        elapsed = perf_counter() - start
+        print('SipMsg: %.0f messages/sec parsed' % (iterations * len(corpus) / elapsed))
+
+        # Parse and extract transaction id, which is what the transaction
+        # manager does with every incoming message
+        start = perf_counter()
+        for _ in range(iterations):
+            for c, m in corpus:
+                msg = c(m)
+                msg.getTId(True, True)
+        elapsed = perf_counter() - start
+
+        rate = iterations * len(corpus) / elapsed
+        print('SipMsg: %.0f messages/sec parsed with getTId()' % rate)
+
+    # INVITE -> 200 OK -> ACK the way StatefulProxy relays them: parse,
+    # fiddle with the Via stack and Max-Forwards, serialize and send.
+    laddr = (('192.0.2.30', 5060), 'udp')
+
+    def relay_req(self, data):
+        req = SipRequest(data)
+        req.getTId(True, True)
+        req.getHFBody('max-forwards').incNum(incr=-1)
+        via0 = SipVia()
+        via0.genBranch()
+        req.insertHeaderBefore(req.getHF('via'), SipHeader(name = 'via', body = via0))
+        return req.localStr(self.laddr)
+
+    def relay_resp(self, data):
+        resp = SipResponse(data)
+        resp.getTId(True, True)
+        resp.removeHeader(resp.getHF('via'))
+        return resp.localStr(self.laddr)
+
+    def test_proxy(self):
+        out = self.relay_req(INVITE.encode())
+        self.assertTrue(out.startswith(INVITE.split('\r\n', 1)[0] + '\r\nVia: SIP/2.0/UDP 192.0.2.30;'))
+        self.assertIn('\r\nMax-Forwards: 69\r\n', out)
+        self.assertEqual(out.split('\r\n\r\n', 1)[1], _SDP)
+        out = self.relay_resp(OK200.encode())
+        self.assertEqual(out.count('\r\nVia: '), 0)
+        self.assertEqual(out.split('\r\n', 2)[1], OK200.split('\r\n', 3)[2])
+
+    @unittest.skipUnless('SIPPY_SIPMSG_PROXY_ITERATIONS' in os.environ, \
+      'benchmark, set SIPPY_SIPMSG_PROXY_ITERATIONS to run')
+    def test_proxy_speed(self):
+        iterations = int(os.environ['SIPPY_SIPMSG_PROXY_ITERATIONS'])
+        invite, ok200, ack = INVITE.encode(), OK200.encode(), ACK.encode()
+        start = perf_counter()
+        for _ in range(iterations):
+            self.relay_req(invite)
+            self.relay_resp(ok200)
+            self.relay_req(ack)
+        elapsed = perf_counter() - start
+        print('SipMsg: %.0f proxied INVITE/200/ACK flows/sec' % (iterations / elapsed))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os
+import unittest
+from hashlib import md5
+from time import perf_counter
+
+from sippy.SipTMRetransmitCache import SipTMRetransmitCache, T1
+from sippy.SipTransactionManager import SipTMRetransmitO
+
+class TestSipTMRetransmitCache(unittest.TestCase):
+    def test_ttl(self):
+        rc = SipTMRetransmitCache()
+        rc.put(1, SipTMRetransmitO(), now = 100.0)
+        rc.put(2, SipTMRetransmitO(data = 'SIP/2.0 200 OK\r\n'), ttl = 4 * T1, now = 100.0)
+        self.assertIsNotNone(rc.get(1, now = 100.0 + 64 * T1 - 0.1))
+        self.assertIsNone(rc.get(2, now = 100.0 + 4 * T1))
+        self.assertEqual(rc.nbytes, 0)
+        self.assertIsNone(rc.get(1, now = 100.0 + 64 * T1))
+        self.assertEqual(len(rc), 0)
+        stats = rc.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expirations']), (1, 2, 2))
+        # expire() drops everything that is due in one go
+        for i in range(10):
+            rc.put(i, SipTMRetransmitO(data = 'x' * 10), now = 200.0 + i)
+        rc.expire(now = 205.0 + 64 * T1)
+        self.assertEqual(sorted(rc.entries.keys()), [6, 7, 8, 9])
+        self.assertEqual(rc.nbytes, 40)
+
+    def test_budgets(self):
+        rc = SipTMRetransmitCache(max_entries = 100, max_bytes = 1000)
+        for i in range(150):
+            rc.put(i, SipTMRetransmitO(), now = 100.0)
+        self.assertEqual(len(rc), 100)
+        self.assertIsNone(rc.get(49, now = 100.0))
+        self.assertIsNotNone(rc.get(50, now = 100.0))
+        for i in range(20):
+            rc.put(1000 + i, SipTMRetransmitO(data = 'x' * 100), now = 100.0)
+        self.assertLessEqual(rc.nbytes, 1000)
+        self.assertEqual(rc.nbytes, 1000)
+        self.assertIsNotNone(rc.get(1019, now = 100.0))
+        self.assertIsNone(rc.get(1009, now = 100.0))
+        # Re-inserting same key replaces entry and its size
+        rc.put(1019, SipTMRetransmitO(data = 'x' * 10), now = 100.0)
+        self.assertEqual(rc.nbytes, 910)
+        self.assertEqual(len(rc), 10)
+        self.assertEqual(rc.stats()['evictions'], 150 + 20 - 10)
+
+    def test_fingerprint_speed(self):
+        iterations = int(os.environ.get('SIPPY_RCACHE_ITERATIONS', '100000'))
+        msgs = [(b'INVITE sip:%d@192.0.2.20 SIP/2.0\r\n' % i) + b'X' * 600 for i in range(1000)]
+        rc = SipTMRetransmitCache()
+
+        start = perf_counter()
+        for i in range(iterations):
+            md5(bytes(bytearray(msgs[i % 1000]))).digest()
+        t_md5 = perf_counter() - start
+
+        start = perf_counter()
+        for i in range(iterations):
+            # Fresh object every time, bytes cache their hash()
+            data = bytes(bytearray(msgs[i % 1000]))
+            key = rc.fingerprint(data)
+            if rc.get(key) is None:
+                rc.put(key, SipTMRetransmitO())
+        t_rc = perf_counter() - start
+        print('SipTMRetransmitCache: md5 %.0f msgs/sec, fingerprint+lookup %.0f msgs/sec' % \
+          (iterations / t_md5, iterations / t_rc))
+        self.assertEqual(len(rc), 1000)
+        self.assertGreater(rc.stats()['hit_rate'], 0.9)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import unittest
+from random import Random
+from time import perf_counter
+
+from sippy.Core.EventDispatcher import EventListener
+from sippy.Core.TimerQueue import TimerHeap, TimerWheel
+from sippy.Time.MonoTime import MonoTime
+
+TICK = 0.01
+
+def mktimer(etime):
+    el = EventListener()
+    el.etime = MonoTime(monot = etime)
+    el.cb_func = mktimer
+    return el
+
+def cancel(tq, el):
+    tq.remove(el)
+    el.cleanup()
+
+class TestTimerQueue(unittest.TestCase):
+    def test_wheel_vs_heap(self):
+        rng = Random(42)
+        t0 = 1000.0
+        heap, wheel = TimerHeap(), TimerWheel(TICK, t0)
+        pairs = []
+        # Spread across all levels of the wheel and into the overflow set
+        for ival in [rng.uniform(0, 2.0) for i in range(500)] + \
+          [rng.uniform(0, 200.0) for i in range(500)] + \
+          [rng.uniform(0, 20000.0) for i in range(200)] + \
+          [rng.uniform(0, 1000000.0) for i in range(100)]:
+            eh, ew = mktimer(t0 + ival), mktimer(t0 + ival)
+            heap.add(eh)
+            wheel.add(ew)
+            pairs.append((eh, ew))
+        for eh, ew in rng.sample(pairs, len(pairs) // 3):
+            cancel(heap, eh)
+            cancel(wheel, ew)
+        self.assertEqual(len(heap), len(wheel))
+        now = t0
+        fired_h, fired_w = [], []
+        while len(heap) > 0:
+            now += rng.choice((0.003, 0.01, 0.5, 7.0, 300.0))
+            fired_h.extend(x.etime.monot for x in heap.pop_due(now))
+            fw = wheel.pop_due(now)
+            for el in fw:
+                self.assertLessEqual(el.etime.monot, now)
+            fired_w.extend(x.etime.monot for x in fw)
+            self.assertEqual(fired_h, fired_w)
+            heap.compact()
+        self.assertEqual(len(wheel), 0)
+        self.assertEqual(len(fired_h), len(pairs) - len(pairs) // 3)
+
+    def _churn(self, tq, ncalls, concurrency):
+        # Model call setups: each call arms retransmit (0.5s), transaction
+        # (32s), expires (300s) and credit (3600s) timers, the short-lived
+        # ones get cancelled shortly after and the rest when call ends.
+        rng = Random(1)
+        now = 1000.0
+        calls = []
+        max_step = 0.0
+        nops = 0
+        stime = perf_counter()
+        for i in range(ncalls):
+            if i % 50 == 0:
+                now += TICK
+                sstime = perf_counter()
+                nops += len(tq.pop_due(now))
+                tq.compact()
+                max_step = max(max_step, perf_counter() - sstime)
+            timers = [mktimer(now + ival) for ival in (0.5, 32.0, 300.0, 3600.0)]
+            for el in timers:
+                tq.add(el)
+            cancel(tq, timers[0])
+            cancel(tq, timers[1])
+            calls.append(timers)
+            nops += 6
+            if len(calls) > concurrency:
+                for el in calls.pop(rng.randrange(len(calls)))[2:]:
+                    cancel(tq, el)
+                    nops += 1
+        etime = perf_counter() - stime
+        return (nops / etime, max_step)
+
+    @unittest.skipUnless('SIPPY_TIMERQUEUE_CALLS' in os.environ, \
+      'benchmark, set SIPPY_TIMERQUEUE_CALLS to run')
+    def test_churn_speed(self):
+        ncalls = int(os.environ['SIPPY_TIMERQUEUE_CALLS'])
+        concurrency = int(os.environ.get('SIPPY_TIMERQUEUE_CONCURRENCY', '20000'))
+        for name, tq in (('heap', TimerHeap()), ('wheel', TimerWheel(TICK, 1000.0))):
+            rate, max_step = self._churn(tq, ncalls, concurrency)
+            print('TimerQueue[%s]: %.0f timer ops/sec, worst dispatch pass %.3f ms' % \
+              (name, rate, max_step * 1000))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,11 @@
+import os
+import socket
 import unittest
-from sippy.Udp_server import self_test
+from threading import Thread
+from time import monotonic, sleep
+
+from sippy.Core.EventDispatcher import ED2
+from sippy.Udp_server import self_test, Udp_server, Udp_server_opts
 
 class TestUdp_server(unittest.TestCase):
     def test_run(self):
@@ -13,5 +19,69 @@ class TestUdp_server(unittest.TestCase):
         # For example, you might want to check if npongs reached 0.
         self.assertEqual(test_instance.npongs, 0)
 
+class TestUdp_server_rbatch(unittest.TestCase):
+    payload = b'OPTIONS sip:bench@127.0.0.1 SIP/2.0\r\n' + b'X' * 400 + b'\r\n\r\n'
+
+    def _run_batch(self, rbatch_size, ndgrams, window = 64):
+        # window = None sends everything back-to-back, as fast as possible
+        state = {'nrecv':0, 'nbatches':0, 'ltime':None}
+        def data_received(data, ra, udp_server, rtime):
+            state['nrecv'] += 1
+            state['ltime'] = monotonic()
+            if state['nrecv'] == ndgrams:
+                ED2.breakLoop()
+        uopts = Udp_server_opts(('127.0.0.1', 0), data_received)
+        uopts.rbatch_size = rbatch_size
+        userv = Udp_server({}, uopts)
+        handle_read_batch = userv.handle_read_batch
+        def count_batches(*args):
+            state['nbatches'] += 1
+            return handle_read_batch(*args)
+        userv.handle_read_batch = count_batches
+        raddr = userv.getSIPaddr()[0]
+        def blast():
+            # Back-to-back bursts, each small enough to fit into the socket
+            # buffer, so that nothing is lost while the batches still form
+            skt = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            deadline = monotonic() + 10.0
+            for i in range(ndgrams):
+                if window is not None and i % window == 0:
+                    while state['nrecv'] < i and monotonic() < deadline:
+                        sleep(0.001)
+                skt.sendto(self.payload, raddr)
+            skt.close()
+        stime = monotonic()
+        sender = Thread(target = blast)
+        sender.start()
+        # Unpaced runs lose datagrams, do not wait for them for long
+        ED2.loop(10.0 if window is not None else 2.0)
+        sender.join()
+        userv.shutdown()
+        rate = state['nrecv'] / (state['ltime'] - stime) if state['nrecv'] > 0 else 0.0
+        return (state['nrecv'], state['nbatches'], rate)
+
+    def test_rbatch(self):
+        ndgrams = 5000
+        for rbatch_size in (1, 4, 16, 64):
+            with self.subTest(rbatch_size=rbatch_size):
+                nrecv, nbatches, rate = self._run_batch(rbatch_size, ndgrams)
+                self.assertEqual(nrecv, ndgrams)
+                if rbatch_size == 1:
+                    self.assertEqual(nbatches, 0)
+                else:
+                    self.assertGreater(nbatches, 0)
+
+    @unittest.skipUnless('SIPPY_UDP_RBATCH_DATAGRAMS' in os.environ, \
+      'benchmark, set SIPPY_UDP_RBATCH_DATAGRAMS to run')
+    def test_rbatch_speed(self):
+        # Datagrams/sec delivered to the main thread versus batch size,
+        # unpaced, so some datagrams may be lost to the socket buffer
+        ndgrams = int(os.environ['SIPPY_UDP_RBATCH_DATAGRAMS'])
+        for rbatch_size in (1, 4, 16, 64):
+            nrecv, nbatches, rate = self._run_batch(rbatch_size, ndgrams, window = None)
+            print('Udp_server: rbatch_size=%d, %d/%d datagrams received in %d ' \
+              'batches, %.0f datagrams/sec' % (rbatch_size, nrecv, ndgrams, \
+              nbatches, rate))
+
 if __name__ == '__main__':
     unittest.main()